@@ -0,0 +1,314 @@
+"""Cross-process locks on PostgreSQL advisory locks.
+
+``DistributedLock`` keeps the ``threading.Lock`` surface the server already
+uses (``acquire(blocking, timeout)`` / ``release()`` / ``locked()``) but takes a
+session-level ``pg_try_advisory_lock`` in the *target* database on a dedicated
+connection, so gunicorn workers, the Render web service and ``cloud_worker.py``
+all exclude each other.  The key is derived from ``(family, target)``.
+
+Lease / heartbeat: the holder records itself in ``tw_lock_holders`` and a
+heartbeat thread extends ``lease_expires_at``.  If the holder process dies its
+connection closes and PostgreSQL drops the lock; if it hangs with the
+connection still open, a contender that finds an expired lease terminates the
+holder's backend and takes over.
+
+When the target database is unreachable the lock degrades to the in-process
+``threading.Lock`` (the previous behaviour) instead of blocking the job.
+Session advisory locks need a direct (non transaction-pooled) connection.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+HOLDERS_TABLE = "tw_lock_holders"
+POLL_SECONDS = 0.5
+
+
+def lock_key(family: str, target: str) -> int:
+    digest = hashlib.blake2b(f"{family}:{target}".encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") & 0x7FFFFFFFFFFFFFFF
+
+
+def ensure_holders_table(cursor) -> None:
+    cursor.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {HOLDERS_TABLE} (
+            lock_key BIGINT PRIMARY KEY,
+            family VARCHAR(64) NOT NULL,
+            target VARCHAR(32) NOT NULL,
+            owner VARCHAR(200) NOT NULL,
+            backend_pid INTEGER,
+            meta JSONB,
+            acquired_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            heartbeat_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            lease_expires_at TIMESTAMPTZ NOT NULL
+        )
+        """
+    )
+
+
+def holders(cursor) -> list[dict[str, Any]]:
+    """Recorded holders plus whether their backend still holds an advisory lock."""
+    ensure_holders_table(cursor)
+    cursor.execute(
+        f"""
+        SELECT h.family, h.target, h.owner, h.backend_pid, h.meta,
+               h.acquired_at, h.heartbeat_at, h.lease_expires_at,
+               h.lease_expires_at < NOW() AS lease_expired,
+               EXISTS (
+                   SELECT 1 FROM pg_locks l
+                   WHERE l.locktype = 'advisory' AND l.pid = h.backend_pid AND l.granted
+               ) AS held
+        FROM {HOLDERS_TABLE} h
+        ORDER BY h.family, h.target
+        """
+    )
+    names = [
+        "family", "target", "owner", "backend_pid", "meta",
+        "acquired_at", "heartbeat_at", "lease_expires_at", "lease_expired", "held",
+    ]
+    out = []
+    for row in cursor.fetchall() or []:
+        values = list(row.values()) if isinstance(row, dict) else list(row)
+        item = dict(zip(names, values))
+        for key in ("acquired_at", "heartbeat_at", "lease_expires_at"):
+            if item.get(key) is not None and hasattr(item[key], "isoformat"):
+                item[key] = item[key].isoformat()
+        out.append(item)
+    return out
+
+
+def _scalar(cursor) -> Any:
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    if isinstance(row, dict):
+        return next(iter(row.values()), None)
+    return row[0]
+
+
+def try_xact_lock(cursor, family: str, target: str, *, timeout: float = 30.0) -> bool:
+    """Transaction-scoped variant for short critical sections (e.g. DDL) on an existing connection.
+
+    Released automatically at COMMIT / ROLLBACK, so no extra connection is needed.
+    """
+    key = lock_key(family, target)
+    deadline = time.monotonic() + max(0.0, timeout)
+    while True:
+        cursor.execute("SELECT pg_try_advisory_xact_lock(%s)", (key,))
+        if _scalar(cursor):
+            return True
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(POLL_SECONDS)
+
+
+class DistributedLock:
+    def __init__(
+        self,
+        family: str,
+        target: str,
+        connect: Callable[[], Any],
+        *,
+        lease: float = 120.0,
+    ):
+        self.family = family
+        self.target = target
+        self.key = lock_key(family, target)
+        self._connect = connect
+        self.lease = float(lease)
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._local = threading.Lock()
+        self._conn = None
+        self._beat_stop: Optional[threading.Event] = None
+        self.mode: Optional[str] = None  # 'advisory' | 'local'
+        self.lost = False
+        self.meta: dict[str, Any] = {}
+
+    # ---- threading.Lock compatible API -----------------------------------
+    def locked(self) -> bool:
+        return self._local.locked()
+
+    def acquire(self, blocking: bool = True, timeout: float = -1, **meta: Any) -> bool:
+        started = time.monotonic()
+        if not self._local.acquire(blocking, timeout if blocking else -1):
+            return False
+        try:
+            conn = self._connect()
+            conn.autocommit = True
+        except Exception as exc:
+            logger.warning("advisory lock %s/%s 改用本機鎖（資料庫不可用）: %s", self.family, self.target, exc)
+            self.mode = "local"
+            return True
+        try:
+            cur = conn.cursor()
+            ensure_holders_table(cur)
+            while True:
+                cur.execute("SELECT pg_try_advisory_lock(%s)", (self.key,))
+                if _scalar(cur):
+                    self._conn = conn
+                    self.mode = "advisory"
+                    self.lost = False
+                    self.meta = meta
+                    self._record_holder(cur)
+                    self._start_heartbeat()
+                    return True
+                if self._break_expired_lease(cur):
+                    continue
+                if not blocking or (timeout is not None and 0 <= timeout <= time.monotonic() - started):
+                    break
+                time.sleep(POLL_SECONDS)
+        except Exception as exc:
+            logger.warning("advisory lock %s/%s 取得失敗，改用本機鎖: %s", self.family, self.target, exc)
+            self._close(conn)
+            self.mode = "local"
+            return True
+        self._close(conn)
+        self._local.release()
+        return False
+
+    def release(self) -> None:
+        if self._beat_stop is not None:
+            self._beat_stop.set()
+            self._beat_stop = None
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            try:
+                cur = conn.cursor()
+                cur.execute(
+                    f"DELETE FROM {HOLDERS_TABLE} WHERE lock_key = %s AND owner = %s",
+                    (self.key, self.owner),
+                )
+                cur.execute("SELECT pg_advisory_unlock(%s)", (self.key,))
+            except Exception as exc:
+                logger.warning("advisory lock %s/%s 釋放失敗（連線關閉後自動釋放）: %s", self.family, self.target, exc)
+            self._close(conn)
+        self.mode = None
+        self._local.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+        return False
+
+    # ---- lease / heartbeat ---------------------------------------------
+    def _record_holder(self, cur) -> None:
+        cur.execute(
+            f"""
+            INSERT INTO {HOLDERS_TABLE} (
+                lock_key, family, target, owner, backend_pid, meta,
+                acquired_at, heartbeat_at, lease_expires_at
+            )
+            VALUES (%s, %s, %s, %s, pg_backend_pid(), %s::jsonb, NOW(), NOW(),
+                    NOW() + make_interval(secs => %s))
+            ON CONFLICT (lock_key) DO UPDATE SET
+                family = EXCLUDED.family,
+                target = EXCLUDED.target,
+                owner = EXCLUDED.owner,
+                backend_pid = EXCLUDED.backend_pid,
+                meta = EXCLUDED.meta,
+                acquired_at = EXCLUDED.acquired_at,
+                heartbeat_at = EXCLUDED.heartbeat_at,
+                lease_expires_at = EXCLUDED.lease_expires_at
+            """,
+            (self.key, self.family, self.target, self.owner, json.dumps(self.meta, default=str), self.lease),
+        )
+
+    def _break_expired_lease(self, cur) -> bool:
+        """Terminate a holder whose lease expired while its session still holds the lock."""
+        cur.execute(
+            f"""
+            SELECT backend_pid FROM {HOLDERS_TABLE}
+            WHERE lock_key = %s AND lease_expires_at < NOW()
+            """,
+            (self.key,),
+        )
+        pid = _scalar(cur)
+        if not pid:
+            return False
+        cur.execute("SELECT pg_terminate_backend(%s)", (pid,))
+        terminated = bool(_scalar(cur))
+        if terminated:
+            logger.warning("advisory lock %s/%s 租約逾期，已終止持有者 backend %s", self.family, self.target, pid)
+            time.sleep(POLL_SECONDS)
+        cur.execute(f"DELETE FROM {HOLDERS_TABLE} WHERE lock_key = %s AND backend_pid = %s", (self.key, pid))
+        return terminated
+
+    def _start_heartbeat(self) -> None:
+        stop = threading.Event()
+        self._beat_stop = stop
+        conn = self._conn
+        interval = max(1.0, self.lease / 3.0)
+
+        def _beat():
+            while not stop.wait(interval):
+                try:
+                    cur = conn.cursor()
+                    cur.execute(
+                        f"""
+                        UPDATE {HOLDERS_TABLE}
+                        SET heartbeat_at = NOW(), lease_expires_at = NOW() + make_interval(secs => %s)
+                        WHERE lock_key = %s AND owner = %s
+                        """,
+                        (self.lease, self.key, self.owner),
+                    )
+                    cur.close()
+                except Exception as exc:
+                    # 連線中斷時 PostgreSQL 已釋放鎖，其他 process 可能已接手
+                    self.lost = True
+                    logger.error("advisory lock %s/%s 心跳失敗，鎖可能已遺失: %s", self.family, self.target, exc)
+                    return
+
+        threading.Thread(target=_beat, name=f"lock-heartbeat-{self.family}", daemon=True).start()
+
+    @staticmethod
+    def _close(conn) -> None:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+class LockManager:
+    """One ``DistributedLock`` per ``(family, target)``; ``connect_for(target)`` opens a connection."""
+
+    def __init__(self, connect_for: Callable[[str], Any], *, lease: float = 120.0):
+        self._connect_for = connect_for
+        self.lease = lease
+        self._locks: dict[tuple[str, str], DistributedLock] = {}
+        self._guard = threading.Lock()
+
+    def get(self, family: str, target: str) -> DistributedLock:
+        with self._guard:
+            lock = self._locks.get((family, target))
+            if lock is None:
+                lock = DistributedLock(family, target, lambda: self._connect_for(target), lease=self.lease)
+                self._locks[(family, target)] = lock
+            return lock
+
+    def local_view(self) -> list[dict[str, Any]]:
+        with self._guard:
+            locks = list(self._locks.values())
+        return [
+            {
+                "family": lock.family,
+                "target": lock.target,
+                "locked": lock.locked(),
+                "mode": lock.mode,
+                "lost": lock.lost,
+            }
+            for lock in locks
+        ]
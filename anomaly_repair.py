@@ -0,0 +1,171 @@
+"""Batch repair planner for price anomalies.
+
+Instead of refetching every flagged symbol separately (one STOCK_DAY request per
+symbol and month), the planner unions the padded windows of all ``(symbol,
+date)`` anomalies into a set of trading days.  Each day is then fetched once
+from the market-wide daily snapshot (TWSE MI_INDEX / TPEX daily quotes), the
+rows of the flagged symbols are validated against the stored previous close in
+one query, and written with a single bulk upsert per day.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from typing import Any, Iterable, Optional
+
+import price_validation
+
+
+@dataclass
+class RepairDay:
+    day: date
+    twse: list[str] = field(default_factory=list)
+    tpex: list[str] = field(default_factory=list)
+
+    @property
+    def symbols(self) -> list[str]:
+        return self.twse + self.tpex
+
+
+@dataclass
+class RepairPlan:
+    days: list[RepairDay]
+    symbols: list[str]
+    anomaly_count: int
+    skipped_symbols: list[str] = field(default_factory=list)
+
+    def summary(self) -> dict[str, Any]:
+        return {
+            "days": len(self.days),
+            "symbols": len(self.symbols),
+            "anomalies": self.anomaly_count,
+            "fetches": sum(bool(d.twse) + bool(d.tpex) for d in self.days),
+            "skippedSymbols": self.skipped_symbols,
+            "start": self.days[0].day.isoformat() if self.days else None,
+            "end": self.days[-1].day.isoformat() if self.days else None,
+        }
+
+
+def _as_date(value: Any) -> Optional[date]:
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    try:
+        return datetime.strptime(str(value)[:10], "%Y-%m-%d").date()
+    except (TypeError, ValueError):
+        return None
+
+
+def plan_repair(
+    anomalies: Iterable[dict[str, Any]],
+    *,
+    pad_days: int = 5,
+    today: Optional[date] = None,
+) -> RepairPlan:
+    """Group anomalies into the set of weekdays that need a daily snapshot.
+
+    Only listed stocks (``.TW`` / ``.TWO``) can be repaired from the daily
+    snapshots; index symbols such as ``^TWII`` are reported as skipped.
+    """
+    today = today or date.today()
+    by_day: dict[date, RepairDay] = {}
+    symbols: set[str] = set()
+    skipped: set[str] = set()
+    count = 0
+    for item in anomalies:
+        symbol = str(item.get("symbol") or "").strip().upper()
+        anchor = _as_date(item.get("date"))
+        if not symbol or anchor is None:
+            continue
+        count += 1
+        if symbol.endswith(".TWO"):
+            market = "tpex"
+        elif symbol.endswith(".TW"):
+            market = "twse"
+        else:
+            skipped.add(symbol)
+            continue
+        symbols.add(symbol)
+        for offset in range(-pad_days, pad_days + 1):
+            day = anchor + timedelta(days=offset)
+            if day.weekday() >= 5 or day > today:
+                continue
+            entry = by_day.setdefault(day, RepairDay(day))
+            bucket = entry.tpex if market == "tpex" else entry.twse
+            if symbol not in bucket:
+                bucket.append(symbol)
+    days = [by_day[d] for d in sorted(by_day)]
+    for entry in days:
+        entry.twse.sort()
+        entry.tpex.sort()
+    return RepairPlan(days=days, symbols=sorted(symbols), anomaly_count=count, skipped_symbols=sorted(skipped))
+
+
+def snapshot_records(snapshot: dict[str, dict[str, Any]], symbols: Iterable[str], day: date) -> list[tuple]:
+    """Pick the rows of ``symbols`` out of a ``{code: {Open, High, ...}}`` daily snapshot."""
+    rows = []
+    for symbol in symbols:
+        rec = snapshot.get(symbol.split(".", 1)[0])
+        if not rec or rec.get("Close") is None:
+            continue
+        rows.append((
+            symbol,
+            day.isoformat(),
+            rec.get("Open"),
+            rec.get("High"),
+            rec.get("Low"),
+            rec.get("Close"),
+            rec.get("Volume"),
+        ))
+    return rows
+
+
+def load_previous_closes(cursor, symbols: list[str], day: date, *, prices_table: str = "tw_stock_prices") -> dict[str, float]:
+    """Last stored close strictly before ``day`` for every symbol, in one query."""
+    if not symbols:
+        return {}
+    cursor.execute(
+        f"""
+        SELECT s.symbol, prev.close_price
+        FROM unnest(%s::text[]) AS s(symbol)
+        JOIN LATERAL (
+            SELECT close_price FROM {prices_table} p
+            WHERE p.symbol = s.symbol AND p.date < %s
+            ORDER BY p.date DESC
+            LIMIT 1
+        ) prev ON TRUE
+        """,
+        (symbols, day),
+    )
+    out = {}
+    for row in cursor.fetchall() or []:
+        sym = row["symbol"] if isinstance(row, dict) else row[0]
+        close = row["close_price"] if isinstance(row, dict) else row[1]
+        if close is not None:
+            out[sym] = float(close)
+    return out
+
+
+def filter_by_previous_close(
+    rows: list[tuple],
+    prev_closes: dict[str, float],
+    threshold: Optional[float],
+) -> tuple[list[tuple], list[tuple[tuple, str]]]:
+    """Reject rows without a positive close or moving more than ``threshold`` vs the stored close."""
+    records = [
+        {"open_price": r[2], "high_price": r[3], "low_price": r[4], "close_price": r[5], "volume": r[6]}
+        for r in rows
+    ]
+    rules = price_validation.refetch_rules(threshold)
+    if threshold is None:
+        rules = price_validation.RuleSet(reject=price_validation.BAD_CLOSE)
+    checked = price_validation.validate_records(
+        records, rules, prev_closes=[prev_closes.get(r[0]) for r in rows]
+    )
+    accepted, rejected = price_validation.split_records(rows, checked)
+    return accepted, [
+        (row, f"pct_change_gt_{threshold}" if reason == "pct_change_gt_threshold" else reason)
+        for row, reason in rejected
+    ]
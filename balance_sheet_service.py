@@ -9,14 +9,19 @@ Main entry points:
 - fetch_all_balance_sheets(year: str, season: str, ...) -> pd.DataFrame
 """
 
+from __future__ import annotations
+
 import logging
 import time
 from io import BytesIO
 from typing import Callable, Optional
 
-import pandas as pd
 import requests
-from lxml import etree
+
+from lazy_imports import lazy_module
+
+pd = lazy_module("pandas")
+etree = lazy_module("lxml.etree")
 
 logger = logging.getLogger(__name__)
 
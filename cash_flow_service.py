@@ -1,13 +1,18 @@
 # -*- coding: utf-8 -*-
 """Fetch Taiwan listed companies' cash-flow statements from MOPS iXBRL."""
 
+from __future__ import annotations
+
 import logging
 import time
 from typing import Callable, Optional
 
-import pandas as pd
 import requests
-from bs4 import BeautifulSoup
+
+from lazy_imports import lazy_module
+
+pd = lazy_module("pandas")
+bs4 = lazy_module("bs4")
 
 logger = logging.getLogger(__name__)
 
@@ -286,7 +291,7 @@ def fetch_cash_flow_row(co_id: str, year: str, season: str) -> pd.DataFrame:
 
     # MOPS emits a second nested <html> document. lxml's HTML parser stops before
     # the later cash-flow section, while BeautifulSoup preserves all iXBRL nodes.
-    soup = BeautifulSoup(response.content, "html.parser")
+    soup = bs4.BeautifulSoup(response.content, "html.parser")
     nodes = soup.find_all(
         lambda tag: bool(tag.name and tag.name.lower().endswith("nonfraction"))
     )
@@ -3,14 +3,17 @@
 from __future__ import annotations
 
 import os
+import select
 import socket
+import threading
 import uuid
-from contextlib import closing
+from contextlib import contextmanager
 from datetime import datetime, timezone
-from typing import Any, Optional
+from typing import Any, Iterator, Optional, Sequence
 
 import psycopg2
 from psycopg2.extras import Json, RealDictCursor
+from psycopg2.pool import ThreadedConnectionPool
 
 ALLOWED_JOB_TYPES = {
     "stock_prices",
@@ -35,6 +38,71 @@ def connect():
     return psycopg2.connect(database_url(), cursor_factory=RealDictCursor)
 
 
+QUEUE_CHANNEL = "tw_job_queued"
+STALE_JOB_MINUTES = max(1, int(os.environ.get("JOB_STALE_MINUTES", "15")))
+
+POOL_MAX_CONNECTIONS = max(1, int(os.environ.get("JOB_QUEUE_POOL_MAX", "4")))
+
+_pool: Optional[ThreadedConnectionPool] = None
+_pool_lock = threading.Lock()
+# ThreadedConnectionPool raises PoolError once maxconn are out; slots, heartbeats,
+# the claim loop and the sweeper all borrow from it, so callers queue here instead.
+_pool_slots = threading.BoundedSemaphore(POOL_MAX_CONNECTIONS)
+_table_ready = False
+
+
+def _get_pool() -> ThreadedConnectionPool:
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.closed:
+            _pool = ThreadedConnectionPool(
+                1,
+                POOL_MAX_CONNECTIONS,
+                database_url(),
+                cursor_factory=RealDictCursor,
+            )
+        return _pool
+
+
+def close_pool() -> None:
+    global _pool, _table_ready
+    with _pool_lock:
+        if _pool is not None and not _pool.closed:
+            _pool.closeall()
+        _pool = None
+        _table_ready = False
+
+
+@contextmanager
+def pooled_connection() -> Iterator[Any]:
+    """Borrow a queue connection; commits on success, drops broken connections.
+
+    Blocks while all ``POOL_MAX_CONNECTIONS`` connections are borrowed.
+    """
+    global _table_ready
+    with _pool_slots:
+        pool = _get_pool()
+        db = pool.getconn()
+        broken = False
+        try:
+            if not _table_ready:
+                ensure_job_table(db)
+                _table_ready = True
+            yield db
+            db.commit()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        except Exception:
+            try:
+                db.rollback()
+            except Exception:
+                broken = True
+            raise
+        finally:
+            pool.putconn(db, close=broken or bool(db.closed))
+
+
 def ensure_job_table(conn=None) -> None:
     own_connection = conn is None
     db = conn or connect()
@@ -88,8 +156,7 @@ def enqueue_job(
     if job_type not in ALLOWED_JOB_TYPES:
         raise ValueError(f"Unsupported job_type: {job_type}")
     job_id = str(uuid.uuid4())
-    with closing(connect()) as db, db:
-        ensure_job_table(db)
+    with pooled_connection() as db:
         with db.cursor() as cursor:
             cursor.execute(
                 """
@@ -99,12 +166,119 @@ def enqueue_job(
                 """,
                 (job_id, job_type, Json(params or {}), max(1, min(int(max_attempts), 5))),
             )
-            return dict(cursor.fetchone())
+            row = dict(cursor.fetchone())
+            # Delivered to listening workers when this transaction commits.
+            notify_queue(cursor, job_type)
+            return row
+
+
+def notify_queue(cursor, job_type: str = "") -> None:
+    cursor.execute("SELECT pg_notify(%s, %s)", (QUEUE_CHANNEL, job_type))
+
+
+def recover_stale_jobs(stale_minutes: int = STALE_JOB_MINUTES) -> dict[str, int]:
+    """Requeue (or fail, when out of attempts) running jobs whose heartbeat stopped.
+
+    A worker killed during deployment relinquishes its job this way.  Runs from
+    the worker's periodic sweeper rather than on every claim.
+    """
+    with pooled_connection() as db:
+        with db.cursor() as cursor:
+            cursor.execute(
+                """
+                UPDATE tw_job_runs
+                SET status = CASE WHEN attempts < max_attempts THEN 'queued' ELSE 'failed' END,
+                    message = CASE WHEN attempts < max_attempts
+                        THEN 'Recovered after stale worker' ELSE 'Failed: worker lost' END,
+                    error = CASE WHEN attempts < max_attempts THEN error ELSE 'Worker heartbeat lost' END,
+                    finished_at = CASE WHEN attempts < max_attempts THEN NULL ELSE NOW() END,
+                    locked_by = NULL,
+                    started_at = CASE WHEN attempts < max_attempts THEN NULL ELSE started_at END,
+                    updated_at = NOW()
+                WHERE status = 'running'
+                  AND heartbeat_at < NOW() - make_interval(mins => %s)
+                RETURNING status
+                """,
+                (int(stale_minutes),),
+            )
+            statuses = [row["status"] for row in cursor.fetchall()]
+            requeued = statuses.count("queued")
+            if requeued:
+                notify_queue(cursor)
+            return {"requeued": requeued, "failed": statuses.count("failed")}
+
+
+class JobListener:
+    """``LISTEN`` on the queue channel from a dedicated autocommit connection.
+
+    ``wait(timeout)`` returns the notification payloads (job types), or an empty
+    list on timeout / ``wake()``.  While the database is unreachable it simply
+    sleeps, so callers keep their polling fallback.  LISTEN needs a direct
+    (non transaction-pooled) connection.
+    """
+
+    def __init__(self, channel: str = QUEUE_CHANNEL, connect_fn=None):
+        self.channel = channel
+        self._connect = connect_fn or connect
+        self._conn = None
+        self._wake_r, self._wake_w = os.pipe()
+
+    def _ensure(self):
+        if self._conn is None or self._conn.closed:
+            conn = self._connect()
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                cursor.execute(f'LISTEN "{self.channel}"')
+            self._conn = conn
+        return self._conn
+
+    def wake(self) -> None:
+        os.write(self._wake_w, b"x")
+
+    def wait(self, timeout: float) -> list[str]:
+        try:
+            conn = self._ensure()
+        except Exception:
+            self._close_conn()
+            select.select([self._wake_r], [], [], timeout)
+            self._drain_wake()
+            return []
+        ready, _, _ = select.select([conn, self._wake_r], [], [], timeout)
+        self._drain_wake()
+        if conn not in ready:
+            return []
+        try:
+            conn.poll()
+        except Exception:
+            self._close_conn()
+            return []
+        payloads = [notify.payload for notify in conn.notifies]
+        conn.notifies.clear()
+        return payloads
+
+    def _drain_wake(self) -> None:
+        while select.select([self._wake_r], [], [], 0)[0]:
+            os.read(self._wake_r, 1024)
+
+    def _close_conn(self) -> None:
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def close(self) -> None:
+        self._close_conn()
+        for fd in (self._wake_r, self._wake_w):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
 
 
 def get_job(job_id: str) -> Optional[dict[str, Any]]:
-    with closing(connect()) as db, db:
-        ensure_job_table(db)
+    with pooled_connection() as db:
         with db.cursor() as cursor:
             cursor.execute("SELECT * FROM tw_job_runs WHERE id = %s", (job_id,))
             row = cursor.fetchone()
@@ -112,8 +286,7 @@ def get_job(job_id: str) -> Optional[dict[str, Any]]:
 
 
 def list_jobs(limit: int = 20) -> list[dict[str, Any]]:
-    with closing(connect()) as db, db:
-        ensure_job_table(db)
+    with pooled_connection() as db:
         with db.cursor() as cursor:
             cursor.execute(
                 """
@@ -126,28 +299,24 @@ def list_jobs(limit: int = 20) -> list[dict[str, Any]]:
             return [dict(row) for row in cursor.fetchall()]
 
 
-def claim_next_job(worker_id: Optional[str] = None) -> Optional[dict[str, Any]]:
+def claim_next_job(
+    worker_id: Optional[str] = None,
+    job_types: Optional[Sequence[str]] = None,
+) -> Optional[dict[str, Any]]:
+    """Claim the oldest queued job, optionally only among ``job_types`` (free worker slots)."""
     worker = worker_id or f"{socket.gethostname()}:{os.getpid()}"
-    with closing(connect()) as db, db:
-        ensure_job_table(db)
+    types = list(job_types) if job_types is not None else None
+    if types == []:
+        return None
+    with pooled_connection() as db:
         with db.cursor() as cursor:
-            # A worker killed during deployment relinquishes its job after 15 minutes.
-            cursor.execute(
-                """
-                UPDATE tw_job_runs
-                SET status = 'queued', locked_by = NULL, started_at = NULL,
-                    message = 'Recovered after stale worker', updated_at = NOW()
-                WHERE status = 'running'
-                  AND heartbeat_at < NOW() - INTERVAL '15 minutes'
-                  AND attempts < max_attempts
-                """
-            )
             cursor.execute(
                 """
                 WITH next_job AS (
                     SELECT id
                     FROM tw_job_runs
                     WHERE status = 'queued'
+                      AND (%s::text[] IS NULL OR job_type = ANY(%s::text[]))
                     ORDER BY queued_at
                     FOR UPDATE SKIP LOCKED
                     LIMIT 1
@@ -164,7 +333,7 @@ def claim_next_job(worker_id: Optional[str] = None) -> Optional[dict[str, Any]]:
                 WHERE jobs.id = next_job.id
                 RETURNING jobs.*
                 """,
-                (worker,),
+                (types, types, worker),
             )
             row = cursor.fetchone()
             return dict(row) if row else None
@@ -193,7 +362,7 @@ def update_job(
         assignments.append("result = %s")
         values.append(Json(result))
     values.append(job_id)
-    with closing(connect()) as db, db:
+    with pooled_connection() as db:
         with db.cursor() as cursor:
             cursor.execute(
                 f"UPDATE tw_job_runs SET {', '.join(assignments)} WHERE id = %s",
@@ -202,7 +371,7 @@ def update_job(
 
 
 def complete_job(job_id: str, result: Optional[dict[str, Any]] = None) -> None:
-    with closing(connect()) as db, db:
+    with pooled_connection() as db:
         with db.cursor() as cursor:
             cursor.execute(
                 """
@@ -217,7 +386,7 @@ def complete_job(job_id: str, result: Optional[dict[str, Any]] = None) -> None:
 
 
 def fail_job(job_id: str, error: Exception | str) -> None:
-    with closing(connect()) as db, db:
+    with pooled_connection() as db:
         with db.cursor() as cursor:
             cursor.execute(
                 """
@@ -231,9 +400,13 @@ def fail_job(job_id: str, error: Exception | str) -> None:
                     finished_at = CASE WHEN attempts < max_attempts THEN NULL ELSE NOW() END,
                     updated_at = NOW()
                 WHERE id = %s
+                RETURNING status
                 """,
                 (str(error)[:8000], job_id),
             )
+            row = cursor.fetchone()
+            if row and row["status"] == "queued":
+                notify_queue(cursor)
 
 
 def serialize_job(job: dict[str, Any]) -> dict[str, Any]:
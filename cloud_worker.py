@@ -1,5 +1,16 @@
 #!/usr/bin/env python3
-"""Render background worker for long-running stock-data jobs."""
+"""Render background worker for long-running stock-data jobs.
+
+Workers ``LISTEN`` for the queue's ``NOTIFY`` and claim jobs as soon as one is
+enqueued (or a slot frees up); ``WORKER_POLL_SECONDS`` is only the fallback
+poll.  A sweeper thread requeues jobs whose worker stopped heartbeating.
+
+Jobs run in ``WORKER_SLOTS`` concurrent slots.  ``WORKER_JOB_LIMITS`` (e.g.
+``"t86=2,margin=2,stock_prices=1"``) caps how many jobs of one type share the
+slots, so network-bound fetches overlap while heavy price backfills stay
+serialized.  Each job type has a handler that calls the server's service
+functions in-process and reports real progress through ``update_job``.
+"""
 
 from __future__ import annotations
 
@@ -8,10 +19,16 @@ import os
 import socket
 import threading
 import time
-from typing import Any
-from urllib.parse import urlencode
+from typing import Any, Callable, Optional
 
-from cloud_jobs import claim_next_job, complete_job, fail_job, update_job
+from cloud_jobs import (
+    JobListener,
+    claim_next_job,
+    complete_job,
+    fail_job,
+    recover_stale_jobs,
+    update_job,
+)
 
 logging.basicConfig(
     level=os.environ.get("LOG_LEVEL", "INFO"),
@@ -19,8 +36,38 @@ logging.basicConfig(
 )
 logger = logging.getLogger("cloud-worker")
 
-POLL_SECONDS = max(1.0, float(os.environ.get("WORKER_POLL_SECONDS", "5")))
+POLL_SECONDS = max(1.0, float(os.environ.get("WORKER_POLL_SECONDS", "60")))
+SWEEP_SECONDS = max(5.0, float(os.environ.get("WORKER_SWEEP_SECONDS", "60")))
 WORKER_ID = os.environ.get("RENDER_INSTANCE_ID") or f"{socket.gethostname()}:{os.getpid()}"
+WORKER_SLOTS = max(1, int(os.environ.get("WORKER_SLOTS", "1")))
+PROGRESS_INTERVAL_SECONDS = max(0.0, float(os.environ.get("WORKER_PROGRESS_SECONDS", "2")))
+PRICE_BATCH_SIZE = max(1, int(os.environ.get("WORKER_PRICE_BATCH", "50")))
+
+DEFAULT_JOB_LIMITS = {
+    "stock_prices": 1,
+    "returns": 1,
+    "t86": 2,
+    "margin": 2,
+    "revenue": 1,
+    "income_statement": 1,
+    "balance_sheet": 1,
+    "cash_flow": 1,
+}
+
+
+def parse_job_limits(text: Optional[str], defaults: Optional[dict[str, int]] = None) -> dict[str, int]:
+    """Parse ``"t86=2,stock_prices=1"`` on top of ``defaults`` (unknown entries are ignored)."""
+    limits = dict(DEFAULT_JOB_LIMITS if defaults is None else defaults)
+    for part in str(text or "").split(","):
+        name, _, value = part.partition("=")
+        name = name.strip()
+        if not name or not value.strip():
+            continue
+        try:
+            limits[name] = max(0, int(value))
+        except ValueError:
+            logger.warning("Ignoring invalid job limit %r", part)
+    return limits
 
 
 def _compact_result(payload: Any) -> dict[str, Any]:
@@ -56,84 +103,335 @@ class Heartbeat:
         self.thread.join(timeout=2)
 
     def _run(self):
-        elapsed = 0
+        # Only refreshes heartbeat_at; the progress message belongs to JobProgress.
         while not self.stop_event.wait(20):
-            elapsed += 20
             try:
-                update_job(
-                    self.job_id,
-                    message=f"Worker running ({elapsed}s)",
-                )
+                update_job(self.job_id)
             except Exception:
                 logger.exception("Unable to update heartbeat for %s", self.job_id)
 
 
-def _request_for_job(job_type: str, params: dict[str, Any]):
-    # Importing here keeps queue startup lightweight and gives Render clearer errors.
-    from server import app, stock_api
-
-    query = dict(params)
-    query.pop("dry_run", None)
-    query["use_local_db"] = "false"
-    query["persist"] = "true"
-
-    with app.test_client() as client:
-        if job_type == "stock_prices":
-            body = dict(params)
-            body.pop("dry_run", None)
-            body["use_local_db"] = False
-            body.setdefault("update_prices", True)
-            body.setdefault("update_returns", True)
-            if not body.get("symbols"):
-                symbols = [
-                    str(item.get("symbol") or "")
-                    for item in stock_api.get_all_symbols()
-                    if item.get("symbol")
-                ]
-                scope = str(body.pop("stock_scope", "count"))
-                stock_count = max(1, int(body.pop("stock_count", 50) or 50))
-                range_from = str(body.pop("range_from", "") or "")
-                range_to = str(body.pop("range_to", "") or "")
-                if scope == "listed":
-                    symbols = [symbol for symbol in symbols if symbol.endswith(".TW")]
-                elif scope == "otc":
-                    symbols = [symbol for symbol in symbols if symbol.endswith(".TWO")]
-                elif scope == "range" and (range_from or range_to):
-                    symbols = [
-                        symbol for symbol in symbols
-                        if (not range_from or symbol.split(".")[0] >= range_from)
-                        and (not range_to or symbol.split(".")[0] <= range_to)
-                    ]
-                elif scope != "all":
-                    symbols = symbols[:stock_count]
-                body["symbols"] = symbols
-            return client.post("/api/update", json=body)
-        if job_type == "returns":
-            body = dict(params)
-            body.pop("dry_run", None)
-            body["use_neon"] = True
-            body["upload_to_neon"] = False
-            body.setdefault("all", not bool(body.get("symbol") or body.get("symbols")))
-            return client.post("/api/returns/compute", json=body)
-        if job_type == "t86":
-            return client.get(f"/api/t86/fetch?{urlencode(query)}")
-        if job_type == "margin":
-            return client.get(f"/api/margin/fetch?{urlencode(query)}")
-        if job_type == "revenue":
-            return client.get(f"/api/revenue/fetch_range?{urlencode(query)}")
-        if job_type == "income_statement":
-            query["write_to_db"] = "1"
-            query.setdefault("retry_on_block", "1")
-            return client.get(f"/api/income-statement?{urlencode(query)}")
-        if job_type == "balance_sheet":
-            query["write_to_db"] = "1"
-            query.setdefault("retry_on_block", "1")
-            return client.get(f"/api/balance-sheet?{urlencode(query)}")
-        if job_type == "cash_flow":
-            query["write_to_db"] = "1"
-            query.setdefault("retry_on_block", "1")
-            return client.get(f"/api/cash-flow-statement?{urlencode(query)}")
-    raise ValueError(f"Unsupported job type: {job_type}")
+class JobProgress:
+    """Throttled progress reporter for one job.
+
+    ``span(start, end)`` returns a ``(done, total, item)`` callback that maps a
+    phase of the job onto ``start..end`` percent.
+    """
+
+    def __init__(self, job_id: str, *, interval: float = PROGRESS_INTERVAL_SECONDS, update=None):
+        self.job_id = job_id
+        self.interval = interval
+        self._update = update or update_job
+        self._last_at = 0.0
+        self.percent = 0
+
+    def report(
+        self,
+        percent: float,
+        *,
+        current_item: Optional[str] = None,
+        message: Optional[str] = None,
+        force: bool = False,
+    ) -> None:
+        percent = max(self.percent, min(99, int(percent)))
+        now = time.monotonic()
+        if not force and now - self._last_at < self.interval:
+            return
+        self.percent = percent
+        self._last_at = now
+        try:
+            self._update(self.job_id, progress=percent, current_item=current_item, message=message)
+        except Exception:
+            logger.exception("Unable to report progress for %s", self.job_id)
+
+    def span(self, start: float, end: float, label: str = "") -> Callable[..., None]:
+        def _callback(done: int, total: int, item: Any = None) -> None:
+            fraction = (float(done) / float(total)) if total else 0.0
+            text = f"{label} {done}/{total}".strip() if total else (label or None)
+            self.report(
+                start + (end - start) * min(1.0, fraction),
+                current_item=None if item is None else str(item),
+                message=text,
+                force=bool(total) and done >= total,
+            )
+
+        return _callback
+
+
+def _call_view(view, path: str, *, method: str = "GET", query=None, body=None) -> tuple[int, Any]:
+    """Run a Flask view function in-process under a request context (no test client round trip)."""
+    from server import app
+
+    with app.test_request_context(path, method=method, query_string=query, json=body):
+        response = app.make_response(view())
+        payload = response.get_json(silent=True)
+        if payload is None:
+            payload = response.get_data(as_text=True)
+        return response.status_code, payload
+
+
+def _raise_for_status(status_code: int, payload: Any) -> None:
+    if status_code >= 400:
+        detail = payload.get("error") if isinstance(payload, dict) else str(payload)[:2000]
+        raise RuntimeError(f"HTTP {status_code}: {detail}")
+
+
+class StatusWatcher:
+    """Mirror a server module-level status dict (processed/total) into job progress."""
+
+    def __init__(self, status_name: str, progress: JobProgress, *, start: float = 5, end: float = 95):
+        self.status_name = status_name
+        self.callback = progress.span(start, end, status_name.replace("_fetch_status", ""))
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop_event.set()
+        self.thread.join(timeout=2)
+        return False
+
+    def _run(self):
+        import server
+
+        while not self.stop_event.wait(5):
+            status = getattr(server, self.status_name, None) or {}
+            if status.get("total"):
+                self.callback(int(status.get("processed") or 0), int(status["total"]), status.get("current_code"))
+
+
+def _clean_params(params: dict[str, Any]) -> dict[str, Any]:
+    cleaned = dict(params)
+    cleaned.pop("dry_run", None)
+    return cleaned
+
+
+def _range_params(params: dict[str, Any]) -> tuple[str, str, str, float]:
+    start = params.get("start")
+    end = params.get("end")
+    if not start or not end:
+        raise ValueError("start and end are required")
+    sleep = params.get("sleep")
+    return str(start), str(end), str(params.get("market") or "both"), float(sleep) if sleep is not None else 0.6
+
+
+def _persist_enabled(params: dict[str, Any]) -> bool:
+    return str(params.get("persist", "true")).lower() != "false"
+
+
+def _resolve_symbols(params: dict[str, Any]) -> list[str]:
+    from server import stock_api
+
+    if params.get("symbols"):
+        return [str(symbol) for symbol in params["symbols"] if symbol]
+    symbols = [
+        str(item.get("symbol") or "")
+        for item in stock_api.get_all_symbols()
+        if item.get("symbol")
+    ]
+    scope = str(params.get("stock_scope", "count"))
+    stock_count = max(1, int(params.get("stock_count", 50) or 50))
+    range_from = str(params.get("range_from", "") or "")
+    range_to = str(params.get("range_to", "") or "")
+    if scope == "listed":
+        symbols = [symbol for symbol in symbols if symbol.endswith(".TW")]
+    elif scope == "otc":
+        symbols = [symbol for symbol in symbols if symbol.endswith(".TWO")]
+    elif scope == "range" and (range_from or range_to):
+        symbols = [
+            symbol for symbol in symbols
+            if (not range_from or symbol.split(".")[0] >= range_from)
+            and (not range_to or symbol.split(".")[0] <= range_to)
+        ]
+    elif scope != "all":
+        symbols = symbols[:stock_count]
+    return symbols
+
+
+def _returns_callback(progress: JobProgress, start: float, end: float) -> Callable[[dict], None]:
+    span = progress.span(start, end, "returns")
+
+    def _callback(event: dict) -> None:
+        if isinstance(event, dict) and event.get("event") == "progress":
+            span(int(event.get("index") or 0), int(event.get("total") or 0), event.get("symbol"))
+
+    return _callback
+
+
+def handle_stock_prices(params: dict[str, Any], progress: JobProgress) -> dict[str, Any]:
+    from datetime import datetime
+
+    from server import DEFAULT_START_DATE, compute_returns_task, run_stock_update
+
+    body = _clean_params(params)
+    for key in ("stock_scope", "stock_count", "range_from", "range_to"):
+        body.pop(key, None)
+    body["use_local_db"] = False
+    body.setdefault("update_prices", True)
+    update_returns = bool(body.pop("update_returns", True))
+    # 報酬率在 worker 內同步計算，不交給 /api/update 的背景執行緒
+    body["update_returns"] = False
+    symbols = _resolve_symbols(params)
+    only_index = bool(body.get("only_market_index")) and bool(body.get("fetch_market_index"))
+    if not symbols and not only_index:
+        raise ValueError("No symbols to update")
+
+    batches = [symbols[i:i + PRICE_BATCH_SIZE] for i in range(0, len(symbols), PRICE_BATCH_SIZE)] or [[]]
+    prices_end = 80 if update_returns else 99
+    prices_progress = progress.span(5, prices_end, "prices")
+    results: list[Any] = []
+    errors: list[Any] = []
+    done = 0
+    for batch in batches:
+        payload, status_code = run_stock_update({**body, "symbols": batch})
+        _raise_for_status(status_code, payload)
+        results.extend(payload.get("results") or [])
+        errors.extend(payload.get("errors") or [])
+        done += len(batch)
+        prices_progress(done, len(symbols), batch[-1] if batch else None)
+
+    result: dict[str, Any] = {
+        "success": not errors,
+        "results": results,
+        "errors": errors,
+        "summary": {"total": len(symbols), "success": len(results), "failed": len(errors), "batches": len(batches)},
+    }
+    if update_returns and symbols:
+        result["returns"] = compute_returns_task(
+            symbols=symbols,
+            start=body.get("start_date", DEFAULT_START_DATE),
+            end=body.get("end_date") or datetime.now().strftime("%Y-%m-%d"),
+            all=False,
+            limit=None,
+            fill_missing=True,
+            use_neon=True,
+            upload_to_neon=False,
+            progress_callback=_returns_callback(progress, prices_end, 99),
+        )
+    return result
+
+
+def handle_returns(params: dict[str, Any], progress: JobProgress) -> dict[str, Any]:
+    from server import compute_returns_task
+
+    body = _clean_params(params)
+    symbols = body.get("symbols")
+    symbols = [s for s in symbols if isinstance(s, str) and s.strip()] if isinstance(symbols, list) else None
+    all_flag = bool(body.get("all", not bool(body.get("symbol") or symbols)))
+    result = compute_returns_task(
+        symbols=symbols,
+        symbol=body.get("symbol"),
+        start=body.get("start"),
+        end=body.get("end"),
+        all=all_flag,
+        limit=body.get("limit"),
+        fill_missing=bool(body.get("fillMissing", body.get("fill_missing", False))),
+        use_neon=True,
+        upload_to_neon=False,
+        batch_size=body.get("batch_size"),
+        max_workers=body.get("max_workers"),
+        progress_callback=_returns_callback(progress, 5, 99),
+    )
+    return {"success": True, **result}
+
+
+def _handle_daily_range(kind: str, params: dict[str, Any], progress: JobProgress) -> dict[str, Any]:
+    from server import DatabaseManager, stock_api
+
+    start, end, market, sleep_seconds = _range_params(params)
+    fetch = getattr(stock_api, f"fetch_{kind}_range")
+    upsert = getattr(stock_api, f"upsert_{kind}_records")
+    persist = _persist_enabled(params)
+    records, summary, daily_stats = fetch(
+        start,
+        end,
+        market=market,
+        sleep_seconds=sleep_seconds,
+        progress_callback=progress.span(5, 90 if persist else 99, kind),
+    )
+    inserted = 0
+    if persist and records:
+        progress.report(90, message=f"Writing {len(records)} {kind} records", force=True)
+        db_manager = DatabaseManager(use_local=False)
+        try:
+            inserted = upsert(records, db_manager=db_manager)
+        finally:
+            db_manager.disconnect()
+    return {
+        "success": True,
+        "summary": summary,
+        "daily_stats": daily_stats,
+        "count": len(records),
+        "persisted": inserted,
+        "persist_enabled": persist,
+        "data": records,
+    }
+
+
+def handle_t86(params: dict[str, Any], progress: JobProgress) -> dict[str, Any]:
+    return _handle_daily_range("t86", params, progress)
+
+
+def handle_margin(params: dict[str, Any], progress: JobProgress) -> dict[str, Any]:
+    return _handle_daily_range("margin", params, progress)
+
+
+def handle_revenue(params: dict[str, Any], progress: JobProgress) -> dict[str, Any]:
+    from server import DatabaseManager, fetch_revenue_range
+
+    start, end = params.get("start"), params.get("end")
+    if not start or not end:
+        raise ValueError("start and end (YYYY-MM) are required")
+    sleep = params.get("sleep")
+    db_manager = None
+    if _persist_enabled(params):
+        db_manager = DatabaseManager(use_local=False)
+        if not db_manager.connect():
+            raise RuntimeError("資料庫連線失敗")
+    try:
+        result = fetch_revenue_range(
+            str(start),
+            str(end),
+            market=str(params.get("market") or "both"),
+            sleep_seconds=float(sleep) if sleep is not None else 1.0,
+            db_manager=db_manager,
+            progress_callback=progress.span(5, 99, "revenue"),
+        )
+    finally:
+        if db_manager is not None:
+            db_manager.disconnect()
+    return {"success": True, **result}
+
+
+def _statement_handler(view_name: str, path: str, status_name: str):
+    def _handler(params: dict[str, Any], progress: JobProgress) -> Any:
+        import server
+
+        query = _clean_params(params)
+        query["use_local_db"] = "false"
+        query["write_to_db"] = "1"
+        query.setdefault("retry_on_block", "1")
+        with StatusWatcher(status_name, progress):
+            status_code, payload = _call_view(getattr(server, view_name), path, query=query)
+        _raise_for_status(status_code, payload)
+        return payload
+
+    return _handler
+
+
+JOB_HANDLERS: dict[str, Callable[[dict[str, Any], JobProgress], Any]] = {
+    "stock_prices": handle_stock_prices,
+    "returns": handle_returns,
+    "t86": handle_t86,
+    "margin": handle_margin,
+    "revenue": handle_revenue,
+    "income_statement": _statement_handler("api_income_statement", "/api/income-statement", "income_fetch_status"),
+    "balance_sheet": _statement_handler("api_balance_sheet", "/api/balance-sheet", "balance_fetch_status"),
+    "cash_flow": _statement_handler("api_cash_flow_statement", "/api/cash-flow-statement", "cash_flow_fetch_status"),
+}
 
 
 def execute_job(job: dict[str, Any]) -> dict[str, Any]:
@@ -144,27 +442,22 @@ def execute_job(job: dict[str, Any]) -> dict[str, Any]:
         update_job(job_id, progress=90, message="Dry run validated")
         return {"dry_run": True, "job_type": job_type, "params": params}
 
-    update_job(job_id, progress=5, message=f"Starting {job_type}")
+    handler = JOB_HANDLERS.get(job_type)
+    if handler is None:
+        raise ValueError(f"Unsupported job type: {job_type}")
+    progress = JobProgress(job_id)
+    progress.report(1, message=f"Starting {job_type}", force=True)
     heartbeat = Heartbeat(job_id)
     heartbeat.start()
     try:
-        response = _request_for_job(job_type, params)
-        payload = response.get_json(silent=True)
-        if response.status_code >= 400:
-            detail = payload.get("error") if isinstance(payload, dict) else response.get_data(as_text=True)
-            raise RuntimeError(f"HTTP {response.status_code}: {detail}")
-        update_job(job_id, progress=95, message="Finalizing result")
-        result = _compact_result(payload)
-        result["http_status"] = response.status_code
-        return result
+        payload = handler(params, progress)
+        progress.report(99, message="Finalizing result", force=True)
+        return _compact_result(payload)
     finally:
         heartbeat.stop()
 
 
-def run_once() -> bool:
-    job = claim_next_job(WORKER_ID)
-    if not job:
-        return False
+def run_job(job: dict[str, Any]) -> None:
     job_id = str(job["id"])
     logger.info("Claimed job %s type=%s attempt=%s", job_id, job["job_type"], job["attempts"])
     try:
@@ -174,18 +467,135 @@ def run_once() -> bool:
     except Exception as exc:
         logger.exception("Job %s failed", job_id)
         fail_job(job_id, exc)
+
+
+def run_once(recover=recover_stale_jobs, claim=claim_next_job, runner=None) -> bool:
+    """WORKER_RUN_ONCE: no sweeper thread runs, so requeue stale jobs before claiming one."""
+    Sweeper(recover=recover).sweep()
+    job = claim(WORKER_ID)
+    if not job:
+        return False
+    (runner or run_job)(job)
     return True
 
 
+class SlotPool:
+    """``slots`` concurrent jobs, at most ``limits[job_type]`` of each type."""
+
+    def __init__(
+        self,
+        slots: int,
+        limits: dict[str, int],
+        runner: Callable[[dict[str, Any]], None] = run_job,
+        on_free: Optional[Callable[[], None]] = None,
+    ):
+        self.slots = max(1, int(slots))
+        self.limits = dict(limits)
+        self.runner = runner
+        self.on_free = on_free
+        self.running: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._threads: set[threading.Thread] = set()
+
+    def claimable_types(self) -> list[str]:
+        with self._lock:
+            if sum(self.running.values()) >= self.slots:
+                return []
+            return sorted(
+                job_type for job_type, limit in self.limits.items()
+                if self.running.get(job_type, 0) < limit
+            )
+
+    def submit(self, job: dict[str, Any]) -> None:
+        job_type = str(job["job_type"])
+        with self._lock:
+            self.running[job_type] = self.running.get(job_type, 0) + 1
+        thread = threading.Thread(
+            target=self._run, args=(job,), name=f"job-{job_type}-{job['id']}", daemon=True
+        )
+        self._threads.add(thread)
+        thread.start()
+
+    def _run(self, job: dict[str, Any]) -> None:
+        job_type = str(job["job_type"])
+        try:
+            self.runner(job)
+        finally:
+            with self._lock:
+                self.running[job_type] = max(0, self.running.get(job_type, 0) - 1)
+            self._threads.discard(threading.current_thread())
+            if self.on_free is not None:
+                self.on_free()
+
+    def join(self, timeout: Optional[float] = None) -> None:
+        for thread in list(self._threads):
+            thread.join(timeout)
+
+
+def fill_slots(pool: SlotPool, claim=claim_next_job) -> int:
+    """Claim jobs until every free slot (or the queue) is exhausted; returns the number started."""
+    started = 0
+    while True:
+        job_types = pool.claimable_types()
+        if not job_types:
+            return started
+        job = claim(WORKER_ID, job_types)
+        if not job:
+            return started
+        pool.submit(job)
+        started += 1
+
+
+class Sweeper:
+    """Periodically requeues running jobs whose worker stopped heartbeating."""
+
+    def __init__(self, interval: float = SWEEP_SECONDS, recover=recover_stale_jobs):
+        self.interval = interval
+        self.recover = recover
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="job-sweeper", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join(timeout=2)
+
+    def sweep(self) -> dict[str, int]:
+        try:
+            counts = self.recover()
+        except Exception:
+            logger.exception("Stale job sweep failed")
+            return {}
+        if any(counts.values()):
+            logger.warning("Stale job sweep: %s", counts)
+        return counts
+
+    def _run(self):
+        self.sweep()
+        while not self.stop_event.wait(self.interval):
+            self.sweep()
+
+
 def main():
-    logger.info("Worker %s started", WORKER_ID)
+    limits = parse_job_limits(os.environ.get("WORKER_JOB_LIMITS"))
+    logger.info("Worker %s started slots=%s limits=%s", WORKER_ID, WORKER_SLOTS, limits)
     run_once_mode = os.environ.get("WORKER_RUN_ONCE", "").lower() in {"1", "true", "yes"}
+    if run_once_mode:
+        run_once()
+        return
+    listener = JobListener()
+    pool = SlotPool(WORKER_SLOTS, limits, on_free=listener.wake)
+    Sweeper().start()
     while True:
-        worked = run_once()
-        if run_once_mode:
-            return
-        if not worked:
-            time.sleep(POLL_SECONDS)
+        try:
+            fill_slots(pool)
+        except Exception:
+            logger.exception("Unable to claim jobs")
+        # NOTIFY from enqueue_job / fail_job / the sweeper, a freed slot, or the fallback poll.
+        listener.wait(POLL_SECONDS)
 
 
 if __name__ == "__main__":
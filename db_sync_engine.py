@@ -0,0 +1,561 @@
+"""Incremental table sync between two PostgreSQL databases (local <-> Neon).
+
+Per table the engine:
+
+1. picks the merge key: the primary key, except that a single serial
+   surrogate key (``id SERIAL``) next to a unique business key such as
+   ``UNIQUE (symbol, date)`` is replaced by that business key.  Surrogate ids
+   are assigned independently on each side, so they are neither copied nor
+   used to match rows;
+2. picks a high-water-mark column: ``updated_at`` when present, otherwise the
+   first date / timestamp / integer merge-key column (key range); tables
+   with neither are copied in full;
+3. streams ``COPY (SELECT ... WHERE hwm >= last) TO STDOUT`` from the source
+   straight into ``COPY ... FROM STDIN`` on the destination through an OS pipe,
+   so rows are never materialised in Python.  ``updated_at`` is stamped at
+   transaction start, so a transaction committing after the last sync can
+   carry an older stamp; that mark is re-read with an overlap window
+   (``SYNC_WATERMARK_OVERLAP_SECONDS``) and the idempotent merge absorbs the
+   repeats;
+4. loads them into a temporary staging table and merges with
+   ``INSERT ... ON CONFLICT (merge key) DO UPDATE`` so updated rows propagate;
+5. stores the new mark in ``sync_watermarks`` on the destination inside the
+   same transaction as the merge.
+
+``sync_tables`` runs several tables in parallel with a bounded worker pool,
+each worker using its own pair of connections.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+WATERMARK_TABLE = "sync_watermarks"
+TOUCH_FUNCTION = "sync_touch_updated_at"
+KEY_RANGE_TYPES = {
+    "date",
+    "timestamp without time zone",
+    "timestamp with time zone",
+    "integer",
+    "bigint",
+    "smallint",
+}
+
+# updated_at 取自交易開始時間：晚提交的交易可能帶著早於上次水位的時間戳，重讀這段區間
+WATERMARK_OVERLAP_SECONDS = int(os.getenv("SYNC_WATERMARK_OVERLAP_SECONDS", "600"))
+
+ProgressFn = Callable[..., None]
+
+
+def quote_ident(name: str) -> str:
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def fetch_tuples(cursor) -> list[tuple]:
+    out = []
+    for row in cursor.fetchall() or []:
+        out.append(tuple(row.values()) if isinstance(row, dict) else tuple(row))
+    return out
+
+
+@dataclass
+class TableShape:
+    name: str
+    columns: list[dict[str, Any]]
+    primary_key: list[str]
+    unique_keys: list[list[str]] = field(default_factory=list)
+
+    @property
+    def column_names(self) -> list[str]:
+        return [c["name"] for c in self.columns]
+
+    @property
+    def surrogate_key(self) -> Optional[str]:
+        """Single-column serial primary key that a unique business key can stand in for."""
+        if len(self.primary_key) != 1 or not self.unique_keys:
+            return None
+        pk = self.primary_key[0]
+        for col in self.columns:
+            if col["name"] == pk and "nextval(" in str(col.get("default") or ""):
+                return pk
+        return None
+
+    def merge_key(self) -> list[str]:
+        if self.surrogate_key:
+            return list(self.unique_keys[0])
+        if self.primary_key:
+            return list(self.primary_key)
+        return list(self.unique_keys[0]) if self.unique_keys else []
+
+    @property
+    def copy_columns(self) -> list[str]:
+        """Columns carried over; the surrogate key is left to the destination's own sequence."""
+        surrogate = self.surrogate_key
+        return [c for c in self.column_names if c != surrogate]
+
+    def column_type(self, name: str) -> str:
+        for col in self.columns:
+            if col["name"] == name:
+                return col["data_type"]
+        return ""
+
+    def watermark_column(self) -> Optional[str]:
+        key = self.merge_key()
+        if "updated_at" in self.column_names and key:
+            return "updated_at"
+        for col in key:
+            if self.column_type(col) in KEY_RANGE_TYPES:
+                return col
+        return None
+
+
+@dataclass
+class TableResult:
+    name: str
+    success: bool = True
+    row_count: int = 0
+    merged: int = 0
+    mode: str = "full"
+    watermark_column: Optional[str] = None
+    watermark: Optional[str] = None
+    seconds: float = 0.0
+    error: Optional[str] = None
+
+    def as_dict(self) -> dict[str, Any]:
+        out = {
+            "name": self.name,
+            "success": self.success,
+            "rowCount": self.row_count,
+            "insertedCount": self.merged,
+            "mode": self.mode,
+            "watermarkColumn": self.watermark_column,
+            "watermark": self.watermark,
+            "seconds": round(self.seconds, 3),
+        }
+        if self.error:
+            out["error"] = self.error
+        return out
+
+
+def describe_table(cursor, table: str) -> Optional[TableShape]:
+    cursor.execute(
+        """
+        SELECT column_name, data_type, character_maximum_length, is_nullable, column_default
+        FROM information_schema.columns
+        WHERE table_schema = 'public' AND table_name = %s
+        ORDER BY ordinal_position
+        """,
+        (table,),
+    )
+    columns = [
+        {
+            "name": r[0],
+            "data_type": (r[1] or "").lower(),
+            "max_length": r[2],
+            "nullable": r[3] != "NO",
+            "default": r[4],
+        }
+        for r in fetch_tuples(cursor)
+    ]
+    if not columns:
+        return None
+    cursor.execute(
+        """
+        SELECT a.attname
+        FROM pg_index i
+        JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+        WHERE i.indrelid = %s::regclass AND i.indisprimary
+        ORDER BY array_position(i.indkey, a.attnum)
+        """,
+        (quote_ident(table),),
+    )
+    primary_key = [r[0] for r in fetch_tuples(cursor)]
+    # 非主鍵的唯一鍵（UNIQUE 約束或唯一索引；排除部分／運算式索引）
+    cursor.execute(
+        """
+        SELECT array_agg(a.attname ORDER BY array_position(i.indkey, a.attnum))
+        FROM pg_index i
+        JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+        WHERE i.indrelid = %s::regclass AND i.indisunique AND NOT i.indisprimary
+          AND i.indpred IS NULL AND i.indexprs IS NULL
+        GROUP BY i.indexrelid
+        ORDER BY i.indexrelid
+        """,
+        (quote_ident(table),),
+    )
+    unique_keys: list[list[str]] = []
+    for (cols,) in fetch_tuples(cursor):
+        cols = list(cols or [])
+        if cols and cols not in unique_keys:
+            unique_keys.append(cols)
+    return TableShape(table, columns, primary_key, unique_keys)
+
+
+def list_tables(cursor) -> list[str]:
+    """Public tables to sync.  Partitions are skipped: their rows are read (and merged) through the parent."""
+    cursor.execute(
+        """
+        SELECT c.relname FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = 'public' AND c.relkind IN ('r', 'p') AND NOT c.relispartition
+        ORDER BY c.relname
+        """
+    )
+    return [r[0] for r in fetch_tuples(cursor) if r[0] != WATERMARK_TABLE]
+
+
+def ensure_destination_table(cursor, shape: TableShape, *, recreate: bool = False) -> None:
+    """Create the destination table (and the sequences its defaults use) if missing."""
+    cursor.execute(
+        """
+        SELECT c.relkind FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = 'public' AND c.relname = %s
+        """,
+        (shape.name,),
+    )
+    existing = fetch_tuples(cursor)
+    relkind = existing[0][0] if existing else None
+    if relkind is not None and (recreate or relkind not in ("r", "p")):
+        kind = {"v": "VIEW", "m": "MATERIALIZED VIEW", "f": "FOREIGN TABLE"}.get(relkind, "TABLE")
+        cursor.execute(f"DROP {kind} IF EXISTS {quote_ident(shape.name)} CASCADE")
+
+    defs = []
+    for col in shape.columns:
+        col_def = f'{quote_ident(col["name"])} {col["data_type"]}'
+        if col["max_length"]:
+            col_def += f'({col["max_length"]})'
+        if not col["nullable"]:
+            col_def += " NOT NULL"
+        if col["default"]:
+            seq = re.search(r"nextval\('([^']+)'", str(col["default"]))
+            if seq:
+                cursor.execute(
+                    "CREATE SEQUENCE IF NOT EXISTS "
+                    + ".".join(quote_ident(part) for part in seq.group(1).replace('"', "").split(".", 1))
+                )
+            col_def += f' DEFAULT {col["default"]}'
+        defs.append(col_def)
+    ddl = f"CREATE TABLE IF NOT EXISTS {quote_ident(shape.name)} ({', '.join(defs)}"
+    if shape.primary_key:
+        ddl += f", PRIMARY KEY ({', '.join(quote_ident(c) for c in shape.primary_key)})"
+    cursor.execute(ddl + ")")
+    # 唯一鍵一併帶過去；名稱與 PostgreSQL 預設的 UNIQUE 約束名相同，已存在時不重建
+    for key in shape.unique_keys:
+        index = f"{shape.name}_{'_'.join(key)}_key"
+        cursor.execute(
+            f"CREATE UNIQUE INDEX IF NOT EXISTS {quote_ident(index)} ON {quote_ident(shape.name)} "
+            f"({', '.join(quote_ident(c) for c in key)})"
+        )
+
+
+def ensure_change_marker(cursor, table: str) -> bool:
+    """Give ``table`` an ``updated_at`` that a BEFORE UPDATE trigger bumps on every rewrite.
+
+    Tables keyed by a serial id cannot use the id as a watermark (a rewritten
+    row keeps its id); with this marker ``watermark_column`` picks
+    ``updated_at`` and upserts from any writer propagate.  Checks the catalog
+    first so the per-request ``create_tables`` does not take a table lock.
+    Returns True when something was installed.
+    """
+    trigger = f"{table}_touch_updated_at"
+    cursor.execute(
+        """
+        SELECT
+            EXISTS (
+                SELECT 1 FROM information_schema.columns
+                WHERE table_schema = 'public' AND table_name = %s AND column_name = 'updated_at'
+            ),
+            EXISTS (SELECT 1 FROM pg_trigger WHERE tgrelid = %s::regclass AND tgname = %s)
+        """,
+        (table, quote_ident(table), trigger),
+    )
+    has_column, has_trigger = fetch_tuples(cursor)[0]
+    if has_column and has_trigger:
+        return False
+    if not has_column:
+        cursor.execute(
+            f"ALTER TABLE {quote_ident(table)} ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP"
+        )
+    if not has_trigger:
+        cursor.execute(
+            f"""
+            CREATE OR REPLACE FUNCTION {TOUCH_FUNCTION}() RETURNS trigger AS $$
+            BEGIN
+                NEW.updated_at := CURRENT_TIMESTAMP;
+                RETURN NEW;
+            END;
+            $$ LANGUAGE plpgsql
+            """
+        )
+        cursor.execute(
+            f"CREATE TRIGGER {quote_ident(trigger)} BEFORE UPDATE ON {quote_ident(table)} "
+            f"FOR EACH ROW EXECUTE FUNCTION {TOUCH_FUNCTION}()"
+        )
+    return True
+
+
+def ensure_watermark_table(cursor) -> None:
+    cursor.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {WATERMARK_TABLE} (
+            direction VARCHAR(20) NOT NULL,
+            table_name VARCHAR(128) NOT NULL,
+            column_name VARCHAR(128),
+            value TEXT,
+            rows_synced BIGINT DEFAULT 0,
+            synced_at TIMESTAMPTZ DEFAULT NOW(),
+            PRIMARY KEY (direction, table_name)
+        )
+        """
+    )
+
+
+def load_watermark(cursor, direction: str, table: str, column: Optional[str]) -> Optional[str]:
+    cursor.execute(
+        f"SELECT column_name, value FROM {WATERMARK_TABLE} WHERE direction = %s AND table_name = %s",
+        (direction, table),
+    )
+    rows = fetch_tuples(cursor)
+    if not rows or rows[0][0] != column:
+        return None
+    return rows[0][1]
+
+
+def pipe_copy(src_cursor, dst_cursor, select_sql: str, copy_in_sql: str) -> None:
+    """Stream ``COPY TO STDOUT`` on one connection into ``COPY FROM STDIN`` on another."""
+    read_fd, write_fd = os.pipe()
+    reader = os.fdopen(read_fd, "rb")
+    writer = os.fdopen(write_fd, "wb")
+    errors: list[BaseException] = []
+
+    def _produce():
+        try:
+            src_cursor.copy_expert(f"COPY ({select_sql}) TO STDOUT", writer)
+        except BaseException as exc:  # noqa: BLE001 - re-raised in the caller
+            errors.append(exc)
+        finally:
+            try:
+                writer.close()
+            except OSError:
+                pass
+
+    producer = threading.Thread(target=_produce, name="db-sync-copy-out", daemon=True)
+    producer.start()
+    try:
+        dst_cursor.copy_expert(copy_in_sql, reader)
+    finally:
+        reader.close()
+        producer.join()
+    if errors:
+        raise errors[0]
+
+
+def stage_copy(src_cursor, dst_cursor, shape: TableShape, select_sql: str, *, target: str) -> int:
+    """Stream ``select_sql`` into a ``_sync_stage`` temp table shaped like ``target``; returns staged rows."""
+    cols = ", ".join(quote_ident(c) for c in shape.copy_columns)
+    dst_cursor.execute(
+        f"CREATE TEMP TABLE _sync_stage ON COMMIT DROP AS SELECT {cols} FROM {quote_ident(target)} WITH NO DATA"
+    )
+    pipe_copy(src_cursor, dst_cursor, select_sql, f"COPY _sync_stage ({cols}) FROM STDIN")
+    dst_cursor.execute("SELECT COUNT(*) FROM _sync_stage")
+    return int(fetch_tuples(dst_cursor)[0][0] or 0)
+
+
+def merge_stage(cursor, shape: TableShape, target: str) -> int:
+    """Merge ``_sync_stage`` into ``target``: upsert by merge key, full replace without one."""
+    cols = ", ".join(quote_ident(c) for c in shape.copy_columns)
+    key = shape.merge_key()
+    if key:
+        pk = ", ".join(quote_ident(c) for c in key)
+        updates = [c for c in shape.copy_columns if c not in key]
+        on_conflict = (
+            "DO UPDATE SET " + ", ".join(f"{quote_ident(c)} = EXCLUDED.{quote_ident(c)}" for c in updates)
+            if updates else "DO NOTHING"
+        )
+        cursor.execute(
+            f"""
+            INSERT INTO {quote_ident(target)} ({cols})
+            SELECT DISTINCT ON ({pk}) {cols} FROM _sync_stage ORDER BY {pk}
+            ON CONFLICT ({pk}) {on_conflict}
+            """
+        )
+    else:
+        # 無主鍵無法合併：整表以暫存表內容取代（同一交易內）
+        cursor.execute(f"DELETE FROM {quote_ident(target)}")
+        cursor.execute(f"INSERT INTO {quote_ident(target)} ({cols}) SELECT {cols} FROM _sync_stage")
+    return cursor.rowcount if cursor.rowcount and cursor.rowcount > 0 else 0
+
+
+def sync_table(
+    src_conn,
+    dst_conn,
+    table: str,
+    *,
+    direction: str,
+    full: bool = False,
+    recreate: bool = False,
+    progress: Optional[ProgressFn] = None,
+) -> TableResult:
+    """Sync one table from ``src_conn`` to ``dst_conn`` (both plain psycopg2 connections)."""
+    started = time.perf_counter()
+    result = TableResult(name=table)
+    notify = progress or (lambda *a, **k: None)
+    src = src_conn.cursor()
+    dst = dst_conn.cursor()
+    try:
+        shape = describe_table(src, table)
+        src_conn.rollback()
+        if shape is None:
+            result.mode = "skipped"
+            return result
+        notify("table_start", f"開始同步表格: {table}", table=table)
+
+        ensure_watermark_table(dst)
+        ensure_destination_table(dst, shape, recreate=recreate)
+        dst_conn.commit()
+
+        cols = ", ".join(quote_ident(c) for c in shape.copy_columns)
+        wm_col = shape.watermark_column()
+        last = None if (full or recreate or wm_col is None) else load_watermark(dst, direction, table, wm_col)
+        where = ""
+        if last is not None:
+            lower = _literal(src, last)
+            if wm_col == "updated_at" and WATERMARK_OVERLAP_SECONDS > 0:
+                col_type = shape.column_type(wm_col) or "timestamp with time zone"
+                lower = f"CAST({lower} AS {col_type}) - INTERVAL '{WATERMARK_OVERLAP_SECONDS} seconds'"
+            where = f" WHERE {quote_ident(wm_col)} >= {lower}"
+            result.mode = "incremental"
+        result.watermark_column = wm_col
+
+        result.row_count = stage_copy(src, dst, shape, f"SELECT {cols} FROM {quote_ident(table)}{where}", target=table)
+        src_conn.rollback()
+        notify("table_info", f"{table} 待合併 {result.row_count} 行（{result.mode}）", table=table, row_count=result.row_count)
+
+        if recreate:
+            dst.execute(f"TRUNCATE TABLE {quote_ident(table)}")
+        result.merged = merge_stage(dst, shape, table)
+
+        new_mark = last
+        if wm_col is not None:
+            dst.execute(f"SELECT MAX({quote_ident(wm_col)})::text FROM _sync_stage")
+            new_mark = fetch_tuples(dst)[0][0] or last
+        dst.execute(
+            f"""
+            INSERT INTO {WATERMARK_TABLE} (direction, table_name, column_name, value, rows_synced, synced_at)
+            VALUES (%s, %s, %s, %s, %s, NOW())
+            ON CONFLICT (direction, table_name) DO UPDATE SET
+                column_name = EXCLUDED.column_name,
+                value = EXCLUDED.value,
+                rows_synced = EXCLUDED.rows_synced,
+                synced_at = NOW()
+            """,
+            (direction, table, wm_col, new_mark, result.row_count),
+        )
+        dst_conn.commit()
+        result.watermark = new_mark
+        notify(
+            "table_done",
+            f"完成同步表格: {table} ({result.merged}/{result.row_count})",
+            table=table,
+            inserted=result.merged,
+            row_count=result.row_count,
+        )
+        return result
+    except Exception as exc:
+        for conn in (src_conn, dst_conn):
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+        result.success = False
+        result.error = str(exc)
+        notify("error", f"表格 {table} 處理失敗: {exc}", table=table)
+        logger.error("sync %s %s failed: %s", direction, table, exc)
+        return result
+    finally:
+        result.seconds = time.perf_counter() - started
+        for cur in (src, dst):
+            try:
+                cur.close()
+            except Exception:
+                pass
+
+
+def _literal(cursor, value: str) -> str:
+    return cursor.mogrify("%s", (value,)).decode() if hasattr(cursor, "mogrify") else repr(value)
+
+
+@dataclass
+class SyncReport:
+    direction: str
+    tables: list[TableResult] = field(default_factory=list)
+
+    def as_dict(self) -> dict[str, Any]:
+        errors = [{"table": t.name, "error": t.error} for t in self.tables if not t.success]
+        return {
+            "success": not errors,
+            "direction": self.direction,
+            "tables": [t.as_dict() for t in self.tables],
+            "totalTables": len(self.tables),
+            "totalRows": sum(t.merged for t in self.tables),
+            "errors": errors,
+        }
+
+
+def sync_tables(
+    src_connect: Callable[[], Any],
+    dst_connect: Callable[[], Any],
+    tables: Optional[Iterable[str]] = None,
+    *,
+    direction: str,
+    workers: int = 3,
+    full: bool = False,
+    recreate: bool = False,
+    progress: Optional[ProgressFn] = None,
+) -> SyncReport:
+    """Sync ``tables`` (all public tables of the source when ``None``) with bounded parallelism."""
+    if tables is None:
+        conn = src_connect()
+        try:
+            tables = list_tables(conn.cursor())
+        finally:
+            conn.close()
+    table_list = list(dict.fromkeys(tables))
+    report = SyncReport(direction=direction)
+
+    def _one(table: str) -> TableResult:
+        src_conn = dst_conn = None
+        try:
+            src_conn = src_connect()
+            dst_conn = dst_connect()
+            return sync_table(
+                src_conn, dst_conn, table,
+                direction=direction, full=full, recreate=recreate, progress=progress,
+            )
+        except Exception as exc:
+            if progress:
+                progress("error", f"表格 {table} 連線失敗: {exc}", table=table)
+            return TableResult(name=table, success=False, error=str(exc))
+        finally:
+            for conn in (src_conn, dst_conn):
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+    with ThreadPoolExecutor(max_workers=max(1, min(int(workers), 8)), thread_name_prefix="db-sync") as pool:
+        futures = {pool.submit(_one, t): t for t in table_list}
+        for future in as_completed(futures):
+            report.tables.append(future.result())
+    order = {t: i for i, t in enumerate(table_list)}
+    report.tables.sort(key=lambda r: order.get(r.name, 0))
+    return report
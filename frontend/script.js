@@ -761,6 +761,29 @@ class TaiwanStockApp {
             if (!res.ok || !data.success) {
                 throw new Error(data.error || `HTTP ${res.status}`);
             }
+            if (data.background) {
+                const plan = data.plan || {};
+                this.addLogMessage(`🗓️ 批次修復已於背景開始：${plan.symbols || 0} 檔、${plan.days || 0} 個交易日（${plan.start || ''}~${plan.end || ''}）`, 'info');
+                const statusUrl = apiUrl('/api/anomalies/repair/status');
+                let st = data.status || {};
+                let lastDay = -1;
+                while (true) {
+                    await this.sleep(2000);
+                    const sres = await fetch(statusUrl);
+                    const sdata = await sres.json();
+                    st = sdata.status || {};
+                    if ((st.processedDays || 0) !== lastDay) {
+                        lastDay = st.processedDays || 0;
+                        this.addLogMessage(`⏳ 進度 ${lastDay}/${st.totalDays || 0} 日，已寫入 ${st.inserted || 0} 筆、拒收 ${st.rejected || 0} 筆`, 'info');
+                    }
+                    if (!st.running) break;
+                }
+                if (st.error) {
+                    throw new Error(st.error);
+                }
+                this.addLogMessage(`✅ 批次修復完成：重抓寫入 ${st.inserted || 0} 筆，抓取 ${st.fetches || 0} 次日行情。`, 'success');
+                return;
+            }
             this.addLogMessage(`✅ 修復完成：刪除 ${data.deleted || 0} 筆、重抓 ${data.refetched || 0} 筆。`, 'success');
             if (Array.isArray(data.details)) {
                 data.details.slice(0, 5).forEach((d, i) => {
@@ -15,15 +15,21 @@ The core scraping/parsing logic is largely adapted from the standalone
 script `comprehensive_income_statement.py`.
 """
 
+from __future__ import annotations
+
 import time
 from io import BytesIO, StringIO
 from typing import List, Callable, Optional
 
 import logging
-import pandas as pd
 import requests
-from bs4 import BeautifulSoup
-from lxml import etree
+
+from lazy_imports import lazy_module
+
+# pandas / bs4 / lxml 延遲載入，僅在實際抓取財報時才匯入
+pd = lazy_module("pandas")
+bs4 = lazy_module("bs4")
+etree = lazy_module("lxml.etree")
 
 
 TARGET_KEYWORDS = {
@@ -435,7 +441,7 @@ def _append_missing_eps_facts(results, raw_content):
         return
 
     try:
-        soup = BeautifulSoup(raw_content, "html.parser")
+        soup = bs4.BeautifulSoup(raw_content, "html.parser")
     except Exception:
         return
 
@@ -0,0 +1,370 @@
+"""Managed index migrations and EXPLAIN probes for the hot query shapes.
+
+Each migration is an idempotent ``CREATE INDEX CONCURRENTLY IF NOT EXISTS``
+recorded in ``schema_migrations``.  Expression indexes repeat the exact
+expressions used by the portal search / financial-ratio queries; PostgreSQL only
+matches an expression index when the query expression is textually identical.
+
+``explain_probes`` runs ``EXPLAIN (FORMAT JSON)`` for representative queries of
+the busiest endpoints and summarises which relations are still sequentially
+scanned, so regressions show up on ``/api/debug/query-plans``.
+"""
+
+from __future__ import annotations
+
+import logging
+from typing import Any, Callable, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_TABLE = "schema_migrations"
+
+# 與主檔表達式索引（0002–0009）一致的正規化運算式
+UNDERLYING_NORM_SQL = (
+    "UPPER(REPLACE(REPLACE(REPLACE(COALESCE(underlying_code, ''), '.TW', ''), '.TWO', ''), '.TAI', ''))"
+)
+SYMBOL_NORM_SQL = "REPLACE(REPLACE(REPLACE(UPPER(symbol), '.TW', ''), '.TWO', ''), '.TAI', '')"
+# 與 financial_ratios_service.compute_records_from_connection 一致
+RATIO_SYMBOL_NORM_SQL = "REPLACE(REPLACE(symbol, '.TWO', ''), '.TW', '')"
+
+# (id, table, sql, required column or None)
+# ``{prices}`` is replaced by the environment-specific prices table.
+MIGRATIONS: list[tuple[str, str, str, Optional[str]]] = [
+    (
+        "0001_pg_trgm",
+        "",
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        None,
+    ),
+    (
+        "0002_tw_warrant_master_underlying_norm",
+        "tw_warrant_master",
+        f"CREATE INDEX CONCURRENTLY IF NOT EXISTS tw_warrant_master_underlying_norm_idx "
+        f"ON tw_warrant_master (({UNDERLYING_NORM_SQL}))",
+        "underlying_code",
+    ),
+    (
+        "0003_tpex_warrant_master_underlying_norm",
+        "tpex_warrant_master",
+        f"CREATE INDEX CONCURRENTLY IF NOT EXISTS tpex_warrant_master_underlying_norm_idx "
+        f"ON tpex_warrant_master (({UNDERLYING_NORM_SQL}))",
+        "underlying_code",
+    ),
+    (
+        "0004_tw_warrant_master_code_upper",
+        "tw_warrant_master",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS tw_warrant_master_code_upper_idx "
+        "ON tw_warrant_master ((UPPER(warrant_code)))",
+        None,
+    ),
+    (
+        "0005_tpex_warrant_master_code_upper",
+        "tpex_warrant_master",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS tpex_warrant_master_code_upper_idx "
+        "ON tpex_warrant_master ((UPPER(warrant_code)))",
+        None,
+    ),
+    (
+        "0006_tw_warrant_master_trgm",
+        "tw_warrant_master",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS tw_warrant_master_search_trgm_idx "
+        "ON tw_warrant_master USING gin "
+        "(warrant_code gin_trgm_ops, warrant_name gin_trgm_ops, underlying_name gin_trgm_ops)",
+        None,
+    ),
+    (
+        "0007_tpex_warrant_master_trgm",
+        "tpex_warrant_master",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS tpex_warrant_master_search_trgm_idx "
+        "ON tpex_warrant_master USING gin "
+        "(warrant_code gin_trgm_ops, warrant_name gin_trgm_ops, underlying_name gin_trgm_ops)",
+        None,
+    ),
+    (
+        "0008_stock_symbols_norm",
+        "stock_symbols",
+        f"CREATE INDEX CONCURRENTLY IF NOT EXISTS stock_symbols_symbol_norm_idx "
+        f"ON stock_symbols (({SYMBOL_NORM_SQL}))",
+        "symbol",
+    ),
+    (
+        "0009_stock_symbols_upper",
+        "stock_symbols",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS stock_symbols_symbol_upper_idx "
+        "ON stock_symbols ((UPPER(symbol)))",
+        "symbol",
+    ),
+    (
+        "0010_tw_stock_symbols_ratio_norm",
+        "tw_stock_symbols",
+        f"CREATE INDEX CONCURRENTLY IF NOT EXISTS tw_stock_symbols_code_norm_idx "
+        f"ON tw_stock_symbols (({RATIO_SYMBOL_NORM_SQL}))",
+        "symbol",
+    ),
+    (
+        "0011_prices_updated_at",
+        "{prices}",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS {prices}_updated_at_idx "
+        "ON {prices} (updated_at DESC)",
+        "updated_at",
+    ),
+]
+
+
+def _first_value(row: Any) -> Any:
+    if row is None:
+        return None
+    if isinstance(row, dict):
+        return next(iter(row.values()), None)
+    return row[0]
+
+
+def _render(text: str, prices_table: str) -> str:
+    return text.replace("{prices}", prices_table)
+
+
+def ensure_migrations_table(cursor) -> None:
+    cursor.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {MIGRATIONS_TABLE} (
+            id VARCHAR(120) PRIMARY KEY,
+            statement TEXT NOT NULL,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        )
+        """
+    )
+
+
+def _column_exists(cursor, table: str, column: Optional[str]) -> bool:
+    cursor.execute(
+        """
+        SELECT COUNT(*) AS n
+        FROM information_schema.columns
+        WHERE table_schema = 'public' AND table_name = %s
+          AND (%s::text IS NULL OR column_name = %s)
+        """,
+        (table, column, column),
+    )
+    return int(_first_value(cursor.fetchone()) or 0) > 0
+
+
+def _index_name(sql: str) -> Optional[str]:
+    marker = "IF NOT EXISTS "
+    if marker not in sql:
+        return None
+    return sql.split(marker, 1)[1].split()[0]
+
+
+def migration_status(connection, *, prices_table: str = "tw_stock_prices") -> list[dict[str, Any]]:
+    """Return every migration with its applied / pending / skipped state."""
+    cursor = connection.cursor()
+    try:
+        ensure_migrations_table(cursor)
+        cursor.execute(f"SELECT id, applied_at FROM {MIGRATIONS_TABLE}")
+        applied = {}
+        for row in cursor.fetchall() or []:
+            key = row["id"] if isinstance(row, dict) else row[0]
+            applied[key] = row["applied_at"] if isinstance(row, dict) else row[1]
+        connection.commit()
+        out = []
+        for migration_id, table, sql, column in MIGRATIONS:
+            table_name = _render(table, prices_table)
+            state = "applied" if migration_id in applied else "pending"
+            if state == "pending" and table_name and not _column_exists(cursor, table_name, column):
+                state = "skipped"
+            out.append({
+                "id": migration_id,
+                "table": table_name or None,
+                "state": state,
+                "applied_at": applied.get(migration_id),
+                "sql": _render(sql, prices_table),
+            })
+        return out
+    finally:
+        cursor.close()
+
+
+def apply_migrations(
+    connection,
+    *,
+    prices_table: str = "tw_stock_prices",
+    only: Optional[Iterable[str]] = None,
+) -> list[dict[str, Any]]:
+    """Apply pending migrations one by one in autocommit mode.
+
+    ``CREATE INDEX CONCURRENTLY`` cannot run inside a transaction block, so the
+    connection is switched to autocommit for the duration of the call.  A failed
+    concurrent build leaves an INVALID index behind; it is dropped so the next
+    run can retry.
+    """
+    wanted = set(only) if only else None
+    previous_autocommit = connection.autocommit
+    connection.commit()
+    connection.autocommit = True
+    results: list[dict[str, Any]] = []
+    cursor = connection.cursor()
+    try:
+        ensure_migrations_table(cursor)
+        cursor.execute(f"SELECT id FROM {MIGRATIONS_TABLE}")
+        applied = {_first_value(row) for row in cursor.fetchall() or []}
+        for migration_id, table, sql, column in MIGRATIONS:
+            if wanted is not None and migration_id not in wanted:
+                continue
+            if migration_id in applied:
+                continue
+            table_name = _render(table, prices_table)
+            statement = _render(sql, prices_table)
+            if table_name and not _column_exists(cursor, table_name, column):
+                results.append({"id": migration_id, "state": "skipped", "reason": "table/column missing"})
+                continue
+            try:
+                cursor.execute(statement)
+                cursor.execute(
+                    f"INSERT INTO {MIGRATIONS_TABLE} (id, statement) VALUES (%s, %s) "
+                    "ON CONFLICT (id) DO NOTHING",
+                    (migration_id, statement),
+                )
+                results.append({"id": migration_id, "state": "applied"})
+                logger.info("migration %s applied", migration_id)
+            except Exception as exc:
+                logger.warning("migration %s failed: %s", migration_id, exc)
+                index_name = _index_name(statement)
+                if index_name and "INDEX" in statement:
+                    try:
+                        cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}")
+                    except Exception:
+                        pass
+                results.append({"id": migration_id, "state": "failed", "error": str(exc)})
+        return results
+    finally:
+        cursor.close()
+        connection.autocommit = previous_autocommit
+
+
+def _walk_plan(node: dict[str, Any], summary: dict[str, Any]) -> None:
+    node_type = node.get("Node Type")
+    relation = node.get("Relation Name")
+    index_name = node.get("Index Name")
+    summary["nodes"].append(node_type)
+    if node_type == "Seq Scan" and relation:
+        summary["seq_scans"].append(relation)
+    if index_name:
+        summary["indexes"].append(index_name)
+    if node_type == "Sort":
+        summary["sorts"] += 1
+    for child in node.get("Plans") or []:
+        _walk_plan(child, summary)
+
+
+def summarize_plan(plan_json: Any) -> dict[str, Any]:
+    """Reduce an ``EXPLAIN (FORMAT JSON)`` document to the fields worth watching."""
+    doc = plan_json
+    if isinstance(doc, str):
+        import json
+
+        doc = json.loads(doc)
+    if isinstance(doc, list):
+        doc = doc[0] if doc else {}
+    root = (doc or {}).get("Plan") or {}
+    summary: dict[str, Any] = {
+        "total_cost": root.get("Total Cost"),
+        "plan_rows": root.get("Plan Rows"),
+        "nodes": [],
+        "seq_scans": [],
+        "indexes": [],
+        "sorts": 0,
+    }
+    if "Execution Time" in (doc or {}):
+        summary["execution_ms"] = doc.get("Execution Time")
+    _walk_plan(root, summary)
+    summary["seq_scans"] = sorted(set(summary["seq_scans"]))
+    summary["indexes"] = sorted(set(summary["indexes"]))
+    return summary
+
+
+def default_probes(
+    search_clause: Callable[[str], tuple[str, list]],
+    *,
+    prices_table: str = "tw_stock_prices",
+    warrant_code: str = "030001",
+    symbol: str = "2330.TW",
+) -> list[tuple[str, str, list]]:
+    """Representative queries of the busiest endpoints as ``(name, sql, params)``."""
+    code_clause, code_params = search_clause(symbol.split(".")[0])
+    name_clause, name_params = search_clause("台積電")
+    master_sql = (
+        "SELECT warrant_code FROM warrant_search "
+        "WHERE expiry_date >= CURRENT_DATE AND {clause}"
+    )
+    return [
+        ("portal_master_search_code", master_sql.format(clause=code_clause), list(code_params)),
+        ("portal_master_search_name", master_sql.format(clause=name_clause), list(name_params)),
+        (
+            "warrant_timeseries",
+            "SELECT trade_date, open_price, high_price, low_price, close_price, volume "
+            "FROM tw_warrant_trade WHERE warrant_code = %s ORDER BY trade_date DESC LIMIT 250",
+            [warrant_code],
+        ),
+        (
+            "ta_screen_recent_bars",
+            "SELECT warrant_code, trade_date, close_price FROM ("
+            " SELECT warrant_code, trade_date, close_price,"
+            " ROW_NUMBER() OVER (PARTITION BY warrant_code ORDER BY trade_date DESC) AS rn"
+            " FROM tpex_warrant_daily_quotes WHERE warrant_code = ANY(%s)"
+            ") t WHERE rn <= 80",
+            [[warrant_code]],
+        ),
+        (
+            "latest_warrant_snapshot",
+            "SELECT * FROM latest_warrant_bars WHERE warrant_code = ANY(%s)",
+            [[warrant_code]],
+        ),
+        (
+            "stock_quote",
+            "SELECT * FROM latest_stock_bars WHERE symbol = %s",
+            [symbol],
+        ),
+        (
+            "stock_prices_window",
+            f"SELECT date, close_price FROM {prices_table} WHERE symbol = %s ORDER BY date DESC LIMIT 2",
+            [symbol],
+        ),
+        (
+            "financial_ratio_symbols",
+            f"SELECT * FROM tw_stock_symbols WHERE {RATIO_SYMBOL_NORM_SQL} = ANY(%s)",
+            [[symbol.split(".")[0]]],
+        ),
+        (
+            "statistics_last_update",
+            f"SELECT MAX(updated_at) FROM {prices_table} WHERE updated_at IS NOT NULL",
+            [],
+        ),
+        (
+            "warrant_rankings_latest_date",
+            "SELECT MAX(trade_date) FROM tw_warrant_trade",
+            [],
+        ),
+    ]
+
+
+def explain_probes(
+    connection,
+    probes: list[tuple[str, str, list]],
+    *,
+    analyze: bool = False,
+) -> list[dict[str, Any]]:
+    """EXPLAIN each probe; with ``analyze`` the statement runs and is rolled back."""
+    prefix = "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " if analyze else "EXPLAIN (FORMAT JSON) "
+    results: list[dict[str, Any]] = []
+    for name, sql, params in probes:
+        cursor = connection.cursor()
+        try:
+            cursor.execute(prefix + sql, params or None)
+            plan = _first_value(cursor.fetchone())
+            results.append({"name": name, "ok": True, **summarize_plan(plan)})
+        except Exception as exc:
+            results.append({"name": name, "ok": False, "error": str(exc).strip()})
+        finally:
+            cursor.close()
+            connection.rollback()
+    return results
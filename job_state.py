@@ -0,0 +1,334 @@
+"""Job progress shared across processes (gunicorn workers, the Render web service, cloud_worker).
+
+The background jobs keep mutating (and re-assigning) their module-level status
+dicts exactly as before.  The store only needs a getter per status:
+
+* a publisher thread upserts a status into ``tw_job_state`` whenever its JSON
+  snapshot changes, and re-publishes running jobs as a heartbeat;
+* ``view(name)`` flushes the local copy and returns the stored one, so a status
+  endpoint served by any worker reports the job wherever it runs.
+
+Statuses that never changed in this process (the idle defaults) are never
+published, so an idle worker cannot overwrite another worker's progress.  A
+running status whose heartbeat stops (process killed) is reported with
+``running: False, stale: True``.
+
+``EventRelay`` does the same for the SSE log stream: events pushed in one
+process are ``NOTIFY``-ed to every other process, so a browser connected to
+any worker sees the progress of a job running on another one.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import queue
+import socket
+import threading
+import time
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+STATE_TABLE = "tw_job_state"
+EVENT_CHANNEL = "tw_sse_events"
+# NOTIFY 的 payload 上限是 8000 bytes，保留一點餘裕
+MAX_EVENT_BYTES = 7900
+
+
+def _snapshot(value: Any) -> str:
+    return json.dumps(value or {}, sort_keys=True, default=str, ensure_ascii=False)
+
+
+class JobStateStore:
+    def __init__(
+        self,
+        connect: Callable[[], Any],
+        *,
+        interval: float = 1.0,
+        heartbeat: float = 30.0,
+        stale_after: float = 180.0,
+        retry_after: float = 30.0,
+    ):
+        self._connect = connect
+        self.interval = interval
+        self.heartbeat = heartbeat
+        self.stale_after = stale_after
+        self.retry_after = retry_after
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._getters: dict[str, Callable[[], Any]] = {}
+        self._published: dict[str, str] = {}
+        self._published_at: dict[str, float] = {}
+        self._lock = threading.RLock()
+        self._conn = None
+        self._ready = False
+        self._down_until = 0.0
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    # ---- registration -------------------------------------------------
+    def register(self, name: str, getter: Callable[[], Any]) -> None:
+        with self._lock:
+            self._getters[name] = getter
+            # 啟動時的預設值視為「已發佈」，閒置的 worker 不會覆蓋別人的進度
+            self._published[name] = _snapshot(getter())
+            self._published_at[name] = 0.0
+
+    # ---- connection ---------------------------------------------------
+    def _cursor(self):
+        if time.monotonic() < self._down_until:
+            return None
+        try:
+            if self._conn is None or getattr(self._conn, "closed", 0):
+                self._conn = self._connect()
+                self._conn.autocommit = True
+                self._ready = False
+            cur = self._conn.cursor()
+            if not self._ready:
+                cur.execute(
+                    f"""
+                    CREATE TABLE IF NOT EXISTS {STATE_TABLE} (
+                        name VARCHAR(100) PRIMARY KEY,
+                        payload JSONB NOT NULL,
+                        owner VARCHAR(200),
+                        updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+                    )
+                    """
+                )
+                self._ready = True
+            return cur
+        except Exception as exc:
+            logger.debug("job state store unavailable: %s", exc)
+            self._conn = None
+            self._down_until = time.monotonic() + self.retry_after
+            return None
+
+    # ---- publish / read -----------------------------------------------
+    def _flush(self, name: str, *, force: bool = False) -> None:
+        getter = self._getters.get(name)
+        if getter is None:
+            return
+        value = getter() or {}
+        text = _snapshot(value)
+        now = time.monotonic()
+        changed = text != self._published.get(name)
+        beat = bool(value.get("running")) and now - self._published_at.get(name, 0.0) >= self.heartbeat
+        if not (changed or beat or force):
+            return
+        cur = self._cursor()
+        if cur is None:
+            return
+        try:
+            cur.execute(
+                f"""
+                INSERT INTO {STATE_TABLE} (name, payload, owner, updated_at)
+                VALUES (%s, %s::jsonb, %s, NOW())
+                ON CONFLICT (name) DO UPDATE SET
+                    payload = EXCLUDED.payload,
+                    owner = EXCLUDED.owner,
+                    updated_at = NOW()
+                """,
+                (name, text, self.owner),
+            )
+            self._published[name] = text
+            self._published_at[name] = now
+        except Exception as exc:
+            logger.debug("job state publish %s failed: %s", name, exc)
+            self._conn = None
+        finally:
+            cur.close()
+
+    def flush_all(self) -> None:
+        with self._lock:
+            for name in list(self._getters):
+                self._flush(name)
+
+    def view(self, name: str) -> dict[str, Any]:
+        """Latest status of ``name`` across processes (local copy when the store is down)."""
+        with self._lock:
+            self._flush(name)
+            getter = self._getters.get(name)
+            local = dict((getter() if getter else None) or {})
+            cur = self._cursor()
+            if cur is None:
+                return local
+            try:
+                cur.execute(
+                    f"""
+                    SELECT payload, owner, EXTRACT(EPOCH FROM NOW() - updated_at)
+                    FROM {STATE_TABLE} WHERE name = %s
+                    """,
+                    (name,),
+                )
+                row = cur.fetchone()
+            except Exception as exc:
+                logger.debug("job state read %s failed: %s", name, exc)
+                self._conn = None
+                return local
+            finally:
+                cur.close()
+        if not row:
+            return local
+        if isinstance(row, dict):
+            row = tuple(row.values())
+        payload, owner, age = row
+        payload = dict(json.loads(payload) if isinstance(payload, str) else payload or {})
+        payload["owner"] = owner
+        if payload.get("running") and age is not None and float(age) > self.stale_after:
+            payload["running"] = False
+            payload["stale"] = True
+        return payload
+
+    def is_running(self, name: str) -> bool:
+        return bool(self.view(name).get("running"))
+
+    # ---- background publisher -----------------------------------------
+    def _loop(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.flush_all()
+            except Exception:
+                logger.debug("job state publisher iteration failed", exc_info=True)
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="job-state-publisher", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+class EventRelay:
+    """Fan SSE events out to every process through ``NOTIFY``.
+
+    ``publish(event)`` only enqueues, a sender thread does the ``pg_notify``, so
+    the job pushing progress never waits on the database.  A listener thread
+    ``LISTEN``s on the channel and hands events published by *other* processes
+    to ``deliver``.  Events too large for a NOTIFY payload keep only
+    channel/event/message.  While the database is unreachable events are
+    dropped; the local stream keeps working.
+    """
+
+    def __init__(
+        self,
+        connect: Callable[[], Any],
+        deliver: Callable[[dict], None],
+        *,
+        channel: str = EVENT_CHANNEL,
+        retry_after: float = 30.0,
+        listener_factory: Optional[Callable[[], Any]] = None,
+    ):
+        self._connect = connect
+        self._deliver = deliver
+        self.channel = channel
+        self.retry_after = retry_after
+        self._listener_factory = listener_factory or self._default_listener
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._outbox: queue.Queue = queue.Queue(maxsize=1000)
+        self._conn = None
+        self._down_until = 0.0
+        self._listen_down_until = 0.0
+        self._threads: list[threading.Thread] = []
+        self._stop = threading.Event()
+
+    def _default_listener(self):
+        from cloud_jobs import JobListener
+
+        return JobListener(self.channel, connect_fn=self._listen_connect)
+
+    def _listen_connect(self):
+        # 連不上時退避，避免 listener 每次 wait 都重連
+        if time.monotonic() < self._listen_down_until:
+            raise RuntimeError("sse relay listener backing off")
+        try:
+            return self._connect()
+        except Exception:
+            self._listen_down_until = time.monotonic() + self.retry_after
+            raise
+
+    # ---- sending ------------------------------------------------------
+    def publish(self, event: dict) -> None:
+        if not self._threads:
+            return
+        try:
+            self._outbox.put_nowait(event)
+        except queue.Full:
+            pass
+
+    def encode(self, event: dict) -> str:
+        text = json.dumps({"origin": self.owner, "event": event}, default=str, ensure_ascii=False)
+        if len(text.encode("utf-8")) <= MAX_EVENT_BYTES:
+            return text
+        slim = {key: event.get(key) for key in ("channel", "event", "message")}
+        slim["message"] = str(slim["message"] or "")[:1000]
+        return json.dumps({"origin": self.owner, "event": slim}, default=str, ensure_ascii=False)
+
+    def send(self, event: dict) -> bool:
+        if time.monotonic() < self._down_until:
+            return False
+        try:
+            if self._conn is None or getattr(self._conn, "closed", 0):
+                self._conn = self._connect()
+                self._conn.autocommit = True
+            cur = self._conn.cursor()
+            try:
+                cur.execute("SELECT pg_notify(%s, %s)", (self.channel, self.encode(event)))
+            finally:
+                cur.close()
+            return True
+        except Exception as exc:
+            logger.debug("sse relay unavailable: %s", exc)
+            self._conn = None
+            self._down_until = time.monotonic() + self.retry_after
+            return False
+
+    def _send_loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                event = self._outbox.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            self.send(event)
+
+    # ---- receiving ----------------------------------------------------
+    def receive(self, payload: str) -> None:
+        try:
+            data = json.loads(payload)
+        except ValueError:
+            return
+        # 自己發出的事件已直接放進本機佇列
+        if not isinstance(data, dict) or data.get("origin") == self.owner:
+            return
+        event = data.get("event")
+        if isinstance(event, dict):
+            self._deliver(event)
+
+    def _listen_loop(self) -> None:
+        listener = self._listener_factory()
+        try:
+            while not self._stop.is_set():
+                for payload in listener.wait(5.0):
+                    try:
+                        self.receive(payload)
+                    except Exception:
+                        logger.debug("sse relay delivery failed", exc_info=True)
+        finally:
+            listener.close()
+
+    def start(self) -> None:
+        if any(t.is_alive() for t in self._threads):
+            return
+        self._stop.clear()
+        self._threads = [
+            threading.Thread(target=self._send_loop, name="sse-relay-sender", daemon=True),
+            threading.Thread(target=self._listen_loop, name="sse-relay-listener", daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
@@ -0,0 +1,333 @@
+"""Latest-bar snapshot tables for stocks and warrants.
+
+``latest_stock_bars`` and ``latest_warrant_bars`` hold one row per code with the
+last bar, the previous close and the trade date.  They are maintained by the
+upsert helpers in ``server.py`` (inside the same transaction as the raw rows),
+so "latest trade per code" becomes a primary-key lookup instead of a
+``DISTINCT ON`` / window sort over the full history tables.
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+from typing import Any, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+LATEST_STOCK_TABLE = "latest_stock_bars"
+LATEST_WARRANT_TABLE = "latest_warrant_bars"
+
+# market -> (source table, volume column, turnover column)
+WARRANT_SOURCES = {
+    "TWSE": ("tw_warrant_trade", "volume", "turnover"),
+    "TPEX": ("tpex_warrant_daily_quotes", "trade_volume", "trade_value"),
+}
+
+_ready_lock = threading.Lock()
+_ready_dsns: set[str] = set()
+
+BOOTSTRAP_TABLE = "latest_bars_bootstrap"
+STOCK_PART = "stock"
+BOOTSTRAP_PARTS = (STOCK_PART, *WARRANT_SOURCES)
+_bootstrapped: set[tuple[str, str]] = set()
+
+
+def _dsn_key(cursor) -> str:
+    conn = getattr(cursor, "connection", None)
+    return str(getattr(conn, "dsn", "") or id(conn))
+
+
+def ensure_latest_tables(cursor) -> None:
+    """Create the snapshot tables once per connection target."""
+    key = _dsn_key(cursor)
+    if key in _ready_dsns:
+        return
+    with _ready_lock:
+        if key in _ready_dsns:
+            return
+        cursor.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {LATEST_STOCK_TABLE} (
+                symbol VARCHAR(20) PRIMARY KEY,
+                trade_date DATE NOT NULL,
+                open_price DECIMAL(10,2),
+                high_price DECIMAL(10,2),
+                low_price DECIMAL(10,2),
+                close_price DECIMAL(10,2),
+                volume BIGINT,
+                prev_trade_date DATE,
+                prev_close DECIMAL(10,2),
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """
+        )
+        cursor.execute(
+            f"""
+            CREATE INDEX IF NOT EXISTS {LATEST_STOCK_TABLE}_trade_date_idx
+            ON {LATEST_STOCK_TABLE}(trade_date DESC)
+            """
+        )
+        cursor.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {LATEST_WARRANT_TABLE} (
+                market VARCHAR(10) NOT NULL,
+                warrant_code VARCHAR(20) NOT NULL,
+                trade_date DATE NOT NULL,
+                open_price NUMERIC(20,6),
+                high_price NUMERIC(20,6),
+                low_price NUMERIC(20,6),
+                close_price NUMERIC(20,6),
+                volume BIGINT,
+                turnover NUMERIC(20,2),
+                prev_trade_date DATE,
+                prev_close NUMERIC(20,6),
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (market, warrant_code)
+            )
+            """
+        )
+        cursor.execute(
+            f"""
+            CREATE INDEX IF NOT EXISTS {LATEST_WARRANT_TABLE}_code_idx
+            ON {LATEST_WARRANT_TABLE}(warrant_code)
+            """
+        )
+        cursor.execute(
+            f"""
+            CREATE INDEX IF NOT EXISTS {LATEST_WARRANT_TABLE}_trade_date_idx
+            ON {LATEST_WARRANT_TABLE}(market, trade_date DESC)
+            """
+        )
+        _ready_dsns.add(key)
+
+
+def _unique_codes(codes: Iterable[Any]) -> list[str]:
+    seen: dict[str, None] = {}
+    for code in codes:
+        text = str(code or "").strip()
+        if text:
+            seen[text] = None
+    return list(seen)
+
+
+def refresh_latest_stock_bars(
+    cursor,
+    symbols: Optional[Iterable[str]] = None,
+    *,
+    prices_table: str = "tw_stock_prices",
+) -> int:
+    """Recompute the snapshot for ``symbols`` (or every symbol when ``None``).
+
+    Per-symbol refresh uses two indexed ``LIMIT 1`` lookups on ``(symbol, date)``
+    so it stays cheap after each ingest; the full rebuild is for bootstrap only.
+    """
+    ensure_latest_tables(cursor)
+    upsert_tail = """
+        ON CONFLICT (symbol) DO UPDATE SET
+            trade_date = EXCLUDED.trade_date,
+            open_price = EXCLUDED.open_price,
+            high_price = EXCLUDED.high_price,
+            low_price = EXCLUDED.low_price,
+            close_price = EXCLUDED.close_price,
+            volume = EXCLUDED.volume,
+            prev_trade_date = EXCLUDED.prev_trade_date,
+            prev_close = EXCLUDED.prev_close,
+            updated_at = CURRENT_TIMESTAMP
+    """
+    insert_head = f"""
+        INSERT INTO {LATEST_STOCK_TABLE} (
+            symbol, trade_date, open_price, high_price, low_price, close_price,
+            volume, prev_trade_date, prev_close, updated_at
+        )
+    """
+    if symbols is None:
+        cursor.execute(
+            f"""
+            {insert_head}
+            SELECT symbol, date, open_price, high_price, low_price, close_price,
+                   volume, prev_date, prev_close, CURRENT_TIMESTAMP
+            FROM (
+                SELECT symbol, date, open_price, high_price, low_price, close_price, volume,
+                       LEAD(date) OVER w AS prev_date,
+                       LEAD(close_price) OVER w AS prev_close,
+                       ROW_NUMBER() OVER w AS rn
+                FROM {prices_table}
+                WINDOW w AS (PARTITION BY symbol ORDER BY date DESC)
+            ) ranked
+            WHERE rn = 1
+            {upsert_tail}
+            """
+        )
+        return cursor.rowcount or 0
+
+    symbol_list = _unique_codes(symbols)
+    if not symbol_list:
+        return 0
+    cursor.execute(
+        f"""
+        {insert_head}
+        SELECT s.symbol, cur.date, cur.open_price, cur.high_price, cur.low_price,
+               cur.close_price, cur.volume, prev.date, prev.close_price, CURRENT_TIMESTAMP
+        FROM unnest(%s::text[]) AS s(symbol)
+        JOIN LATERAL (
+            SELECT date, open_price, high_price, low_price, close_price, volume
+            FROM {prices_table} p
+            WHERE p.symbol = s.symbol
+            ORDER BY p.date DESC
+            LIMIT 1
+        ) cur ON TRUE
+        LEFT JOIN LATERAL (
+            SELECT date, close_price
+            FROM {prices_table} p
+            WHERE p.symbol = s.symbol AND p.date < cur.date
+            ORDER BY p.date DESC
+            LIMIT 1
+        ) prev ON TRUE
+        {upsert_tail}
+        """,
+        (symbol_list,),
+    )
+    return cursor.rowcount or 0
+
+
+def refresh_latest_warrant_bars(
+    cursor,
+    market: str,
+    codes: Optional[Iterable[str]] = None,
+) -> int:
+    """Recompute the warrant snapshot of one market for ``codes`` (all when ``None``)."""
+    market_key = str(market or "").strip().upper()
+    if market_key not in WARRANT_SOURCES:
+        raise ValueError(f"Unsupported warrant market: {market}")
+    source, volume_col, turnover_col = WARRANT_SOURCES[market_key]
+    ensure_latest_tables(cursor)
+    insert_head = f"""
+        INSERT INTO {LATEST_WARRANT_TABLE} (
+            market, warrant_code, trade_date, open_price, high_price, low_price,
+            close_price, volume, turnover, prev_trade_date, prev_close, updated_at
+        )
+    """
+    upsert_tail = """
+        ON CONFLICT (market, warrant_code) DO UPDATE SET
+            trade_date = EXCLUDED.trade_date,
+            open_price = EXCLUDED.open_price,
+            high_price = EXCLUDED.high_price,
+            low_price = EXCLUDED.low_price,
+            close_price = EXCLUDED.close_price,
+            volume = EXCLUDED.volume,
+            turnover = EXCLUDED.turnover,
+            prev_trade_date = EXCLUDED.prev_trade_date,
+            prev_close = EXCLUDED.prev_close,
+            updated_at = CURRENT_TIMESTAMP
+    """
+    if codes is None:
+        cursor.execute(
+            f"""
+            {insert_head}
+            SELECT %s, warrant_code, trade_date, open_price, high_price, low_price,
+                   close_price, {volume_col}, {turnover_col}, prev_date, prev_close, CURRENT_TIMESTAMP
+            FROM (
+                SELECT warrant_code, trade_date, open_price, high_price, low_price,
+                       close_price, {volume_col}, {turnover_col},
+                       LEAD(trade_date) OVER w AS prev_date,
+                       LEAD(close_price) OVER w AS prev_close,
+                       ROW_NUMBER() OVER w AS rn
+                FROM {source}
+                WINDOW w AS (PARTITION BY warrant_code ORDER BY trade_date DESC)
+            ) ranked
+            WHERE rn = 1
+            {upsert_tail}
+            """,
+            (market_key,),
+        )
+        return cursor.rowcount or 0
+
+    code_list = _unique_codes(codes)
+    if not code_list:
+        return 0
+    cursor.execute(
+        f"""
+        {insert_head}
+        SELECT %s, c.code, cur.trade_date, cur.open_price, cur.high_price, cur.low_price,
+               cur.close_price, cur.{volume_col}, cur.{turnover_col},
+               prev.trade_date, prev.close_price, CURRENT_TIMESTAMP
+        FROM unnest(%s::text[]) AS c(code)
+        JOIN LATERAL (
+            SELECT trade_date, open_price, high_price, low_price, close_price,
+                   {volume_col}, {turnover_col}
+            FROM {source} t
+            WHERE t.warrant_code = c.code
+            ORDER BY t.trade_date DESC
+            LIMIT 1
+        ) cur ON TRUE
+        LEFT JOIN LATERAL (
+            SELECT trade_date, close_price
+            FROM {source} t
+            WHERE t.warrant_code = c.code AND t.trade_date < cur.trade_date
+            ORDER BY t.trade_date DESC
+            LIMIT 1
+        ) prev ON TRUE
+        {upsert_tail}
+        """,
+        (market_key, code_list),
+    )
+    return cursor.rowcount or 0
+
+
+def bootstrap(
+    cursor,
+    *,
+    prices_table: str = "tw_stock_prices",
+    parts: Optional[Iterable[str]] = None,
+) -> dict[str, int]:
+    """Full rebuild of every snapshot part (``stock``, ``TWSE``, ``TPEX``) not yet bootstrapped.
+
+    Completion is recorded in ``latest_bars_bootstrap`` in the same transaction
+    as the rebuild, so a snapshot that ingests already made non-empty is still
+    rebuilt once in full.  The rebuild upserts, so rows written meanwhile stay
+    correct.  ``parts`` restricts the run (warrant endpoints bootstrap only the
+    warrant markets, never ``tw_stock_prices``).
+    """
+    key = _dsn_key(cursor)
+    wanted = [p for p in (parts or BOOTSTRAP_PARTS) if p in BOOTSTRAP_PARTS]
+    todo = [p for p in wanted if (key, p) not in _bootstrapped]
+    if not todo:
+        return {}
+    ensure_latest_tables(cursor)
+    cursor.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {BOOTSTRAP_TABLE} (
+            part VARCHAR(10) PRIMARY KEY,
+            row_count BIGINT,
+            completed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+    cursor.execute(f"SELECT part FROM {BOOTSTRAP_TABLE} WHERE part = ANY(%s)", (todo,))
+    done = {_first_value(row) for row in cursor.fetchall() or []}
+    filled: dict[str, int] = {}
+    for part in todo:
+        if part in done:
+            continue
+        if part == STOCK_PART:
+            filled[part] = refresh_latest_stock_bars(cursor, prices_table=prices_table)
+        else:
+            filled[part] = refresh_latest_warrant_bars(cursor, part)
+        cursor.execute(
+            f"INSERT INTO {BOOTSTRAP_TABLE} (part, row_count) VALUES (%s, %s) ON CONFLICT (part) DO NOTHING",
+            (part, filled[part]),
+        )
+    # only markers already committed are memoised; parts rebuilt now are skipped once their row is visible
+    _bootstrapped.update((key, p) for p in done)
+    if filled:
+        logger.info("latest bar snapshot bootstrap: %s", filled)
+    return filled
+
+
+def _first_value(row: Any) -> Any:
+    if row is None:
+        return None
+    if isinstance(row, dict):
+        return next(iter(row.values()), None)
+    return row[0]
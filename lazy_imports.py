@@ -0,0 +1,47 @@
+"""Deferred imports for heavy optional modules (pandas, yfinance, bs4, lxml, selenium).
+
+``pd = lazy_module("pandas")`` binds a proxy whose first attribute access
+imports the real module, so ``import server`` (and every cloud worker that
+imports it) no longer pays for pandas / yfinance / bs4 / lxml up front.
+``scripts/bench_import_time.py`` measures the resulting cold start.
+"""
+
+from __future__ import annotations
+
+import importlib
+import threading
+import types
+from typing import Any
+
+
+class LazyModule(types.ModuleType):
+    """Module proxy that imports ``name`` on first attribute access."""
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self.__dict__["_lazy_target"] = None
+        self.__dict__["_lazy_lock"] = threading.Lock()
+
+    def _load(self) -> types.ModuleType:
+        target = self.__dict__["_lazy_target"]
+        if target is None:
+            with self.__dict__["_lazy_lock"]:
+                target = self.__dict__["_lazy_target"]
+                if target is None:
+                    target = importlib.import_module(self.__name__)
+                    self.__dict__["_lazy_target"] = target
+        return target
+
+    def __getattr__(self, attr: str) -> Any:
+        return getattr(self._load(), attr)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self) -> str:
+        state = "loaded" if self.__dict__["_lazy_target"] is not None else "not loaded"
+        return f"<lazy module {self.__name__!r} ({state})>"
+
+
+def lazy_module(name: str) -> LazyModule:
+    return LazyModule(name)
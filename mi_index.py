@@ -0,0 +1,380 @@
+"""TWSE MI_INDEX daily snapshot: fetched once per date, parsed once into typed rows.
+
+``MI_INDEX?type=ALL`` carries every listed security's close for a date:
+ordinary shares / ETFs (-> ``tw_stock_prices``) and warrants
+(-> ``tw_warrant_trade``).  Stock and warrant ingestion used to download the
+same day twice (``ALLBUT0999`` and ``ALL``); both now read one
+``DailySnapshot`` via ``fetch_snapshot``, which keeps recently fetched dates in
+a small single-flight cache so concurrent callers share one download.
+
+``ingest`` fans one snapshot out to the ``tw_stock_prices`` and
+``tw_warrant_trade`` writers on the caller's cursor, i.e. in one transaction.
+"""
+
+from __future__ import annotations
+
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import date
+from typing import Any, Callable, Optional
+
+import requests
+from psycopg2.extras import execute_values
+
+import price_anomalies
+import price_validation
+import warrant_ta_state
+import warrant_rankings
+from latest_bars import refresh_latest_stock_bars, refresh_latest_warrant_bars
+
+MI_INDEX_URL = "https://www.twse.com.tw/exchangeReport/MI_INDEX"
+CACHE_TTL_SECONDS = 600.0
+CACHE_MAX_DATES = 8
+
+_WARRANT_NAME_MARKERS = ("購", "售", "牛", "熊", "權證")
+# 每日收盤行情欄位；舊版 data9 無 fields 時依此順序解析
+_DEFAULT_FIELDS = [
+    "證券代號", "證券名稱", "成交股數", "成交筆數", "成交金額",
+    "開盤價", "最高價", "最低價", "收盤價", "漲跌(+/-)", "漲跌價差",
+]
+
+
+def parse_number(val: Any) -> Optional[float]:
+    if val is None:
+        return None
+    s = re.sub(r"<[^>]+>", "", str(val)).replace(",", "").strip()
+    if not s or s in ("--", "-", "---", "null", "None"):
+        return None
+    try:
+        return float(s)
+    except ValueError:
+        return None
+
+
+def is_warrant_name(name: Optional[str]) -> bool:
+    return any(k in (name or "") for k in _WARRANT_NAME_MARKERS)
+
+
+def is_warrant(code: str, name: Optional[str]) -> bool:
+    if is_warrant_name(name):
+        return True
+    # 上市權證代號：6 碼，03~08 開頭（認購／認售／牛熊證）
+    return len(code) == 6 and code[0] == "0" and code[1] in "345678"
+
+
+@dataclass(frozen=True)
+class SecurityQuote:
+    code: str
+    name: Optional[str]
+    shares: Optional[float]
+    turnover: Optional[float]
+    open: Optional[float]
+    high: Optional[float]
+    low: Optional[float]
+    close: Optional[float]
+    change: Optional[float]
+
+    @property
+    def is_warrant(self) -> bool:
+        return is_warrant(self.code, self.name)
+
+    @property
+    def volume_lots(self) -> Optional[int]:
+        return int(self.shares / 1000) if self.shares is not None else None
+
+    def trade_quote(self) -> dict[str, Any]:
+        """Row shape of the ``tw_warrant_trade`` writer (volume in lots)."""
+        return {
+            "warrant_name": self.name,
+            "open_price": self.open,
+            "high_price": self.high,
+            "low_price": self.low,
+            "close_price": self.close,
+            "price_change": self.change,
+            "turnover": self.turnover,
+            "volume": self.volume_lots,
+        }
+
+
+@dataclass
+class DailySnapshot:
+    trade_date: date
+    quotes: dict[str, SecurityQuote] = field(default_factory=dict)
+
+    def stock_records(self) -> list[dict[str, Any]]:
+        """Ordinary shares / ETFs in the StockAPI batch shape (volume in shares), not yet validated."""
+        day = self.trade_date.strftime("%Y-%m-%d")
+        return [
+            {
+                "ticker": f"{q.code}.TW",
+                "Date": day,
+                "Open": q.open,
+                "High": q.high,
+                "Low": q.low,
+                "Close": q.close,
+                "Volume": q.shares,
+            }
+            for q in self.quotes.values()
+            if q.code.isdigit() and not q.is_warrant
+        ]
+
+    def trade_quotes(self) -> dict[str, dict[str, Any]]:
+        """Every security in the ``tw_warrant_trade`` writer shape, keyed by code."""
+        return {code: q.trade_quote() for code, q in self.quotes.items()}
+
+
+def _quote_table(payload: dict) -> tuple[list[str], list]:
+    tables = payload.get("tables")
+    if isinstance(tables, list):
+        for table in tables:
+            if not isinstance(table, dict):
+                continue
+            fields = table.get("fields") or []
+            if "收盤價" in fields and "證券代號" in fields:
+                return list(fields), table.get("data") or []
+    if payload.get("data9"):
+        return list(payload.get("fields9") or _DEFAULT_FIELDS), payload["data9"]
+    return [], []
+
+
+def parse_payload(payload: Optional[dict], trade_date: date) -> DailySnapshot:
+    snapshot = DailySnapshot(trade_date)
+    if not isinstance(payload, dict):
+        return snapshot
+    fields, rows = _quote_table(payload)
+    idx = {name: i for i, name in enumerate(fields)}
+    if "證券代號" not in idx:
+        return snapshot
+
+    def _cell(row: list, name: str) -> Any:
+        i = idx.get(name)
+        return row[i] if i is not None and i < len(row) else None
+
+    for row in rows:
+        if not isinstance(row, list):
+            continue
+        code = str(_cell(row, "證券代號") or "").strip()
+        if not code:
+            continue
+        name = _cell(row, "證券名稱")
+        snapshot.quotes[code] = SecurityQuote(
+            code=code,
+            name=str(name).strip() if name is not None else None,
+            shares=parse_number(_cell(row, "成交股數")),
+            turnover=parse_number(_cell(row, "成交金額")),
+            open=parse_number(_cell(row, "開盤價")),
+            high=parse_number(_cell(row, "最高價")),
+            low=parse_number(_cell(row, "最低價")),
+            close=parse_number(_cell(row, "收盤價")),
+            change=parse_number(_cell(row, "漲跌價差")),
+        )
+    return snapshot
+
+
+def fetch_payload(trade_date: date, *, timeout: float = 120, **request_kwargs: Any) -> Optional[dict]:
+    """Download MI_INDEX ``type=ALL``; ``None`` for non-trading days / no data."""
+    resp = requests.get(
+        MI_INDEX_URL,
+        params={"response": "json", "date": trade_date.strftime("%Y%m%d"), "type": "ALL"},
+        headers={"User-Agent": "Mozilla/5.0"},
+        timeout=timeout,
+        **request_kwargs,
+    )
+    if resp.status_code != 200:
+        raise RuntimeError(f"MI_INDEX HTTP {resp.status_code}")
+    payload = resp.json()
+    if not isinstance(payload, dict):
+        return None
+    stat = payload.get("stat")
+    if stat and stat != "OK":
+        return None
+    return payload
+
+
+class SnapshotCache:
+    """Recently fetched snapshots by date; one download per date even under concurrency."""
+
+    def __init__(self, ttl: float = CACHE_TTL_SECONDS, max_dates: int = CACHE_MAX_DATES):
+        self.ttl = ttl
+        self.max_dates = max_dates
+        self._entries: dict[date, tuple[float, DailySnapshot]] = {}
+        self._key_locks: dict[date, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self.fetches = 0
+
+    def get(self, trade_date: date, fetch: Callable[[date], Optional[dict]]) -> Optional[DailySnapshot]:
+        with self._lock:
+            key_lock = self._key_locks.setdefault(trade_date, threading.Lock())
+        with key_lock:
+            with self._lock:
+                entry = self._entries.get(trade_date)
+                if entry and time.monotonic() - entry[0] < self.ttl:
+                    return entry[1]
+            payload = fetch(trade_date)
+            self.fetches += 1
+            if payload is None:
+                # 非交易日或尚未公布：不快取，收盤後可再取
+                return None
+            snapshot = parse_payload(payload, trade_date)
+            with self._lock:
+                self._entries[trade_date] = (time.monotonic(), snapshot)
+                while len(self._entries) > self.max_dates:
+                    oldest = min(self._entries, key=lambda d: self._entries[d][0])
+                    self._entries.pop(oldest, None)
+                    self._key_locks.pop(oldest, None)
+            return snapshot
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+default_cache = SnapshotCache()
+
+
+def fetch_snapshot(
+    trade_date: date,
+    *,
+    fetch: Callable[[date], Optional[dict]] = fetch_payload,
+    cache: Optional[SnapshotCache] = None,
+) -> Optional[DailySnapshot]:
+    return (cache or default_cache).get(trade_date, fetch)
+
+
+# ---- writers ---------------------------------------------------------------
+def write_stock_prices(cursor, snapshot: DailySnapshot, prices_table: str = "tw_stock_prices") -> int:
+    """Upsert the snapshot's validated stock closes (same rules as the StockAPI batch fetch)."""
+    candidates = snapshot.stock_records()
+    checked = price_validation.validate_records(candidates, price_validation.SNAPSHOT_RULES)
+    rows = [
+        (rec["ticker"], rec["Date"], rec["Open"], rec["High"], rec["Low"], round(rec["Close"], 2), int(rec["Volume"]))
+        for rec, ok in zip(candidates, checked.accept)
+        if ok
+    ]
+    if not rows:
+        return 0
+    execute_values(
+        cursor,
+        f"""
+        INSERT INTO {prices_table} (symbol, date, open_price, high_price, low_price, close_price, volume)
+        VALUES %s
+        ON CONFLICT (symbol, date) DO UPDATE SET
+            open_price = EXCLUDED.open_price,
+            high_price = EXCLUDED.high_price,
+            low_price = EXCLUDED.low_price,
+            close_price = EXCLUDED.close_price,
+            volume = EXCLUDED.volume
+        """,
+        rows,
+        page_size=1000,
+    )
+    symbols = [r[0] for r in rows]
+    refresh_latest_stock_bars(cursor, symbols, prices_table=prices_table)
+    price_anomalies.update_price_anomalies(
+        cursor, symbols, snapshot.trade_date.isoformat(), prices_table=prices_table
+    )
+    return len(rows)
+
+
+def write_warrant_trades(
+    cursor,
+    trade_date: date,
+    quotes: dict[str, dict[str, Any]],
+    master_codes: Optional[set[str]] = None,
+    *,
+    refresh_snapshots: bool = True,
+) -> int:
+    """Upsert warrant trades (OHLC / turnover / lots) from ``trade_quote`` shaped rows.
+
+    ``refresh_snapshots=False`` skips the latest-bar / TA-state / ranking refresh
+    (multi-day callers do it once for the whole range).
+    """
+    if not quotes:
+        return 0
+    rows = []
+    for code, q in quotes.items():
+        name = q.get("warrant_name")
+        if master_codes is not None:
+            if code not in master_codes and not is_warrant_name(name):
+                continue
+        elif not is_warrant_name(name):
+            continue
+        # 無價且無量則略過（避免塞一堆空白列）
+        if (
+            q.get("close_price") is None
+            and q.get("open_price") is None
+            and not (q.get("turnover") or 0)
+            and not (q.get("volume") or 0)
+        ):
+            continue
+        rows.append((
+            trade_date,  # out_date
+            trade_date,
+            code,
+            name,
+            q.get("turnover"),
+            q.get("volume"),
+            q.get("open_price"),
+            q.get("high_price"),
+            q.get("low_price"),
+            q.get("close_price"),
+            q.get("price_change"),
+        ))
+    if not rows:
+        return 0
+    execute_values(
+        cursor,
+        """
+        INSERT INTO tw_warrant_trade (
+            out_date, trade_date, warrant_code, warrant_name,
+            turnover, volume,
+            open_price, high_price, low_price, close_price, price_change,
+            updated_at
+        ) VALUES %s
+        ON CONFLICT (warrant_code, trade_date) DO UPDATE SET
+            out_date = EXCLUDED.out_date,
+            warrant_name = COALESCE(EXCLUDED.warrant_name, tw_warrant_trade.warrant_name),
+            turnover = COALESCE(EXCLUDED.turnover, tw_warrant_trade.turnover),
+            volume = COALESCE(EXCLUDED.volume, tw_warrant_trade.volume),
+            open_price = COALESCE(EXCLUDED.open_price, tw_warrant_trade.open_price),
+            high_price = COALESCE(EXCLUDED.high_price, tw_warrant_trade.high_price),
+            low_price = COALESCE(EXCLUDED.low_price, tw_warrant_trade.low_price),
+            close_price = COALESCE(EXCLUDED.close_price, tw_warrant_trade.close_price),
+            price_change = COALESCE(EXCLUDED.price_change, tw_warrant_trade.price_change),
+            updated_at = NOW()
+        """,
+        rows,
+        template="(%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,NOW())",
+        page_size=2000,
+    )
+    if not refresh_snapshots:
+        return len(rows)
+    refresh_latest_warrant_bars(cursor, "TWSE", [r[2] for r in rows])
+    warrant_ta_state.update_states(cursor, "TWSE", [r[2] for r in rows], since=trade_date)
+    warrant_rankings.build_day(cursor, "TWSE", trade_date)
+    return len(rows)
+
+
+def ingest(
+    cursor,
+    snapshot: DailySnapshot,
+    *,
+    prices_table: str = "tw_stock_prices",
+    master_codes: Optional[set[str]] = None,
+    stocks: bool = True,
+    warrants: bool = True,
+) -> dict[str, Any]:
+    """Write one snapshot to both tables on ``cursor``; the caller commits (one transaction)."""
+    stock_count = write_stock_prices(cursor, snapshot, prices_table) if stocks else 0
+    warrant_count = (
+        write_warrant_trades(cursor, snapshot.trade_date, snapshot.trade_quotes(), master_codes)
+        if warrants else 0
+    )
+    return {
+        "tradeDate": snapshot.trade_date.isoformat(),
+        "securities": len(snapshot.quotes),
+        "stockPrices": stock_count,
+        "warrantTrades": warrant_count,
+    }
@@ -0,0 +1,321 @@
+"""Persisted day-over-day price anomaly index.
+
+``price_anomalies`` keeps every close-to-close move above ``floor`` (default
+10%) per symbol, maintained incrementally by the price upsert helpers: only the
+upserted dates (and the first day after them) are recomputed against the
+previous close, so detection no longer needs a ``LAG()`` window over the whole
+prices table.
+
+Rows carry a ``rule_version`` derived from the floor.  ``price_anomaly_scan_state``
+records which rule each symbol was fully scanned with; raising the query
+threshold never needs a rescan, lowering the floor only rescans symbols whose
+state is on an older rule.  Readers check ``index_covers`` and fall back to a
+direct scan until the background ``rescan_stale_symbols`` has caught up.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import threading
+from typing import Any, Callable, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+ANOMALY_TABLE = "price_anomalies"
+SCAN_STATE_TABLE = "price_anomaly_scan_state"
+RESCAN_CHUNK = 200
+
+
+def _env_floor() -> float:
+    try:
+        return float(os.getenv("PRICE_ANOMALY_FLOOR", "0.1"))
+    except ValueError:
+        return 0.1
+
+
+ANOMALY_FLOOR = _env_floor()
+
+
+def rule_version(floor: float = None) -> str:
+    return f"pct_close_v1@{ANOMALY_FLOOR if floor is None else floor:g}"
+
+
+_ready_lock = threading.Lock()
+_ready_dsns: set[str] = set()
+
+
+def _dsn_key(cursor) -> str:
+    conn = getattr(cursor, "connection", None)
+    return str(getattr(conn, "dsn", "") or id(conn))
+
+
+def ensure_anomaly_tables(cursor) -> None:
+    key = _dsn_key(cursor)
+    if key in _ready_dsns:
+        return
+    with _ready_lock:
+        if key in _ready_dsns:
+            return
+        cursor.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {ANOMALY_TABLE} (
+                symbol VARCHAR(20) NOT NULL,
+                date DATE NOT NULL,
+                close_price DECIMAL(10,2),
+                prev_date DATE,
+                prev_close DECIMAL(10,2),
+                pct_change NUMERIC(12,6) NOT NULL,
+                rule_version VARCHAR(40) NOT NULL,
+                detected_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (symbol, date)
+            )
+            """
+        )
+        cursor.execute(
+            f"""
+            CREATE INDEX IF NOT EXISTS {ANOMALY_TABLE}_date_idx
+            ON {ANOMALY_TABLE}(date DESC, pct_change DESC)
+            """
+        )
+        cursor.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {SCAN_STATE_TABLE} (
+                symbol VARCHAR(20) PRIMARY KEY,
+                rule_version VARCHAR(40) NOT NULL,
+                scanned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """
+        )
+        _ready_dsns.add(key)
+
+
+def _unique(values: Iterable[Any]) -> list[str]:
+    seen: dict[str, None] = {}
+    for value in values:
+        text = str(value or "").strip()
+        if text:
+            seen[text] = None
+    return list(seen)
+
+
+def update_price_anomalies(
+    cursor,
+    symbols: Iterable[str],
+    since: Optional[str] = None,
+    *,
+    prices_table: str = "tw_stock_prices",
+    floor: float = None,
+) -> int:
+    """Recompute anomalies of ``symbols`` for dates ``>= since`` (all dates when ``None``).
+
+    Each symbol is anchored on its last close before ``since`` so the first
+    recomputed day is still compared against the real previous close.
+    """
+    symbol_list = _unique(symbols)
+    if not symbol_list:
+        return 0
+    floor = ANOMALY_FLOOR if floor is None else floor
+    ensure_anomaly_tables(cursor)
+    if since is None:
+        cursor.execute(f"DELETE FROM {ANOMALY_TABLE} WHERE symbol = ANY(%s)", (symbol_list,))
+        anchor_sql = "NULL::date"
+        anchor_params: list[Any] = []
+        since_filter = ""
+        since_params: list[Any] = []
+    else:
+        cursor.execute(
+            f"DELETE FROM {ANOMALY_TABLE} WHERE symbol = ANY(%s) AND date >= %s",
+            (symbol_list, since),
+        )
+        anchor_sql = f"""(
+            SELECT MAX(q.date) FROM {prices_table} q
+            WHERE q.symbol = s.symbol AND q.date < %s
+        )"""
+        anchor_params = [since]
+        since_filter = "AND px.date >= %s"
+        since_params = [since]
+    cursor.execute(
+        f"""
+        INSERT INTO {ANOMALY_TABLE} (
+            symbol, date, close_price, prev_date, prev_close, pct_change, rule_version, detected_at
+        )
+        SELECT px.symbol, px.date, px.close_price, px.prev_date, px.prev_close,
+               ABS(px.close_price - px.prev_close) / ABS(px.prev_close), %s, CURRENT_TIMESTAMP
+        FROM (
+            SELECT p.symbol, p.date, p.close_price,
+                   LAG(p.date) OVER w AS prev_date,
+                   LAG(p.close_price) OVER w AS prev_close
+            FROM unnest(%s::text[]) AS s(symbol)
+            CROSS JOIN LATERAL (SELECT {anchor_sql} AS anchor) a
+            JOIN {prices_table} p
+              ON p.symbol = s.symbol
+             AND (a.anchor IS NULL OR p.date >= a.anchor)
+            WINDOW w AS (PARTITION BY p.symbol ORDER BY p.date)
+        ) px
+        WHERE px.prev_close IS NOT NULL
+          AND px.prev_close <> 0
+          AND px.close_price IS NOT NULL
+          AND ABS(px.close_price - px.prev_close) / ABS(px.prev_close) > %s
+          {since_filter}
+        ON CONFLICT (symbol, date) DO UPDATE SET
+            close_price = EXCLUDED.close_price,
+            prev_date = EXCLUDED.prev_date,
+            prev_close = EXCLUDED.prev_close,
+            pct_change = EXCLUDED.pct_change,
+            rule_version = EXCLUDED.rule_version,
+            detected_at = CURRENT_TIMESTAMP
+        """,
+        [rule_version(floor), symbol_list] + anchor_params + [floor] + since_params,
+    )
+    return cursor.rowcount or 0
+
+
+def stale_symbols(
+    cursor,
+    symbols: Optional[Iterable[str]] = None,
+    *,
+    prices_table: str = "tw_stock_prices",
+    floor: float = None,
+    limit: Optional[int] = None,
+) -> list[str]:
+    """Symbols never fully scanned with the current rule version.
+
+    Without ``symbols`` the universe is every symbol in ``prices_table``,
+    enumerated by a loose index scan on ``(symbol, date)`` (one probe per
+    symbol) rather than from a derived snapshot that may be incomplete.
+    """
+    version = rule_version(floor)
+    ensure_anomaly_tables(cursor)
+    tail = "ORDER BY 1" + (" LIMIT %s" if limit else "")
+    extra = [int(limit)] if limit else []
+    if symbols is not None:
+        candidates = _unique(symbols)
+        if not candidates:
+            return []
+        cursor.execute(
+            f"""
+            SELECT s.symbol FROM unnest(%s::text[]) AS s(symbol)
+            LEFT JOIN {SCAN_STATE_TABLE} st ON st.symbol = s.symbol
+            WHERE st.rule_version IS DISTINCT FROM %s
+            {tail}
+            """,
+            [candidates, version] + extra,
+        )
+    else:
+        cursor.execute(
+            f"""
+            WITH RECURSIVE u(symbol) AS (
+                (SELECT symbol FROM {prices_table} ORDER BY symbol LIMIT 1)
+                UNION ALL
+                SELECT (SELECT p.symbol FROM {prices_table} p WHERE p.symbol > u.symbol ORDER BY p.symbol LIMIT 1)
+                FROM u WHERE u.symbol IS NOT NULL
+            )
+            SELECT u.symbol FROM u
+            LEFT JOIN {SCAN_STATE_TABLE} st ON st.symbol = u.symbol
+            WHERE u.symbol IS NOT NULL AND st.rule_version IS DISTINCT FROM %s
+            {tail}
+            """,
+            [version] + extra,
+        )
+    return [_first_value(row) for row in cursor.fetchall() or []]
+
+
+def index_covers(cursor, symbol: Optional[str] = None, *, prices_table: str = "tw_stock_prices") -> bool:
+    """Whether the index can answer for ``symbol`` (or the whole market) without a rescan."""
+    return not stale_symbols(cursor, [symbol] if symbol else None, prices_table=prices_table, limit=1)
+
+
+def rescan_stale_symbols(
+    cursor,
+    symbols: Optional[Iterable[str]] = None,
+    *,
+    prices_table: str = "tw_stock_prices",
+    floor: float = None,
+    commit: Optional[Callable[[], None]] = None,
+) -> int:
+    """Fully rescan symbols never scanned with the current rule version.
+
+    Meant for a background connection: ``commit`` is called after every chunk
+    so a long first scan makes progress visible and resumable.
+    """
+    floor = ANOMALY_FLOOR if floor is None else floor
+    version = rule_version(floor)
+    stale = stale_symbols(cursor, symbols, prices_table=prices_table, floor=floor)
+    for i in range(0, len(stale), RESCAN_CHUNK):
+        chunk = stale[i:i + RESCAN_CHUNK]
+        update_price_anomalies(cursor, chunk, None, prices_table=prices_table, floor=floor)
+        cursor.execute(
+            f"""
+            INSERT INTO {SCAN_STATE_TABLE} (symbol, rule_version, scanned_at)
+            SELECT unnest(%s::text[]), %s, CURRENT_TIMESTAMP
+            ON CONFLICT (symbol) DO UPDATE SET
+                rule_version = EXCLUDED.rule_version,
+                scanned_at = CURRENT_TIMESTAMP
+            """,
+            (chunk, version),
+        )
+        if commit is not None:
+            commit()
+    if stale:
+        logger.info("price anomaly index rescanned %d symbols (%s)", len(stale), version)
+    return len(stale)
+
+
+def query_price_anomalies(
+    cursor,
+    symbol: Optional[str] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    threshold: float = 0.2,
+    *,
+    floor: float = None,
+) -> list[dict[str, Any]]:
+    """Read anomalies above ``threshold`` from the index (``threshold`` must be >= floor)."""
+    conds = ["rule_version = %s", "pct_change > %s"]
+    params: list[Any] = [rule_version(floor), threshold]
+    if symbol:
+        conds.append("symbol = %s")
+        params.append(symbol)
+    if start_date:
+        conds.append("date >= %s")
+        params.append(start_date)
+    if end_date:
+        conds.append("date <= %s")
+        params.append(end_date)
+    cursor.execute(
+        f"""
+        SELECT symbol, date, close_price, prev_close, pct_change
+        FROM {ANOMALY_TABLE}
+        WHERE {" AND ".join(conds)}
+        ORDER BY symbol, date
+        """,
+        params,
+    )
+    return list(cursor.fetchall() or [])
+
+
+def status(cursor) -> dict[str, Any]:
+    ensure_anomaly_tables(cursor)
+    cursor.execute(
+        f"""
+        SELECT rule_version, COUNT(*) AS symbols, MAX(scanned_at) AS last_scan
+        FROM {SCAN_STATE_TABLE} GROUP BY rule_version
+        """
+    )
+    scans = [dict(row) for row in cursor.fetchall() or []]
+    cursor.execute(f"SELECT COUNT(*) AS n FROM {ANOMALY_TABLE} WHERE rule_version = %s", (rule_version(),))
+    return {
+        "rule_version": rule_version(),
+        "floor": ANOMALY_FLOOR,
+        "anomalies": int(_first_value(cursor.fetchone()) or 0),
+        "scans": scans,
+    }
+
+
+def _first_value(row: Any) -> Any:
+    if row is None:
+        return None
+    if isinstance(row, dict):
+        return next(iter(row.values()), None)
+    return row[0]
@@ -0,0 +1,193 @@
+"""Vectorized price sanity checks shared by the batch, individual and refetch paths.
+
+Rows are turned into NumPy columns once and every rule is evaluated over the
+whole day / batch in a single pass.  Each rule sets a bit in ``reasons``; a
+``RuleSet`` decides which bits reject a row, the others are kept as warnings
+(e.g. a move beyond the daily price limit is legitimate on ex-rights days or in
+the first days after listing, so it is reported but not rejected by default).
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Any, Iterable, Mapping, Optional, Sequence
+
+import numpy as np
+
+BAD_CLOSE = 1 << 0          # close 缺失或 <= 0
+PRICE_CEILING = 1 << 1      # 任一價格 >= 上限（預設 30000，解析錯位的典型症狀）
+ZERO_VOLUME = 1 << 2        # 成交量缺失或 <= 0
+OHLC_ORDER = 1 << 3         # high < max(open, close, low) 或 low > min(open, close)
+LIMIT_BREACH = 1 << 4       # 相對前收超過漲跌幅限制
+SPLIT_LIKE = 1 << 5         # 相對前收跳動過大，疑似分割/減資未調整
+MOVE_GT_THRESHOLD = 1 << 6  # 相對前收超過呼叫端指定的門檻（重抓驗證）
+
+REASON_NAMES = {
+    BAD_CLOSE: "close_le_zero_or_null",
+    PRICE_CEILING: "price_ge_ceiling",
+    ZERO_VOLUME: "zero_volume",
+    OHLC_ORDER: "ohlc_order",
+    LIMIT_BREACH: "limit_breach",
+    SPLIT_LIKE: "split_like_jump",
+    MOVE_GT_THRESHOLD: "pct_change_gt_threshold",
+}
+
+
+@dataclass(frozen=True)
+class RuleSet:
+    reject: int
+    price_ceiling: float = 30000.0
+    limit_pct: float = 0.10
+    # 漲跌停價依升降單位進位，實際漲跌幅可能略超過 10%
+    limit_tolerance: float = 0.011
+    split_threshold: float = 0.40
+    max_move: Optional[float] = None
+
+
+# 全市場日行情：維持原本的 close>0、volume>0、< 30000 過濾
+SNAPSHOT_RULES = RuleSet(reject=BAD_CLOSE | PRICE_CEILING | ZERO_VOLUME)
+# 個股月資料：零成交量的日子照常保留
+HISTORY_RULES = RuleSet(reject=BAD_CLOSE | PRICE_CEILING)
+
+
+def refetch_rules(threshold: Optional[float]) -> RuleSet:
+    """Rules used when refetched rows are about to overwrite stored ones."""
+    if threshold is None:
+        return RuleSet(reject=0)
+    return RuleSet(reject=BAD_CLOSE | MOVE_GT_THRESHOLD, max_move=float(threshold))
+
+
+@dataclass
+class ValidationResult:
+    accept: np.ndarray
+    reasons: np.ndarray
+    prev_close: np.ndarray
+    reject_mask: int = 0
+
+    def reason_codes(self, index: int, *, rejecting_only: bool = False) -> list[str]:
+        bits = int(self.reasons[index])
+        if rejecting_only:
+            bits &= self.reject_mask
+        return [name for bit, name in REASON_NAMES.items() if bits & bit]
+
+    def rejected_indices(self) -> np.ndarray:
+        return np.flatnonzero(~self.accept)
+
+    def counts(self) -> dict[str, int]:
+        return {
+            name: int(np.count_nonzero(self.reasons & bit))
+            for bit, name in REASON_NAMES.items()
+            if np.any(self.reasons & bit)
+        }
+
+
+def _to_float_array(values: Iterable[Any]) -> np.ndarray:
+    out = []
+    for value in values:
+        try:
+            out.append(float(value) if value is not None else np.nan)
+        except (TypeError, ValueError):
+            out.append(np.nan)
+    return np.asarray(out, dtype=float)
+
+
+def _column(records: Sequence[Mapping[str, Any]], *keys: str) -> np.ndarray:
+    def pick(rec):
+        for key in keys:
+            if key in rec and rec[key] is not None:
+                return rec[key]
+        return None
+    return _to_float_array(pick(rec) for rec in records)
+
+
+def sequential_prev_close(close: np.ndarray, first_prev: Optional[float]) -> np.ndarray:
+    """Previous valid close inside one symbol's date-sorted rows.
+
+    Row 0 is compared with ``first_prev`` (the stored close before the batch);
+    rows with a missing / non-positive close are skipped when carrying forward.
+    """
+    n = close.shape[0]
+    valid = np.isfinite(close) & (close > 0)
+    last_valid = np.maximum.accumulate(np.where(valid, np.arange(n), -1)) if n else np.empty(0, dtype=int)
+    prev_idx = np.concatenate(([-1], last_valid[:-1])) if n else last_valid
+    seed = np.nan if first_prev is None else float(first_prev)
+    return np.where(prev_idx >= 0, close[np.maximum(prev_idx, 0)], seed)
+
+
+def validate_arrays(
+    open_: np.ndarray,
+    high: np.ndarray,
+    low: np.ndarray,
+    close: np.ndarray,
+    volume: np.ndarray,
+    prev_close: np.ndarray,
+    rules: RuleSet,
+) -> ValidationResult:
+    """Evaluate every rule over the columns; NaN means "not provided"."""
+    reasons = np.zeros(close.shape[0], dtype=np.int64)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        bad_close = ~(np.isfinite(close) & (close > 0))
+        reasons[bad_close] |= BAD_CLOSE
+
+        prices = np.vstack([open_, high, low, close])
+        reasons[np.any(prices >= rules.price_ceiling, axis=0)] |= PRICE_CEILING
+
+        reasons[~(np.isfinite(volume) & (volume > 0))] |= ZERO_VOLUME
+
+        # 收盤已判定無效時不再參與 OHLC 比較，避免同一列重複計因
+        close_ok = np.where(bad_close, np.nan, close)
+        body_max = np.fmax(np.fmax(open_, close_ok), low)
+        body_min = np.fmin(open_, close_ok)
+        ohlc_bad = (np.isfinite(high) & (high < body_max)) | (np.isfinite(low) & (low > body_min))
+        reasons[ohlc_bad] |= OHLC_ORDER
+
+        has_prev = np.isfinite(prev_close) & (prev_close > 0) & ~bad_close
+        move = np.where(has_prev, np.abs(close - prev_close) / np.where(has_prev, prev_close, 1.0), 0.0)
+        reasons[has_prev & (move > rules.limit_pct + rules.limit_tolerance)] |= LIMIT_BREACH
+        reasons[has_prev & (move > rules.split_threshold)] |= SPLIT_LIKE
+        if rules.max_move is not None:
+            reasons[has_prev & (move > rules.max_move)] |= MOVE_GT_THRESHOLD
+
+    accept = (reasons & rules.reject) == 0
+    return ValidationResult(accept=accept, reasons=reasons, prev_close=prev_close, reject_mask=rules.reject)
+
+
+def validate_records(
+    records: Sequence[Mapping[str, Any]],
+    rules: RuleSet,
+    *,
+    prev_close: Optional[float] = None,
+    prev_closes: Optional[Sequence[Optional[float]]] = None,
+    sequential: bool = False,
+) -> ValidationResult:
+    """Validate dict rows using either ``Open/High/...`` or ``open_price/...`` keys.
+
+    ``sequential=True`` treats the rows as one symbol's date-sorted history and
+    derives each row's previous close from the row before it (seeded with
+    ``prev_close``); otherwise ``prev_closes`` gives one previous close per row.
+    """
+    open_ = _column(records, "open_price", "Open", "open")
+    high = _column(records, "high_price", "High", "high")
+    low = _column(records, "low_price", "Low", "low")
+    close = _column(records, "close_price", "Close", "close")
+    volume = _column(records, "volume", "Volume")
+    if sequential:
+        prev = sequential_prev_close(close, prev_close)
+    elif prev_closes is not None:
+        prev = _to_float_array(prev_closes)
+    else:
+        prev = np.full(close.shape[0], np.nan)
+    return validate_arrays(open_, high, low, close, volume, prev, rules)
+
+
+def split_records(records: Sequence[Any], result: ValidationResult) -> tuple[list[Any], list[tuple[Any, str]]]:
+    """Split ``records`` by the accept mask; rejects carry their first reject reason."""
+    accepted: list[Any] = []
+    rejected: list[tuple[Any, str]] = []
+    for i, rec in enumerate(records):
+        if result.accept[i]:
+            accepted.append(rec)
+        else:
+            codes = result.reason_codes(i, rejecting_only=True)
+            rejected.append((rec, codes[0] if codes else "rejected"))
+    return accepted, rejected
@@ -0,0 +1,366 @@
+"""Change-feed replication from the local database to Neon.
+
+Row triggers on the replicated tables append ``(table, key, op)`` to
+``replication_log`` inside the writing transaction, so every upsert helper,
+backfill script, anomaly fix or T86 / margin / revenue import is captured
+without touching its code.
+
+Keys are the table's merge key (``TableShape.merge_key``): for tables such as
+``tw_stock_prices`` with an ``id SERIAL`` surrogate next to ``UNIQUE (symbol,
+date)`` that is the business key, because ids are assigned independently on
+Neon.
+
+``replicate_once`` drains the log in id order: keys are de-duplicated per
+table, the *current* rows are streamed from the source with COPY into a Neon
+staging table and merged with ``ON CONFLICT DO UPDATE``; keys that no longer
+exist on the source are deleted on Neon.  Log rows are removed only after the
+Neon transaction commits, so a crash simply replays an idempotent batch.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Iterable, Optional
+
+import db_sync_engine
+from db_sync_engine import TableShape, fetch_tuples, quote_ident
+from table_config import (
+    institutional_trades_table,
+    margin_trades_table,
+    monthly_revenue_table,
+    stock_prices_table,
+)
+
+logger = logging.getLogger(__name__)
+
+LOG_TABLE = "replication_log"
+TRIGGER_FUNCTION = "replication_log_capture"
+DEFAULT_BATCH = 20000
+
+
+def default_table_map() -> dict[str, str]:
+    """Local table -> Neon table for the tables written by the daily jobs."""
+    pairs = [
+        stock_prices_table,
+        institutional_trades_table,
+        margin_trades_table,
+        monthly_revenue_table,
+    ]
+    return {fn(use_neon=False): fn(use_neon=True) for fn in pairs}
+
+
+def ensure_log_table(cursor) -> None:
+    cursor.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {LOG_TABLE} (
+            id BIGSERIAL PRIMARY KEY,
+            table_name VARCHAR(128) NOT NULL,
+            row_key JSONB NOT NULL,
+            op CHAR(1) NOT NULL,
+            logged_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        )
+        """
+    )
+    cursor.execute(
+        f"""
+        CREATE OR REPLACE FUNCTION {TRIGGER_FUNCTION}() RETURNS trigger AS $$
+        DECLARE
+            rec JSONB;
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                rec := to_jsonb(OLD);
+            ELSE
+                rec := to_jsonb(NEW);
+            END IF;
+            INSERT INTO {LOG_TABLE} (table_name, row_key, op)
+            SELECT TG_TABLE_NAME,
+                   (SELECT jsonb_object_agg(k, rec -> k) FROM unnest(TG_ARGV) AS k),
+                   LEFT(TG_OP, 1);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """
+    )
+
+
+def install_triggers(cursor, tables: Iterable[str]) -> list[str]:
+    """Attach the capture trigger to every existing table with a primary or unique key."""
+    ensure_log_table(cursor)
+    installed = []
+    for table in tables:
+        shape = db_sync_engine.describe_table(cursor, table)
+        if shape is None or not shape.merge_key():
+            continue
+        args = ", ".join("'" + c.replace("'", "''") + "'" for c in shape.merge_key())
+        trigger = quote_ident(f"{table}_replication_log")
+        cursor.execute(f"DROP TRIGGER IF EXISTS {trigger} ON {quote_ident(table)}")
+        cursor.execute(
+            f"""
+            CREATE TRIGGER {trigger}
+            AFTER INSERT OR UPDATE OR DELETE ON {quote_ident(table)}
+            FOR EACH ROW EXECUTE FUNCTION {TRIGGER_FUNCTION}({args})
+            """
+        )
+        installed.append(table)
+    return installed
+
+
+def drop_triggers(cursor) -> list[str]:
+    """Detach every capture trigger, so nothing accumulates in the log while no replicator drains it."""
+    cursor.execute(
+        """
+        SELECT c.relname, t.tgname
+        FROM pg_trigger t
+        JOIN pg_class c ON c.oid = t.tgrelid
+        JOIN pg_proc p ON p.oid = t.tgfoid
+        WHERE p.proname = %s AND NOT t.tgisinternal
+        """,
+        (TRIGGER_FUNCTION,),
+    )
+    dropped = []
+    for table, trigger in cursor.fetchall():
+        cursor.execute(f"DROP TRIGGER IF EXISTS {quote_ident(trigger)} ON {quote_ident(table)}")
+        dropped.append(table)
+    return dropped
+
+
+def lag(cursor) -> dict[str, Any]:
+    ensure_log_table(cursor)
+    cursor.execute(
+        f"""
+        SELECT table_name, COUNT(*), MIN(logged_at), MAX(logged_at)
+        FROM {LOG_TABLE} GROUP BY table_name ORDER BY table_name
+        """
+    )
+    tables = []
+    oldest = None
+    for name, pending, first, last in fetch_tuples(cursor):
+        tables.append({
+            "table": name,
+            "pending": int(pending),
+            "oldest": first.isoformat() if first else None,
+            "newest": last.isoformat() if last else None,
+        })
+        if first is not None and (oldest is None or first < oldest):
+            oldest = first
+    now = datetime.now(timezone.utc)
+    return {
+        "pending": sum(t["pending"] for t in tables),
+        "lag_seconds": round((now - oldest).total_seconds(), 1) if oldest else 0.0,
+        "tables": tables,
+    }
+
+
+def _keys_recordset(shape: TableShape) -> str:
+    return ", ".join(f"{quote_ident(c)} {shape.column_type(c)}" for c in shape.merge_key())
+
+
+def _key_join(shape: TableShape, left: str, right: str) -> str:
+    return " AND ".join(f"{left}.{quote_ident(c)} = {right}.{quote_ident(c)}" for c in shape.merge_key())
+
+
+def _resolve_surrogate_keys(src, shape: TableShape, table: str, keys: list[dict]) -> list[dict]:
+    """Map entries logged by surrogate id (triggers installed before business keys) to business keys.
+
+    Rows that no longer exist cannot be mapped and are dropped.
+    """
+    surrogate, key = shape.surrogate_key, shape.merge_key()
+    legacy = [k[surrogate] for k in keys if surrogate and surrogate in k and not all(c in k for c in key)]
+    resolved = [k for k in keys if all(c in k for c in key)]
+    if legacy:
+        src.execute(
+            f"SELECT {', '.join(quote_ident(c) for c in key)} FROM {quote_ident(table)} "
+            f"WHERE {quote_ident(surrogate)} = ANY(%s)",
+            (legacy,),
+        )
+        resolved.extend(dict(zip(key, row)) for row in fetch_tuples(src))
+    return resolved
+
+
+def replicate_table(src_conn, dst_conn, table: str, target: str, keys: list[dict], deleted: list[dict]) -> dict[str, int]:
+    """Ship the current source rows for ``keys`` to ``target`` and delete vanished ones."""
+    src = src_conn.cursor()
+    dst = dst_conn.cursor()
+    shape = db_sync_engine.describe_table(src, table)
+    if shape is None or not shape.merge_key():
+        raise RuntimeError(f"{table} 沒有主鍵或唯一鍵，無法增量複寫")
+    keys = _resolve_surrogate_keys(src, shape, table, keys)
+    deleted = [k for k in deleted if all(c in k for c in shape.merge_key())]
+    cols = ", ".join(f"t.{quote_ident(c)}" for c in shape.copy_columns)
+    keys_sql = src.mogrify(
+        f"jsonb_to_recordset(%s::jsonb) AS k({_keys_recordset(shape)})", (json.dumps(keys, default=str),)
+    ).decode()
+    staged = db_sync_engine.stage_copy(
+        src,
+        dst,
+        shape,
+        f"SELECT {cols} FROM {quote_ident(table)} t JOIN {keys_sql} ON {_key_join(shape, 't', 'k')}",
+        target=target,
+    )
+    merged = db_sync_engine.merge_stage(dst, shape, target)
+    # 同一個 Neon 交易會處理多張表，暫存表用完即丟
+    dst.execute("DROP TABLE IF EXISTS _sync_stage")
+    removed = 0
+    if deleted:
+        gone_sql = src.mogrify(
+            f"""
+            SELECT {", ".join(f"k.{quote_ident(c)}" for c in shape.merge_key())}
+            FROM jsonb_to_recordset(%s::jsonb) AS k({_keys_recordset(shape)})
+            WHERE NOT EXISTS (SELECT 1 FROM {quote_ident(table)} t WHERE {_key_join(shape, 't', 'k')})
+            """,
+            (json.dumps(deleted, default=str),),
+        ).decode()
+        src.execute(gone_sql)
+        gone = [dict(zip(shape.merge_key(), row)) for row in fetch_tuples(src)]
+        if gone:
+            dst.execute(
+                f"""
+                DELETE FROM {quote_ident(target)} t
+                USING jsonb_to_recordset(%s::jsonb) AS k({_keys_recordset(shape)})
+                WHERE {_key_join(shape, 't', 'k')}
+                """,
+                (json.dumps(gone, default=str),),
+            )
+            removed = dst.rowcount or 0
+    src_conn.rollback()
+    return {"staged": staged, "merged": merged, "deleted": removed}
+
+
+def replicate_once(
+    src_conn,
+    dst_conn,
+    *,
+    table_map: Optional[dict[str, str]] = None,
+    batch_size: int = DEFAULT_BATCH,
+) -> dict[str, Any]:
+    """Drain up to ``batch_size`` log entries; returns per-table counts."""
+    table_map = table_map or default_table_map()
+    src = src_conn.cursor()
+    src.execute(
+        f"SELECT id, table_name, row_key, op FROM {LOG_TABLE} ORDER BY id LIMIT %s",
+        (int(batch_size),),
+    )
+    entries = fetch_tuples(src)
+    src_conn.rollback()
+    if not entries:
+        return {"entries": 0, "tables": {}}
+
+    by_table: dict[str, dict[str, Any]] = {}
+    for _id, table, key, op in entries:
+        key = json.loads(key) if isinstance(key, str) else key
+        bucket = by_table.setdefault(table, {"keys": {}, "deleted": {}})
+        marker = json.dumps(key, sort_keys=True, default=str)
+        bucket["keys"][marker] = key
+        if op == "D":
+            bucket["deleted"][marker] = key
+
+    summary: dict[str, Any] = {}
+    for table, bucket in by_table.items():
+        target = table_map.get(table, table)
+        summary[table] = replicate_table(
+            src_conn, dst_conn, table, target,
+            list(bucket["keys"].values()), list(bucket["deleted"].values()),
+        )
+    dst_conn.commit()
+
+    # Neon 已提交後才清掉 log；中途失敗時整批重送（合併為冪等）。
+    # 只刪讀到的 id：較小的 id 可能屬於讀取時尚未提交的交易，之後才出現，不能一併刪掉
+    src.execute(f"DELETE FROM {LOG_TABLE} WHERE id = ANY(%s)", ([e[0] for e in entries],))
+    src_conn.commit()
+    return {"entries": len(entries), "tables": summary}
+
+
+class Replicator:
+    """Background loop shipping the log to Neon every ``interval`` seconds."""
+
+    def __init__(
+        self,
+        src_connect: Callable[[], Any],
+        dst_connect: Callable[[], Any],
+        *,
+        interval: float = 30.0,
+        batch_size: int = DEFAULT_BATCH,
+        table_map: Optional[dict[str, str]] = None,
+    ):
+        self.src_connect = src_connect
+        self.dst_connect = dst_connect
+        self.interval = interval
+        self.batch_size = batch_size
+        self.table_map = table_map
+        self.status: dict[str, Any] = {
+            "running": False,
+            "last_run": None,
+            "last_success": None,
+            "last_error": None,
+            "shipped_entries": 0,
+            "last_batch": None,
+        }
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def run_once(self) -> dict[str, Any]:
+        """Drain the log until empty (or an error); safe to call from any thread."""
+        with self._lock:
+            src_conn = dst_conn = None
+            started = time.perf_counter()
+            self.status["last_run"] = datetime.now().isoformat()
+            try:
+                src_conn = self.src_connect()
+                dst_conn = self.dst_connect()
+                total = 0
+                while True:
+                    batch = replicate_once(
+                        src_conn, dst_conn, table_map=self.table_map, batch_size=self.batch_size
+                    )
+                    total += batch["entries"]
+                    if batch["entries"]:
+                        self.status["last_batch"] = batch
+                    if batch["entries"] < self.batch_size:
+                        break
+                self.status["shipped_entries"] += total
+                self.status["last_success"] = datetime.now().isoformat()
+                self.status["last_error"] = None
+                if total:
+                    logger.info("replicated %d log entries to Neon in %.1fs", total, time.perf_counter() - started)
+                return {"entries": total}
+            except Exception as exc:
+                self.status["last_error"] = str(exc)
+                logger.error("replication to Neon failed: %s", exc)
+                for conn in (src_conn, dst_conn):
+                    if conn is not None:
+                        try:
+                            conn.rollback()
+                        except Exception:
+                            pass
+                raise
+            finally:
+                for conn in (src_conn, dst_conn):
+                    if conn is not None:
+                        try:
+                            conn.close()
+                        except Exception:
+                            pass
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception:
+                pass
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="neon-replicator", daemon=True)
+        self._thread.start()
+        self.status["running"] = True
+
+    def stop(self) -> None:
+        self._stop.set()
+        self.status["running"] = False
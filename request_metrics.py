@@ -0,0 +1,212 @@
+"""Per-request latency and database instrumentation with a Prometheus text exporter.
+
+``install(app)`` registers ``before_request`` / ``after_request`` hooks that time
+every request by route template, and ``record_query`` is called by
+``TableNameAwareCursor`` for each statement so query count, rows and DB time are
+attributed to the request running on the current thread.  Each response gets a
+``Server-Timing`` header and everything is exported on ``/metrics``.
+
+Metrics are per process; with several gunicorn workers each one reports its own
+series (scrape them individually or aggregate on the Prometheus side).
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+from typing import Any, Iterable, Optional
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 1000)
+UNMATCHED_ROUTE = "<unmatched>"
+BACKGROUND_ROUTE = "<background>"
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "total", "count")
+
+    def __init__(self, buckets: Iterable[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.total += value
+        self.count += 1
+
+    def cumulative(self) -> list[tuple[float, int]]:
+        running = 0
+        out = []
+        for bound, n in zip(self.buckets, self.counts):
+            running += n
+            out.append((bound, running))
+        return out
+
+
+class _RequestStats:
+    __slots__ = ("started", "elapsed", "queries", "rows", "db_seconds")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+        self.queries = 0
+        self.rows = 0
+        self.db_seconds = 0.0
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._latency: dict[tuple[str, str, str], Histogram] = {}
+        self._db_seconds: dict[tuple[str, str], Histogram] = {}
+        self._queries_per_request: dict[tuple[str, str], Histogram] = {}
+        self._queries_total: dict[str, int] = {}
+        self._rows_total: dict[str, int] = {}
+        self._db_seconds_total: dict[str, float] = {}
+        self.started_at = time.time()
+
+    # ------------------------------------------------------------------
+    # Request lifecycle
+    # ------------------------------------------------------------------
+    def begin_request(self) -> None:
+        self._local.stats = _RequestStats()
+
+    def current(self) -> Optional[_RequestStats]:
+        return getattr(self._local, "stats", None)
+
+    def end_request(self, method: str, route: str, status: int) -> Optional[_RequestStats]:
+        stats = self.current()
+        self._local.stats = None
+        if stats is None:
+            return None
+        elapsed = stats.elapsed = time.perf_counter() - stats.started
+        key = (method, route)
+        with self._lock:
+            self._latency.setdefault((method, route, str(status)), Histogram(LATENCY_BUCKETS)).observe(elapsed)
+            self._db_seconds.setdefault(key, Histogram(LATENCY_BUCKETS)).observe(stats.db_seconds)
+            self._queries_per_request.setdefault(key, Histogram(QUERY_COUNT_BUCKETS)).observe(stats.queries)
+        return stats
+
+    def record_query(self, elapsed: float, rows: Optional[int]) -> None:
+        """Attribute one statement to the current request (or to background work)."""
+        rows = rows if rows and rows > 0 else 0
+        stats = self.current()
+        route = BACKGROUND_ROUTE
+        if stats is not None:
+            stats.queries += 1
+            stats.rows += rows
+            stats.db_seconds += elapsed
+            route = getattr(self._local, "route", None) or UNMATCHED_ROUTE
+        with self._lock:
+            self._queries_total[route] = self._queries_total.get(route, 0) + 1
+            self._rows_total[route] = self._rows_total.get(route, 0) + rows
+            self._db_seconds_total[route] = self._db_seconds_total.get(route, 0.0) + elapsed
+
+    def set_route(self, route: Optional[str]) -> None:
+        self._local.route = route
+
+    # ------------------------------------------------------------------
+    # Export
+    # ------------------------------------------------------------------
+    def render_prometheus(self) -> str:
+        lines: list[str] = []
+
+        def histogram(name: str, help_text: str, series: dict, label_names: tuple[str, ...]) -> None:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for labels, hist in sorted(series.items()):
+                base = ",".join(f'{k}="{_escape(v)}"' for k, v in zip(label_names, labels))
+                for bound, n in hist.cumulative():
+                    lines.append(f'{name}_bucket{{{base},le="{_fmt(bound)}"}} {n}')
+                lines.append(f'{name}_bucket{{{base},le="+Inf"}} {hist.count}')
+                lines.append(f"{name}_sum{{{base}}} {_fmt(hist.total)}")
+                lines.append(f"{name}_count{{{base}}} {hist.count}")
+
+        def counter(name: str, help_text: str, series: dict) -> None:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for route, value in sorted(series.items()):
+                lines.append(f'{name}{{route="{_escape(route)}"}} {_fmt(value)}')
+
+        with self._lock:
+            histogram(
+                "http_request_duration_seconds",
+                "Request latency by route template.",
+                self._latency,
+                ("method", "route", "status"),
+            )
+            histogram(
+                "http_request_db_seconds",
+                "Database time spent per request.",
+                self._db_seconds,
+                ("method", "route"),
+            )
+            histogram(
+                "http_request_db_queries",
+                "SQL statements executed per request.",
+                self._queries_per_request,
+                ("method", "route"),
+            )
+            counter("db_queries_total", "SQL statements executed.", self._queries_total)
+            counter("db_rows_total", "Rows reported by cursor.rowcount.", self._rows_total)
+            counter("db_query_seconds_total", "Time spent in cursor.execute.", self._db_seconds_total)
+        lines.append("# HELP process_start_time_seconds Start time of the process.")
+        lines.append("# TYPE process_start_time_seconds gauge")
+        lines.append(f"process_start_time_seconds {_fmt(self.started_at)}")
+        return "\n".join(lines) + "\n"
+
+
+def _fmt(value: Any) -> str:
+    if isinstance(value, float):
+        return repr(round(value, 6))
+    return str(value)
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+registry = MetricsRegistry()
+record_query = registry.record_query
+
+
+def install(app, *, endpoint: str = "/metrics") -> None:
+    """Register the timing hooks and the ``/metrics`` route on ``app``."""
+    from flask import Response, request
+
+    token = (os.getenv("METRICS_TOKEN") or "").strip()
+
+    @app.before_request
+    def _metrics_begin():
+        registry.begin_request()
+        rule = request.url_rule
+        registry.set_route(rule.rule if rule is not None else UNMATCHED_ROUTE)
+
+    @app.after_request
+    def _metrics_end(response):
+        rule = request.url_rule
+        route = rule.rule if rule is not None else UNMATCHED_ROUTE
+        stats = registry.end_request(request.method, route, response.status_code)
+        registry.set_route(None)
+        if stats is not None:
+            response.headers.add(
+                "Server-Timing",
+                f'db;dur={stats.db_seconds * 1000.0:.1f};desc="{stats.queries} queries, {stats.rows} rows", '
+                f"app;dur={stats.elapsed * 1000.0:.1f}",
+            )
+        return response
+
+    @app.route(endpoint, methods=["GET"])
+    def metrics():
+        if token:
+            header = request.headers.get("Authorization") or ""
+            if header != f"Bearer {token}":
+                return Response("unauthorized\n", status=401, mimetype="text/plain")
+        return Response(registry.render_prometheus(), mimetype="text/plain; version=0.0.4")
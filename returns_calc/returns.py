@@ -1,6 +1,11 @@
 from __future__ import annotations
-import pandas as pd
 import numpy as np
+
+try:
+    from lazy_imports import lazy_module
+    pd = lazy_module("pandas")
+except ImportError:  # 於 returns_calc/ 目錄下以 main.py 獨立執行時
+    import pandas as pd
 from datetime import datetime
 from typing import Iterable
 
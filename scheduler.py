@@ -7,14 +7,14 @@
 import os
 import sys
 import logging
-from datetime import datetime, time as dt_time
 from apscheduler.schedulers.blocking import BlockingScheduler
 from apscheduler.triggers.cron import CronTrigger
 import requests
 import psycopg2
-from psycopg2.extras import RealDictCursor
 import subprocess
 
+import replication_log
+
 # 配置日誌
 logging.basicConfig(
     level=logging.INFO,
@@ -53,6 +53,8 @@ class StockDataScheduler:
         logger.info("=" * 60)
         
         try:
+            self._ensure_replication_triggers()
+
             # 1. 抓取上市股票資料
             logger.info("📊 抓取上市股票資料...")
             self._fetch_twse_data()
@@ -117,65 +119,42 @@ class StockDataScheduler:
         except Exception as e:
             logger.error(f"❌ 抓取上櫃股票資料時發生錯誤: {e}")
     
-    def _sync_to_neon(self):
-        """同步資料到 Neon 資料庫"""
+    def _ensure_replication_triggers(self):
+        """確保本機複寫觸發器存在（需在寫入前安裝，之後的變更才會進 replication_log）
+
+        未設定 Neon 時沒有人清 replication_log，改為移除觸發器，避免 log 無限增長。
+        """
         try:
-            # 連接本地資料庫
-            local_conn = psycopg2.connect(**LOCAL_DB_CONFIG)
-            local_cur = local_conn.cursor(cursor_factory=RealDictCursor)
-            
-            # 連接 Neon 資料庫
-            neon_conn = psycopg2.connect(NEON_DB_URL)
-            neon_cur = neon_conn.cursor()
-            
-            # 取得今日資料
-            today = datetime.now().date()
-            local_cur.execute("""
-                SELECT symbol, date, open_price, high_price, low_price, 
-                       close_price, volume, transaction_count
-                FROM tw_stock_prices
-                WHERE date = %s
-            """, (today,))
-            
-            rows = local_cur.fetchall()
-            logger.info(f"📦 準備同步 {len(rows)} 筆資料到 Neon")
-            
-            if rows:
-                # 批次插入到 Neon（使用 ON CONFLICT 避免重複）
-                from psycopg2.extras import execute_values
-                
-                execute_values(
-                    neon_cur,
-                    """
-                    INSERT INTO tw_stock_prices 
-                    (symbol, date, open_price, high_price, low_price, 
-                     close_price, volume, transaction_count)
-                    VALUES %s
-                    ON CONFLICT (symbol, date) 
-                    DO UPDATE SET
-                        open_price = EXCLUDED.open_price,
-                        high_price = EXCLUDED.high_price,
-                        low_price = EXCLUDED.low_price,
-                        close_price = EXCLUDED.close_price,
-                        volume = EXCLUDED.volume,
-                        transaction_count = EXCLUDED.transaction_count
-                    """,
-                    [(r['symbol'], r['date'], r['open_price'], r['high_price'],
-                      r['low_price'], r['close_price'], r['volume'], 
-                      r['transaction_count']) for r in rows]
+            conn = psycopg2.connect(**LOCAL_DB_CONFIG)
+            try:
+                if not NEON_DB_URL:
+                    dropped = replication_log.drop_triggers(conn.cursor())
+                    conn.commit()
+                    if dropped:
+                        logger.info(f"🔁 未設定 Neon，已移除複寫觸發器: {', '.join(dropped)}")
+                    return
+                installed = replication_log.install_triggers(
+                    conn.cursor(), replication_log.default_table_map()
                 )
-                
-                neon_conn.commit()
-                logger.info(f"✅ 成功同步 {len(rows)} 筆資料到 Neon")
-            else:
-                logger.warning("⚠️  沒有今日資料需要同步")
-            
-            # 關閉連接
-            local_cur.close()
-            local_conn.close()
-            neon_cur.close()
-            neon_conn.close()
-            
+                conn.commit()
+                logger.info(f"🔁 複寫觸發器就緒: {', '.join(installed) or '無'}")
+            finally:
+                conn.close()
+        except Exception as e:
+            logger.error(f"❌ 安裝複寫觸發器失敗: {e}")
+
+    def _sync_to_neon(self):
+        """把 replication_log 累積的變更送到 Neon（COPY + 冪等合併）"""
+        if not NEON_DB_URL:
+            logger.warning("⚠️  未設定 NEON_DATABASE_URL，略過同步")
+            return
+        try:
+            replicator = replication_log.Replicator(
+                lambda: psycopg2.connect(**LOCAL_DB_CONFIG),
+                lambda: psycopg2.connect(NEON_DB_URL),
+            )
+            result = replicator.run_once()
+            logger.info(f"✅ 已同步 {result['entries']} 筆變更到 Neon")
         except Exception as e:
             logger.error(f"❌ 同步到 Neon 時發生錯誤: {e}", exc_info=True)
     
@@ -204,6 +183,7 @@ class StockDataScheduler:
         logger.info("=" * 60)
         
         try:
+            self._ensure_replication_triggers()
             result = subprocess.run(
                 [sys.executable, 'smart_refresh.py', '--full'],
                 capture_output=True,
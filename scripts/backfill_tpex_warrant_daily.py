@@ -4,6 +4,11 @@
 用法：
   python3 scripts/backfill_tpex_warrant_daily.py
   python3 scripts/backfill_tpex_warrant_daily.py --start 2025-11-01 --end 2026-07-31
+  python3 scripts/backfill_tpex_warrant_daily.py --workers 6 --sleep 0.3
+
+只抓交易日、多日並行；每日完成狀態記錄於 tpex_warrant_backfill_days，中斷後重跑會接續，
+失敗日收集在結尾並以非零代碼結束（再跑一次即重試）。整段回補後與 API 回補相同，
+一次更新最新 K 棒快照、技術狀態、排行與首頁統計。
 """
 
 from __future__ import annotations
@@ -22,6 +27,10 @@ import requests
 from psycopg2.extras import execute_values
 
 ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+import tpex_backfill  # noqa: E402
 
 
 def _load_dotenv():
@@ -222,11 +231,13 @@ def main():
     parser = argparse.ArgumentParser(description='Backfill TPEX warrant daily quotes')
     parser.add_argument('--start', default='', help='YYYY-MM-DD（預設 end 往前 270 天）')
     parser.add_argument('--end', default='', help='YYYY-MM-DD（預設今天）')
-    parser.add_argument('--sleep', type=float, default=0.25, help='每日間隔秒數')
+    parser.add_argument('--sleep', type=float, default=0.25, help='對櫃買主機的請求最小間隔秒數（並行共用）')
+    parser.add_argument('--workers', type=int, default=tpex_backfill.DEFAULT_WORKERS, help='同時抓取的日數')
+    parser.add_argument('--force', action='store_true', help='連已完成／已有資料的日子也重抓')
     parser.add_argument(
         '--continue-on-error',
         action='store_true',
-        help='單日失敗時略過並繼續（預設遇錯中止）',
+        help='（保留相容）單日失敗一律記錄後繼續，結束時以非零代碼回報',
     )
     args = parser.parse_args()
 
@@ -245,67 +256,61 @@ def main():
     )
 
     conn = _connect()
-    imported_days = skipped_days = imported_count = failed_days = 0
     try:
         cur = conn.cursor()
-        # 已有資料的日期跳過，方便斷點續跑
-        cur.execute(
-            """
-            SELECT DISTINCT trade_date
-            FROM tpex_warrant_daily_quotes
-            WHERE trade_date BETWEEN %s AND %s
-            """,
-            (start_date, end_date),
+        plan = tpex_backfill.plan_days(cur, start_date, end_date, force=args.force)
+        days = plan['days']
+        if not args.force:
+            # 已有資料的日期跳過（含進度表建立前匯入的日子）
+            cur.execute(
+                """
+                SELECT DISTINCT trade_date
+                FROM tpex_warrant_daily_quotes
+                WHERE trade_date BETWEEN %s AND %s
+                """,
+                (start_date, end_date),
+            )
+            existing = {r[0] for r in (cur.fetchall() or []) if r and r[0]}
+            days = [d for d in days if d not in existing]
+        conn.commit()
+        cur.close()
+        print(
+            f'  to fetch: {len(days)} days '
+            f'(holidays {len(plan["holidays"])}, completed {len(plan["completed"])})',
+            flush=True,
+        )
+
+        def on_day(day, status, result):
+            if status == 'failed':
+                print(f'  FAIL {day.isoformat()}: {result.failures[-1]["error"]}', file=sys.stderr, flush=True)
+            elif status == 'empty':
+                print(f'  skip {day.isoformat()} (no data)', flush=True)
+            else:
+                print(f'  ok   {day.isoformat()}', flush=True)
+
+        result = tpex_backfill.run_backfill(
+            conn,
+            days,
+            fetch=fetch_day,
+            write=import_rows,
+            workers=args.workers,
+            limiter=tpex_backfill.HostRateLimiter(args.sleep),
+            on_day=on_day,
         )
-        existing = {r[0] for r in (cur.fetchall() or []) if r and r[0]}
-        if existing:
-            print(f'  existing days in range: {len(existing)}', flush=True)
-
-        d = start_date
-        while d <= end_date:
-            if d in existing:
-                skipped_days += 1
-                print(f'  have {d.isoformat()} (skip)', flush=True)
-                d += timedelta(days=1)
-                continue
-            try:
-                data = fetch_day(d)
-                if not data:
-                    skipped_days += 1
-                    print(f'  skip {d.isoformat()} (no data)', flush=True)
-                else:
-                    n = import_rows(cur, data)
-                    conn.commit()
-                    imported_days += 1
-                    imported_count += n
-                    existing.add(d)
-                    print(f'  ok   {d.isoformat()} rows={n}', flush=True)
-            except Exception as e:
-                conn.rollback()
-                print(f'  FAIL {d.isoformat()}: {e}', file=sys.stderr, flush=True)
-                if args.continue_on_error:
-                    failed_days += 1
-                else:
-                    raise
-            if args.sleep > 0 and d < end_date:
-                time.sleep(args.sleep)
-            d += timedelta(days=1)
+        tpex_backfill.finish_range(conn, result)
     finally:
         conn.close()
 
     print(
-        'OK',
+        'OK' if not result.failures else 'DONE WITH FAILURES (rerun to retry)',
         {
             'start': start_date.isoformat(),
             'end': end_date.isoformat(),
-            'importedDays': imported_days,
-            'skippedDays': skipped_days,
-            'failedDays': failed_days,
-            'importedCount': imported_count,
+            **result.summary(),
         },
         flush=True,
     )
-    return 1 if failed_days else 0
+    return 1 if result.failures else 0
 
 
 if __name__ == '__main__':
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Cold-start benchmark: wall time of ``import <module>`` in fresh interpreters.
+
+Each run starts a new Python process with the network disabled through a
+socket guard (any connect attempt fails immediately), so the number reflects
+pure import cost and proves startup works offline.
+
+    python scripts/bench_import_time.py                 # import server, 5 runs
+    python scripts/bench_import_time.py --module cloud_worker --runs 3
+    python scripts/bench_import_time.py --max-seconds 1.0   # exit 1 if slower
+    python scripts/bench_import_time.py --top 15            # slowest modules (-X importtime)
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ("pandas", "yfinance", "bs4", "lxml", "selenium")
+
+PROBE = r"""
+import json, socket, sys, time
+
+def _offline(*args, **kwargs):
+    raise OSError("network disabled by bench_import_time")
+
+socket.socket.connect = _offline
+socket.create_connection = _offline
+started = time.perf_counter()
+__import__(sys.argv[1])
+elapsed = time.perf_counter() - started
+print(json.dumps({
+    "seconds": elapsed,
+    "heavy": [m for m in json.loads(sys.argv[2]) if m in sys.modules],
+}))
+"""
+
+
+def run_once(module: str) -> dict:
+    env = dict(os.environ, PYTHONPATH=ROOT, SYMBOL_MASTER_PRELOAD="0")
+    proc = subprocess.run(
+        [sys.executable, "-c", PROBE, module, json.dumps(HEAVY_MODULES)],
+        cwd=ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        timeout=120,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr[-2000:]}")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def top_modules(module: str, limit: int) -> list[tuple[int, str]]:
+    env = dict(os.environ, PYTHONPATH=ROOT, SYMBOL_MASTER_PRELOAD="0")
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        timeout=120,
+    )
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        parts = line.split("|")
+        try:
+            cumulative = int(parts[1].strip())
+        except ValueError:
+            continue
+        rows.append((cumulative, parts[2].rstrip()))
+    rows.sort(reverse=True)
+    return rows[:limit]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Measure cold import time of the server modules")
+    parser.add_argument("--module", default="server")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-seconds", type=float, default=None, help="Fail when the median exceeds this")
+    parser.add_argument("--top", type=int, default=0, help="Also list the N slowest imports")
+    args = parser.parse_args()
+
+    results = [run_once(args.module) for _ in range(max(1, args.runs))]
+    seconds = [r["seconds"] for r in results]
+    median = statistics.median(seconds)
+    print(f"import {args.module}: median {median:.3f}s  min {min(seconds):.3f}s  max {max(seconds):.3f}s  ({len(seconds)} runs, offline)")
+    heavy = results[-1]["heavy"]
+    print(f"heavy modules loaded at import: {', '.join(heavy) if heavy else 'none'}")
+
+    if args.top:
+        print("\nslowest imports (cumulative µs):")
+        for cumulative, name in top_modules(args.module, args.top):
+            print(f"  {cumulative:>9}  {name}")
+
+    if args.max_seconds is not None and median > args.max_seconds:
+        print(f"FAIL: median {median:.3f}s > {args.max_seconds:.3f}s")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
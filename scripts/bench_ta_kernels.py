@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Benchmark: list-based vs NumPy TA screening over a synthetic warrant universe.
+
+Builds ``--codes`` random OHLC series of up to ``--bars`` bars (the portal
+screen loads 80), then times ``evaluate_ta_signals`` per code against one
+``evaluate_ta_signals_matrix`` call (split into packing the bar dicts and the
+array kernels), and checks both return the same signals.
+
+    python scripts/bench_ta_kernels.py                     # 4000 codes × 80 bars
+    python scripts/bench_ta_kernels.py --codes 20000 --runs 3
+    python scripts/bench_ta_kernels.py --min-speedup 3      # exit 1 if slower
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from warrant_ta_screen import (  # noqa: E402
+    evaluate_packed_signals,
+    evaluate_ta_signals,
+    evaluate_ta_signals_matrix,
+    pack_bars,
+)
+
+
+def synthetic_universe(codes: int, bars: int, seed: int = 0) -> dict:
+    rng = random.Random(seed)
+    universe = {}
+    for i in range(codes):
+        n = rng.randint(max(1, bars // 2), bars)
+        price = 0.2 + rng.random() * 3
+        series = []
+        for _ in range(n):
+            price = max(0.01, price * (1 + rng.uniform(-0.1, 0.1)))
+            o = price * (1 + rng.uniform(-0.04, 0.04))
+            series.append({
+                'open': round(o, 2) if rng.random() > 0.05 else None,
+                'high': round(max(o, price) * 1.02, 2),
+                'low': round(min(o, price) * 0.98, 2),
+                'close': round(price, 2),
+            })
+        universe[f'{30000 + i:06d}'] = series
+    return universe
+
+
+def time_runs(fn, runs: int) -> float:
+    seconds = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn()
+        seconds.append(time.perf_counter() - started)
+    return statistics.median(seconds)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare list-based and NumPy TA kernels")
+    parser.add_argument("--codes", type=int, default=4000)
+    parser.add_argument("--bars", type=int, default=80)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--min-speedup", type=float, default=None, help="Fail when the speedup is below this")
+    args = parser.parse_args()
+
+    universe = synthetic_universe(args.codes, args.bars)
+    reference = {code: evaluate_ta_signals(bars) for code, bars in universe.items()}
+    if evaluate_ta_signals_matrix(universe) != reference:
+        print("FAIL: NumPy kernels disagree with the list-based reference")
+        sys.exit(1)
+
+    runs = max(1, args.runs)
+    list_s = time_runs(lambda: [evaluate_ta_signals(b) for b in universe.values()], runs)
+    numpy_s = time_runs(lambda: evaluate_ta_signals_matrix(universe), runs)
+    packed = pack_bars(universe)
+    pack_s = time_runs(lambda: pack_bars(universe), runs)
+    kernel_s = time_runs(lambda: evaluate_packed_signals(*packed), runs)
+    speedup = list_s / numpy_s if numpy_s else float('inf')
+    print(f"{args.codes} codes × ≤{args.bars} bars, median of {runs} runs")
+    print(f"  list reference : {list_s * 1000:8.1f} ms")
+    print(f"  numpy total    : {numpy_s * 1000:8.1f} ms")
+    print(f"    pack dicts   : {pack_s * 1000:8.1f} ms")
+    print(f"    kernels      : {kernel_s * 1000:8.1f} ms")
+    print(f"  speedup        : {speedup:8.1f}x (signals identical)")
+
+    if args.min_speedup is not None and speedup < args.min_speedup:
+        print(f"FAIL: speedup {speedup:.1f}x < {args.min_speedup:.1f}x")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,22 +6,19 @@ import time
 import json
 import csv
 import requests
-import pandas as pd
 import numpy as np
-import yfinance as yf
 from datetime import datetime, timedelta, date, timezone
 import logging
-from bs4 import BeautifulSoup
 import urllib3
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.by import By
-from selenium.common.exceptions import NoSuchElementException, TimeoutException
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
+from lazy_imports import lazy_module
+# pandas / yfinance / bs4 延遲到第一次使用才載入（Selenium 於月營收下載函式內匯入），
+# 讓 import server 與 cloud worker 冷啟動不必付這些套件的載入成本
+pd = lazy_module('pandas')
+yf = lazy_module('yfinance')
+bs4 = lazy_module('bs4')
 # 禁用 SSL 警告
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-from flask import Flask, jsonify, request, send_from_directory, send_file, Response, stream_with_context
+from flask import Blueprint, Flask, current_app, jsonify, request, send_from_directory, send_file, Response, stream_with_context
 from flask_cors import CORS
 import psycopg2
 from psycopg2 import sql
@@ -42,7 +39,7 @@ from concurrent.futures import ThreadPoolExecutor, as_completed
 import io
 import zipfile
 import tempfile
-from functools import partial
+from functools import lru_cache, partial
 from typing import Optional
 import argparse
 
@@ -81,6 +78,33 @@ from table_config import (
 )
 
 from returns_calc import compute_returns as compute_returns_task
+from symbol_master import DERIVATIVE_NAME_KEYWORDS, SymbolMaster
+import index_advisor
+import request_metrics
+import price_anomalies
+import anomaly_repair
+import db_sync_engine
+import replication_log
+import job_state
+import advisory_locks
+import price_validation
+import mi_index
+import warrant_ta_state
+import warrant_bar_cache
+import tpex_backfill
+import warrant_portal_stats
+import warrant_search
+import warrant_rankings
+import warrant_ohlc_enrichment
+import warrant_partitions
+from request_metrics import record_query as record_query_metrics
+from latest_bars import (
+    WARRANT_SOURCES as LATEST_WARRANT_MARKETS,
+    bootstrap as bootstrap_latest_bars,
+    ensure_latest_tables,
+    refresh_latest_stock_bars,
+    refresh_latest_warrant_bars,
+)
 from cloud_jobs_api import cloud_jobs_blueprint
 
 # 配置日誌
@@ -96,14 +120,27 @@ except Exception:
     pass
 
 DEFAULT_START_DATE = '2010-01-01'
+# 異常偵測改讀 price_anomalies 索引（設為 0 則維持每次 LAG() 全表掃描）
+PRICE_ANOMALY_INDEX_ENABLED = str(os.getenv('PRICE_ANOMALY_INDEX_ENABLED', '1')).strip().lower() not in ('0', 'false', 'no', 'off')
+# 索引未涵蓋的股票由背景補掃；每個目標庫最多每隔此秒數檢查一次
+PRICE_ANOMALY_RESCAN_CHECK_SECONDS = int(os.getenv('PRICE_ANOMALY_RESCAN_CHECK_SECONDS', '600'))
+# 本機 → Neon 變更複寫（replication_log 觸發器 + 背景 replicator）；預設關閉，僅本機主庫需要
+NEON_REPLICATION_ENABLED = str(os.getenv('NEON_REPLICATION_ENABLED', '0')).strip().lower() not in ('0', 'false', 'no', 'off')
+# 背景工作進度寫入 tw_job_state，讓多個 gunicorn worker / cloud worker 共享狀態
+JOB_STATE_SHARED = str(os.getenv('JOB_STATE_SHARED', '1')).strip().lower() not in ('0', 'false', 'no', 'off')
+# 權證技術篩選改讀 warrant_ta_state 預算旗標（設為 0 則每次請求重算近 80 根日線）
+WARRANT_TA_STATE_ENABLED = str(os.getenv('WARRANT_TA_STATE_ENABLED', '1')).strip().lower() not in ('0', 'false', 'no', 'off')
+WARRANT_TA_STATE_CHECK_SECONDS = int(os.getenv('WARRANT_TA_STATE_CHECK_SECONDS', '300'))
+# 首頁統計：行程內快取秒數；快取表超過 MAX_AGE 秒未刷新時（例如由外部腳本匯入）讀取時重算
+WARRANT_PORTAL_STATS_TTL = int(os.getenv('WARRANT_PORTAL_STATS_TTL', '60'))
+WARRANT_PORTAL_STATS_MAX_AGE = int(os.getenv('WARRANT_PORTAL_STATS_MAX_AGE', '3600'))
+# 權證日線歸檔：到期超過此天數的權證整段歷史搬到 *_archive 冷分區
+WARRANT_ARCHIVE_GRACE_DAYS = int(os.getenv('WARRANT_ARCHIVE_GRACE_DAYS', str(warrant_partitions.DEFAULT_GRACE_DAYS)))
 
 FMTQIK_URL = 'https://www.twse.com.tw/exchangeReport/FMTQIK'
 
-# 全局数据库表锁（防止并发修改表结构导致死锁）
-db_table_lock = threading.Lock()
-# 全局更新鎖，避免並行 /api/update 造成重複抓取
-update_lock = threading.Lock()
-db_sync_lock = threading.Lock()
+# 跨 process 的工作鎖（/api/update、損益表抓取、資料庫同步、建表）改用 PostgreSQL advisory lock，
+# 見 advisory_locks 與檔案中段的 lock_manager
 
 def _safe_div(n, d):
     try:
@@ -170,7 +207,16 @@ def _compute_ratios_record(row: dict) -> dict:
 current_dir = os.path.dirname(os.path.abspath(__file__))
 frontend_dir = os.path.join(current_dir, 'frontend')
 
-app = Flask(__name__, static_folder=frontend_dir, static_url_path='')
+# 各領域路由掛在 blueprint 上，由 create_app() 組成 WSGI app（見檔案末段）
+system_bp = Blueprint('system', __name__)
+prices_bp = Blueprint('prices', __name__)
+returns_bp = Blueprint('returns', __name__)
+market_bp = Blueprint('market', __name__)
+statements_bp = Blueprint('statements', __name__)
+warrants_bp = Blueprint('warrants', __name__)
+sync_bp = Blueprint('sync', __name__)
+DOMAIN_BLUEPRINTS = (system_bp, prices_bp, returns_bp, market_bp, statements_bp, warrants_bp, sync_bp)
+
 allowed_origins = [
     origin.strip()
     for origin in os.environ.get(
@@ -192,11 +238,13 @@ allowed_origins = [
     ).split(',')
     if origin.strip()
 ]
-CORS(app, resources={r"/api/*": {"origins": allowed_origins}})
-app.register_blueprint(cloud_jobs_blueprint)
+REQUEST_METRICS_ENABLED = str(os.getenv('REQUEST_METRICS_ENABLED', '1')).strip().lower() not in ('0', 'false', 'no', 'off')
+SSE_SHARED = str(os.getenv('SSE_SHARED', '1')).strip().lower() not in ('0', 'false', 'no', 'off')
 
-# SSE 事件佇列（推進度/警告到前端）
+# SSE 事件佇列（推進度/警告到前端）；多 worker 時由 sse_relay 經 NOTIFY 轉送到其他 process
 sse_queue = Queue()
+_sse_clients = 0
+_sse_clients_lock = threading.Lock()
 
 def push_sse(channel: str, event: str, message: str | None = None, **extra):
     try:
@@ -212,30 +260,45 @@ def push_sse(channel: str, event: str, message: str | None = None, **extra):
                     continue
                 payload[k] = v
         sse_queue.put(payload, timeout=0.1)
+        if SSE_SHARED:
+            sse_relay.publish(payload)
     except Exception:
         pass
 
 
-@app.route('/api/stream/logs', methods=['GET'])
+def _deliver_relayed_sse(payload):
+    """其他 process 的事件：本機有串流連線時才放進佇列，避免無人讀取時無限累積。"""
+    if _sse_clients:
+        sse_queue.put(payload, timeout=0.1)
+
+
+@system_bp.route('/api/stream/logs', methods=['GET'])
 def stream_logs():
     """Server-Sent Events: 推送後端進度/警告到前端。"""
     def event_stream():
+        global _sse_clients
         heartbeat_interval = 10
         last_heartbeat = time.time()
-        while True:
-            try:
-                item = sse_queue.get(timeout=1)
+        with _sse_clients_lock:
+            _sse_clients += 1
+        try:
+            while True:
                 try:
-                    payload = json.dumps(item, ensure_ascii=False)
-                except TypeError:
-                    payload = json.dumps({'channel': 'system', 'event': 'error', 'message': 'encode_failed'})
-                yield f"data: {payload}\n\n"
-            except Exception:
-                pass
-            now = time.time()
-            if now - last_heartbeat >= heartbeat_interval:
-                last_heartbeat = now
-                yield "data: {\"channel\":\"system\",\"event\":\"heartbeat\"}\n\n"
+                    item = sse_queue.get(timeout=1)
+                    try:
+                        payload = json.dumps(item, ensure_ascii=False)
+                    except TypeError:
+                        payload = json.dumps({'channel': 'system', 'event': 'error', 'message': 'encode_failed'})
+                    yield f"data: {payload}\n\n"
+                except Exception:
+                    pass
+                now = time.time()
+                if now - last_heartbeat >= heartbeat_interval:
+                    last_heartbeat = now
+                    yield "data: {\"channel\":\"system\",\"event\":\"heartbeat\"}\n\n"
+        finally:
+            with _sse_clients_lock:
+                _sse_clients -= 1
 
     headers = {
         'Content-Type': 'text/event-stream; charset=utf-8',
@@ -245,6 +308,23 @@ def stream_logs():
     }
     return Response(event_stream(), headers=headers)
 
+# 邏輯表名 → 環境表名；\b 保證不會誤改 tw_stock_prices_backup 之類的名稱
+_LOGICAL_TABLE_RE = re.compile(r'\b(tw_stock_prices|tw_stock_returns|tw_institutional_trades)\b')
+_ADAPT_CACHE_MAX_QUERY_LEN = 16384
+
+
+def _rewrite_table_names(query: str, mapping: tuple) -> str:
+    if not _LOGICAL_TABLE_RE.search(query):
+        return query
+    table = dict(mapping)
+    return _LOGICAL_TABLE_RE.sub(lambda m: table.get(m.group(1), m.group(1)), query)
+
+
+@lru_cache(maxsize=4096)
+def _rewrite_table_names_cached(query: str, mapping: tuple) -> str:
+    return _rewrite_table_names(query, mapping)
+
+
 class TableNameAwareCursor(RealDictCursor):
     """Cursor that automatically maps logical table names to environment-specific ones."""
 
@@ -259,27 +339,39 @@ class TableNameAwareCursor(RealDictCursor):
         self._table_prices = table_prices
         self._table_returns = table_returns
         self._table_institutional = table_institutional
+        # 只保留需要改寫的對應；預設環境下為空，execute 直接略過
+        self._table_mapping = tuple(
+            (logical, physical)
+            for logical, physical in (
+                ("tw_stock_prices", table_prices or "tw_stock_prices"),
+                ("tw_stock_returns", table_returns or "tw_stock_returns"),
+                ("tw_institutional_trades", table_institutional or "tw_institutional_trades"),
+            )
+            if logical != physical
+        )
         super().__init__(*args, **kwargs)
 
     def _adapt_query(self, query):
-        if not isinstance(query, str):
+        if not self._table_mapping or not isinstance(query, str):
             return query
-        prices = self._table_prices or "tw_stock_prices"
-        returns = self._table_returns or "tw_stock_returns"
-        institutional = self._table_institutional or "tw_institutional_trades"
-        if prices != "tw_stock_prices":
-            query = query.replace("tw_stock_prices", prices)
-        if returns != "tw_stock_returns":
-            query = query.replace("tw_stock_returns", returns)
-        if institutional != "tw_institutional_trades":
-            query = query.replace("tw_institutional_trades", institutional)
-        return query
+        # 動態拼接的大型查詢（內嵌代號清單等）幾乎不會重複，不進快取以免佔記憶體
+        if len(query) > _ADAPT_CACHE_MAX_QUERY_LEN:
+            return _rewrite_table_names(query, self._table_mapping)
+        return _rewrite_table_names_cached(query, self._table_mapping)
 
     def execute(self, query, vars=None):
-        return super().execute(self._adapt_query(query), vars)
+        started = time.perf_counter()
+        try:
+            return super().execute(self._adapt_query(query), vars)
+        finally:
+            record_query_metrics(time.perf_counter() - started, self.rowcount)
 
     def executemany(self, query, vars_list):
-        return super().executemany(self._adapt_query(query), vars_list)
+        started = time.perf_counter()
+        try:
+            return super().executemany(self._adapt_query(query), vars_list)
+        finally:
+            record_query_metrics(time.perf_counter() - started, self.rowcount)
 
     def mogrify(self, query, vars=None):
         return super().mogrify(self._adapt_query(query), vars)
@@ -533,19 +625,31 @@ class DatabaseManager:
         except Exception as e:
             return False, f"連接測試失敗: {e}"
     
+    @property
+    def lock_target(self) -> str:
+        """advisory lock 所在的資料庫（鎖取在目標庫內，同庫的所有 process 互斥）。"""
+        return 'neon' if self.is_neon else 'local'
+
     def create_tables(self):
         """创建股票数据表（带锁保护）"""
         if self._tables_ready:
             return True
-        # 获取表锁，防止并发修改表结构
-        acquired = db_table_lock.acquire(timeout=30)
+        if self.connection is None:
+            if not self.connect():
+                return False
+        # 以交易層級 advisory lock 序列化建表（跨 worker / process，commit 或 rollback 時自動釋放）
+        try:
+            acquired = advisory_locks.try_xact_lock(
+                self.connection.cursor(), 'schema', self.lock_target, timeout=30
+            )
+        except Exception as e:
+            logger.warning(f"取得建表鎖失敗: {e}")
+            acquired = False
         if not acquired:
             logger.warning("获取表锁超时，跳过表检查")
             # 即使略過建表，也要確保 prices 的 unique index 存在，否則 ON CONFLICT 會直接報錯
             try:
-                if self.connection is None:
-                    if not self.connect():
-                        return False
+                self.connection.rollback()
                 self.ensure_prices_unique()
             except Exception:
                 pass
@@ -589,6 +693,8 @@ class DatabaseManager:
 
             # 確保 (symbol, date) unique index 存在（並自動處理重複）
             self.ensure_prices_unique()
+            # 價格／報酬率改寫時 updated_at 跟著更新，資料庫同步以它為增量水位（見 db_sync_engine）
+            db_sync_engine.ensure_change_marker(cursor, self.table_prices)
 
             # 創建報酬率數據表
             cursor.execute(
@@ -612,6 +718,7 @@ class DatabaseManager:
                 ON {self.table_returns}(symbol, date);
                 """
             )
+            db_sync_engine.ensure_change_marker(cursor, self.table_returns)
 
             # 為現有表添加新欄位（如果不存在）
             try:
@@ -1047,10 +1154,22 @@ class DatabaseManager:
                     )
                 except Exception as e:
                     logger.warning("cash flow table add column %s warning: %s", col, e)
+
+            # 最新一根 K 棒快照（股票／權證）
+            ensure_latest_tables(cursor)
+            # 快照首次建置以標記列記錄完成（不以空表判斷，先到的匯入不會讓快照永遠不完整）
+            bootstrap_latest_bars(cursor, prices_table=self.table_prices)
+            price_anomalies.ensure_anomaly_tables(cursor)
+            # 權證日線：已分區時預建未來月份分區；到期權證歸檔表
+            warrant_partitions.ensure_upcoming(cursor, _taipei_today())
+            warrant_partitions.ensure_archive_tables(cursor)
+            if NEON_REPLICATION_ENABLED and not self.is_neon:
+                replication_log.install_triggers(cursor, replication_log.default_table_map())
             
             self.connection.commit()
             cursor.close()
             self._tables_ready = True
+            _schedule_price_anomaly_rescan(self)
             logger.info("资料库表创建成功")
             return True
         except Exception as e:
@@ -1061,10 +1180,45 @@ class DatabaseManager:
             except Exception:
                 pass
             return False
-        finally:
-            # 确保释放锁
-            db_table_lock.release()
-            logger.debug("表锁已释放")
+
+def _symbol_master_connection():
+    db = DatabaseManager()
+    if not db.connect():
+        raise RuntimeError('資料庫連接失敗')
+    return db.connection
+
+
+def _lock_connection(target):
+    db = DatabaseManager(use_local=(target == 'local'))
+    if not db.connect():
+        raise RuntimeError('資料庫連接失敗')
+    return db.connection
+
+
+try:
+    _job_lock_lease = float(os.getenv('JOB_LOCK_LEASE_SECONDS', '120'))
+except ValueError:
+    _job_lock_lease = 120.0
+
+lock_manager = advisory_locks.LockManager(_lock_connection, lease=_job_lock_lease)
+
+
+def _job_lock(family, db_manager=None):
+    """工作族群 + 目標資料庫的跨 process 鎖。"""
+    target = (db_manager or DatabaseManager()).lock_target
+    return lock_manager.get(family, target)
+
+
+job_state_store = job_state.JobStateStore(_symbol_master_connection)
+sse_relay = job_state.EventRelay(_symbol_master_connection, _deliver_relayed_sse)
+
+
+def _job_status_view(name):
+    """跨 process 的工作狀態；關閉共享時直接回傳本機 dict。"""
+    if JOB_STATE_SHARED:
+        return job_state_store.view(name)
+    return dict(globals().get(name) or {})
+
 
 class StockAPI:
     TWSE_T86_URL = "https://www.twse.com.tw/fund/T86"
@@ -1073,15 +1227,43 @@ class StockAPI:
     TPEX_MARGIN_URL = "https://www.tpex.org.tw/web/stock/margin_trading/margin_balance/margin_bal_result.php"
 
     def __init__(self):
-        self.symbols_cache = None
-        self.cache_time = None
+        # 股票清單以 tw_stock_symbols 為準，交易所清單僅由背景執行緒差異更新
+        self.symbol_master = SymbolMaster(
+            _symbol_master_connection,
+            listing_fetcher=self.fetch_exchange_listing,
+            refresh_interval=float(os.getenv('SYMBOL_MASTER_REFRESH_SECONDS', str(6 * 3600))),
+        )
         self.db_manager = DatabaseManager()
         self.max_workers = 10  # 並行抓取的最大線程數
         self.bwibbu_cache = None
         self.bwibbu_cache_time = None
         self.bwibbu_cache_ttl = 900  # 預設 15 分鐘快取
-        self.twse_session = requests.Session()
-        self.twse_session.headers.update({
+        self._session_lock = threading.Lock()
+        self._twse_session = None
+        self._tpex_session = None
+
+    @property
+    def twse_session(self):
+        """TWSE session；第一次使用時才預熱 historical 頁面取得 cookie。"""
+        if self._twse_session is None:
+            with self._session_lock:
+                if self._twse_session is None:
+                    self._twse_session = self._build_twse_session()
+        return self._twse_session
+
+    @property
+    def tpex_session(self):
+        """TPEX session（上櫃 BWIBBU 指標）；第一次使用時才預熱。"""
+        if self._tpex_session is None:
+            with self._session_lock:
+                if self._tpex_session is None:
+                    self._tpex_session = self._build_tpex_session()
+        return self._tpex_session
+
+    @staticmethod
+    def _build_twse_session():
+        session = requests.Session()
+        session.headers.update({
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36',
             'Accept': 'application/json, text/javascript, */*; q=0.01',
             'Accept-Language': 'zh-TW,zh;q=0.9',
@@ -1091,21 +1273,25 @@ class StockAPI:
         })
         try:
             # 預熱 historical 頁面以取得必要 cookie
-            self.twse_session.get('https://www.twse.com.tw/zh/trading/historical/bwibbu-day.html', timeout=10)
+            session.get('https://www.twse.com.tw/zh/trading/historical/bwibbu-day.html', timeout=10)
         except Exception as exc:
             logger.warning(f"初始化 TWSE session 失敗: {exc}")
-        # TPEX session for 上櫃 BWIBBU 指標
-        self.tpex_session = requests.Session()
-        self.tpex_session.headers.update({
+        return session
+
+    @staticmethod
+    def _build_tpex_session():
+        session = requests.Session()
+        session.headers.update({
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
             'Accept': 'application/json,text/html',
             'Referer': 'https://www.tpex.org.tw'
         })
         try:
             # 預熱 TPEX 相關頁面
-            self.tpex_session.get('https://www.tpex.org.tw/web/stock/3insti/daily_trade/3itrade_hedge.php', timeout=10)
+            session.get('https://www.tpex.org.tw/web/stock/3insti/daily_trade/3itrade_hedge.php', timeout=10)
         except Exception as exc:
             logger.warning(f"初始化 TPEX session 失敗: {exc}")
+        return session
 
     @staticmethod
     def _ensure_date(target_date):
@@ -1189,7 +1375,7 @@ class StockAPI:
         except Exception:
             return None
         
-    def fetch_twse_symbols(self):
+    def fetch_twse_symbols(self, fallback: bool = True):
         """抓取台灣上市公司股票代碼"""
         try:
             url = 'https://isin.twse.com.tw/isin/C_public.jsp?strMode=2'
@@ -1199,7 +1385,7 @@ class StockAPI:
             }
             response = requests.get(url, timeout=10, verify=False, headers=headers)
             response.encoding = 'big5'
-            soup = BeautifulSoup(response.text, 'html.parser')
+            soup = bs4.BeautifulSoup(response.text, 'html.parser')
             
             table = soup.find('table', {'class': 'h4'})
             if not table:
@@ -1226,10 +1412,12 @@ class StockAPI:
             return symbols
         except Exception as e:
             logger.error(f"抓取上市股票失敗: {e}")
+            if not fallback:
+                raise
             # 返回備用的熱門上市股票清單
             return self.get_backup_twse_symbols()
 
-    def fetch_otc_symbols(self):
+    def fetch_otc_symbols(self, fallback: bool = True):
         """抓取台灣櫃檯買賣中心股票代碼"""
         try:
             url = 'https://isin.twse.com.tw/isin/C_public.jsp?strMode=4'
@@ -1238,7 +1426,7 @@ class StockAPI:
             }
             response = requests.get(url, timeout=10, verify=False, headers=headers)
             response.encoding = 'big5'
-            soup = BeautifulSoup(response.text, 'html.parser')
+            soup = bs4.BeautifulSoup(response.text, 'html.parser')
             
             table = soup.find('table', {'class': 'h4'})
             if not table:
@@ -1265,6 +1453,8 @@ class StockAPI:
             return symbols
         except Exception as e:
             logger.error(f"抓取櫃檯股票失敗: {e}")
+            if not fallback:
+                raise
             # 返回備用的熱門櫃檯股票清單
             return self.get_backup_otc_symbols()
     
@@ -1386,29 +1576,36 @@ class StockAPI:
         logger.info(f"添加 {len(indices)} 個市場指數/ETF")
         return indices
 
+    def fetch_exchange_listing(self):
+        """抓取交易所完整上市/上櫃清單（供 symbol master 背景差異更新，失敗時拋出例外）"""
+        twse_symbols = self.fetch_twse_symbols(fallback=False)
+        otc_symbols = self.fetch_otc_symbols(fallback=False)
+        if not twse_symbols or not otc_symbols:
+            raise RuntimeError('交易所股票清單為空')
+        return [
+            symbol for symbol in twse_symbols + otc_symbols
+            if not any(keyword in symbol['name'] for keyword in DERIVATIVE_NAME_KEYWORDS)
+        ]
+
     def get_all_symbols(self, force_refresh=False):
-        """獲取所有台灣股票代碼"""
-        # 檢查快取
-        if not force_refresh and self.symbols_cache and self.cache_time:
-            if time.time() - self.cache_time < 3600:  # 1小時快取
-                return self.symbols_cache
-        
-        # 抓取新數據
-        twse_symbols = self.fetch_twse_symbols()
-        otc_symbols = self.fetch_otc_symbols()
-        market_indices = self.get_market_indices()
-        all_symbols = twse_symbols + otc_symbols + market_indices
-        
+        """獲取所有台灣股票代碼（讀取 symbol master，不同步等待交易所清單）"""
+        master = self.symbol_master
+        master.ensure_loaded()
+        if force_refresh:
+            master.refresh_async()
+
+        listed = master.symbols()
+        if not listed:
+            # 資料表尚未建立或為空：先回傳備用清單，背景更新完成後即改用完整清單
+            listed = self.get_backup_twse_symbols() + self.get_backup_otc_symbols()
+        all_symbols = listed + self.get_market_indices()
+
         # 過濾掉權證等衍生商品
         filtered_symbols = []
         for symbol in all_symbols:
-            if not any(keyword in symbol['name'] for keyword in ['購', '牛熊證', '權證']):
+            if not any(keyword in symbol['name'] for keyword in DERIVATIVE_NAME_KEYWORDS):
                 filtered_symbols.append(symbol)
-        
-        # 更新快取
-        self.symbols_cache = filtered_symbols
-        self.cache_time = time.time()
-        
+
         logger.info(f"總共取得 {len(filtered_symbols)} 檔股票")
         return filtered_symbols
 
@@ -1537,128 +1734,32 @@ class StockAPI:
             target_date: datetime 對象或 'YYYY-MM-DD' 字串
         Returns:
             dict: {stock_code: {date, open, high, low, close, volume}, ...}
+
+        與權證匯入共用同一份 MI_INDEX 快照（mi_index.fetch_snapshot），同一日期只下載一次。
         """
         try:
             if isinstance(target_date, str):
                 target_dt = datetime.strptime(target_date, '%Y-%m-%d')
             else:
                 target_dt = target_date
-            
-            # 使用證交所的每日收盤行情 API
-            url = "https://www.twse.com.tw/exchangeReport/MI_INDEX"
-            params = {
-                'response': 'json',
-                'date': target_dt.strftime('%Y%m%d'),
-                'type': 'ALLBUT0999'  # 全部（除了指數）
-            }
-            
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-            }
-            
-            response = requests.get(url, params=params, headers=headers, timeout=15, verify=False)
-            
-            if response.status_code != 200:
-                logger.warning(f"批量抓取 {target_dt.strftime('%Y-%m-%d')} 失敗: HTTP {response.status_code}")
-                return {}
-            
-            data = response.json()
-            
-            if data.get('stat') != 'OK':
-                logger.warning(f"批量抓取 {target_dt.strftime('%Y-%m-%d')} 回傳非 OK: {data.get('stat')}")
+            trade_day = target_dt.date() if isinstance(target_dt, datetime) else target_dt
+
+            snapshot = _fetch_twse_daily_snapshot(trade_day)
+            if snapshot is None:
+                logger.warning(f"批量抓取 {trade_day.strftime('%Y-%m-%d')} 無資料（非交易日或尚未公布）")
                 return {}
-            
+            candidates = snapshot.stock_records()
+
+            # 整日一次驗證（close>0、volume>0、< 30000 等規則）
             result = {}
-            
-            # 解析 data9 (個股日成交資訊) - 新版格式
-            if 'data9' in data and data['data9']:
-                for row in data['data9']:
-                    try:
-                        if len(row) < 9:
-                            continue
-                        
-                        stock_code = row[0].strip()
-                        if not stock_code or not stock_code.isdigit():
-                            continue
-                        
-                        # 解析價格和成交量
-                        close_str = row[8].replace(',', '').strip()
-                        open_str = row[5].replace(',', '').strip()
-                        high_str = row[6].replace(',', '').strip()
-                        low_str = row[7].replace(',', '').strip()
-                        volume_str = row[2].replace(',', '').strip()
-                        
-                        if close_str in ['--', '---', ''] or volume_str in ['--', '0', '']:
-                            continue
-                        
-                        close_price = float(close_str)
-                        volume = int(volume_str)
-                        
-                        if close_price <= 0 or volume <= 0 or close_price >= 30000:
-                            continue
-                        
-                        result[stock_code] = {
-                            'ticker': f"{stock_code}.TW",
-                            'Date': target_dt.strftime('%Y-%m-%d'),
-                            'Open': float(open_str) if open_str not in ['--', '---', ''] else None,
-                            'High': float(high_str) if high_str not in ['--', '---', ''] else None,
-                            'Low': float(low_str) if low_str not in ['--', '---', ''] else None,
-                            'Close': round(close_price, 2),
-                            'Volume': volume
-                        }
-                    except (ValueError, IndexError) as e:
-                        continue
-            
-            # 如果 data9 不存在，嘗試解析 tables 格式 (舊版格式，如 2010 年)
-            elif 'tables' in data and data['tables']:
-                for table in data['tables']:
-                    # 尋找每日收盤行情的表格
-                    if 'title' in table and '每日收盤行情' in table['title'] and 'data' in table:
-                        for row in table['data']:
-                            try:
-                                if len(row) < 9:
-                                    continue
-                                
-                                stock_code = row[0].strip()
-                                if not stock_code or not stock_code.isdigit():
-                                    continue
-                                
-                                # 解析價格和成交量 (舊格式欄位順序相同)
-                                close_str = row[8].replace(',', '').strip()
-                                open_str = row[5].replace(',', '').strip()
-                                high_str = row[6].replace(',', '').strip()
-                                low_str = row[7].replace(',', '').strip()
-                                volume_str = row[2].replace(',', '').strip()
-                                
-                                # 移除 HTML 標籤 (舊格式可能包含 <p> 標籤)
-                                import re
-                                close_str = re.sub(r'<[^>]+>', '', close_str)
-                                open_str = re.sub(r'<[^>]+>', '', open_str)
-                                high_str = re.sub(r'<[^>]+>', '', high_str)
-                                low_str = re.sub(r'<[^>]+>', '', low_str)
-                                
-                                if close_str in ['--', '---', ''] or volume_str in ['--', '0', '']:
-                                    continue
-                                
-                                close_price = float(close_str)
-                                volume = int(volume_str)
-                                
-                                if close_price <= 0 or volume <= 0 or close_price >= 30000:
-                                    continue
-                                
-                                result[stock_code] = {
-                                    'ticker': f"{stock_code}.TW",
-                                    'Date': target_dt.strftime('%Y-%m-%d'),
-                                    'Open': float(open_str) if open_str not in ['--', '---', ''] else None,
-                                    'High': float(high_str) if high_str not in ['--', '---', ''] else None,
-                                    'Low': float(low_str) if low_str not in ['--', '---', ''] else None,
-                                    'Close': round(close_price, 2),
-                                    'Volume': volume
-                                }
-                            except (ValueError, IndexError) as e:
-                                continue
-                        break  # 找到目標表格後跳出迴圈
-            
+            checked = price_validation.validate_records(candidates, price_validation.SNAPSHOT_RULES)
+            for rec, ok in zip(candidates, checked.accept):
+                if not ok:
+                    continue
+                rec['Close'] = round(rec['Close'], 2)
+                rec['Volume'] = int(rec['Volume'])
+                result[rec['ticker'].split('.')[0]] = rec
+
             logger.debug(f"批量抓取 {target_dt.strftime('%Y-%m-%d')} 成功，共 {len(result)} 檔股票")
             return result
             
@@ -1751,7 +1852,13 @@ class StockAPI:
                 logger.warning(f"TPEX 批量抓取 {target_dt.strftime('%Y-%m-%d')} 回傳非 ok: {data.get('stat')}")
                 return {}
 
-            result = {}
+            invalid = {'----', '---', '--', '', 'NaN', 'null', 'None'}
+
+            def _num(text):
+                text = str(text).replace(',', '').strip()
+                return None if text in invalid else float(text)
+
+            candidates = []
             tables = data.get('tables') or []
             for table in tables:
                 rows = table.get('data') if isinstance(table, dict) else None
@@ -1767,33 +1874,27 @@ class StockAPI:
                         if not stock_code or not stock_code.isdigit():
                             continue
 
-                        close_str = str(row[2]).replace(',', '').strip()
-                        open_str = str(row[4]).replace(',', '').strip()
-                        high_str = str(row[5]).replace(',', '').strip()
-                        low_str = str(row[6]).replace(',', '').strip()
-                        volume_str = str(row[7]).replace(',', '').strip()
-
-                        invalid = {'----', '---', '--', '', '0', 'NaN', 'null', 'None'}
-                        if close_str in invalid or volume_str in invalid:
-                            continue
-
-                        close_price = float(close_str)
-                        volume = int(float(volume_str))
-                        if close_price <= 0 or volume <= 0 or close_price >= 30000:
-                            continue
-
-                        result[stock_code] = {
+                        candidates.append({
                             'ticker': f"{stock_code}.TWO",
                             'Date': target_dt.strftime('%Y-%m-%d'),
-                            'Open': float(open_str) if open_str not in invalid else None,
-                            'High': float(high_str) if high_str not in invalid else None,
-                            'Low': float(low_str) if low_str not in invalid else None,
-                            'Close': round(close_price, 2),
-                            'Volume': volume
-                        }
+                            'Open': _num(row[4]) or None,
+                            'High': _num(row[5]) or None,
+                            'Low': _num(row[6]) or None,
+                            'Close': _num(row[2]),
+                            'Volume': _num(row[7]),
+                        })
                     except Exception:
                         continue
 
+            result = {}
+            checked = price_validation.validate_records(candidates, price_validation.SNAPSHOT_RULES)
+            for rec, ok in zip(candidates, checked.accept):
+                if not ok:
+                    continue
+                rec['Close'] = round(rec['Close'], 2)
+                rec['Volume'] = int(rec['Volume'])
+                result[rec['ticker'].split('.')[0]] = rec
+
             logger.debug(f"TPEX 批量抓取 {target_dt.strftime('%Y-%m-%d')} 成功，共 {len(result)} 檔股票")
             return result
         except Exception as e:
@@ -2446,7 +2547,7 @@ class StockAPI:
         )
         return results
 
-    def fetch_t86_range(self, start_date, end_date, market: str = 'both', sleep_seconds: float = 0.6):
+    def fetch_t86_range(self, start_date, end_date, market: str = 'both', sleep_seconds: float = 0.6, progress_callback=None):
         start_dt = self._ensure_date(start_date)
         end_dt = self._ensure_date(end_date)
         if start_dt > end_dt:
@@ -2463,6 +2564,7 @@ class StockAPI:
         total_twse = 0
         total_tpex = 0
 
+        total_days = (end_dt - start_dt).days + 1
         current = start_dt
         while current <= end_dt:
             day_records = []
@@ -2496,6 +2598,8 @@ class StockAPI:
                 'tpex_count': tpex_count,
                 'total_count': twse_count + tpex_count,
             })
+            if progress_callback is not None:
+                progress_callback(len(daily_stats), total_days, current.isoformat())
 
             total_twse += twse_count
             total_tpex += tpex_count
@@ -3085,7 +3189,7 @@ class StockAPI:
         logger.info(f"TPEX margin_balance {dt} 抓取 {len(results)} 筆")
         return results
 
-    def fetch_margin_range(self, start_date, end_date, market: str = 'both', sleep_seconds: float = 0.6):
+    def fetch_margin_range(self, start_date, end_date, market: str = 'both', sleep_seconds: float = 0.6, progress_callback=None):
         """抓取融資融券區間資料，支援 TWSE / TPEX / both。"""
         start_dt = self._ensure_date(start_date)
         end_dt = self._ensure_date(end_date)
@@ -3103,6 +3207,7 @@ class StockAPI:
         total_twse = 0
         total_tpex = 0
 
+        total_days = (end_dt - start_dt).days + 1
         current = start_dt
         while current <= end_dt:
             day_records: list[dict] = []
@@ -3136,6 +3241,8 @@ class StockAPI:
                 'tpex_count': tpex_count,
                 'total_count': twse_count + tpex_count,
             })
+            if progress_callback is not None:
+                progress_callback(len(daily_stats), total_days, current.isoformat())
 
             total_twse += twse_count
             total_tpex += tpex_count
@@ -3867,6 +3974,12 @@ class StockAPI:
                 for mk in market_set:
                     tasks.append((mk, y_tw, m))
 
+        from selenium import webdriver
+        from selenium.webdriver.chrome.options import Options
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support import expected_conditions as EC
+        from selenium.webdriver.support.ui import WebDriverWait
+
         chrome_options = Options()
         prefs = {
             "download.default_directory": download_dir,
@@ -4340,24 +4453,15 @@ class StockAPI:
                                         low_price = float(row[5].replace(',', '')) if row[5] != '--' else None
                                         close_price = float(row[6].replace(',', '')) if row[6] != '--' else None
                                         
-                                        # 驗證所有價格都小於30000
-                                        if (close_price is not None and close_price > 0 and
-                                            (open_price is None or open_price < 30000) and 
-                                            (high_price is None or high_price < 30000) and 
-                                            (low_price is None or low_price < 30000) and 
-                                            close_price < 30000):
-                                            result.append({
-                                                'ticker': f"{stock_code}.TW",
-                                                'Date': trade_date.strftime('%Y-%m-%d'),
-                                                'Open': round(open_price, 2) if open_price is not None else None,
-                                                'High': round(high_price, 2) if high_price is not None else None,
-                                                'Low': round(low_price, 2) if low_price is not None else None,
-                                                'Close': round(close_price, 2),
-                                                'Volume': volume
-                                            })
-                                        else:
-                                            logger.warning(f"價格超過30000，跳過 {trade_date.strftime('%Y-%m-%d')}: "
-                                                          f"O:{open_price}, H:{high_price}, L:{low_price}, C:{close_price}")
+                                        result.append({
+                                            'ticker': f"{stock_code}.TW",
+                                            'Date': trade_date.strftime('%Y-%m-%d'),
+                                            'Open': round(open_price, 2) if open_price is not None else None,
+                                            'High': round(high_price, 2) if high_price is not None else None,
+                                            'Low': round(low_price, 2) if low_price is not None else None,
+                                            'Close': round(close_price, 2) if close_price is not None else None,
+                                            'Volume': volume
+                                        })
                             except (ValueError, IndexError) as e:
                                 logger.warning(f"解析數據行失敗: {row}, 錯誤: {e}")
                                 continue
@@ -4370,8 +4474,17 @@ class StockAPI:
                 
                 time.sleep(1.5)  # 增加延遲避免請求過於頻繁
             
-            # 按日期排序
+            # 按日期排序後整批驗證（close>0、價格 < 30000；其餘規則僅記錄）
             result.sort(key=lambda x: x['Date'])
+            checked = price_validation.validate_records(
+                result, price_validation.HISTORY_RULES, sequential=True
+            )
+            result, rejected = price_validation.split_records(result, checked)
+            for rec, reason in rejected:
+                logger.warning(
+                    f"{stock_code} {rec['Date']} 驗證未通過（{reason}），跳過: "
+                    f"O:{rec['Open']}, H:{rec['High']}, L:{rec['Low']}, C:{rec['Close']}"
+                )
             return result
             
         except Exception as e:
@@ -4381,11 +4494,11 @@ class StockAPI:
     def is_otc_stock(self, stock_code):
         """判斷是否為上櫃股票"""
         try:
-            # 先查詢我們的股票清單來確定市場
-            if hasattr(self, 'symbols_cache') and self.symbols_cache:
-                for stock in self.symbols_cache:
-                    if stock['symbol'] == stock_code or stock['symbol'].startswith(stock_code + '.'):
-                        return stock.get('market') == '上櫃'
+            # 先查詢 symbol master 索引來確定市場（O(1)）
+            self.symbol_master.ensure_loaded()
+            known = self.symbol_master.is_otc(stock_code)
+            if known is not None:
+                return known
             
             # 如果快取中找不到，使用已知的上櫃股票代碼範圍和特定股票
             code_num = int(stock_code)
@@ -4892,28 +5005,24 @@ class StockAPI:
 # 初始化 API 實例
 stock_api = StockAPI()
 
-# 註冊 BWIBBU Blueprint（統一於本服務下提供 /api/bwibbu/*）
-try:
-    from bwibbu_blueprint import create_bwibbu_blueprint
-    app.register_blueprint(create_bwibbu_blueprint(DatabaseManager, stock_api))
-    logger.info("BWIBBU Blueprint 已註冊於 /api/bwibbu")
-except Exception as e:
-    logger.warning(f"BWIBBU Blueprint 註冊失敗: {e}")
+if os.getenv('SYMBOL_MASTER_PRELOAD', '1').strip().lower() not in ('0', 'false', 'no', 'off'):
+    # 啟動時於背景載入 symbol master，避免第一個請求承擔載入成本
+    threading.Thread(target=stock_api.symbol_master.ensure_loaded, name='symbol-master-load', daemon=True).start()
 
 # 主頁路由 - 提供前端 UI
-@app.route('/')
+@system_bp.route('/')
 def index():
     """提供主頁面"""
     return send_file(os.path.join(frontend_dir, 'index.html'))
 
-@app.route('/<path:filename>')
+@system_bp.route('/<path:filename>')
 def static_files(filename):
     """提供靜態文件"""
     return send_from_directory(frontend_dir, filename)
 
 # API 路由定義
 
-@app.route('/api/twse/bwibbu', methods=['GET'])
+@market_bp.route('/api/twse/bwibbu', methods=['GET'])
 def get_twse_bwibbu_all():
     """從資料庫讀取 BWIBBU 指標。
     Query:
@@ -5028,7 +5137,7 @@ def get_twse_bwibbu_all():
         return jsonify({'success': False, 'error': str(exc)}), 500
 
 
-@app.get('/api/financial-ratios')
+@statements_bp.get('/api/financial-ratios')
 def api_financial_ratios():
     year = request.args.get('year')
     season = request.args.get('season')
@@ -5299,18 +5408,18 @@ def api_financial_ratios():
             pass
 
 
-@app.get('/api/financial-ratios/status')
+@statements_bp.get('/api/financial-ratios/status')
 def api_financial_ratios_status():
     """Return current progress status of financial-ratios computation."""
 
     try:
-        return jsonify({'success': True, 'status': financial_ratios_status})
+        return jsonify({'success': True, 'status': _job_status_view('financial_ratios_status')})
     except Exception as e:
         logger.error(f"financial-ratios status error: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-@app.route('/api/twse/bwibbu/refresh_range', methods=['POST'])
+@market_bp.route('/api/twse/bwibbu/refresh_range', methods=['POST'])
 def refresh_twse_bwibbu_range():
     """批次刷新指定日期區間的 BWIBBU 指標（使用 BWIBBU_d）。
     JSON body: { start: 'YYYY-MM-DD', end: 'YYYY-MM-DD', use_local_db?: bool }
@@ -5375,7 +5484,7 @@ def refresh_twse_bwibbu_range():
         return jsonify({'success': False, 'error': str(exc)}), 500
 
 
-@app.route('/api/twse/bwibbu/refresh', methods=['POST'])
+@market_bp.route('/api/twse/bwibbu/refresh', methods=['POST'])
 def refresh_twse_bwibbu():
     """手動刷新並儲存 BWIBBU_ALL 指標資料。Body: {force_refresh, fetch_only}"""
     try:
@@ -5474,10 +5583,139 @@ def _upsert_prices(cursor, symbol, price_records, prices_table: str = None):
             volume = EXCLUDED.volume
     """
     execute_values(cursor, upsert_sql, values, page_size=500)
+    refresh_latest_stock_bars(cursor, [symbol], prices_table=prices_table)
+    price_anomalies.update_price_anomalies(
+        cursor, [symbol], min(v[1] for v in values), prices_table=prices_table
+    )
     logger.info(f"_upsert_prices: 成功寫入 {symbol} 的 {len(values)} 筆資料")
     return len(values)
 
-@app.route('/api/prices/twii/import_yf', methods=['POST'])
+
+def _refresh_latest_stock_bars_safely(db_manager, symbols) -> int:
+    """批次寫入後更新 latest_stock_bars；失敗僅記錄警告，不影響主流程。"""
+    if not symbols:
+        return 0
+    try:
+        if db_manager.connection is None or getattr(db_manager.connection, 'closed', 1) != 0:
+            if not db_manager.connect():
+                return 0
+        cur = db_manager.connection.cursor()
+        try:
+            refreshed = refresh_latest_stock_bars(cur, symbols, prices_table=db_manager.table_prices)
+            db_manager.connection.commit()
+            return refreshed
+        finally:
+            cur.close()
+    except Exception as exc:
+        logger.warning(f"更新 latest_stock_bars 失敗: {exc}")
+        try:
+            db_manager.connection.rollback()
+        except Exception:
+            pass
+        return 0
+
+def _refresh_price_anomalies_safely(db_manager, symbols, since=None) -> int:
+    """批次寫入後增量更新 price_anomalies；失敗僅記錄警告，不影響主流程。"""
+    if not symbols:
+        return 0
+    try:
+        if db_manager.connection is None or getattr(db_manager.connection, 'closed', 1) != 0:
+            if not db_manager.connect():
+                return 0
+        cur = db_manager.connection.cursor()
+        try:
+            updated = price_anomalies.update_price_anomalies(
+                cur, symbols, since, prices_table=db_manager.table_prices
+            )
+            db_manager.connection.commit()
+            return updated
+        finally:
+            cur.close()
+    except Exception as exc:
+        logger.warning(f"更新 price_anomalies 失敗: {exc}")
+        try:
+            db_manager.connection.rollback()
+        except Exception:
+            pass
+        return 0
+
+@prices_bp.route('/api/prices/twse/daily-snapshot', methods=['POST'])
+def ingest_twse_daily_snapshot_api():
+    """以 MI_INDEX 每日快照一次寫入上市股價與權證成交（每日一次下載、一個交易）。
+
+    JSON body:
+      - date: YYYY-MM-DD，或 start/end 區間（略過週末與非交易日）
+      - stocks / warrants: 是否寫入 tw_stock_prices / tw_warrant_trade（預設皆 true）
+      - sleep: 區間模式每日間隔秒數（預設 2.5）
+      - use_local_db: 使用本地資料庫（預設 false）
+    """
+    denied = _require_quantgems_admin()
+    if denied is not None:
+        return denied
+    body = request.get_json(silent=True) or {}
+    try:
+        start = body.get('start') or body.get('date')
+        end = body.get('end') or start
+        if not start:
+            return jsonify({'success': False, 'error': '需要 date 或 start/end 參數'}), 400
+        start_d = datetime.strptime(str(start), '%Y-%m-%d').date()
+        end_d = datetime.strptime(str(end), '%Y-%m-%d').date()
+    except ValueError:
+        return jsonify({'success': False, 'error': '日期格式錯誤，需 YYYY-MM-DD'}), 400
+    if end_d < start_d:
+        start_d, end_d = end_d, start_d
+    write_stocks = bool(body.get('stocks', True))
+    write_warrants = bool(body.get('warrants', True))
+    try:
+        sleep_sec = max(0.0, float(body.get('sleep', 2.5)))
+    except (TypeError, ValueError):
+        sleep_sec = 2.5
+
+    db_manager = DatabaseManager.from_request_payload(body)
+    if not db_manager.connect():
+        return jsonify({'success': False, 'error': '資料庫連接失敗'}), 500
+    days = []
+    errors = []
+    try:
+        db_manager.create_tables()
+        cursor = db_manager.connection.cursor()
+        current = start_d
+        fetched = False
+        while current <= end_d:
+            if current.weekday() < 5:
+                if fetched:
+                    time.sleep(sleep_sec)
+                fetched = True
+                try:
+                    snapshot = _fetch_twse_daily_snapshot(current)
+                    if snapshot is not None and snapshot.quotes:
+                        days.append(ingest_twse_daily_snapshot(
+                            cursor,
+                            snapshot,
+                            prices_table=db_manager.table_prices,
+                            stocks=write_stocks,
+                            warrants=write_warrants,
+                        ))
+                        db_manager.connection.commit()
+                except Exception as exc:
+                    db_manager.connection.rollback()
+                    logger.warning(f"MI_INDEX 快照匯入 {current} 失敗: {exc}")
+                    errors.append({'date': current.isoformat(), 'error': str(exc)})
+            current += timedelta(days=1)
+        if write_warrants and days:
+            _refresh_warrant_portal_stats(db_manager)
+    finally:
+        db_manager.disconnect()
+    return jsonify({
+        'success': not errors or bool(days),
+        'days': days,
+        'errors': errors,
+        'stockPrices': sum(d['stockPrices'] for d in days),
+        'warrantTrades': sum(d['warrantTrades'] for d in days),
+    })
+
+
+@prices_bp.route('/api/prices/twii/import_yf', methods=['POST'])
 def import_twii_from_yfinance():
     """使用 yfinance 匯入 ^TWII 日K 至 tw_stock_prices。
     JSON body: { start?: 'YYYY-MM-DD', end?: 'YYYY-MM-DD', use_local_db?: bool }
@@ -5648,8 +5886,11 @@ def _validate_refetched_records(cur, symbol, recs, threshold=0.5):
     # 若未指定門檻（None）則不進行過濾，直接回傳
     if threshold is None:
         return recs, []
-    # 取得 DB 先前收盤
-    first_date = recs[0].get('date') or recs[0].get('Date')
+    def _get_date(r):
+        return r.get('date') or r.get('Date')
+    recs_sorted = sorted(recs, key=_get_date)
+    # 取得 DB 先前收盤（以批次中最早的日期為準）
+    first_date = _get_date(recs_sorted[0])
     prev_close = None
     try:
         cur.execute("SELECT close_price FROM tw_stock_prices WHERE symbol=%s AND date < %s ORDER BY date DESC LIMIT 1", [symbol, first_date])
@@ -5659,31 +5900,92 @@ def _validate_refetched_records(cur, symbol, recs, threshold=0.5):
     except Exception:
         prev_close = None
 
-    # 依日期排序
-    def _get_date(r):
-        return r.get('date') or r.get('Date')
-    recs_sorted = sorted(recs, key=_get_date)
-
-    filtered = []
-    skipped = []
-    for r in recs_sorted:
-        close = r.get('close_price') or r.get('Close')
-        if close is None or close <= 0:
-            skipped.append((r, 'close_le_zero_or_null'))
-            continue
-        if prev_close is not None and prev_close != 0:
-            pct = abs(float(close) - float(prev_close)) / abs(float(prev_close))
-            if pct > threshold:
-                skipped.append((r, f'pct_change_gt_{threshold}'))
-                # 更新 prev_close 為當前（即便跳過，以便後續比較較為連續）
-                prev_close = float(close)
-                continue
-        filtered.append(r)
-        prev_close = float(close)
+    # 整批驗證：每筆與前一筆有效收盤比較（第一筆與 DB 前收比較）
+    checked = price_validation.validate_records(
+        recs_sorted,
+        price_validation.refetch_rules(threshold),
+        prev_close=prev_close,
+        sequential=True,
+    )
+    filtered, skipped = price_validation.split_records(recs_sorted, checked)
+    skipped = [
+        (r, f'pct_change_gt_{threshold}' if reason == 'pct_change_gt_threshold' else reason)
+        for r, reason in skipped
+    ]
     return filtered, skipped
 
 def _detect_price_anomalies(cursor, symbol=None, start_date=None, end_date=None, threshold=0.2):
-    """以相鄰收盤價漲跌幅偵測異常，返回 list[dict]。"""
+    """以相鄰收盤價漲跌幅偵測異常，返回 list[dict]。
+
+    門檻不低於 price_anomalies 的下限、且索引已涵蓋（所有股票皆以目前規則版本掃描過）時直接讀取
+    持久化索引；否則（更低門檻，或背景補掃尚未完成）退回對 tw_stock_prices 做 LAG() 掃描。
+    """
+    if (
+        PRICE_ANOMALY_INDEX_ENABLED
+        and threshold is not None
+        and threshold >= price_anomalies.ANOMALY_FLOOR
+        and price_anomalies.index_covers(cursor, symbol)
+    ):
+        rows = price_anomalies.query_price_anomalies(cursor, symbol, start_date, end_date, threshold)
+    else:
+        rows = _scan_price_anomalies(cursor, symbol, start_date, end_date, threshold)
+    # 正規化輸出
+    anomalies = []
+    for r in rows:
+        date_val = r['date']
+        anomalies.append({
+            'symbol': r['symbol'],
+            'date': date_val.strftime('%Y-%m-%d') if hasattr(date_val, 'strftime') else str(date_val),
+            'close': float(r['close_price']) if r['close_price'] is not None else None,
+            'prev_close': float(r['prev_close']) if r['prev_close'] is not None else None,
+            'pct_change': float(r['pct_change']) if r['pct_change'] is not None else None
+        })
+    return anomalies
+
+_price_anomaly_rescan_lock = threading.Lock()
+_price_anomaly_rescan_checked: dict[bool, float] = {}
+
+
+def _schedule_price_anomaly_rescan(db_manager) -> None:
+    """create_tables 後：背景補掃尚未以目前規則版本掃描的股票（新股、規則變更、首次部署）。
+
+    使用獨立連線、每批 commit，不佔用請求連線；每個目標庫最多每 PRICE_ANOMALY_RESCAN_CHECK_SECONDS 檢查一次。
+    """
+    if not PRICE_ANOMALY_INDEX_ENABLED:
+        return
+    target = db_manager.is_neon
+    now = time.time()
+    if now - _price_anomaly_rescan_checked.get(target, 0.0) < PRICE_ANOMALY_RESCAN_CHECK_SECONDS:
+        return
+    if not _price_anomaly_rescan_lock.acquire(blocking=False):
+        return
+    _price_anomaly_rescan_checked[target] = now
+    use_local = db_manager.use_local
+
+    def _job():
+        try:
+            bg = DatabaseManager(use_local=use_local)
+            if not bg.connect():
+                return
+            try:
+                cur = bg.connection.cursor()
+                price_anomalies.rescan_stale_symbols(
+                    cur, prices_table=bg.table_prices, commit=bg.connection.commit,
+                )
+                bg.connection.commit()
+            finally:
+                bg.disconnect()
+        except Exception as exc:
+            logger.warning(f"price_anomalies 背景補掃失敗: {exc}")
+            _price_anomaly_rescan_checked.pop(target, None)
+        finally:
+            _price_anomaly_rescan_lock.release()
+
+    threading.Thread(target=_job, name='price-anomaly-rescan', daemon=True).start()
+
+
+def _scan_price_anomalies(cursor, symbol=None, start_date=None, end_date=None, threshold=0.2):
+    """直接以 LAG() 視窗掃描 tw_stock_prices（不經索引）。"""
     conds = []
     params = []
     if symbol:
@@ -5714,22 +6016,27 @@ def _detect_price_anomalies(cursor, symbol=None, start_date=None, end_date=None,
         ORDER BY symbol, date
     """
     cursor.execute(sql, params + [threshold])
-    rows = cursor.fetchall()
-    # 正規化輸出
-    anomalies = []
-    for r in rows:
-        date_val = r['date']
-        anomalies.append({
-            'symbol': r['symbol'],
-            'date': date_val.strftime('%Y-%m-%d') if hasattr(date_val, 'strftime') else str(date_val),
-            'close': float(r['close_price']) if r['close_price'] is not None else None,
-            'prev_close': float(r['prev_close']) if r['prev_close'] is not None else None,
-            'pct_change': float(r['pct_change']) if r['pct_change'] is not None else None
-        })
-    return anomalies
+    return cursor.fetchall()
 
-@app.route('/api/anomalies/detect', methods=['GET'])
-def detect_anomalies():
+@prices_bp.route('/api/anomalies/index/status', methods=['GET'])
+def anomalies_index_status():
+    """price_anomalies 索引狀態（規則版本、各版本已掃描股票數、異常筆數）。"""
+    db = DatabaseManager.from_request_args(request.args)
+    if not db.connect():
+        return jsonify({'success': False, 'error': '資料庫連線失敗'}), 500
+    try:
+        cur = db.connection.cursor()
+        info = price_anomalies.status(cur)
+        db.connection.commit()
+        return jsonify({'success': True, 'enabled': PRICE_ANOMALY_INDEX_ENABLED, **info})
+    except Exception as e:
+        logger.error(f"anomalies index status 錯誤: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+    finally:
+        db.disconnect()
+
+@prices_bp.route('/api/anomalies/detect', methods=['GET'])
+def detect_anomalies():
     """偵測 tw_stock_prices 異常跳動。query: symbol, start, end, threshold=0.2"""
     try:
         symbol = request.args.get('symbol')
@@ -5756,7 +6063,7 @@ def detect_anomalies():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-@app.route('/api/income-statement/import', methods=['POST', 'OPTIONS'])
+@statements_bp.route('/api/income-statement/import', methods=['POST', 'OPTIONS'])
 def api_income_statement_import():
     """將前端提供的損益表寬表資料寫入資料庫。
 
@@ -5790,7 +6097,7 @@ def api_income_statement_import():
         return jsonify({'success': False, 'error': str(exc)}), 500
 
 
-@app.route('/api/balance-sheet/import', methods=['POST', 'OPTIONS'])
+@statements_bp.route('/api/balance-sheet/import', methods=['POST', 'OPTIONS'])
 def api_balance_sheet_import():
     """將前端提供的資產負債表寬表資料寫入資料庫。
 
@@ -5824,7 +6131,7 @@ def api_balance_sheet_import():
         return jsonify({'success': False, 'error': str(exc)}), 500
 
 
-@app.route('/api/cash-flow-statement/import', methods=['POST', 'OPTIONS'])
+@statements_bp.route('/api/cash-flow-statement/import', methods=['POST', 'OPTIONS'])
 def api_cash_flow_import():
     """將前端提供的現金流量表寬表資料寫入資料庫。"""
     try:
@@ -5850,7 +6157,7 @@ def api_cash_flow_import():
         return jsonify({'success': False, 'error': str(exc)}), 500
 
 
-@app.route('/api/anomalies/export', methods=['GET'])
+@prices_bp.route('/api/anomalies/export', methods=['GET'])
 def export_anomalies():
     """匯出異常清單（CSV，Excel 可開啟）。Query: symbol, start, end, threshold=0.2"""
     try:
@@ -5892,7 +6199,7 @@ def export_anomalies():
         logger.error(f"export_anomalies 錯誤: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/api/anomalies/fix', methods=['POST'])
+@prices_bp.route('/api/anomalies/fix', methods=['POST'])
 def fix_anomalies():
     """備份+刪除異常資料，並重抓指定範圍。
     JSON body: {symbol (可選), start, end, threshold=0.2, ruleVersion='rules_v1_pct', refetchPaddingDays=5}
@@ -5917,6 +6224,18 @@ def fix_anomalies():
         except Exception:
             rv_thresh = 0.5
 
+        # 全市場僅重抓：改走批次修復（依交易日抓日行情），於背景執行不阻塞請求
+        if not symbol and refetch_only:
+            return _start_anomaly_repair(
+                body.get('use_local_db', request.args.get('use_local_db')),
+                None,
+                start_date,
+                end_date,
+                threshold,
+                pad_days=pad_days,
+                validation_threshold=rv_thresh,
+            )
+
         db = DatabaseManager.from_request_args(request.args)
         if not db.connect():
             return jsonify({'success': False, 'error': '資料庫連線失敗'}), 500
@@ -5961,6 +6280,7 @@ def fix_anomalies():
                         [sym] + date_list
                     )
                     total_deleted += cur.rowcount if cur.rowcount else 0
+                    price_anomalies.update_price_anomalies(cur, [sym], min(date_list), prices_table=db.table_prices)
 
                 # 重抓：擴大區間避免缺邊
                 refetch_start = min(date_list)
@@ -6028,7 +6348,7 @@ def fix_anomalies():
         logger.error(f"fix_anomalies 外層錯誤: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/api/anomalies/fix_stream', methods=['GET'])
+@prices_bp.route('/api/anomalies/fix_stream', methods=['GET'])
 def fix_anomalies_stream():
     """以 Server-Sent Events (SSE) 方式串流修復進度與抓到的股價預覽。
     Query: symbol(可選), start, end, threshold=0.2, refetchOnly=true, refetchPaddingDays=5
@@ -6239,7 +6559,295 @@ def fix_anomalies_stream():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-@app.route('/api/prices/refetch_range', methods=['POST'])
+anomaly_repair_status = {
+    'running': False,
+    'startedAt': None,
+    'finishedAt': None,
+    'plan': None,
+    'totalDays': None,
+    'processedDays': 0,
+    'fetches': 0,
+    'inserted': 0,
+    'rejected': 0,
+    'missing': 0,
+    'currentDate': None,
+    'error': None,
+}
+
+
+def _run_anomaly_repair(
+    db_manager,
+    plan,
+    *,
+    validation_threshold=0.5,
+    sleep_sec: float = 0.5,
+    threshold=None,
+    status: dict | None = None,
+) -> dict:
+    """依修復計畫逐交易日抓一次全市場日行情，驗證後整批 upsert。"""
+    st = status if isinstance(status, dict) else {}
+    st.update({
+        'running': True,
+        'startedAt': st.get('startedAt') or datetime.utcnow().isoformat(),
+        'finishedAt': None,
+        'plan': plan.summary(),
+        'totalDays': len(plan.days),
+        'processedDays': 0,
+        'fetches': 0,
+        'inserted': 0,
+        'rejected': 0,
+        'missing': 0,
+        'currentDate': None,
+        'error': None,
+    })
+    push_sse('anomaly_repair', 'start', f'開始批次修復：{len(plan.symbols)} 檔、{len(plan.days)} 個交易日', plan=st['plan'])
+
+    prices_table = db_manager.table_prices
+    upsert_sql = f"""
+        INSERT INTO {prices_table} (symbol, date, open_price, high_price, low_price, close_price, volume)
+        VALUES %s
+        ON CONFLICT (symbol, date) DO UPDATE SET
+            open_price = EXCLUDED.open_price,
+            high_price = EXCLUDED.high_price,
+            low_price = EXCLUDED.low_price,
+            close_price = EXCLUDED.close_price,
+            volume = EXCLUDED.volume
+    """
+    written_since: dict[str, str] = {}
+    written_count: dict[str, int] = {}
+    cursor = db_manager.connection.cursor()
+    for index, entry in enumerate(plan.days):
+        day_str = entry.day.isoformat()
+        st['currentDate'] = day_str
+        rows = []
+        if entry.twse:
+            snapshot = stock_api.fetch_twse_all_stocks_day(day_str)
+            st['fetches'] += 1
+            rows.extend(anomaly_repair.snapshot_records(snapshot, entry.twse, entry.day))
+        if entry.tpex:
+            if entry.twse and sleep_sec:
+                time.sleep(sleep_sec)
+            snapshot = stock_api.fetch_tpex_all_stocks_day(day_str)
+            st['fetches'] += 1
+            rows.extend(anomaly_repair.snapshot_records(snapshot, entry.tpex, entry.day))
+        st['missing'] += len(entry.symbols) - len(rows)
+
+        accepted, rejected = [], []
+        if rows:
+            try:
+                prev_closes = anomaly_repair.load_previous_closes(
+                    cursor, [r[0] for r in rows], entry.day, prices_table=prices_table
+                )
+                accepted, rejected = anomaly_repair.filter_by_previous_close(
+                    rows, prev_closes, validation_threshold
+                )
+                if accepted:
+                    execute_values(cursor, upsert_sql, accepted, page_size=1000)
+                db_manager.connection.commit()
+            except Exception:
+                db_manager.connection.rollback()
+                raise
+        for row in accepted:
+            written_since.setdefault(row[0], day_str)
+            written_count[row[0]] = written_count.get(row[0], 0) + 1
+        st['inserted'] += len(accepted)
+        st['rejected'] += len(rejected)
+        st['processedDays'] = index + 1
+        push_sse(
+            'anomaly_repair', 'day_done',
+            f'{day_str} 寫入 {len(accepted)} 筆、拒收 {len(rejected)} 筆',
+            date=day_str,
+            inserted=len(accepted),
+            rejected=len(rejected),
+            processedDays=index + 1,
+            totalDays=len(plan.days),
+        )
+        if sleep_sec and index + 1 < len(plan.days):
+            time.sleep(sleep_sec)
+
+    # 逐日寫完後，依各檔最早寫入日一次更新快照、異常索引與稽核
+    by_since: dict[str, list[str]] = {}
+    for sym, since in written_since.items():
+        by_since.setdefault(since, []).append(sym)
+    try:
+        for since, syms in by_since.items():
+            refresh_latest_stock_bars(cursor, syms, prices_table=prices_table)
+            price_anomalies.update_price_anomalies(cursor, syms, since, prices_table=prices_table)
+        if written_count:
+            execute_values(
+                cursor,
+                """
+                    INSERT INTO stock_anomaly_audit
+                        (symbol, start_date, end_date, deleted_count, refetched_count, rule_version, threshold)
+                    VALUES %s
+                """,
+                [
+                    (sym, st['plan']['start'], st['plan']['end'], 0, cnt, 'batch_repair', threshold)
+                    for sym, cnt in written_count.items()
+                ],
+            )
+        db_manager.connection.commit()
+    except Exception:
+        db_manager.connection.rollback()
+        raise
+    finally:
+        cursor.close()
+
+    st['running'] = False
+    st['finishedAt'] = datetime.utcnow().isoformat()
+    st['currentDate'] = None
+    push_sse(
+        'anomaly_repair', 'done',
+        f"批次修復完成：寫入 {st['inserted']} 筆、拒收 {st['rejected']} 筆",
+        status=dict(st),
+    )
+    return dict(st)
+
+
+def _start_anomaly_repair(
+    use_local_db,
+    symbol,
+    start_date,
+    end_date,
+    threshold: float,
+    *,
+    pad_days: int = 5,
+    validation_threshold=0.5,
+    sleep_sec: float = 0.5,
+    sync: bool = False,
+):
+    """偵測異常 → 建立修復計畫 → 背景執行；回傳 (response, status_code)。
+
+    偵測前先以跨 process 鎖佔住工作，避免兩個請求都通過檢查後各自偵測、各自啟動修復；
+    提早結束（連線失敗、偵測失敗、無異常）時釋放鎖並重設狀態。
+    """
+    global anomaly_repair_status
+    db_manager = DatabaseManager.from_request_args({'use_local_db': use_local_db})
+    repair_lock = _job_lock('anomaly_repair', db_manager)
+    if not repair_lock.acquire(blocking=False):
+        return jsonify({'success': False, 'error': '批次修復進行中', 'status': _job_status_view('anomaly_repair_status')}), 409
+
+    anomaly_repair_status = {
+        'running': True,
+        'phase': 'detect',
+        'startedAt': datetime.utcnow().isoformat(),
+        'finishedAt': None,
+        'plan': None,
+        'totalDays': 0,
+        'processedDays': 0,
+        'currentDate': None,
+        'error': None,
+    }
+
+    def _release(error=None):
+        anomaly_repair_status['running'] = False
+        anomaly_repair_status['finishedAt'] = datetime.utcnow().isoformat()
+        if error:
+            anomaly_repair_status['error'] = error
+        db_manager.disconnect()
+        if repair_lock.locked():
+            repair_lock.release()
+
+    if not db_manager.connect():
+        _release('資料庫連線失敗')
+        return jsonify({'success': False, 'error': '資料庫連線失敗'}), 500
+    try:
+        db_manager.create_tables()
+        cur = db_manager.connection.cursor()
+        anomalies = _detect_price_anomalies(cur, symbol, start_date, end_date, threshold)
+        cur.close()
+        plan = anomaly_repair.plan_repair(anomalies, pad_days=pad_days)
+    except Exception as e:
+        _release(str(e))
+        logger.error(f"批次修復偵測失敗: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+    anomaly_repair_status['plan'] = plan.summary()
+    if not plan.days:
+        _release()
+        return jsonify({'success': True, 'message': '未發現異常', 'plan': plan.summary(), 'deleted': 0, 'refetched': 0}), 200
+
+    anomaly_repair_status.update({'phase': 'repair', 'totalDays': len(plan.days)})
+
+    def _job():
+        try:
+            _run_anomaly_repair(
+                db_manager,
+                plan,
+                validation_threshold=validation_threshold,
+                sleep_sec=sleep_sec,
+                threshold=threshold,
+                status=anomaly_repair_status,
+            )
+        except Exception as e:
+            anomaly_repair_status['running'] = False
+            anomaly_repair_status['finishedAt'] = datetime.utcnow().isoformat()
+            anomaly_repair_status['error'] = str(e)
+            push_sse('anomaly_repair', 'error', str(e))
+            logger.exception('批次修復任務失敗')
+        finally:
+            db_manager.disconnect()
+            if repair_lock.locked():
+                repair_lock.release()
+
+    if sync:
+        _job()
+        ok = not anomaly_repair_status.get('error')
+        return jsonify({
+            'success': ok,
+            'message': '批次修復完成' if ok else '批次修復失敗',
+            'status': anomaly_repair_status,
+            'refetched': anomaly_repair_status.get('inserted', 0),
+            'deleted': 0,
+        }), (200 if ok else 500)
+
+    threading.Thread(target=_job, daemon=True).start()
+    return jsonify({
+        'success': True,
+        'background': True,
+        'message': '批次修復已開始（背景），進度見 /api/anomalies/repair/status 或 SSE channel anomaly_repair',
+        'plan': plan.summary(),
+        'status': anomaly_repair_status,
+    }), 202
+
+
+@prices_bp.route('/api/anomalies/repair', methods=['POST'])
+def repair_anomalies_batch():
+    """全市場批次修復：依交易日抓一次日行情，整批驗證後 upsert（背景執行）。
+    JSON body: {symbol?, start, end, threshold=0.2, refetchPaddingDays=5,
+                refetchValidationThreshold=0.5, sleepSec=0.5, sync=false, use_local_db?}
+    """
+    body = request.get_json(silent=True) or {}
+    try:
+        threshold = float(body.get('threshold', 0.2))
+        pad_days = max(0, min(30, int(body.get('refetchPaddingDays', 5))))
+        sleep_sec = max(0.0, min(5.0, float(body.get('sleepSec', 0.5))))
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': '參數格式錯誤'}), 400
+    rv_thresh = body.get('refetchValidationThreshold', 0.5)
+    try:
+        rv_thresh = float(rv_thresh) if rv_thresh is not None else None
+    except (TypeError, ValueError):
+        rv_thresh = 0.5
+    return _start_anomaly_repair(
+        body.get('use_local_db'),
+        body.get('symbol'),
+        body.get('start'),
+        body.get('end'),
+        threshold,
+        pad_days=pad_days,
+        validation_threshold=rv_thresh,
+        sleep_sec=sleep_sec,
+        sync=str(body.get('sync') or '').lower() in ('1', 'true', 'yes'),
+    )
+
+
+@prices_bp.route('/api/anomalies/repair/status', methods=['GET'])
+def repair_anomalies_status():
+    return jsonify({'success': True, 'status': _job_status_view('anomaly_repair_status')})
+
+
+@prices_bp.route('/api/prices/refetch_range', methods=['POST'])
 def refetch_prices_range():
     """刪除指定股票在日期區間內的全部股價資料，並整段重抓後寫回。
     JSON body: { symbol, start, end, use_local_db?: bool }
@@ -6289,6 +6897,7 @@ def refetch_prices_range():
                 [symbol, start_date, end_date]
             )
             deleted_count = cur.rowcount if cur.rowcount else 0
+            price_anomalies.update_price_anomalies(cur, [symbol], start_date, prices_table=db.table_prices)
             db.connection.commit()
 
             # 整段重抓並寫回（upsert）
@@ -6328,7 +6937,7 @@ def refetch_prices_range():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-@app.route('/api/prices/refetch_range_by_anomalies', methods=['POST'])
+@prices_bp.route('/api/prices/refetch_range_by_anomalies', methods=['POST'])
 def refetch_prices_range_by_anomalies():
     try:
         if not request.is_json:
@@ -6421,6 +7030,9 @@ def refetch_prices_range_by_anomalies():
                 )
                 deleted_count = cur.rowcount if cur.rowcount else 0
                 total_deleted += deleted_count
+                price_anomalies.update_price_anomalies(
+                    cur, [sym], min(anomaly_dates_param), prices_table=db.table_prices
+                )
                 db.connection.commit()
 
                 fetched_count = 0
@@ -6476,7 +7088,7 @@ def refetch_prices_range_by_anomalies():
         logger.error(f"refetch_prices_range_by_anomalies 外層錯誤: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/api/symbols', methods=['GET'])
+@prices_bp.route('/api/symbols', methods=['GET'])
 def get_symbols():
     """獲取所有股票代碼"""
     try:
@@ -6517,7 +7129,13 @@ def get_symbols():
         }), 500
 
 
-@app.route('/api/symbols/refresh_from_exchanges', methods=['POST'])
+@prices_bp.route('/api/symbols/master/status', methods=['GET'])
+def get_symbol_master_status():
+    """symbol master 載入/背景更新狀態"""
+    return jsonify({'success': True, 'data': stock_api.symbol_master.status()})
+
+
+@prices_bp.route('/api/symbols/refresh_from_exchanges', methods=['POST'])
 def refresh_symbols_from_exchanges():
     """Refresh symbols table from official exchanges (TWSE/TPEx).
 
@@ -6582,6 +7200,11 @@ def refresh_symbols_from_exchanges():
             results.append(run_once('remote'))
 
         ok = all(r.get('ok') for r in results)
+        if ok and table == stock_api.symbol_master.table:
+            try:
+                stock_api.symbol_master.load()
+            except Exception as exc:
+                logger.warning(f"重新載入 symbol master 失敗: {exc}")
         return jsonify({'success': ok, 'results': results})
 
     except subprocess.TimeoutExpired:
@@ -6591,7 +7214,7 @@ def refresh_symbols_from_exchanges():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-@app.route('/api/symbols/refresh_etf_names', methods=['POST'])
+@prices_bp.route('/api/symbols/refresh_etf_names', methods=['POST'])
 def refresh_etf_names_from_isin():
     """Refresh ETF symbols/names into symbols table from ISIN (ETF list).
 
@@ -6664,7 +7287,7 @@ def refresh_etf_names_from_isin():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-@app.get('/api/income-statement')
+@statements_bp.get('/api/income-statement')
 def api_income_statement():
     """Return wide-format income statement data for all stocks for a given year/season.
 
@@ -6805,6 +7428,7 @@ def api_income_statement():
         data_json = df_single.to_json(orient='records', force_ascii=False)
         return Response(data_json, mimetype='application/json; charset=utf-8')
 
+    income_fetch_lock = _job_lock('income_statement', DatabaseManager.from_request_args(request.args))
     if not income_fetch_lock.acquire(blocking=False):
         return jsonify({'error': '已有損益表抓取任務進行中，請等待完成後再試。'}), 409
 
@@ -7218,7 +7842,7 @@ def _run_income_statement_bulk_fetch(
     return resp
 
 
-@app.get('/api/balance-sheet')
+@statements_bp.get('/api/balance-sheet')
 def api_balance_sheet():
     """Return wide-format balance sheet data for all stocks for a given year/season.
 
@@ -7679,18 +8303,18 @@ def api_balance_sheet():
     return Response(data_json, mimetype='application/json; charset=utf-8')
 
 
-@app.get('/api/balance-sheet/status')
+@statements_bp.get('/api/balance-sheet/status')
 def api_balance_sheet_status():
     """Return current progress status of balance-sheet fetching."""
 
     try:
-        return jsonify({'success': True, 'status': balance_fetch_status})
+        return jsonify({'success': True, 'status': _job_status_view('balance_fetch_status')})
     except Exception as e:
         logger.error(f"balance-sheet status error: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-@app.get('/api/cash-flow-statement')
+@statements_bp.get('/api/cash-flow-statement')
 def api_cash_flow_statement():
     """抓取單一股票、代號範圍或全市場的現金流量表。"""
     from datetime import datetime as _dt, timedelta as _td, timezone as _tz
@@ -7915,27 +8539,27 @@ def api_cash_flow_statement():
             db.disconnect()
 
 
-@app.get('/api/cash-flow-statement/status')
+@statements_bp.get('/api/cash-flow-statement/status')
 def api_cash_flow_statement_status():
-    return jsonify({'success': True, 'status': cash_flow_fetch_status})
+    return jsonify({'success': True, 'status': _job_status_view('cash_flow_fetch_status')})
 
 
-@app.get('/api/income-statement/status')
+@statements_bp.get('/api/income-statement/status')
 def api_income_statement_status():
     """Return current progress status of income-statement fetching."""
 
     try:
-        return jsonify({'success': True, 'status': income_fetch_status})
+        return jsonify({'success': True, 'status': _job_status_view('income_fetch_status')})
     except Exception as e:
         logger.error(f"income-statement status error: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
 # Debug routes
-@app.route('/api/debug/routes', methods=['GET'])
+@system_bp.route('/api/debug/routes', methods=['GET'])
 def list_routes():
     try:
         routes = []
-        for rule in app.url_map.iter_rules():
+        for rule in current_app.url_map.iter_rules():
             methods = sorted([m for m in rule.methods if m not in ('HEAD', 'OPTIONS')])
             routes.append({
                 'rule': str(rule),
@@ -7947,6 +8571,97 @@ def list_routes():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+
+@system_bp.route('/api/locks', methods=['GET'])
+def list_job_locks():
+    """跨 process 工作鎖的持有者（tw_lock_holders + pg_locks），以及本 process 的鎖狀態。
+
+    Query: use_local_db=true 查本機資料庫上的鎖，預設查 Neon（未設定時為本機）。
+    """
+    db = DatabaseManager.from_request_args(request.args)
+    payload = {'success': True, 'target': db.lock_target, 'process': lock_manager.local_view()}
+    if not db.connect():
+        payload.update({'success': False, 'error': '資料庫連接失敗'})
+        return jsonify(payload), 500
+    try:
+        cur = db.connection.cursor()
+        payload['holders'] = advisory_locks.holders(cur)
+        db.connection.commit()
+        cur.close()
+    except Exception as e:
+        payload.update({'success': False, 'error': str(e)})
+        return jsonify(payload), 500
+    finally:
+        db.disconnect()
+    return jsonify(payload)
+
+@system_bp.route('/api/debug/query-plans', methods=['GET'])
+def debug_query_plans():
+    """熱門查詢的 EXPLAIN 摘要（Seq Scan 的資料表、使用的索引、估計成本）。
+
+    Query: use_local_db, code（權證代號）, symbol（股票代號）, analyze=1（實際執行並回滾）
+    """
+    analyze = str(request.args.get('analyze', '0')).strip().lower() in ('1', 'true', 'yes')
+    if analyze:
+        denied = _require_quantgems_admin()
+        if denied is not None:
+            return denied
+    db = DatabaseManager.from_request_args(request.args)
+    if not db.connect():
+        return jsonify({'success': False, 'error': '資料庫連線失敗'}), 500
+    try:
+        probes = index_advisor.default_probes(
+            warrant_search.search_clause,
+            prices_table=db.table_prices,
+            warrant_code=(request.args.get('code') or '030001').strip(),
+            symbol=(request.args.get('symbol') or '2330.TW').strip(),
+        )
+        plans = index_advisor.explain_probes(db.connection, probes, analyze=analyze)
+        flagged = [p['name'] for p in plans if p.get('seq_scans')]
+        return jsonify({
+            'success': True,
+            'analyze': analyze,
+            'plans': plans,
+            'seqScanProbes': flagged,
+        })
+    except Exception as e:
+        logger.error(f"query-plans error: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+    finally:
+        db.disconnect()
+
+
+@system_bp.route('/api/debug/index-migrations', methods=['GET', 'POST'])
+def debug_index_migrations():
+    """GET：列出索引遷移狀態；POST（管理員）：以 CONCURRENTLY 套用尚未執行的遷移。"""
+    if request.method == 'POST':
+        denied = _require_quantgems_admin()
+        if denied is not None:
+            return denied
+        payload = request.get_json(silent=True) or {}
+        db = DatabaseManager.from_request_payload(payload)
+    else:
+        payload = {}
+        db = DatabaseManager.from_request_args(request.args)
+    if not db.connect():
+        return jsonify({'success': False, 'error': '資料庫連線失敗'}), 500
+    try:
+        if request.method == 'POST':
+            results = index_advisor.apply_migrations(
+                db.connection,
+                prices_table=db.table_prices,
+                only=payload.get('only') or None,
+            )
+            return jsonify({'success': True, 'results': results})
+        status = index_advisor.migration_status(db.connection, prices_table=db.table_prices)
+        return jsonify({'success': True, 'migrations': status})
+    except Exception as e:
+        logger.error(f"index-migrations error: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+    finally:
+        db.disconnect()
+
+
 def _is_safe_identifier(name: str) -> bool:
     if not name:
         return False
@@ -7978,7 +8693,7 @@ def _resolve_table_override(cursor, table_name: str) -> str:
     return table_name
 
 
-@app.route('/api/tables', methods=['GET'])
+@system_bp.route('/api/tables', methods=['GET'])
 def list_tables_for_query():
     try:
         db_manager = DatabaseManager.from_request_args(request.args)
@@ -8013,7 +8728,7 @@ def list_tables_for_query():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-@app.route('/api/query/table', methods=['GET'])
+@system_bp.route('/api/query/table', methods=['GET'])
 def query_table_generic():
     try:
         table = request.args.get('table')
@@ -8134,8 +8849,6 @@ def query_table_generic():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-income_fetch_lock = threading.Lock()
-
 # 權證匯入進度狀態（提供前端查詢進度用）
 income_fetch_status = {
     'running': False,
@@ -8182,11 +8895,40 @@ tpex_warrant_daily_backfill_status = {
     'processedDays': 0,
     'importedDays': 0,
     'skippedDays': 0,
+    'failedDays': 0,
+    'failures': [],
     'importedCount': 0,
     'currentDate': None,
     'error': None,
 }
 
+twse_warrant_ohlc_enrich_status = {
+    'running': False,
+    'startedAt': None,
+    'finishedAt': None,
+    'start': None,
+    'end': None,
+    'phase': None,
+    'snapshotDays': 0,
+    'stockDayTasks': 0,
+    'processed': 0,
+    'current': None,
+    'result': None,
+    'error': None,
+}
+
+warrant_partition_status = {
+    'running': False,
+    'startedAt': None,
+    'finishedAt': None,
+    'phase': None,
+    'market': None,
+    'archivedCodes': 0,
+    'archivedRows': 0,
+    'result': None,
+    'error': None,
+}
+
 
 def _parse_roc_date_text(text: str | None):
     """解析權證日期：支援民國 7 碼（1150731）與西元 8 碼（20261105）。
@@ -8356,73 +9098,6 @@ def _backfill_tw_warrant_underlying_codes(cursor) -> int:
     return len(updates)
 
 
-def _portal_master_search_clause(q: str) -> tuple[str, list]:
-    """主檔關鍵字：權證代號／名稱、標的名稱、股票代號（含 2330.TW）。
-
-    代號類查詢（如 5274、2330.TW）採精確／前綴比對，避免「5274」誤中「052745」。
-    名稱類查詢仍用模糊比對。
-    """
-    q = (q or '').strip()
-    if not q:
-        return '', []
-    q_norm = _normalize_stock_code_query(q)
-    has_cjk = any('\u4e00' <= ch <= '\u9fff' for ch in q)
-    code_body = (q_norm or '').replace('.', '')
-    is_code_query = (
-        bool(code_body)
-        and code_body.isalnum()
-        and any(ch.isdigit() for ch in code_body)
-        and not has_cjk
-    )
-
-    # 正規化後的標的代號欄位（去掉 .TW / .TWO / .TAI）
-    underlying_norm_sql = (
-        "UPPER(REPLACE(REPLACE(REPLACE(COALESCE(underlying_code, ''), '.TW', ''), '.TWO', ''), '.TAI', ''))"
-    )
-    symbol_norm_sql = (
-        "REPLACE(REPLACE(REPLACE(UPPER(symbol), '.TW', ''), '.TWO', ''), '.TAI', '')"
-    )
-
-    if is_code_query:
-        # 權證代號：完全相等或前綴（輸入 05274 → 052745）；標的代號：完全相等
-        clause = (
-            '('
-            ' UPPER(warrant_code) = UPPER(%s)'
-            ' OR warrant_code ILIKE %s'
-            f' OR {underlying_norm_sql} = UPPER(%s)'
-            ' OR COALESCE(underlying_name, \'\') IN ('
-            '   SELECT DISTINCT COALESCE(NULLIF(TRIM(short_name), \'\'), name)'
-            '   FROM stock_symbols'
-            f'   WHERE {symbol_norm_sql} = UPPER(%s)'
-            '      OR UPPER(symbol) = UPPER(%s)'
-            ' )'
-            f' OR {underlying_norm_sql} IN ('
-            f'   SELECT DISTINCT {symbol_norm_sql}'
-            '   FROM stock_symbols'
-            f'   WHERE {symbol_norm_sql} = UPPER(%s)'
-            '      OR UPPER(symbol) = UPPER(%s)'
-            ' )'
-            ')'
-        )
-        prefix = f'{q_norm}%'
-        params = [q_norm, prefix, q_norm, q_norm, q_norm, q_norm, q_norm]
-        return clause, params
-
-    # 名稱／自由文字：名稱模糊；代號仍只做精確比對，避免誤中
-    name_pat = f'%{q}%'
-    clause = (
-        '('
-        ' warrant_name ILIKE %s'
-        ' OR COALESCE(underlying_name, \'\') ILIKE %s'
-        ' OR UPPER(warrant_code) = UPPER(%s)'
-        f' OR {underlying_norm_sql} = UPPER(%s)'
-        ')'
-    )
-    code_key = q_norm or q
-    params = [name_pat, name_pat, code_key, code_key]
-    return clause, params
-
-
 def _parse_twse_market_number(val):
     if val is None:
         return None
@@ -8456,87 +9131,34 @@ def _taipei_today() -> date:
     return datetime.now(timezone(timedelta(hours=8))).date()
 
 
-def _is_warrant_like_name(name: str | None) -> bool:
-    s = name or ''
-    return any(k in s for k in ('購', '售', '牛', '熊', '權證'))
-
-
 def _fetch_twse_mi_index_payload(trade_date_obj: date) -> dict | None:
     """抓取 MI_INDEX JSON；非交易日／無資料回傳 None。"""
-    ymd = trade_date_obj.strftime('%Y%m%d')
-    url = f'https://www.twse.com.tw/exchangeReport/MI_INDEX?response=json&date={ymd}&type=ALL'
-    resp = requests.get(url, timeout=120, headers={'User-Agent': 'Mozilla/5.0'})
-    if resp.status_code != 200:
-        raise RuntimeError(f'MI_INDEX HTTP {resp.status_code}')
-    payload = resp.json()
-    if not isinstance(payload, dict):
-        return None
-    stat = payload.get('stat')
-    if stat and stat != 'OK':
-        return None
-    return payload
+    return mi_index.fetch_payload(trade_date_obj)
 
 
-def _parse_twse_mi_index_quotes(payload: dict) -> dict[str, dict]:
-    """從 MI_INDEX payload 取出各證券 OHLC + 成交金額／張數（含權證）。"""
-    tables = payload.get('tables') if isinstance(payload, dict) else None
-    if not isinstance(tables, list):
-        return {}
-    target = None
-    for table in tables:
-        if not isinstance(table, dict):
-            continue
-        fields = table.get('fields') or []
-        if '收盤價' in fields and '證券代號' in fields:
-            target = table
-            break
-    if not target:
-        return {}
-    fields = target.get('fields') or []
-    idx = {name: i for i, name in enumerate(fields)}
-    out: dict[str, dict] = {}
-    for row in target.get('data') or []:
-        if not isinstance(row, list):
-            continue
-        code = str(row[idx['證券代號']]).strip() if '證券代號' in idx else ''
-        if not code:
-            continue
-        shares = _parse_twse_market_number(row[idx['成交股數']]) if '成交股數' in idx else None
-        volume_lots = int(shares / 1000) if shares is not None else None
-        out[code] = {
-            'warrant_name': str(row[idx['證券名稱']]).strip() if '證券名稱' in idx else None,
-            'open_price': _parse_twse_market_number(row[idx['開盤價']]) if '開盤價' in idx else None,
-            'high_price': _parse_twse_market_number(row[idx['最高價']]) if '最高價' in idx else None,
-            'low_price': _parse_twse_market_number(row[idx['最低價']]) if '最低價' in idx else None,
-            'close_price': _parse_twse_market_number(row[idx['收盤價']]) if '收盤價' in idx else None,
-            'price_change': _parse_twse_market_number(row[idx['漲跌價差']]) if '漲跌價差' in idx else None,
-            'turnover': _parse_twse_market_number(row[idx['成交金額']]) if '成交金額' in idx else None,
-            'volume': volume_lots,
-        }
-    return out
+def _fetch_twse_daily_snapshot(trade_date_obj: date) -> mi_index.DailySnapshot | None:
+    """取得指定日 MI_INDEX 快照（已解析、程序內快取），股價與權證共用。"""
+    return mi_index.fetch_snapshot(trade_date_obj, fetch=_fetch_twse_mi_index_payload)
 
 
 def _fetch_twse_mi_index_ohlc(trade_date_obj: date) -> dict[str, dict]:
     """從 MI_INDEX 全市場收盤行情取出各證券 OHLC／成交（含權證）。"""
-    payload = _fetch_twse_mi_index_payload(trade_date_obj)
-    if not payload:
+    snapshot = _fetch_twse_daily_snapshot(trade_date_obj)
+    if snapshot is None:
         raise RuntimeError(f'MI_INDEX unavailable for {trade_date_obj.isoformat()}')
-    return _parse_twse_mi_index_quotes(payload)
+    return snapshot.trade_quotes()
 
 
-def _find_latest_twse_mi_index_date(max_back_days: int = 10) -> tuple[date, dict[str, dict]]:
-    """往回找最近一個有 MI_INDEX 收盤行情的交易日，回傳 (date, quotes)。"""
+def _find_latest_twse_daily_snapshot(max_back_days: int = 10) -> mi_index.DailySnapshot:
+    """往回找最近一個有 MI_INDEX 收盤行情的交易日。"""
     start = _taipei_today()
     last_err = None
     for i in range(max(1, max_back_days)):
         d = start - timedelta(days=i)
         try:
-            payload = _fetch_twse_mi_index_payload(d)
-            if not payload:
-                continue
-            quotes = _parse_twse_mi_index_quotes(payload)
-            if quotes:
-                return d, quotes
+            snapshot = _fetch_twse_daily_snapshot(d)
+            if snapshot is not None and snapshot.quotes:
+                return snapshot
         except Exception as e:
             last_err = e
             continue
@@ -8552,65 +9174,7 @@ def _upsert_tw_warrant_trade_from_mi_index(
     master_codes: set[str] | None = None,
 ) -> int:
     """以 MI_INDEX 整批 upsert 權證成交（含 OHLC／金額／張數）。"""
-    if not quotes:
-        return 0
-    rows = []
-    for code, q in quotes.items():
-        name = q.get('warrant_name')
-        if master_codes is not None:
-            if code not in master_codes and not _is_warrant_like_name(name):
-                continue
-        elif not _is_warrant_like_name(name):
-            continue
-        # 無價且無量則略過（避免塞一堆空白列）
-        if (
-            q.get('close_price') is None
-            and q.get('open_price') is None
-            and not (q.get('turnover') or 0)
-            and not (q.get('volume') or 0)
-        ):
-            continue
-        rows.append((
-            trade_date_obj,  # out_date
-            trade_date_obj,
-            code,
-            name,
-            q.get('turnover'),
-            q.get('volume'),
-            q.get('open_price'),
-            q.get('high_price'),
-            q.get('low_price'),
-            q.get('close_price'),
-            q.get('price_change'),
-        ))
-    if not rows:
-        return 0
-    execute_values(
-        cursor,
-        """
-        INSERT INTO tw_warrant_trade (
-            out_date, trade_date, warrant_code, warrant_name,
-            turnover, volume,
-            open_price, high_price, low_price, close_price, price_change,
-            updated_at
-        ) VALUES %s
-        ON CONFLICT (warrant_code, trade_date) DO UPDATE SET
-            out_date = EXCLUDED.out_date,
-            warrant_name = COALESCE(EXCLUDED.warrant_name, tw_warrant_trade.warrant_name),
-            turnover = COALESCE(EXCLUDED.turnover, tw_warrant_trade.turnover),
-            volume = COALESCE(EXCLUDED.volume, tw_warrant_trade.volume),
-            open_price = COALESCE(EXCLUDED.open_price, tw_warrant_trade.open_price),
-            high_price = COALESCE(EXCLUDED.high_price, tw_warrant_trade.high_price),
-            low_price = COALESCE(EXCLUDED.low_price, tw_warrant_trade.low_price),
-            close_price = COALESCE(EXCLUDED.close_price, tw_warrant_trade.close_price),
-            price_change = COALESCE(EXCLUDED.price_change, tw_warrant_trade.price_change),
-            updated_at = NOW()
-        """,
-        rows,
-        template='(%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,%s,NOW())',
-        page_size=2000,
-    )
-    return len(rows)
+    return mi_index.write_warrant_trades(cursor, trade_date_obj, quotes, master_codes)
 
 
 def _enrich_tw_warrant_trade_ohlc(cursor, trade_date_obj: date) -> int:
@@ -8635,8 +9199,31 @@ def _enrich_tw_warrant_trade_ohlc(cursor, trade_date_obj: date) -> int:
     return _upsert_tw_warrant_trade_from_mi_index(cursor, trade_date_obj, quotes, master_codes=None)
 
 
-def _import_tpex_warrant_daily_rows(cursor, data: list) -> tuple[int, str | None]:
-    """寫入上櫃權證日行情，回傳 (筆數, trade_date_str)。"""
+def ingest_twse_daily_snapshot(
+    cursor,
+    snapshot: mi_index.DailySnapshot,
+    *,
+    prices_table: str,
+    master_codes: set[str] | None = None,
+    stocks: bool = True,
+    warrants: bool = True,
+) -> dict:
+    """一份 MI_INDEX 快照同時寫入 tw_stock_prices 與 tw_warrant_trade（由呼叫端 commit，同一交易）。"""
+    return mi_index.ingest(
+        cursor,
+        snapshot,
+        prices_table=prices_table,
+        master_codes=master_codes,
+        stocks=stocks,
+        warrants=warrants,
+    )
+
+
+def _import_tpex_warrant_daily_rows(cursor, data: list, *, refresh_snapshots: bool = True) -> tuple[int, str | None]:
+    """寫入上櫃權證日行情，回傳 (筆數, trade_date_str)。
+
+    refresh_snapshots=False 時不更新 latest_warrant_bars／技術狀態／當日排行（多日回補結束後一次補）。
+    """
     if not data:
         return 0, None
     first_trade_date = _parse_roc_date_text(data[0].get('Date'))
@@ -8668,11 +9255,17 @@ def _import_tpex_warrant_daily_rows(cursor, data: list) -> tuple[int, str | None
     rows = []
     batch_size = 1000
     affected = 0
+    touched_codes: set[str] = set()
+    trade_dates: set[date] = set()
+    earliest_date = None
     for item in data:
         trade_date = _parse_roc_date_text(item.get('Date'))
         code = str(item.get('Code') or '').strip()
         if trade_date is None or not code:
             continue
+        touched_codes.add(code)
+        trade_dates.add(trade_date)
+        earliest_date = trade_date if earliest_date is None else min(earliest_date, trade_date)
         rows.append((
             trade_date,
             code,
@@ -8706,6 +9299,11 @@ def _import_tpex_warrant_daily_rows(cursor, data: list) -> tuple[int, str | None
             page_size=batch_size,
         )
         affected += len(rows)
+    if refresh_snapshots:
+        refresh_latest_warrant_bars(cursor, 'TPEX', touched_codes)
+        warrant_ta_state.update_states(cursor, 'TPEX', touched_codes, since=earliest_date)
+        for day in sorted(trade_dates):
+            warrant_rankings.build_day(cursor, 'TPEX', day)
     return affected, trade_date_str
 
 
@@ -8775,59 +9373,76 @@ def _backfill_tpex_warrant_daily_range(
     end_date: date,
     *,
     sleep_sec: float = 0.35,
+    workers: int = tpex_backfill.DEFAULT_WORKERS,
+    retry_failed: bool = True,
+    force: bool = False,
     status: dict | None = None,
 ) -> dict:
-    """逐日回補 tpex_warrant_daily_quotes，回傳統計。"""
+    """回補 tpex_warrant_daily_quotes：只抓交易日、多日並行（同一主機限速 sleep_sec 秒一次），
+
+    每日各自一個交易並記錄於 tpex_warrant_backfill_days；重跑時略過已完成日，
+    失敗日收集後留待下次重試，不中斷整段區間。回傳統計。
+    """
     if end_date < start_date:
         start_date, end_date = end_date, start_date
     st = status if isinstance(status, dict) else {}
-    total_days = (end_date - start_date).days + 1
+
+    cursor = db_manager.connection.cursor()
+    try:
+        plan = tpex_backfill.plan_days(
+            cursor, start_date, end_date,
+            prices_table=db_manager.table_prices, retry_failed=retry_failed, force=force,
+        )
+        db_manager.connection.commit()
+    finally:
+        cursor.close()
+    days = plan['days']
     st.update({
         'running': True,
         'startedAt': st.get('startedAt') or datetime.utcnow().isoformat(),
         'finishedAt': None,
         'start': start_date.isoformat(),
         'end': end_date.isoformat(),
-        'totalDays': total_days,
+        'totalDays': len(days),
         'processedDays': 0,
         'importedDays': 0,
         'skippedDays': 0,
+        'resumedDays': len(plan['completed']),
+        'holidayDays': len(plan['holidays']),
+        'failedDays': 0,
+        'failures': [],
         'importedCount': 0,
+        'workers': workers,
         'currentDate': None,
         'error': None,
     })
 
-    cursor = db_manager.connection.cursor()
-    cur = start_date
-    while cur <= end_date:
-        st['currentDate'] = cur.isoformat()
-        try:
-            data = _fetch_tpex_warrant_daily_csv_for_date(cur)
-            if not data:
-                st['skippedDays'] = int(st.get('skippedDays') or 0) + 1
-            else:
-                cursor.execute('BEGIN')
-                try:
-                    affected, _ = _import_tpex_warrant_daily_rows(cursor, data)
-                    db_manager.connection.commit()
-                except Exception:
-                    try:
-                        db_manager.connection.rollback()
-                    except Exception:
-                        pass
-                    raise
-                st['importedDays'] = int(st.get('importedDays') or 0) + 1
-                st['importedCount'] = int(st.get('importedCount') or 0) + int(affected or 0)
-        except Exception as e:
-            st['error'] = f'{cur.isoformat()}: {e}'
-            logger.exception('TPEX 權證日線回補失敗 %s', cur.isoformat())
-            raise
-        finally:
-            st['processedDays'] = int(st.get('processedDays') or 0) + 1
-        if sleep_sec and sleep_sec > 0 and cur < end_date:
-            time.sleep(sleep_sec)
-        cur += timedelta(days=1)
+    def on_day(day, day_status, result):
+        st['processedDays'] = int(st.get('processedDays') or 0) + 1
+        st['currentDate'] = day.isoformat()
+        st['importedDays'] = result.imported_days
+        st['skippedDays'] = result.empty_days
+        st['failedDays'] = len(result.failures)
+        st['importedCount'] = result.imported_count
+
+    result = tpex_backfill.run_backfill(
+        db_manager.connection,
+        days,
+        fetch=_fetch_tpex_warrant_daily_csv_for_date,
+        write=lambda cur, rows: _import_tpex_warrant_daily_rows(cur, rows, refresh_snapshots=False)[0],
+        workers=workers,
+        limiter=tpex_backfill.HostRateLimiter(sleep_sec),
+        on_day=on_day,
+    )
+
+    # 最新 K 棒快照與技術狀態在整段回補後一次更新；回補日的排行於查詢時重建
+    if tpex_backfill.finish_range(db_manager.connection, result):
+        _warrant_portal_stats_memo.pop(db_manager.is_neon, None)
 
+    st['failures'] = result.failures
+    st['failedDays'] = len(result.failures)
+    if result.failures:
+        st['error'] = f"{len(result.failures)} 日失敗，重新執行即可重試（首筆 {result.failures[0]['date']}: {result.failures[0]['error']}）"
     st['running'] = False
     st['finishedAt'] = datetime.utcnow().isoformat()
     st['currentDate'] = None
@@ -8835,91 +9450,20 @@ def _backfill_tpex_warrant_daily_range(
         'start': start_date.isoformat(),
         'end': end_date.isoformat(),
         'processedDays': st.get('processedDays'),
-        'importedDays': st.get('importedDays'),
-        'skippedDays': st.get('skippedDays'),
-        'importedCount': st.get('importedCount'),
+        'resumedDays': st.get('resumedDays'),
+        'holidayDays': st.get('holidayDays'),
+        **result.summary(),
+        'skippedDays': result.empty_days,
     }
 
 
 def _fetch_twse_warrant_stock_day(code: str, year: int, month: int) -> list[dict]:
     """抓取單檔權證某月日 OHLC（STOCK_DAY）。"""
-    ymd = f'{year}{month:02d}01'
-    url = (
-        'https://www.twse.com.tw/exchangeReport/STOCK_DAY'
-        f'?response=json&date={ymd}&stockNo={code}'
-    )
-    resp = requests.get(url, timeout=30, headers={'User-Agent': 'Mozilla/5.0'})
-    if resp.status_code != 200:
-        return []
-    try:
-        payload = resp.json()
-    except Exception:
-        return []
-    if not isinstance(payload, dict) or payload.get('stat') != 'OK':
-        return []
-    fields = payload.get('fields') or []
-    idx = {name: i for i, name in enumerate(fields)}
-    rows = []
-    for row in payload.get('data') or []:
-        if not isinstance(row, list):
-            continue
-        trade_date_obj = _parse_twse_roc_slash_date(row[idx['日期']]) if '日期' in idx else None
-        if not trade_date_obj:
-            continue
-        shares = _parse_twse_market_number(row[idx['成交股數']]) if '成交股數' in idx else None
-        volume_lots = int(shares / 1000) if shares is not None else None
-        rows.append({
-            'trade_date': trade_date_obj,
-            'warrant_code': code,
-            'turnover': _parse_twse_market_number(row[idx['成交金額']]) if '成交金額' in idx else None,
-            'volume': volume_lots,
-            'open_price': _parse_twse_market_number(row[idx['開盤價']]) if '開盤價' in idx else None,
-            'high_price': _parse_twse_market_number(row[idx['最高價']]) if '最高價' in idx else None,
-            'low_price': _parse_twse_market_number(row[idx['最低價']]) if '最低價' in idx else None,
-            'close_price': _parse_twse_market_number(row[idx['收盤價']]) if '收盤價' in idx else None,
-            'price_change': _parse_twse_market_number(row[idx['漲跌價差']]) if '漲跌價差' in idx else None,
-        })
-    return rows
+    return warrant_ohlc_enrichment.fetch_stock_day(code, year, month)
 
 
 def _upsert_tw_warrant_trade_ohlc_rows(cursor, rows: list[dict]) -> int:
-    if not rows:
-        return 0
-    values = []
-    for r in rows:
-        values.append((
-            r.get('trade_date'),
-            r.get('warrant_code'),
-            r.get('turnover'),
-            r.get('volume'),
-            r.get('open_price'),
-            r.get('high_price'),
-            r.get('low_price'),
-            r.get('close_price'),
-            r.get('price_change'),
-        ))
-    execute_values(
-        cursor,
-        """
-        INSERT INTO tw_warrant_trade (
-            trade_date, warrant_code, turnover, volume,
-            open_price, high_price, low_price, close_price, price_change, updated_at
-        ) VALUES %s
-        ON CONFLICT (warrant_code, trade_date) DO UPDATE SET
-            turnover = COALESCE(EXCLUDED.turnover, tw_warrant_trade.turnover),
-            volume = COALESCE(EXCLUDED.volume, tw_warrant_trade.volume),
-            open_price = COALESCE(EXCLUDED.open_price, tw_warrant_trade.open_price),
-            high_price = COALESCE(EXCLUDED.high_price, tw_warrant_trade.high_price),
-            low_price = COALESCE(EXCLUDED.low_price, tw_warrant_trade.low_price),
-            close_price = COALESCE(EXCLUDED.close_price, tw_warrant_trade.close_price),
-            price_change = COALESCE(EXCLUDED.price_change, tw_warrant_trade.price_change),
-            updated_at = NOW()
-        """,
-        values,
-        template='(%s,%s,%s,%s,%s,%s,%s,%s,%s,NOW())',
-        page_size=500,
-    )
-    return len(values)
+    return warrant_ohlc_enrichment.write_stock_day_rows(cursor, rows)
 
 
 def _fetch_json_list(url: str):
@@ -9053,7 +9597,7 @@ def _require_quantgems_admin():
     return None
 
 
-@app.route('/api/warrants/import-latest', methods=['POST'])
+@warrants_bp.route('/api/warrants/import-latest', methods=['POST'])
 def import_latest_warrants():
     """同步最新權證成交：上市用 MI_INDEX（OHLC＋成交金額／張數），上櫃用 TPEX 日行情。
 
@@ -9090,12 +9634,15 @@ def import_latest_warrants():
             cursor = db_manager.connection.cursor()
             cursor.execute('BEGIN')
 
-            # --- TWSE MI_INDEX ---
+            # --- TWSE MI_INDEX（同一份快照同時寫入上市股價與權證成交）---
             if date_param:
                 trade_date_obj = datetime.strptime(date_param, '%Y-%m-%d').date()
-                quotes = _fetch_twse_mi_index_ohlc(trade_date_obj)
+                snapshot = _fetch_twse_daily_snapshot(trade_date_obj)
+                if snapshot is None:
+                    raise RuntimeError(f'MI_INDEX unavailable for {trade_date_obj.isoformat()}')
             else:
-                trade_date_obj, quotes = _find_latest_twse_mi_index_date(max_back_days=10)
+                snapshot = _find_latest_twse_daily_snapshot(max_back_days=10)
+                trade_date_obj = snapshot.trade_date
 
             cursor.execute('SELECT warrant_code FROM tw_warrant_master')
             master_codes = set()
@@ -9104,10 +9651,12 @@ def import_latest_warrants():
                 if code:
                     master_codes.add(str(code).strip())
 
-            twse_count = _upsert_tw_warrant_trade_from_mi_index(
-                cursor, trade_date_obj, quotes, master_codes=master_codes or None,
+            ingested = ingest_twse_daily_snapshot(
+                cursor, snapshot, prices_table=db_manager.table_prices, master_codes=master_codes or None,
             )
-            warrants_import_status['total'] = len(quotes)
+            twse_count = ingested['warrantTrades']
+            warrants_import_status['total'] = ingested['securities']
+            warrants_import_status['stockPricesUpdated'] = ingested['stockPrices']
             warrants_import_status['processed'] = twse_count
             warrants_import_status['importedCount'] = twse_count
             warrants_import_status['tradeDate'] = trade_date_obj.strftime('%Y-%m-%d')
@@ -9144,6 +9693,8 @@ def import_latest_warrants():
                 tpex_warrant_daily_import_status['error'] = tpex_error
 
             db_manager.connection.commit()
+            _sync_warrant_bar_cache(db_manager)
+            _refresh_warrant_portal_stats(db_manager)
 
             trade_date_str = trade_date_obj.strftime('%Y-%m-%d')
             warrants_import_status['running'] = False
@@ -9162,6 +9713,7 @@ def import_latest_warrants():
                 'message': '權證資料匯入完成：' + '；'.join(msg_parts),
                 'importedCount': twse_count,
                 'ohlcUpdated': twse_count,
+                'stockPricesUpdated': ingested['stockPrices'],
                 'tradeDate': trade_date_str,
                 'tpexImportedCount': tpex_count,
                 'tpexTradeDate': tpex_date_str,
@@ -9188,21 +9740,23 @@ def import_latest_warrants():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-@app.route('/api/warrants/import-status', methods=['GET'])
+@warrants_bp.route('/api/warrants/import-status', methods=['GET'])
 def get_warrants_import_status_api():
-    """回傳 TWSE 權證日成交與主檔匯入進度狀態，供前端輪詢顯示。"""
+    """回傳 TWSE 權證日成交、主檔匯入與 OHLC 補齊進度狀態，供前端輪詢顯示。"""
     try:
         return jsonify({
             'success': True,
-            'status': warrants_import_status,
-            'master': twse_warrant_master_import_status,
+            'status': _job_status_view('warrants_import_status'),
+            'master': _job_status_view('twse_warrant_master_import_status'),
+            'ohlcEnrich': _job_status_view('twse_warrant_ohlc_enrich_status'),
+            'partitions': _job_status_view('warrant_partition_status'),
         })
     except Exception as e:
         logger.exception('取得權證匯入狀態失敗')
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-@app.route('/api/warrants/twse/import-master', methods=['POST'])
+@warrants_bp.route('/api/warrants/twse/import-master', methods=['POST'])
 def import_twse_warrant_master():
     """從 TWSE OpenAPI 抓取上市權證基本資料（全部有發行）並匯入 tw_warrant_master。
 
@@ -9364,6 +9918,8 @@ def import_twse_warrant_master():
                 affected += len(rows)
 
             db_manager.connection.commit()
+            _refresh_warrant_search(db_manager, 'TWSE')
+            _refresh_warrant_portal_stats(db_manager)
             twse_warrant_master_import_status['running'] = False
             twse_warrant_master_import_status['finishedAt'] = datetime.utcnow().isoformat()
             twse_warrant_master_import_status['processed'] = affected
@@ -9393,7 +9949,7 @@ def import_twse_warrant_master():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-@app.route('/api/warrants/tpex/import-master', methods=['POST'])
+@warrants_bp.route('/api/warrants/tpex/import-master', methods=['POST'])
 def import_tpex_warrant_master():
     """從 TPEX API 抓取上櫃權證主檔並匯入 tpex_warrant_master。"""
     try:
@@ -9494,6 +10050,8 @@ def import_tpex_warrant_master():
                 affected += len(rows)
 
             db_manager.connection.commit()
+            _refresh_warrant_search(db_manager, 'TPEX')
+            _refresh_warrant_portal_stats(db_manager)
             tpex_warrant_master_import_status['running'] = False
             tpex_warrant_master_import_status['finishedAt'] = datetime.utcnow().isoformat()
             tpex_warrant_master_import_status['processed'] = affected
@@ -9519,7 +10077,7 @@ def import_tpex_warrant_master():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-@app.route('/api/warrants/tpex/import-daily', methods=['POST'])
+@warrants_bp.route('/api/warrants/tpex/import-daily', methods=['POST'])
 def import_tpex_warrant_daily():
     """從 TPEX API 抓取上櫃權證日行情並匯入 tpex_warrant_daily_quotes。"""
     try:
@@ -9550,6 +10108,8 @@ def import_tpex_warrant_daily():
             tpex_warrant_daily_import_status['tradeDate'] = trade_date_str
 
             db_manager.connection.commit()
+            _sync_warrant_bar_cache(db_manager)
+            _refresh_warrant_portal_stats(db_manager)
             tpex_warrant_daily_import_status['running'] = False
             tpex_warrant_daily_import_status['finishedAt'] = datetime.utcnow().isoformat()
             tpex_warrant_daily_import_status['processed'] = affected
@@ -9575,37 +10135,41 @@ def import_tpex_warrant_daily():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-@app.route('/api/warrants/tpex/import-status', methods=['GET'])
+@warrants_bp.route('/api/warrants/tpex/import-status', methods=['GET'])
 def get_tpex_warrant_import_status_api():
     """回傳 TPEX 權證主檔與日行情匯入狀態。"""
     try:
         return jsonify({
             'success': True,
-            'master': tpex_warrant_master_import_status,
-            'daily': tpex_warrant_daily_import_status,
-            'backfill': tpex_warrant_daily_backfill_status,
+            'master': _job_status_view('tpex_warrant_master_import_status'),
+            'daily': _job_status_view('tpex_warrant_daily_import_status'),
+            'backfill': _job_status_view('tpex_warrant_daily_backfill_status'),
         })
     except Exception as e:
         logger.exception('取得 TPEX 權證匯入狀態失敗')
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-@app.route('/api/warrants/tpex/backfill-daily', methods=['POST'])
+@warrants_bp.route('/api/warrants/tpex/backfill-daily', methods=['POST'])
 def backfill_tpex_warrant_daily():
     """以櫃買歷史日報表 CSV 回補上櫃權證日線（預設背景執行）。
 
     JSON／query：
       - start: YYYY-MM-DD（預設 end 往前 180 天）
       - end: YYYY-MM-DD（預設今天）
-      - sleepSec: 每日間隔秒數（預設 0.35）
+      - sleepSec: 對櫃買主機的請求最小間隔秒數（預設 0.35，所有並行請求共用）
+      - workers: 同時抓取的日數（預設 4，上限 8）
+      - retryFailed: 是否重抓先前失敗的日子（預設 true）；force: true 則連已完成日也重抓
       - sync: true 則同步執行（適合本機；Vercel 易逾時）
+
+    每日完成狀態記錄於 tpex_warrant_backfill_days，中斷後重跑同一區間會從未完成日繼續。
     """
     denied = _require_quantgems_admin()
     if denied is not None:
         return denied
 
     global tpex_warrant_daily_backfill_status
-    if tpex_warrant_daily_backfill_status.get('running'):
+    if tpex_warrant_daily_backfill_status.get('running') or _job_status_view('tpex_warrant_daily_backfill_status').get('running'):
         return jsonify({
             'success': False,
             'error': '回補進行中',
@@ -9616,7 +10180,10 @@ def backfill_tpex_warrant_daily():
     end_raw = (request.args.get('end') or body.get('end') or '').strip()
     start_raw = (request.args.get('start') or body.get('start') or '').strip()
     sleep_raw = request.args.get('sleepSec', body.get('sleepSec', 0.35))
+    workers_raw = request.args.get('workers', body.get('workers', tpex_backfill.DEFAULT_WORKERS))
     sync = str(request.args.get('sync') or body.get('sync') or '').lower() in ('1', 'true', 'yes')
+    retry_failed = str(request.args.get('retryFailed', body.get('retryFailed', '1'))).lower() not in ('0', 'false', 'no', 'off')
+    force = str(request.args.get('force') or body.get('force') or '').lower() in ('1', 'true', 'yes')
 
     try:
         end_date = date.fromisoformat(end_raw) if end_raw else date.today()
@@ -9635,6 +10202,11 @@ def backfill_tpex_warrant_daily():
     except Exception:
         sleep_sec = 0.35
     sleep_sec = max(0.0, min(5.0, sleep_sec))
+    try:
+        workers = int(workers_raw)
+    except Exception:
+        workers = tpex_backfill.DEFAULT_WORKERS
+    workers = max(1, min(tpex_backfill.MAX_WORKERS, workers))
 
     # 單次最多 400 曆日，避免誤觸超長任務
     if (end_date - start_date).days > 400:
@@ -9672,6 +10244,9 @@ def backfill_tpex_warrant_daily():
                 start_date,
                 end_date,
                 sleep_sec=sleep_sec,
+                workers=workers,
+                retry_failed=retry_failed,
+                force=force,
                 status=tpex_warrant_daily_backfill_status,
             )
         except Exception as e:
@@ -9699,7 +10274,318 @@ def backfill_tpex_warrant_daily():
     })
 
 
-@app.route('/api/warrants/tpex/dates', methods=['GET'])
+def _enrich_twse_warrant_ohlc_range(
+    db_manager,
+    start_date: date,
+    end_date: date,
+    *,
+    workers: int,
+    stock_day: bool,
+    codes: list[str] | None,
+    status: dict,
+) -> dict:
+    """補齊區間內缺價的上市權證日線：先以 MI_INDEX 逐日整批補，再對仍缺的 (代號, 月) 以 STOCK_DAY 補。"""
+    st = status
+
+    def on_progress(phase, item, item_status):
+        st['phase'] = phase
+        st['processed'] = int(st.get('processed') or 0) + 1
+        st['current'] = item.isoformat() if isinstance(item, date) else f'{item[0]} {item[1]}-{item[2]:02d}'
+
+    def write_snapshot(cursor, snapshot, only_codes):
+        quotes = snapshot.trade_quotes()
+        if only_codes is not None:
+            quotes = {c: q for c, q in quotes.items() if c in only_codes}
+        # 最新 K 棒／技術狀態／排行由 run_enrichment 在整段補齊後一次更新
+        return mi_index.write_warrant_trades(cursor, snapshot.trade_date, quotes, refresh_snapshots=False)
+
+    result = warrant_ohlc_enrichment.run_enrichment(
+        db_manager.connection,
+        start_date,
+        end_date,
+        fetch_snapshot=_fetch_twse_daily_snapshot,
+        write_snapshot=write_snapshot,
+        fetch_stock_day=_fetch_twse_warrant_stock_day,
+        write_stock_day=lambda cursor, rows: warrant_ohlc_enrichment.write_stock_day_rows(
+            cursor, rows, refresh_snapshots=False,
+        ),
+        codes=codes,
+        workers=workers,
+        stock_day=stock_day,
+        on_progress=on_progress,
+    )
+    summary = result.summary()
+    _sync_warrant_bar_cache(db_manager)
+    st['snapshotDays'] = summary['snapshot']['requests']
+    st['stockDayTasks'] = summary['stockDay']['requests']
+    st['result'] = summary
+    failed = summary['snapshot']['failed'] + summary['stockDay']['failed']
+    if failed:
+        st['error'] = f'{failed} 項失敗，重新執行即可重試'
+    st['running'] = False
+    st['finishedAt'] = datetime.utcnow().isoformat()
+    st['phase'] = None
+    st['current'] = None
+    return summary
+
+
+@warrants_bp.route('/api/warrants/twse/enrich-ohlc', methods=['POST'])
+def enrich_twse_warrant_ohlc():
+    """補齊上市權證日線缺價（tw_warrant_trade.close_price 為空）。
+
+    JSON／query：
+      - start／end: YYYY-MM-DD（預設最近 30 天）
+      - workers: 同時抓取數（預設 4，上限 8；對 TWSE 的請求共用 TWSE_MIN_INTERVAL 間隔）
+      - stockDay: 是否以 STOCK_DAY 補 MI_INDEX 仍缺的代號（預設 true）
+      - codes: 只處理指定權證代號（陣列或逗號分隔）
+      - sync: true 則同步執行
+    """
+    denied = _require_quantgems_admin()
+    if denied is not None:
+        return denied
+
+    global twse_warrant_ohlc_enrich_status
+    if twse_warrant_ohlc_enrich_status.get('running') or _job_status_view('twse_warrant_ohlc_enrich_status').get('running'):
+        return jsonify({
+            'success': False,
+            'error': '補齊進行中',
+            'status': twse_warrant_ohlc_enrich_status,
+        }), 409
+
+    body = request.get_json(silent=True) or {}
+    end_raw = (request.args.get('end') or body.get('end') or '').strip()
+    start_raw = (request.args.get('start') or body.get('start') or '').strip()
+    workers_raw = request.args.get('workers', body.get('workers', warrant_ohlc_enrichment.DEFAULT_WORKERS))
+    stock_day = str(request.args.get('stockDay', body.get('stockDay', '1'))).lower() not in ('0', 'false', 'no', 'off')
+    sync = str(request.args.get('sync') or body.get('sync') or '').lower() in ('1', 'true', 'yes')
+    codes_raw = request.args.get('codes') or body.get('codes') or None
+    if isinstance(codes_raw, str):
+        codes_raw = codes_raw.split(',')
+    codes = [str(c).strip() for c in codes_raw if str(c).strip()] if codes_raw else None
+
+    try:
+        end_date = date.fromisoformat(end_raw) if end_raw else _taipei_today()
+        start_date = date.fromisoformat(start_raw) if start_raw else (end_date - timedelta(days=30))
+    except Exception:
+        return jsonify({'success': False, 'error': '日期格式須為 YYYY-MM-DD'}), 400
+    try:
+        workers = int(workers_raw)
+    except Exception:
+        workers = warrant_ohlc_enrichment.DEFAULT_WORKERS
+    workers = max(1, min(warrant_ohlc_enrichment.MAX_WORKERS, workers))
+    if abs((end_date - start_date).days) > 400:
+        return jsonify({'success': False, 'error': '單次補齊區間不可超過 400 天'}), 400
+
+    twse_warrant_ohlc_enrich_status = {
+        'running': True,
+        'startedAt': datetime.utcnow().isoformat(),
+        'finishedAt': None,
+        'start': start_date.isoformat(),
+        'end': end_date.isoformat(),
+        'phase': 'plan',
+        'snapshotDays': 0,
+        'stockDayTasks': 0,
+        'processed': 0,
+        'current': None,
+        'result': None,
+        'error': None,
+    }
+
+    use_local_db = request.args.get('use_local_db') or body.get('use_local_db')
+
+    def _job():
+        db_manager = DatabaseManager.from_request_args({'use_local_db': use_local_db})
+        if not db_manager.connect():
+            twse_warrant_ohlc_enrich_status['running'] = False
+            twse_warrant_ohlc_enrich_status['finishedAt'] = datetime.utcnow().isoformat()
+            twse_warrant_ohlc_enrich_status['error'] = '資料庫連接失敗'
+            return
+        try:
+            _enrich_twse_warrant_ohlc_range(
+                db_manager,
+                start_date,
+                end_date,
+                workers=workers,
+                stock_day=stock_day,
+                codes=codes,
+                status=twse_warrant_ohlc_enrich_status,
+            )
+        except Exception as e:
+            twse_warrant_ohlc_enrich_status['running'] = False
+            twse_warrant_ohlc_enrich_status['finishedAt'] = datetime.utcnow().isoformat()
+            twse_warrant_ohlc_enrich_status['error'] = str(e)
+            logger.exception('上市權證 OHLC 補齊任務失敗')
+        finally:
+            db_manager.disconnect()
+
+    if sync:
+        _job()
+        ok = not twse_warrant_ohlc_enrich_status.get('error')
+        return jsonify({
+            'success': ok,
+            'message': '上市權證 OHLC 補齊完成' if ok else '上市權證 OHLC 補齊失敗',
+            'status': twse_warrant_ohlc_enrich_status,
+        }), (200 if ok else 500)
+
+    threading.Thread(target=_job, daemon=True).start()
+    return jsonify({
+        'success': True,
+        'message': '上市權證 OHLC 補齊已開始（背景）',
+        'status': twse_warrant_ohlc_enrich_status,
+    })
+
+
+def _maintain_warrant_partitions(
+    db_manager,
+    *,
+    migrate: bool,
+    archive: bool,
+    markets: list[str],
+    grace_days: int,
+    status: dict,
+) -> dict:
+    """權證日線分區維護：（選擇性）轉為按月分區、預建／拆分月分區、到期權證歸檔。"""
+    st = status
+    today = _taipei_today()
+    result: dict = {'migrated': [], 'partitionsCreated': {}, 'archived': []}
+    conn = db_manager.connection
+    cur = conn.cursor()
+    try:
+        # DDL 與 create_tables 共用 schema 鎖，避免多個 worker 同時建分區
+        st['phase'] = 'partitions'
+        if not advisory_locks.try_xact_lock(cur, 'schema', db_manager.lock_target, timeout=60):
+            raise RuntimeError('取得建表鎖逾時')
+        if migrate:
+            for market in markets:
+                st['market'] = market
+                result['migrated'].append(warrant_partitions.migrate_to_partitioned(cur, market, today))
+        result['partitionsCreated'] = warrant_partitions.maintain(cur, today)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+    if archive:
+        st['phase'] = 'archive'
+        for market in markets:
+            st['market'] = market
+            base_codes, base_rows = st['archivedCodes'], st['archivedRows']
+
+            def on_batch(codes_done, rows_moved, _c=base_codes, _r=base_rows):
+                st['archivedCodes'] = _c + codes_done
+                st['archivedRows'] = _r + rows_moved
+
+            result['archived'].append(
+                warrant_partitions.archive_expired(conn, market, today, grace_days=grace_days, on_batch=on_batch)
+            )
+    st['result'] = result
+    st['running'] = False
+    st['finishedAt'] = datetime.utcnow().isoformat()
+    st['phase'] = None
+    st['market'] = None
+    return result
+
+
+@warrants_bp.route('/api/warrants/partitions/maintain', methods=['POST'])
+def maintain_warrant_partitions():
+    """權證日線（tw_warrant_trade／tpex_warrant_daily_quotes）分區維護與到期歸檔。
+
+    JSON／query：
+      - migrate: true 則把尚未分區的表一次轉為按 trade_date 月分區（單一交易、鎖表，僅需執行一次）
+      - archive: 是否把到期權證整段歷史搬到 *_archive 冷分區（預設 true）
+      - graceDays: 到期超過幾天才歸檔（預設 WARRANT_ARCHIVE_GRACE_DAYS）
+      - market: twse／tpex／both（預設 both）
+      - sync: true 則同步執行
+    每次執行都會預建未來月份分區，並把落在 default 分區的資料拆到各自月份。
+    """
+    denied = _require_quantgems_admin()
+    if denied is not None:
+        return denied
+
+    global warrant_partition_status
+    if warrant_partition_status.get('running') or _job_status_view('warrant_partition_status').get('running'):
+        return jsonify({
+            'success': False,
+            'error': '分區維護進行中',
+            'status': warrant_partition_status,
+        }), 409
+
+    body = request.get_json(silent=True) or {}
+
+    def _flag(name, default):
+        return str(request.args.get(name, body.get(name, default))).strip().lower() not in ('0', 'false', 'no', 'off', '')
+
+    migrate = _flag('migrate', '0')
+    archive = _flag('archive', '1')
+    sync = _flag('sync', '0')
+    market_raw = str(request.args.get('market') or body.get('market') or 'both').strip().lower()
+    if market_raw not in ('twse', 'tpex', 'both'):
+        return jsonify({'success': False, 'error': 'market 須為 twse／tpex／both'}), 400
+    markets = ['TWSE', 'TPEX'] if market_raw == 'both' else [market_raw.upper()]
+    try:
+        grace_days = max(0, int(request.args.get('graceDays', body.get('graceDays', WARRANT_ARCHIVE_GRACE_DAYS))))
+    except Exception:
+        return jsonify({'success': False, 'error': 'graceDays 須為整數'}), 400
+
+    warrant_partition_status = {
+        'running': True,
+        'startedAt': datetime.utcnow().isoformat(),
+        'finishedAt': None,
+        'phase': 'plan',
+        'market': None,
+        'archivedCodes': 0,
+        'archivedRows': 0,
+        'result': None,
+        'error': None,
+    }
+
+    use_local_db = request.args.get('use_local_db') or body.get('use_local_db')
+
+    def _job():
+        db_manager = DatabaseManager.from_request_args({'use_local_db': use_local_db})
+        if not db_manager.connect():
+            warrant_partition_status['running'] = False
+            warrant_partition_status['finishedAt'] = datetime.utcnow().isoformat()
+            warrant_partition_status['error'] = '資料庫連接失敗'
+            return
+        try:
+            db_manager.create_tables()
+            _maintain_warrant_partitions(
+                db_manager,
+                migrate=migrate,
+                archive=archive,
+                markets=markets,
+                grace_days=grace_days,
+                status=warrant_partition_status,
+            )
+        except Exception as e:
+            warrant_partition_status['running'] = False
+            warrant_partition_status['finishedAt'] = datetime.utcnow().isoformat()
+            warrant_partition_status['error'] = str(e)
+            logger.exception('權證日線分區維護失敗')
+        finally:
+            db_manager.disconnect()
+
+    if sync:
+        _job()
+        ok = not warrant_partition_status.get('error')
+        return jsonify({
+            'success': ok,
+            'message': '權證日線分區維護完成' if ok else '權證日線分區維護失敗',
+            'status': warrant_partition_status,
+        }), (200 if ok else 500)
+
+    threading.Thread(target=_job, daemon=True).start()
+    return jsonify({
+        'success': True,
+        'message': '權證日線分區維護已開始（背景）',
+        'status': warrant_partition_status,
+    })
+
+
+@warrants_bp.route('/api/warrants/tpex/dates', methods=['GET'])
 def get_tpex_warrant_dates():
     """取得 tpex_warrant_daily_quotes 中可用的交易日期清單。"""
     try:
@@ -9742,7 +10628,7 @@ def get_tpex_warrant_dates():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-@app.route('/api/warrants/tpex', methods=['GET'])
+@warrants_bp.route('/api/warrants/tpex', methods=['GET'])
 def query_tpex_warrants():
     """依日期與關鍵字查詢 TPEX 權證日行情。"""
     try:
@@ -9851,7 +10737,7 @@ def query_tpex_warrants():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-@app.route('/api/warrants/dates', methods=['GET'])
+@warrants_bp.route('/api/warrants/dates', methods=['GET'])
 def get_warrant_dates():
     """取得權證可用的交易日期清單，支援 TWSE / TPEX / 全市場。"""
     try:
@@ -9951,70 +10837,49 @@ def _warrant_row_int(val):
         return None
 
 
-@app.route('/api/warrants/portal/stats', methods=['GET'])
+_warrant_portal_stats_memo: dict[bool, tuple[float, dict]] = {}
+
+
+def _refresh_warrant_portal_stats(db_manager) -> None:
+    """權證主檔／日行情匯入 commit 後重算首頁統計快取表（單一聚合查詢）。"""
+    cur = db_manager.connection.cursor()
+    try:
+        warrant_portal_stats.refresh(cur)
+        db_manager.connection.commit()
+        _warrant_portal_stats_memo.pop(db_manager.is_neon, None)
+    except Exception as exc:
+        logger.warning(f"權證首頁統計刷新失敗: {exc}")
+        db_manager.connection.rollback()
+    finally:
+        cur.close()
+
+
+@warrants_bp.route('/api/warrants/portal/stats', methods=['GET'])
 def warrants_portal_stats():
-    """權證雷達首頁統計：主檔筆數、認購認售、最新成交日。"""
+    """權證雷達首頁統計：主檔筆數、認購認售、最新成交日（讀 warrant_portal_stats 快取表）。"""
     try:
         db_manager = DatabaseManager.from_request_args(request.args)
+        cached = _warrant_portal_stats_memo.get(db_manager.is_neon)
+        if cached and time.time() - cached[0] < WARRANT_PORTAL_STATS_TTL:
+            return jsonify(cached[1])
         if not db_manager.connect():
             return jsonify({'success': False, 'error': '資料庫連接失敗'}), 500
         try:
+            _ensure_latest_bars_snapshot(db_manager)
             cur = db_manager.connection.cursor()
-
-            cur.execute('SELECT COUNT(*) AS n FROM tw_warrant_master')
-            tw_total = int((cur.fetchone() or {}).get('n') or 0)
-            cur.execute("SELECT COUNT(*) AS n FROM tw_warrant_master WHERE warrant_type = '認購'")
-            tw_call = int((cur.fetchone() or {}).get('n') or 0)
-            cur.execute("SELECT COUNT(*) AS n FROM tw_warrant_master WHERE warrant_type = '認售'")
-            tw_put = int((cur.fetchone() or {}).get('n') or 0)
-
-            cur.execute('SELECT COUNT(*) AS n FROM tpex_warrant_master')
-            tpex_total = int((cur.fetchone() or {}).get('n') or 0)
-            cur.execute("SELECT COUNT(*) AS n FROM tpex_warrant_master WHERE warrant_type = '認購'")
-            tpex_call = int((cur.fetchone() or {}).get('n') or 0)
-            cur.execute("SELECT COUNT(*) AS n FROM tpex_warrant_master WHERE warrant_type = '認售'")
-            tpex_put = int((cur.fetchone() or {}).get('n') or 0)
-
-            cur.execute('SELECT MAX(trade_date) AS d FROM tw_warrant_trade')
-            tw_latest = _warrant_row_date((cur.fetchone() or {}).get('d'))
-            cur.execute('SELECT MAX(trade_date) AS d FROM tpex_warrant_daily_quotes')
-            tpex_latest = _warrant_row_date((cur.fetchone() or {}).get('d'))
-
-            tw_traded = 0
-            if tw_latest:
-                cur.execute(
-                    'SELECT COUNT(*) AS n FROM tw_warrant_trade WHERE trade_date = %s AND COALESCE(turnover, 0) > 0',
-                    (tw_latest,),
-                )
-                tw_traded = int((cur.fetchone() or {}).get('n') or 0)
-            tpex_traded = 0
-            if tpex_latest:
-                cur.execute(
-                    'SELECT COUNT(*) AS n FROM tpex_warrant_daily_quotes WHERE trade_date = %s AND COALESCE(trade_value, 0) > 0',
-                    (tpex_latest,),
+            try:
+                rows = warrant_portal_stats.read(
+                    cur, max_age=timedelta(seconds=WARRANT_PORTAL_STATS_MAX_AGE),
                 )
-                tpex_traded = int((cur.fetchone() or {}).get('n') or 0)
+                db_manager.connection.commit()
+            finally:
+                cur.close()
         finally:
             db_manager.disconnect()
 
-        return jsonify({
-            'success': True,
-            'twse': {
-                'master_total': tw_total,
-                'call': tw_call,
-                'put': tw_put,
-                'latest_trade_date': tw_latest,
-                'traded_count': tw_traded,
-            },
-            'tpex': {
-                'master_total': tpex_total,
-                'call': tpex_call,
-                'put': tpex_put,
-                'latest_trade_date': tpex_latest,
-                'traded_count': tpex_traded,
-            },
-            'total_master': tw_total + tpex_total,
-        })
+        payload = warrant_portal_stats.payload(rows)
+        _warrant_portal_stats_memo[db_manager.is_neon] = (time.time(), payload)
+        return jsonify(payload)
     except Exception as e:
         logger.exception('權證 portal stats 失敗')
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -10040,7 +10905,94 @@ def _portal_opt_int(name: str):
         return None
 
 
-@app.route('/api/warrants/portal/master', methods=['GET'])
+_latest_bars_bootstrapped: set[bool] = set()
+
+
+def _ensure_latest_bars_snapshot(db_manager) -> None:
+    """權證端點不經 create_tables：確認兩市場權證快照已完成首次建置（不重建股價快照）。"""
+    if db_manager.is_neon in _latest_bars_bootstrapped:
+        return
+    cur = db_manager.connection.cursor()
+    try:
+        bootstrap_latest_bars(cur, parts=list(LATEST_WARRANT_MARKETS))
+        db_manager.connection.commit()
+        _latest_bars_bootstrapped.add(db_manager.is_neon)
+    except Exception as exc:
+        logger.warning(f"latest bar 快照初始化失敗: {exc}")
+        db_manager.connection.rollback()
+    finally:
+        cur.close()
+
+
+_warrant_ta_state_checked: dict[bool, float] = {}
+
+
+def _ensure_warrant_ta_state(db_manager) -> bool:
+    """補齊落後於 latest_warrant_bars 的技術狀態（首次即全量建立）；回傳狀態表是否可用。"""
+    now = time.time()
+    if now - _warrant_ta_state_checked.get(db_manager.is_neon, 0.0) < WARRANT_TA_STATE_CHECK_SECONDS:
+        return True
+    cur = db_manager.connection.cursor()
+    try:
+        warrant_ta_state.catch_up(cur)
+        db_manager.connection.commit()
+        _warrant_ta_state_checked[db_manager.is_neon] = now
+        return True
+    except Exception as exc:
+        logger.warning(f"權證技術狀態補算失敗，改用即時計算: {exc}")
+        db_manager.connection.rollback()
+        return False
+    finally:
+        cur.close()
+
+
+def _sync_warrant_bar_cache(db_manager) -> None:
+    """權證匯入 commit 後：本行程的 K 棒快取立即接上新的一根（其他 worker 由 latest_warrant_bars 比對）。"""
+    try:
+        cur = db_manager.connection.cursor()
+        try:
+            warrant_bar_cache.cache_for(db_manager.is_neon).sync(cur)
+        finally:
+            cur.close()
+    except Exception as exc:
+        logger.warning(f"權證 K 棒快取同步失敗: {exc}")
+
+
+_warrant_search_bootstrapped: set[bool] = set()
+
+
+def _ensure_warrant_search(db_manager) -> None:
+    """每個行程首次使用時確認 warrant_search 存在；若為空表則由兩市場主檔建立。"""
+    if db_manager.is_neon in _warrant_search_bootstrapped:
+        return
+    cur = db_manager.connection.cursor()
+    try:
+        warrant_search.ensure_search_table(cur)
+        if warrant_search.is_empty(cur):
+            warrant_search.refresh(cur)
+        db_manager.connection.commit()
+        _warrant_search_bootstrapped.add(db_manager.is_neon)
+    except Exception as exc:
+        logger.warning(f"warrant_search 初始化失敗: {exc}")
+        db_manager.connection.rollback()
+    finally:
+        cur.close()
+
+
+def _refresh_warrant_search(db_manager, market: str) -> None:
+    """權證主檔匯入 commit 後重建該市場的搜尋表。"""
+    cur = db_manager.connection.cursor()
+    try:
+        warrant_search.refresh(cur, [market])
+        db_manager.connection.commit()
+    except Exception as exc:
+        logger.warning(f"warrant_search 重建失敗（{market}）: {exc}")
+        db_manager.connection.rollback()
+    finally:
+        cur.close()
+
+
+@warrants_bp.route('/api/warrants/portal/master', methods=['GET'])
 def warrants_portal_master_search():
     """全市場權證主檔篩選（TWSE ∪ TPEX）。"""
     try:
@@ -10074,97 +11026,22 @@ def warrants_portal_master_search():
             return jsonify({'success': False, 'error': '資料庫連接失敗'}), 500
 
         try:
+            _ensure_warrant_search(db_manager)
             cur = db_manager.connection.cursor()
 
-            def build_branch(from_sql: str):
-                where = [
-                    'expiry_date IS NOT NULL',
-                    'expiry_date >= CURRENT_DATE',
-                ]
-                params_local: list = []
-                if q:
-                    q_clause, q_params = _portal_master_search_clause(q)
-                    where.append(q_clause)
-                    params_local.extend(q_params)
-                if wtype in ('認購', '認售'):
-                    where.append('warrant_type = %s')
-                    params_local.append(wtype)
-                if expiry_from:
-                    where.append('expiry_date >= %s::date')
-                    params_local.append(expiry_from)
-                if expiry_to:
-                    where.append('expiry_date <= %s::date')
-                    params_local.append(expiry_to)
-                if exercise_min is not None:
-                    where.append('latest_exercise_price >= %s')
-                    params_local.append(exercise_min)
-                if exercise_max is not None:
-                    where.append('latest_exercise_price <= %s')
-                    params_local.append(exercise_max)
-                if ratio_min is not None:
-                    where.append('latest_exercise_ratio >= %s')
-                    params_local.append(ratio_min)
-                if ratio_max is not None:
-                    where.append('latest_exercise_ratio <= %s')
-                    params_local.append(ratio_max)
-                if days_min is not None:
-                    where.append('(expiry_date - CURRENT_DATE) >= %s')
-                    params_local.append(days_min)
-                if days_max is not None:
-                    where.append('(expiry_date - CURRENT_DATE) <= %s')
-                    params_local.append(days_max)
-                where_sql = ' WHERE ' + ' AND '.join(where)
-                return f'{from_sql}{where_sql}', params_local
-
-            tw_from = """
-                SELECT
-                    'TWSE'::text AS market,
-                    warrant_code,
-                    warrant_name,
-                    warrant_type,
-                    warrant_category,
-                    underlying_code,
-                    underlying_name,
-                    expiry_date,
-                    last_trade_date,
-                    latest_exercise_price,
-                    latest_exercise_ratio,
-                    issuance_units_thousand AS issuance,
-                    exercise_start_date,
-                    report_date,
-                    (expiry_date - CURRENT_DATE) AS days_to_expiry
-                FROM tw_warrant_master
-            """
-            tpex_from = """
-                SELECT
-                    'TPEX'::text AS market,
-                    warrant_code,
-                    warrant_name,
-                    warrant_type,
-                    NULL::varchar AS warrant_category,
-                    underlying_code,
-                    underlying_name,
-                    expiry_date,
-                    NULL::date AS last_trade_date,
-                    latest_exercise_price,
-                    latest_exercise_ratio,
-                    accumulated_issuance AS issuance,
-                    listed_date AS exercise_start_date,
-                    report_date,
-                    (expiry_date - CURRENT_DATE) AS days_to_expiry
-                FROM tpex_warrant_master
-            """
-
-            params: list = []
-            if market == 'twse':
-                base, params = build_branch(tw_from)
-            elif market == 'tpex':
-                base, params = build_branch(tpex_from)
-            else:
-                tw_part, tw_params = build_branch(tw_from)
-                tpex_part, tpex_params = build_branch(tpex_from)
-                base = f'({tw_part}) UNION ALL ({tpex_part})'
-                params = tw_params + tpex_params
+            base, params = warrant_search.base_query(
+                market=market,
+                q=q,
+                warrant_type=wtype,
+                expiry_from=expiry_from,
+                expiry_to=expiry_to,
+                exercise_min=exercise_min,
+                exercise_max=exercise_max,
+                ratio_min=ratio_min,
+                ratio_max=ratio_max,
+                days_min=days_min,
+                days_max=days_max,
+            )
 
             if sort == 'code':
                 order_sql = f'ORDER BY warrant_code {direction}'
@@ -10375,14 +11252,14 @@ def warrants_portal_master_search():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-@app.route('/api/warrants/portal/ta-screen', methods=['GET', 'POST'])
+@warrants_bp.route('/api/warrants/portal/ta-screen', methods=['GET', 'POST'])
 def warrants_portal_ta_screen():
     """全市場／條件範圍技術面批次篩選（一次 SQL 取近端日線，避免前端逐檔 timeseries）。"""
     try:
         from warrant_ta_screen import (
             chunked,
-            fetch_recent_bars_by_code,
-            filter_codes_by_ta,
+            evaluate_packed_signals,
+            passes_ta_filters,
             truthy_flag,
         )
 
@@ -10453,97 +11330,23 @@ def warrants_portal_ta_screen():
 
         t0 = time.time()
         try:
+            _ensure_latest_bars_snapshot(db_manager)
+            _ensure_warrant_search(db_manager)
             cur = db_manager.connection.cursor()
 
-            def build_branch(from_sql: str):
-                where = [
-                    'expiry_date IS NOT NULL',
-                    'expiry_date >= CURRENT_DATE',
-                ]
-                params_local: list = []
-                if q:
-                    q_clause, q_params = _portal_master_search_clause(q)
-                    where.append(q_clause)
-                    params_local.extend(q_params)
-                if wtype in ('認購', '認售'):
-                    where.append('warrant_type = %s')
-                    params_local.append(wtype)
-                if expiry_from:
-                    where.append('expiry_date >= %s::date')
-                    params_local.append(expiry_from)
-                if expiry_to:
-                    where.append('expiry_date <= %s::date')
-                    params_local.append(expiry_to)
-                if exercise_min is not None:
-                    where.append('latest_exercise_price >= %s')
-                    params_local.append(exercise_min)
-                if exercise_max is not None:
-                    where.append('latest_exercise_price <= %s')
-                    params_local.append(exercise_max)
-                if ratio_min is not None:
-                    where.append('latest_exercise_ratio >= %s')
-                    params_local.append(ratio_min)
-                if ratio_max is not None:
-                    where.append('latest_exercise_ratio <= %s')
-                    params_local.append(ratio_max)
-                if days_min is not None:
-                    where.append('(expiry_date - CURRENT_DATE) >= %s')
-                    params_local.append(days_min)
-                if days_max is not None:
-                    where.append('(expiry_date - CURRENT_DATE) <= %s')
-                    params_local.append(days_max)
-                where_sql = ' WHERE ' + ' AND '.join(where)
-                return f'{from_sql}{where_sql}', params_local
-
-            tw_from = """
-                SELECT
-                    'TWSE'::text AS market,
-                    warrant_code,
-                    warrant_name,
-                    warrant_type,
-                    warrant_category,
-                    underlying_code,
-                    underlying_name,
-                    expiry_date,
-                    last_trade_date,
-                    latest_exercise_price,
-                    latest_exercise_ratio,
-                    issuance_units_thousand AS issuance,
-                    exercise_start_date,
-                    report_date,
-                    (expiry_date - CURRENT_DATE) AS days_to_expiry
-                FROM tw_warrant_master
-            """
-            tpex_from = """
-                SELECT
-                    'TPEX'::text AS market,
-                    warrant_code,
-                    warrant_name,
-                    warrant_type,
-                    NULL::varchar AS warrant_category,
-                    underlying_code,
-                    underlying_name,
-                    expiry_date,
-                    NULL::date AS last_trade_date,
-                    latest_exercise_price,
-                    latest_exercise_ratio,
-                    accumulated_issuance AS issuance,
-                    listed_date AS exercise_start_date,
-                    report_date,
-                    (expiry_date - CURRENT_DATE) AS days_to_expiry
-                FROM tpex_warrant_master
-            """
-
-            params: list = []
-            if market == 'twse':
-                base, params = build_branch(tw_from)
-            elif market == 'tpex':
-                base, params = build_branch(tpex_from)
-            else:
-                tw_part, tw_params = build_branch(tw_from)
-                tpex_part, tpex_params = build_branch(tpex_from)
-                base = f'({tw_part}) UNION ALL ({tpex_part})'
-                params = tw_params + tpex_params
+            base, params = warrant_search.base_query(
+                market=market,
+                q=q,
+                warrant_type=wtype,
+                expiry_from=expiry_from,
+                expiry_to=expiry_to,
+                exercise_min=exercise_min,
+                exercise_max=exercise_max,
+                ratio_min=ratio_min,
+                ratio_max=ratio_max,
+                days_min=days_min,
+                days_max=days_max,
+            )
 
             need_px = (
                 close_min is not None
@@ -10559,17 +11362,13 @@ def warrants_portal_ta_screen():
                            COALESCE(twpx.turnover, tppx.trade_value) AS turnover,
                            COALESCE(twpx.volume, tppx.trade_volume) AS volume
                     FROM ({base}) m
+                    LEFT JOIN latest_warrant_bars twpx
+                        ON twpx.market = 'TWSE' AND twpx.warrant_code = m.warrant_code
                     LEFT JOIN (
-                        SELECT DISTINCT ON (warrant_code)
-                            warrant_code, trade_date, close_price, turnover, volume
-                        FROM tw_warrant_trade
-                        ORDER BY warrant_code, trade_date DESC
-                    ) twpx ON twpx.warrant_code = m.warrant_code
-                    LEFT JOIN (
-                        SELECT DISTINCT ON (warrant_code)
-                            warrant_code, trade_date, close_price, trade_value, trade_volume
-                        FROM tpex_warrant_daily_quotes
-                        ORDER BY warrant_code, trade_date DESC
+                        SELECT warrant_code, trade_date, close_price,
+                               turnover AS trade_value, volume AS trade_volume
+                        FROM latest_warrant_bars
+                        WHERE market = 'TPEX'
                     ) tppx ON tppx.warrant_code = m.warrant_code
                 """
                 outer_where = []
@@ -10600,14 +11399,31 @@ def warrants_portal_ta_screen():
                     by_code[code] = dict(row)
             candidate_codes = list(by_code.keys())
 
-            # 技術計算：分批取近端日線
-            need_deep = ta_flags['heikinFirstRed'] or ta_flags['reversalFirstRed']
-            bar_limit = 80 if need_deep else 16
             matched_codes: list[str] = []
-            for batch in chunked(candidate_codes, 4000):
-                bars_map = fetch_recent_bars_by_code(cur, batch, limit_bars=bar_limit)
-                matched_codes.extend(filter_codes_by_ta(bars_map, ta_flags))
-
+            use_state = WARRANT_TA_STATE_ENABLED and _ensure_warrant_ta_state(db_manager)
+            if use_state:
+                # 預算旗標：partial index 上的單一 WHERE
+                for batch in chunked(candidate_codes, 5000):
+                    cur.execute(
+                        f"""
+                        SELECT DISTINCT warrant_code
+                        FROM {warrant_ta_state.STATE_TABLE} ts
+                        WHERE ts.warrant_code = ANY(%s)
+                          AND {warrant_ta_state.flag_clause(ta_flags)}
+                        """,
+                        (batch,),
+                    )
+                    matched_codes.extend(r.get('warrant_code') for r in cur.fetchall() or [])
+            else:
+                # 技術計算：近端日線取自行程內 K 棒快取，整批以陣列運算
+                need_deep = ta_flags['heikinFirstRed'] or ta_flags['reversalFirstRed']
+                bar_limit = 80 if need_deep else 16
+                bar_cache = warrant_bar_cache.cache_for(db_manager.is_neon)
+                for batch in chunked(candidate_codes, 4000):
+                    packed = warrant_bar_cache.pack_recent(bar_cache.get_many(cur, batch), bar_limit)
+                    signals = evaluate_packed_signals(*packed)
+                    matched_codes.extend(c for c, sig in signals.items() if passes_ta_filters(sig, ta_flags))
+
             matched_rows = [by_code[c] for c in matched_codes if c in by_code]
 
             # 對符合檔補最新價量（量遠小於全市場候選），再排序分頁
@@ -10615,26 +11431,13 @@ def warrants_portal_ta_screen():
                 m_codes = [r.get('warrant_code') for r in matched_rows if r.get('warrant_code')]
                 price_map: dict[str, dict] = {}
                 for batch in chunked(m_codes, 5000):
+                    # 最新 K 棒快照：TWSE 優先，TPEX 補缺
                     cur.execute(
                         """
-                        SELECT DISTINCT ON (warrant_code)
-                            warrant_code, trade_date, close_price, turnover, volume
-                        FROM tw_warrant_trade
-                        WHERE warrant_code = ANY(%s)
-                        ORDER BY warrant_code, trade_date DESC
-                        """,
-                        (batch,),
-                    )
-                    for r in cur.fetchall() or []:
-                        price_map[r.get('warrant_code')] = r
-                    cur.execute(
-                        """
-                        SELECT DISTINCT ON (warrant_code)
-                            warrant_code, trade_date, close_price,
-                            trade_value AS turnover, trade_volume AS volume
-                        FROM tpex_warrant_daily_quotes
+                        SELECT market, warrant_code, trade_date, close_price, turnover, volume
+                        FROM latest_warrant_bars
                         WHERE warrant_code = ANY(%s)
-                        ORDER BY warrant_code, trade_date DESC
+                        ORDER BY warrant_code, (market = 'TWSE') DESC
                         """,
                         (batch,),
                     )
@@ -10716,7 +11519,7 @@ def warrants_portal_ta_screen():
                 'taFilters': ta_flags,
                 'sort': sort,
                 'sortDir': sort_dir,
-                'source': 'batch-ohlc',
+                'source': 'ta-state' if use_state else 'bar-cache',
             })
         finally:
             db_manager.disconnect()
@@ -10725,7 +11528,7 @@ def warrants_portal_ta_screen():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-@app.route('/api/warrants/portal/master/<code>', methods=['GET'])
+@warrants_bp.route('/api/warrants/portal/master/<code>', methods=['GET'])
 def warrants_portal_master_detail(code: str):
     """單檔權證主檔詳情（先 TWSE 再 TPEX）。"""
     try:
@@ -10846,8 +11649,8 @@ def warrants_portal_master_detail(code: str):
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-@app.route('/api/warrants/rankings', methods=['GET', 'POST'])
-@app.route('/api/warrants/rankings/<kind>', methods=['GET', 'POST'])
+@warrants_bp.route('/api/warrants/rankings', methods=['GET', 'POST'])
+@warrants_bp.route('/api/warrants/rankings/<kind>', methods=['GET', 'POST'])
 def warrants_rankings(kind: str | None = None):
     """當日成交熱度排行（turnover / volume），可篩選認購／認售。
 
@@ -10886,29 +11689,23 @@ def warrants_rankings(kind: str | None = None):
         limit = max(1, min(200, limit))
         date_str = str(pick('date', default='') or '').strip() or None
 
+        if market == 'tpex':
+            markets = ['TPEX']
+        elif market in {'both', 'all'}:
+            markets = ['TWSE', 'TPEX']
+        else:
+            markets = ['TWSE']
+
         db_manager = DatabaseManager.from_request_args(request.args)
         if not db_manager.connect():
             return jsonify({'success': False, 'error': '資料庫連接失敗'}), 500
 
         try:
+            _ensure_latest_bars_snapshot(db_manager)
             cur = db_manager.connection.cursor()
 
             if not date_str:
-                if market == 'tpex':
-                    cur.execute('SELECT MAX(trade_date) AS d FROM tpex_warrant_daily_quotes')
-                elif market in {'both', 'all'}:
-                    cur.execute(
-                        """
-                        SELECT MAX(trade_date) AS d FROM (
-                            SELECT trade_date FROM tw_warrant_trade
-                            UNION ALL
-                            SELECT trade_date FROM tpex_warrant_daily_quotes
-                        ) t
-                        """
-                    )
-                else:
-                    cur.execute('SELECT MAX(trade_date) AS d FROM tw_warrant_trade')
-                date_str = _warrant_row_date((cur.fetchone() or {}).get('d'))
+                date_str = _warrant_row_date(warrant_rankings.latest_trade_date(cur, markets))
                 if not date_str:
                     return jsonify({
                         'success': True,
@@ -10920,201 +11717,20 @@ def warrants_rankings(kind: str | None = None):
                         'rows': [],
                     })
 
-            # 有類型篩選時用 INNER JOIN，避免漏接主檔時混入錯類型
-            if wtype:
-                tw_join = 'INNER JOIN tw_warrant_master m ON m.warrant_code = t.warrant_code AND m.warrant_type = %s'
-                tpex_join = 'INNER JOIN tpex_warrant_master m ON m.warrant_code = t.warrant_code AND m.warrant_type = %s'
-            else:
-                tw_join = 'LEFT JOIN tw_warrant_master m ON m.warrant_code = t.warrant_code'
-                tpex_join = 'LEFT JOIN tpex_warrant_master m ON m.warrant_code = t.warrant_code'
-
-            def order_sql(turnover_expr: str, volume_expr: str) -> str:
-                if metric == 'turnover':
-                    return f'{turnover_expr} DESC NULLS LAST, {volume_expr} DESC NULLS LAST, warrant_code ASC'
-                return f'{volume_expr} DESC NULLS LAST, {turnover_expr} DESC NULLS LAST, warrant_code ASC'
-
-            if market == 'tpex':
-                params: list = []
-                if wtype:
-                    params.append(wtype)
-                params.extend([date_str, limit])
-                cur.execute(
-                    f"""
-                    SELECT t.trade_date, t.warrant_code, t.warrant_name,
-                           t.trade_value AS turnover, t.trade_volume AS volume,
-                           t.close_price,
-                           COALESCE(t.underlying_code, m.underlying_code) AS underlying_code,
-                           COALESCE(t.underlying_name, m.underlying_name) AS underlying_name,
-                           m.warrant_type,
-                           'TPEX' AS market
-                    FROM tpex_warrant_daily_quotes t
-                    {tpex_join}
-                    WHERE t.trade_date = %s::date
-                    ORDER BY {order_sql('turnover', 'volume')}
-                    LIMIT %s
-                    """,
-                    params,
-                )
-            elif market in {'both', 'all'}:
-                params = []
-                if wtype:
-                    params.append(wtype)
-                params.append(date_str)
-                if wtype:
-                    params.append(wtype)
-                params.extend([date_str, limit])
-                cur.execute(
-                    f"""
-                    SELECT * FROM (
-                        SELECT t.trade_date, t.warrant_code, t.warrant_name,
-                               t.turnover, t.volume, t.close_price,
-                               m.underlying_code,
-                               m.underlying_name,
-                               m.warrant_type,
-                               'TWSE'::text AS market
-                        FROM tw_warrant_trade t
-                        {tw_join}
-                        WHERE t.trade_date = %s::date
-                        UNION ALL
-                        SELECT t.trade_date, t.warrant_code, t.warrant_name,
-                               t.trade_value AS turnover, t.trade_volume AS volume, t.close_price,
-                               COALESCE(t.underlying_code, m.underlying_code) AS underlying_code,
-                               COALESCE(t.underlying_name, m.underlying_name) AS underlying_name,
-                               m.warrant_type,
-                               'TPEX'::text AS market
-                        FROM tpex_warrant_daily_quotes t
-                        {tpex_join}
-                        WHERE t.trade_date = %s::date
-                    ) ranked
-                    ORDER BY {order_sql('turnover', 'volume')}
-                    LIMIT %s
-                    """,
-                    params,
-                )
-            else:
-                params = []
-                if wtype:
-                    params.append(wtype)
-                params.extend([date_str, limit])
-                cur.execute(
-                    f"""
-                    SELECT t.trade_date, t.warrant_code, t.warrant_name,
-                           t.turnover, t.volume, t.close_price,
-                           m.underlying_code,
-                           m.underlying_name,
-                           m.warrant_type,
-                           'TWSE' AS market
-                    FROM tw_warrant_trade t
-                    {tw_join}
-                    WHERE t.trade_date = %s::date
-                    ORDER BY {order_sql('turnover', 'volume')}
-                    LIMIT %s
-                    """,
-                    params,
-                )
-            rows_raw = cur.fetchall() or []
+            # 預算排行（當日匯入時建立；歷史日首次查詢時補建）
+            rows_raw = warrant_rankings.read(
+                cur, date_str, markets=markets, warrant_type=wtype, metric=metric, limit=limit,
+            )
 
             # 指定日期若無資料，改抓該市場最新有資料的日期
-            if not rows_raw and date_str:
-                if market == 'tpex':
-                    cur.execute('SELECT MAX(trade_date) AS d FROM tpex_warrant_daily_quotes')
-                elif market in {'both', 'all'}:
-                    cur.execute(
-                        """
-                        SELECT MAX(trade_date) AS d FROM (
-                            SELECT trade_date FROM tw_warrant_trade
-                            UNION ALL
-                            SELECT trade_date FROM tpex_warrant_daily_quotes
-                        ) t
-                        """
-                    )
-                else:
-                    cur.execute('SELECT MAX(trade_date) AS d FROM tw_warrant_trade')
-                fallback_date = _warrant_row_date((cur.fetchone() or {}).get('d'))
+            if not rows_raw:
+                fallback_date = _warrant_row_date(warrant_rankings.latest_trade_date(cur, markets))
                 if fallback_date and fallback_date != date_str:
                     date_str = fallback_date
-                    # 重跑同一套查詢：最簡方式是遞迴參數重進不易，這裡僅對 both/tpex/twse 再查一次最新日
-                    # 重新組 params（與上方分支一致）
-                    if market == 'tpex':
-                        params = []
-                        if wtype:
-                            params.append(wtype)
-                        params.extend([date_str, limit])
-                        cur.execute(
-                            f"""
-                            SELECT t.trade_date, t.warrant_code, t.warrant_name,
-                                   t.trade_value AS turnover, t.trade_volume AS volume,
-                                   t.close_price,
-                                   COALESCE(t.underlying_code, m.underlying_code) AS underlying_code,
-                                   COALESCE(t.underlying_name, m.underlying_name) AS underlying_name,
-                                   m.warrant_type,
-                                   'TPEX' AS market
-                            FROM tpex_warrant_daily_quotes t
-                            {tpex_join}
-                            WHERE t.trade_date = %s::date
-                            ORDER BY {order_sql('turnover', 'volume')}
-                            LIMIT %s
-                            """,
-                            params,
-                        )
-                    elif market in {'both', 'all'}:
-                        params = []
-                        if wtype:
-                            params.append(wtype)
-                        params.append(date_str)
-                        if wtype:
-                            params.append(wtype)
-                        params.extend([date_str, limit])
-                        cur.execute(
-                            f"""
-                            SELECT * FROM (
-                                SELECT t.trade_date, t.warrant_code, t.warrant_name,
-                                       t.turnover, t.volume, t.close_price,
-                                       m.underlying_code,
-                                       m.underlying_name,
-                                       m.warrant_type,
-                                       'TWSE'::text AS market
-                                FROM tw_warrant_trade t
-                                {tw_join}
-                                WHERE t.trade_date = %s::date
-                                UNION ALL
-                                SELECT t.trade_date, t.warrant_code, t.warrant_name,
-                                       t.trade_value AS turnover, t.trade_volume AS volume, t.close_price,
-                                       COALESCE(t.underlying_code, m.underlying_code) AS underlying_code,
-                                       COALESCE(t.underlying_name, m.underlying_name) AS underlying_name,
-                                       m.warrant_type,
-                                       'TPEX'::text AS market
-                                FROM tpex_warrant_daily_quotes t
-                                {tpex_join}
-                                WHERE t.trade_date = %s::date
-                            ) ranked
-                            ORDER BY {order_sql('turnover', 'volume')}
-                            LIMIT %s
-                            """,
-                            params,
-                        )
-                    else:
-                        params = []
-                        if wtype:
-                            params.append(wtype)
-                        params.extend([date_str, limit])
-                        cur.execute(
-                            f"""
-                            SELECT t.trade_date, t.warrant_code, t.warrant_name,
-                                   t.turnover, t.volume, t.close_price,
-                                   m.underlying_code,
-                                   m.underlying_name,
-                                   m.warrant_type,
-                                   'TWSE' AS market
-                            FROM tw_warrant_trade t
-                            {tw_join}
-                            WHERE t.trade_date = %s::date
-                            ORDER BY {order_sql('turnover', 'volume')}
-                            LIMIT %s
-                            """,
-                            params,
-                        )
-                    rows_raw = cur.fetchall() or []
+                    rows_raw = warrant_rankings.read(
+                        cur, date_str, markets=markets, warrant_type=wtype, metric=metric, limit=limit,
+                    )
+            db_manager.connection.commit()
         finally:
             db_manager.disconnect()
 
@@ -11127,7 +11743,7 @@ def warrants_rankings(kind: str | None = None):
             rows.append({
                 'rank': len(rows) + 1,
                 'market': row.get('market'),
-                'trade_date': _warrant_row_date(row.get('trade_date')),
+                'trade_date': date_str,
                 'warrant_code': row.get('warrant_code'),
                 'warrant_name': row.get('warrant_name'),
                 'warrant_type': row_type,
@@ -11154,7 +11770,37 @@ def warrants_rankings(kind: str | None = None):
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-@app.route('/api/warrants/timeseries', methods=['GET'])
+def _warrant_timeseries_response(code, market, start, end, rows):
+    series = []
+    name = None
+    for r in rows:
+        if not name and r.get('warrant_name'):
+            name = r.get('warrant_name')
+        series.append({
+            'trade_date': _warrant_row_date(r.get('trade_date')),
+            'warrant_code': r.get('warrant_code'),
+            'warrant_name': r.get('warrant_name'),
+            'turnover': _warrant_row_num(r.get('turnover')),
+            'volume': _warrant_row_int(r.get('volume')),
+            'close_price': _warrant_row_num(r.get('close_price')),
+            'open_price': _warrant_row_num(r.get('open_price')),
+            'high_price': _warrant_row_num(r.get('high_price')),
+            'low_price': _warrant_row_num(r.get('low_price')),
+        })
+
+    return jsonify({
+        'success': True,
+        'code': code,
+        'name': name,
+        'market': market,
+        'start': start,
+        'end': end,
+        'count': len(series),
+        'data': series,
+    })
+
+
+@warrants_bp.route('/api/warrants/timeseries', methods=['GET'])
 def warrants_timeseries():
     """單檔權證成交時間序列。"""
     try:
@@ -11174,6 +11820,15 @@ def warrants_timeseries():
         try:
             cur = db_manager.connection.cursor()
 
+            # 近端視窗走行程內 K 棒快取；TWSE 缺價需 STOCK_DAY 補齊時仍走資料庫
+            bar_cache = warrant_bar_cache.cache_for(db_manager.is_neon)
+            if not (start or end) and limit_days <= bar_cache.max_bars:
+                cached = bar_cache.get(cur, code)
+                if cached is not None:
+                    rows = cached.rows(limit_days)
+                    if cached.market == 'TPEX' or all(r['close_price'] is not None for r in rows):
+                        return _warrant_timeseries_response(code, cached.market, start, end, rows)
+
             # 判斷市場：有 TPEX OHLC 優先用 daily，否則 TWSE trade
             cur.execute(
                 'SELECT 1 FROM tpex_warrant_daily_quotes WHERE warrant_code = %s LIMIT 1',
@@ -11188,6 +11843,12 @@ def warrants_timeseries():
 
             market = 'TPEX' if is_tpex and not is_twse else ('TWSE' if is_twse else ('TPEX' if is_tpex else None))
             if market is None:
+                # 已到期並歸檔的權證改讀 *_archive
+                market, rows = warrant_partitions.archived_bars(
+                    cur, code, start=start, end=end, limit=None if (start or end) else limit_days,
+                )
+                if market is not None:
+                    return _warrant_timeseries_response(code, market, start, end, rows)
                 return jsonify({
                     'success': True,
                     'code': code,
@@ -11304,6 +11965,7 @@ def warrants_timeseries():
                             fetched = []
                             for yy, mm in months:
                                 try:
+                                    warrant_ohlc_enrichment.TWSE_LIMITER.wait()
                                     fetched.extend(_fetch_twse_warrant_stock_day(code, yy, mm))
                                 except Exception:
                                     logger.exception('STOCK_DAY 抓取失敗 %s %s-%s', code, yy, mm)
@@ -11311,6 +11973,7 @@ def warrants_timeseries():
                                 try:
                                     _upsert_tw_warrant_trade_ohlc_rows(cur, fetched)
                                     db_manager.connection.commit()
+                                    bar_cache.invalidate([code])
                                 except Exception:
                                     logger.exception('寫入權證 OHLC 失敗')
                                     try:
@@ -11344,39 +12007,13 @@ def warrants_timeseries():
         finally:
             db_manager.disconnect()
 
-        series = []
-        name = None
-        for r in rows:
-            if not name and r.get('warrant_name'):
-                name = r.get('warrant_name')
-            series.append({
-                'trade_date': _warrant_row_date(r.get('trade_date')),
-                'warrant_code': r.get('warrant_code'),
-                'warrant_name': r.get('warrant_name'),
-                'turnover': _warrant_row_num(r.get('turnover')),
-                'volume': _warrant_row_int(r.get('volume')),
-                'close_price': _warrant_row_num(r.get('close_price')),
-                'open_price': _warrant_row_num(r.get('open_price')),
-                'high_price': _warrant_row_num(r.get('high_price')),
-                'low_price': _warrant_row_num(r.get('low_price')),
-            })
-
-        return jsonify({
-            'success': True,
-            'code': code,
-            'name': name,
-            'market': market,
-            'start': start,
-            'end': end,
-            'count': len(series),
-            'data': series,
-        })
+        return _warrant_timeseries_response(code, market, start, end, rows)
     except Exception as e:
         logger.exception('權證 timeseries 失敗')
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-@app.route('/api/warrants', methods=['GET'])
+@warrants_bp.route('/api/warrants', methods=['GET'])
 def query_warrants():
     """依日期、關鍵字與市場查詢權證資料。
 
@@ -11619,7 +12256,7 @@ def query_warrants():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-@app.route('/api/t86/fetch', methods=['GET'])
+@market_bp.route('/api/t86/fetch', methods=['GET'])
 def fetch_t86_range_api():
     """抓取 TWSE/TPEX 三大法人（T86）資料區間。
 
@@ -11677,7 +12314,7 @@ def fetch_t86_range_api():
         logger.exception('fetch_t86_range_api 失敗')
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/api/t86/export', methods=['GET'])
+@market_bp.route('/api/t86/export', methods=['GET'])
 def export_t86_csv():
     """匯出 TWSE/TPEX 三大法人資料為 CSV 檔案。"""
     try:
@@ -11759,7 +12396,7 @@ def export_t86_csv():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-@app.route('/api/margin/fetch', methods=['GET'])
+@market_bp.route('/api/margin/fetch', methods=['GET'])
 def fetch_margin_range_api():
     """抓取 TWSE/TPEX 融資融券資料區間。
 
@@ -11818,7 +12455,7 @@ def fetch_margin_range_api():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-@app.route('/api/margin/export', methods=['GET'])
+@market_bp.route('/api/margin/export', methods=['GET'])
 def export_margin_csv():
     """匯出 TWSE/TPEX 融資融券資料為 CSV 檔案。"""
     try:
@@ -11887,7 +12524,133 @@ def export_margin_csv():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-@app.route('/api/revenue/fetch_range', methods=['GET'])
+def _parse_year_month(value: str) -> tuple[int, int]:
+    try:
+        parts = value.split('-')
+        if len(parts) != 2:
+            raise ValueError
+        y = int(parts[0])
+        m = int(parts[1])
+        if m < 1 or m > 12:
+            raise ValueError
+        return y, m
+    except Exception:
+        raise ValueError('年月格式錯誤，需 YYYY-MM')
+
+
+def fetch_revenue_range(
+    start: str,
+    end: str,
+    *,
+    market: str = 'both',
+    sleep_seconds: float = 1.0,
+    db_manager: DatabaseManager | None = None,
+    include_data: bool = False,
+    max_records: int = 2000,
+    progress_callback=None,
+) -> dict:
+    """逐月抓取月營收（MOPS HTML 報表），db_manager 不為 None 時寫入資料庫。
+
+    progress_callback(done, total, 'YYYY-MM') 於每個月份處理完後呼叫。
+    回傳: { summary, monthly_stats, count, data }
+    """
+    start_y, start_m = _parse_year_month(start)
+    end_y, end_m = _parse_year_month(end)
+
+    # 生成月份序列
+    months = []
+    cy, cm = start_y, start_m
+    while (cy < end_y) or (cy == end_y and cm <= end_m):
+        months.append((cy, cm))
+        if cm == 12:
+            cy += 1
+            cm = 1
+        else:
+            cm += 1
+
+    persist_flag = db_manager is not None
+    total_inserted = 0
+    total_records = 0
+    monthly_stats = []
+    merged_records: list[dict] = []
+    total_per_market = {'TWSE': 0, 'TPEX': 0}
+
+    for idx, (yy, mm) in enumerate(months, start=1):
+        try:
+            records, summary = stock_api.fetch_monthly_revenue_html(yy, mm, market=market)
+        except ValueError as ve:
+            monthly_stats.append({
+                'year': yy,
+                'month': mm,
+                'error': str(ve),
+                'total_records': 0,
+                'per_market': {'TWSE': 0, 'TPEX': 0},
+                'persisted': 0,
+            })
+            if progress_callback is not None:
+                progress_callback(idx, len(months), f"{yy:04d}-{mm:02d}")
+            continue
+
+        month_inserted = 0
+        if persist_flag and records:
+            try:
+                month_inserted = stock_api.upsert_monthly_revenue(records, db_manager=db_manager)
+            except Exception as db_exc:
+                logger.exception('月營收歷史資料寫入失敗')
+                month_inserted = 0
+
+        if include_data and records and max_records != 0:
+            if max_records > 0:
+                remaining = max_records - len(merged_records)
+                if remaining > 0:
+                    merged_records.extend(records[:remaining])
+            else:
+                merged_records.extend(records)
+
+        total_inserted += month_inserted
+        total_records += len(records)
+
+        try:
+            per_market = summary.get('per_market') or {}
+            total_per_market['TWSE'] += int(per_market.get('TWSE') or 0)
+            total_per_market['TPEX'] += int(per_market.get('TPEX') or 0)
+        except Exception:
+            pass
+
+        monthly_stats.append({
+            'year': summary.get('year'),
+            'month': summary.get('month'),
+            'roc_yyyymm': summary.get('roc_yyyymm'),
+            'total_records': summary.get('total_records', len(records)),
+            'per_market': summary.get('per_market', {}),
+            'persisted': month_inserted,
+        })
+        if progress_callback is not None:
+            progress_callback(idx, len(months), f"{yy:04d}-{mm:02d}")
+
+        if sleep_seconds and sleep_seconds > 0:
+            time.sleep(sleep_seconds)
+
+    summary_out = {
+        'start': start,
+        'end': end,
+        'period': f"{start} ~ {end}",
+        'monthsProcessed': len(months),
+        'total_records': total_records,
+        'per_market': total_per_market,
+        'totalInserted': total_inserted,
+        'persist_enabled': persist_flag,
+        'include_data': include_data,
+    }
+    return {
+        'summary': summary_out,
+        'monthly_stats': monthly_stats,
+        'count': total_records,
+        'data': merged_records if include_data else [],
+    }
+
+
+@market_bp.route('/api/revenue/fetch_range', methods=['GET'])
 def fetch_revenue_range_api():
     """抓取 TWSE/TPEX 月營收「月份區間」資料（使用 MOPS HTML 報表）。
 
@@ -11911,32 +12674,8 @@ def fetch_revenue_range_api():
         if not start or not end:
             return jsonify({'success': False, 'error': '需要 start 與 end 參數 (YYYY-MM)'}), 400
 
-        def parse_ym(s: str) -> tuple[int, int]:
-            try:
-                parts = s.split('-')
-                if len(parts) != 2:
-                    raise ValueError
-                y = int(parts[0])
-                m = int(parts[1])
-                if m < 1 or m > 12:
-                    raise ValueError
-                return y, m
-            except Exception:
-                raise ValueError('年月格式錯誤，需 YYYY-MM')
-
-        start_y, start_m = parse_ym(start)
-        end_y, end_m = parse_ym(end)
-
-        # 生成月份序列
-        months = []
-        cy, cm = start_y, start_m
-        while (cy < end_y) or (cy == end_y and cm <= end_m):
-            months.append((cy, cm))
-            if cm == 12:
-                cy += 1
-                cm = 1
-            else:
-                cm += 1
+        _parse_year_month(start)
+        _parse_year_month(end)
 
         try:
             sleep_seconds = float(sleep_param) if sleep_param is not None else 1.0
@@ -11952,12 +12691,6 @@ def fetch_revenue_range_api():
 
         persist_flag = (request.args.get('persist', 'true').lower() != 'false')
 
-        total_inserted = 0
-        total_records = 0
-        monthly_stats = []
-        merged_records: list[dict] = []
-        total_per_market = {'TWSE': 0, 'TPEX': 0}
-
         db_manager = None
         if persist_flag:
             db_manager = DatabaseManager.from_request_args(request.args)
@@ -11965,77 +12698,16 @@ def fetch_revenue_range_api():
                 return jsonify({'success': False, 'error': '資料庫連線失敗'}), 500
 
         try:
-            for (yy, mm) in months:
-                try:
-                    records, summary = stock_api.fetch_monthly_revenue_html(yy, mm, market=market)
-                except ValueError as ve:
-                    monthly_stats.append({
-                        'year': yy,
-                        'month': mm,
-                        'error': str(ve),
-                        'total_records': 0,
-                        'per_market': {'TWSE': 0, 'TPEX': 0},
-                        'persisted': 0,
-                    })
-                    continue
-
-                month_inserted = 0
-                if persist_flag and records:
-                    try:
-                        month_inserted = stock_api.upsert_monthly_revenue(records, db_manager=db_manager)
-                    except Exception as db_exc:
-                        logger.exception('月營收歷史資料寫入失敗')
-                        month_inserted = 0
-
-                if include_data_flag and records and max_records != 0:
-                    if max_records > 0:
-                        remaining = max_records - len(merged_records)
-                        if remaining > 0:
-                            merged_records.extend(records[:remaining])
-                    else:
-                        merged_records.extend(records)
-
-                total_inserted += month_inserted
-                total_records += len(records)
-
-                try:
-                    per_market = summary.get('per_market') or {}
-                    total_per_market['TWSE'] += int(per_market.get('TWSE') or 0)
-                    total_per_market['TPEX'] += int(per_market.get('TPEX') or 0)
-                except Exception:
-                    pass
-
-                monthly_stats.append({
-                    'year': summary.get('year'),
-                    'month': summary.get('month'),
-                    'roc_yyyymm': summary.get('roc_yyyymm'),
-                    'total_records': summary.get('total_records', len(records)),
-                    'per_market': summary.get('per_market', {}),
-                    'persisted': month_inserted,
-                })
-
-                if sleep_seconds and sleep_seconds > 0:
-                    time.sleep(sleep_seconds)
-
-            summary_out = {
-                'start': start,
-                'end': end,
-                'period': f"{start} ~ {end}",
-                'monthsProcessed': len(months),
-                'total_records': total_records,
-                'per_market': total_per_market,
-                'totalInserted': total_inserted,
-                'persist_enabled': persist_flag,
-                'include_data': include_data_flag,
-            }
-
-            return jsonify({
-                'success': True,
-                'summary': summary_out,
-                'monthly_stats': monthly_stats,
-                'count': total_records,
-                'data': merged_records if include_data_flag else [],
-            })
+            result = fetch_revenue_range(
+                start,
+                end,
+                market=market,
+                sleep_seconds=sleep_seconds,
+                db_manager=db_manager,
+                include_data=include_data_flag,
+                max_records=max_records,
+            )
+            return jsonify({'success': True, **result})
         finally:
             if db_manager is not None:
                 try:
@@ -12049,7 +12721,7 @@ def fetch_revenue_range_api():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-@app.route('/api/revenue/import_from_csv', methods=['POST'])
+@market_bp.route('/api/revenue/import_from_csv', methods=['POST'])
 def import_revenue_from_csv_api():
     """從本機 MOPS 月營收 CSV 檔匯入 monthly_revenue_table。"""
     try:
@@ -12087,7 +12759,7 @@ def import_revenue_from_csv_api():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-@app.route('/api/revenue/download_mops_csv', methods=['POST'])
+@market_bp.route('/api/revenue/download_mops_csv', methods=['POST'])
 def download_revenue_mops_csv_api():
     try:
         payload = request.get_json(silent=True) or {}
@@ -12141,7 +12813,7 @@ def download_revenue_mops_csv_api():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-@app.route('/api/revenue/fetch', methods=['GET'])
+@market_bp.route('/api/revenue/fetch', methods=['GET'])
 def fetch_revenue_api():
     """抓取上市/上櫃月營收資料，支援指定西元年/月與市場選擇。
 
@@ -12233,7 +12905,7 @@ def fetch_revenue_api():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-@app.route('/api/revenue/export', methods=['GET'])
+@market_bp.route('/api/revenue/export', methods=['GET'])
 def export_revenue_csv():
     """匯出上市/上櫃月營收資料為 CSV 檔案。"""
     try:
@@ -12296,7 +12968,7 @@ def export_revenue_csv():
         logger.exception('export_revenue_csv 失敗')
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/api/debug/fetch_source', methods=['GET'])
+@system_bp.route('/api/debug/fetch_source', methods=['GET'])
 def debug_fetch_source():
     """調用內部抓取邏輯 fetch_stock_data() 並回傳原始抓到的資料摘要，用於診斷來源是否為空。
     Query: symbol, start, end
@@ -12321,7 +12993,7 @@ def debug_fetch_source():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/api/stock/<symbol>/prices', methods=['GET'])
+@prices_bp.route('/api/stock/<symbol>/prices', methods=['GET'])
 def get_stock_prices(symbol):
     """從資料庫或 API 獲取股票價格數據"""
     try:
@@ -12606,7 +13278,7 @@ def get_stock_prices(symbol):
             'details': error_details if app.debug else None
         }), 500
 
-@app.route('/api/stock/<symbol>/returns', methods=['GET'])
+@returns_bp.route('/api/stock/<symbol>/returns', methods=['GET'])
 def get_stock_returns(symbol):
     """從資料庫獲取股票報酬率數據"""
     try:
@@ -12729,7 +13401,7 @@ def get_stock_returns(symbol):
             'error': str(e)
         }), 500
 
-@app.route('/api/returns/compute', methods=['POST'])
+@returns_bp.route('/api/returns/compute', methods=['POST'])
 def compute_returns_api():
     """觸發計算 tw_stock_returns 的 API。
     JSON body 支援參數：
@@ -12792,7 +13464,7 @@ def compute_returns_api():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-@app.route('/api/returns/compute_stream')
+@returns_bp.route('/api/returns/compute_stream')
 def compute_returns_stream():
     """以 Server-Sent Events 方式回傳報酬率計算進度"""
     try:
@@ -12903,14 +13575,38 @@ def compute_returns_stream():
         logger.exception('建立報酬率串流失敗')
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/api/update', methods=['POST'])
+@prices_bp.route('/api/update', methods=['POST'])
 def update_stocks():
-    """批量更新股票數據"""
+    """批量更新股票數據（流程見 run_stock_update）"""
+    # 檢查請求數據
+    if not request.is_json:
+        return jsonify({
+            'success': False,
+            'error': '請求必須是 JSON 格式'
+        }), 400
+
+    data = request.get_json(silent=True)
+    if data is None:
+        return jsonify({
+            'success': False,
+            'error': '無效的 JSON 數據'
+        }), 400
+
+    payload, status_code = run_stock_update(data)
+    return jsonify(payload), status_code
+
+
+def run_stock_update(data: dict) -> tuple[dict, int]:
+    """批量更新股票數據：抓價寫入、刷新最新 K 棒快照與異常索引，必要時背景計算報酬率。
+
+    /api/update 與 cloud_worker 共用，不依賴 request context；回傳 (payload, HTTP 狀態碼)。
+    """
     db_manager = None
+    update_lock = _job_lock('update', DatabaseManager.from_request_payload(data))
     acquired_update_lock = update_lock.acquire(blocking=False)
     if not acquired_update_lock:
         logger.warning("已有 /api/update 流程正在執行，拒絕並行請求")
-        return jsonify({'success': False, 'error': '已有更新作業正在執行，請稍後再試'}), 429
+        return {'success': False, 'error': '已有更新作業正在執行，請稍後再試'}, 429
     try:
         index_symbols = None
 
@@ -12935,20 +13631,6 @@ def update_stocks():
                 return value[:10]
             return None
 
-        # 檢查請求數據
-        if not request.is_json:
-            return jsonify({
-                'success': False,
-                'error': '請求必須是 JSON 格式'
-            }), 400
-        
-        data = request.get_json()
-        if data is None:
-            return jsonify({
-                'success': False,
-                'error': '無效的 JSON 數據'
-            }), 400
-            
         symbols = data.get('symbols', [])
         start_date = data.get('start_date', DEFAULT_START_DATE)
         end_date = data.get('end_date', None)  # 添加 end_date 參數
@@ -12985,10 +13667,10 @@ def update_stocks():
                     symbols = [s['symbol'] for s in all_symbols[:50]]  # 限制50檔避免超時
                 except Exception as e:
                     logger.error(f"獲取股票代碼失敗: {e}")
-                    return jsonify({
+                    return {
                         'success': False,
                         'error': f'獲取股票代碼失敗: {str(e)}'
-                    }), 500
+                    }, 500
         
         results = []
         errors = []
@@ -13000,18 +13682,18 @@ def update_stocks():
         logger.info("嘗試連接資料庫...")
         if not db_manager.connect():
             logger.error("資料庫連接失敗")
-            return jsonify({
+            return {
                 'success': False,
                 'error': '資料庫連接失敗'
-            }), 500
+            }, 500
         
         logger.info("資料庫連接成功，檢查連接狀態...")
         if db_manager.connection is None:
             logger.error("資料庫連接物件為 None")
-            return jsonify({
+            return {
                 'success': False,
                 'error': '資料庫連接物件為空'
-            }), 500
+            }, 500
         
         cursor = None
 
@@ -13021,10 +13703,10 @@ def update_stocks():
             logger.info("資料庫表格檢查/建立完成")
         except Exception as e:
             logger.error(f"建立資料庫表格失敗: {e}")
-            return jsonify({
+            return {
                 'success': False,
                 'error': f'建立資料庫表格失敗: {str(e)}'
-            }), 500
+            }, 500
 
         def _reconnect_db():
             nonlocal cursor
@@ -13043,6 +13725,9 @@ def update_stocks():
             db_manager.create_tables()
             cursor = db_manager.connection.cursor()
 
+        # 每檔本次實際寫入的最早日期，供 price_anomalies 只重算受影響區段
+        written_since: dict[str, str] = {}
+
         def _execute_values_with_retry(upsert_sql, values, *, page_size=1000, max_retries=1):
             last_err = None
             for attempt in range(max_retries + 1):
@@ -13053,6 +13738,10 @@ def update_stocks():
                     try:
                         execute_values(cur_local, upsert_sql, values, page_size=page_size)
                         db_manager.connection.commit()
+                        for row in values:
+                            sym_key, date_key = row[0], str(row[1])[:10]
+                            if sym_key not in written_since or date_key < written_since[sym_key]:
+                                written_since[sym_key] = date_key
                         return
                     finally:
                         try:
@@ -13087,10 +13776,10 @@ def update_stocks():
             # 再次確認連接狀態
             if db_manager.connection is None:
                 logger.error("資料庫連接在 create_tables 後變為 None")
-                return jsonify({
+                return {
                     'success': False,
                     'error': '資料庫連接丟失'
-                }), 500
+                }, 500
                 
             cursor = db_manager.connection.cursor()
             prices_table = db_manager.table_prices
@@ -13583,6 +14272,14 @@ def update_stocks():
             if remaining_symbols:
                 _process_symbols_individual(remaining_symbols)
 
+            # 本次觸及的代碼更新最新 K 棒快照
+            _refresh_latest_stock_bars_safely(db_manager, list(symbols or []) + list(index_symbols or []))
+            symbols_by_since: dict[str, list[str]] = {}
+            for sym_key, since_key in written_since.items():
+                symbols_by_since.setdefault(since_key, []).append(sym_key)
+            for since_key, since_symbols in symbols_by_since.items():
+                _refresh_price_anomalies_safely(db_manager, since_symbols, since_key)
+
             # ✅ 股價更新完成後，自動啟動報酬率計算（背景執行，避免阻塞 API 回應）
             if update_returns:
                 try:
@@ -13695,7 +14392,7 @@ def update_stocks():
             except Exception:
                 error_message = None
 
-        return jsonify({
+        return {
             'success': len(errors) == 0,
             'results': results,
             'errors': errors,
@@ -13714,7 +14411,7 @@ def update_stocks():
                 'success': len(results),
                 'failed': len(errors)
             }
-        })
+        }, 200
     except Exception as e:
         logger.error(f"批量更新失敗: {e}")
         # 確保資料庫連接被關閉
@@ -13723,10 +14420,10 @@ def update_stocks():
                 db_manager.disconnect()
             except Exception:
                 pass
-        return jsonify({
+        return {
             'success': False,
             'error': str(e)
-        }), 500
+        }, 500
     finally:
         if acquired_update_lock:
             try:
@@ -13734,7 +14431,7 @@ def update_stocks():
             except Exception:
                 pass
 
-@app.route('/api/health', methods=['GET'])
+@system_bp.route('/api/health', methods=['GET'])
 def health_check():
     """健康檢查 - 包含資料庫連接狀態和數據統計"""
     try:
@@ -13780,6 +14477,7 @@ def health_check():
                         'database': 'connected',
                         'database_info': db_message,
                         'database_connection': db_info,
+                        'warrant_bar_cache': warrant_bar_cache.cache_for(db_manager.is_neon).memory(),
                         'data_statistics': {
                             'tw_stock_prices': {
                                 'total_records': price_stats['total_records'],
@@ -13835,7 +14533,7 @@ def health_check():
             'version': '1.0.0'
         }), 500
 
-@app.route('/api/test-connection', methods=['GET'])
+@system_bp.route('/api/test-connection', methods=['GET'])
 def test_connection():
     """測試資料庫連接"""
     try:
@@ -13873,7 +14571,7 @@ def test_connection():
             'message': str(e)
         }), 500
 
-@app.route('/api/stocks/<symbol>/price-history', methods=['GET'])
+@prices_bp.route('/api/stocks/<symbol>/price-history', methods=['GET'])
 def get_price_history(symbol):
     """獲取股票K線歷史數據 - 用於前端圖表展示"""
     try:
@@ -13970,7 +14668,7 @@ def get_price_history(symbol):
         }), 500
 
 
-@app.route('/api/stocks/<symbol>/quote', methods=['GET'])
+@prices_bp.route('/api/stocks/<symbol>/quote', methods=['GET'])
 def get_stock_quote(symbol):
     """取得個股最新報價與漲跌幅"""
     try:
@@ -13984,32 +14682,59 @@ def get_stock_quote(symbol):
 
         cursor = db_manager.connection.cursor()
         try:
-            cursor.execute(
-                """
-                SELECT date,
-                       open_price,
-                       high_price,
-                       low_price,
-                       close_price,
-                       volume
-                FROM tw_stock_prices
-                WHERE symbol = %s
-                ORDER BY date DESC
-                LIMIT 2
-                """,
-                (symbol,)
-            )
-            rows = cursor.fetchall()
+            latest = None
+            previous = None
+            try:
+                # 先查最新 K 棒快照（主鍵查詢），查無才回退歷史表
+                cursor.execute(
+                    """
+                    SELECT trade_date AS date,
+                           open_price,
+                           high_price,
+                           low_price,
+                           close_price,
+                           volume,
+                           prev_close
+                    FROM latest_stock_bars
+                    WHERE symbol = %s
+                    """,
+                    (symbol,)
+                )
+                snapshot = cursor.fetchone()
+            except psycopg2.Error:
+                db_manager.connection.rollback()
+                snapshot = None
 
-            if not rows:
-                return jsonify({
-                    'code': 404,
-                    'message': f'找不到 {symbol} 的報價資料',
-                    'data': None
-                }), 404
+            if snapshot:
+                latest = snapshot
+                previous = {'close_price': snapshot['prev_close']} if snapshot['prev_close'] is not None else None
+            else:
+                cursor.execute(
+                    """
+                    SELECT date,
+                           open_price,
+                           high_price,
+                           low_price,
+                           close_price,
+                           volume
+                    FROM tw_stock_prices
+                    WHERE symbol = %s
+                    ORDER BY date DESC
+                    LIMIT 2
+                    """,
+                    (symbol,)
+                )
+                rows = cursor.fetchall()
 
-            latest = rows[0]
-            previous = rows[1] if len(rows) > 1 else None
+                if not rows:
+                    return jsonify({
+                        'code': 404,
+                        'message': f'找不到 {symbol} 的報價資料',
+                        'data': None
+                    }), 404
+
+                latest = rows[0]
+                previous = rows[1] if len(rows) > 1 else None
 
             latest_close = float(latest['close_price']) if latest['close_price'] is not None else None
             previous_close = float(previous['close_price']) if previous and previous['close_price'] is not None else None
@@ -14062,7 +14787,7 @@ def get_stock_quote(symbol):
         }), 500
 
 
-@app.route('/api/statistics', methods=['GET'])
+@prices_bp.route('/api/statistics', methods=['GET'])
 def get_statistics():
     """獲取資料庫統計信息"""
     try:
@@ -14146,7 +14871,7 @@ def get_statistics():
             'error': str(e)
         }), 500
 
-@app.route('/api/database-sync/status', methods=['GET'])
+@sync_bp.route('/api/database-sync/status', methods=['GET'])
 def database_sync_status():
     """檢查 Neon 資料庫連接狀態"""
     try:
@@ -14182,7 +14907,7 @@ def database_sync_status():
             'error': str(e)
         })
 
-@app.route('/api/database-sync/tables', methods=['GET'])
+@sync_bp.route('/api/database-sync/tables', methods=['GET'])
 def get_database_tables():
     """獲取指定資料庫（本機/Neon）的所有表格列表"""
     try:
@@ -14239,6 +14964,11 @@ def get_database_tables():
                  WHERE table_schema = 'public' AND table_name = t.tablename) as column_count
             FROM pg_tables t
             WHERE schemaname = 'public'
+              -- 分區子表經由母表同步，不另外列出
+              AND NOT EXISTS (
+                  SELECT 1 FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+                  WHERE n.nspname = t.schemaname AND c.relname = t.tablename AND c.relispartition
+              )
             ORDER BY tablename
         """)
         tables = cursor.fetchall()
@@ -14280,11 +15010,11 @@ def get_database_tables():
         }), 500
 
 
-@app.route('/api/database-sync/debug_routes', methods=['GET'])
+@sync_bp.route('/api/database-sync/debug_routes', methods=['GET'])
 def database_sync_debug_routes():
     try:
         routes = []
-        for rule in app.url_map.iter_rules():
+        for rule in current_app.url_map.iter_rules():
             if str(rule.rule).startswith('/api/database-sync'):
                 routes.append({
                     'rule': str(rule.rule),
@@ -14297,7 +15027,7 @@ def database_sync_debug_routes():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-@app.route('/api/database-sync/export_csv', methods=['GET', 'POST'])
+@sync_bp.route('/api/database-sync/export_csv', methods=['GET', 'POST'])
 def export_database_tables_csv_zip():
     try:
         source = (request.args.get('source') or '').strip().lower()
@@ -14434,729 +15164,208 @@ def export_database_tables_csv_zip():
         logger.exception('export_database_tables_csv_zip failed')
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/api/database-sync/upload', methods=['POST'])
-def database_sync_upload():
-    """將本地資料庫上傳到 Neon"""
-    local_conn = None
-    neon_conn = None
+def _sync_local_connect():
+    return psycopg2.connect(
+        host=os.environ.get('DB_HOST', 'localhost'),
+        port=os.environ.get('DB_PORT', '5432'),
+        user=os.environ.get('DB_USER', 'postgres'),
+        password=os.environ.get('DB_PASSWORD', ''),
+        database=os.environ.get('DB_NAME', 'postgres'),
+    )
+
+
+def _sync_neon_url():
+    return os.environ.get('DATABASE_URL') or os.environ.get('NEON_DATABASE_URL')
+
+
+def _run_database_sync(direction):
+    """本機 ↔ Neon 同步：COPY 串流 + 暫存表合併 + 高水位增量（db_sync_engine）。
+
+    參數（JSON body）：
+      tables        指定表格（預設全部）
+      full          忽略高水位，整表重新比對合併
+      truncateLocal 僅下載：先清空本機表格再寫入（等同 full）
+      workers       平行表格數（預設 DB_SYNC_WORKERS 或 3）
+    """
+    label = '上傳：本機 → Neon' if direction == 'upload' else '下載：Neon → 本機'
+    data = request.get_json(silent=True) or {}
+    selected_tables = data.get('tables') or []
+    truncate_local = direction == 'download' and bool(data.get('truncateLocal', False))
+    full = bool(data.get('full', False)) or truncate_local
     try:
-        # 獲取要上傳的表格列表
-        data = request.get_json() or {}
-        selected_tables = data.get('tables', [])  # 如果沒有指定，則上傳所有表格
-        
-        logger.info(f"🚀 開始資料庫同步... 選擇的表格: {selected_tables if selected_tables else '全部'}")
-        push_sse(
-            'db_sync',
-            'start',
-            '開始同步：本機 → Neon',
-            direction='upload',
-            selected_tables=selected_tables,
-        )
-        
-        neon_url = (
-            os.environ.get('DATABASE_URL')
-            or os.environ.get('NEON_DATABASE_URL')
-        )
-        if not neon_url:
-            return jsonify({
-                'success': False,
-                'error': 'NEON_DATABASE_URL not configured'
-            }), 400
-        
-        logger.info("📡 連接本地資料庫...")
-        # 連接本地資料庫
-        local_config = {
-            'host': os.environ.get('DB_HOST', 'localhost'),
-            'port': os.environ.get('DB_PORT', '5432'),
-            'user': os.environ.get('DB_USER', 'postgres'),
-            'password': os.environ.get('DB_PASSWORD', ''),
-            'database': os.environ.get('DB_NAME', 'postgres')
-        }
-        
-        try:
-            local_conn = psycopg2.connect(**local_config, cursor_factory=RealDictCursor)
-            logger.info("✅ 本地資料庫連接成功")
-            push_sse('db_sync', 'local_connected', '本地資料庫連接成功', direction='upload')
-        except Exception as e:
-            logger.error(f"❌ 本地資料庫連接失敗: {e}")
-            push_sse('db_sync', 'error', f'本地資料庫連接失敗: {e}', direction='upload')
-            raise
-        
-        logger.info("☁️ 連接 Neon 資料庫...")
-        try:
-            neon_conn = psycopg2.connect(neon_url, cursor_factory=RealDictCursor)
-            logger.info("✅ Neon 資料庫連接成功")
-            push_sse('db_sync', 'neon_connected', 'Neon 資料庫連接成功', direction='upload')
-        except Exception as e:
-            logger.error(f"❌ Neon 資料庫連接失敗: {e}")
-            push_sse('db_sync', 'error', f'Neon 資料庫連接失敗: {e}', direction='upload')
-            if local_conn:
-                local_conn.close()
-            raise
-        
-        local_cursor = local_conn.cursor()
-        neon_cursor = neon_conn.cursor()
-        
-        # 獲取所有表格
-        local_cursor.execute("""
-            SELECT tablename 
-            FROM pg_tables 
-            WHERE schemaname = 'public'
-            ORDER BY tablename
-        """)
-        all_tables = [row['tablename'] for row in local_cursor.fetchall()]
-        
-        # 如果有指定表格，只處理選中的表格
-        if selected_tables:
-            tables = [t for t in all_tables if t in selected_tables]
-            logger.info(f"📋 將上傳 {len(tables)} 個選中的表格（共 {len(all_tables)} 個表格）")
-        else:
-            tables = all_tables
-            logger.info(f"📋 將上傳所有 {len(tables)} 個表格")
-        
-        results = {
-            'success': True,
-            'tables': [],
-            'totalTables': len(tables),
-            'totalRows': 0,
-            'errors': []
-        }
-        
-        for table_name in tables:
-            try:
-                logger.info(f"Processing table: {table_name}")
-                push_sse('db_sync', 'table_start', f'開始上傳表格: {table_name}', direction='upload', table=table_name)
-                
-                # 獲取表格結構
-                local_cursor.execute("""
-                    SELECT 
-                        column_name,
-                        data_type,
-                        character_maximum_length,
-                        is_nullable,
-                        column_default
-                    FROM information_schema.columns
-                    WHERE table_schema = 'public' 
-                      AND table_name = %s
-                    ORDER BY ordinal_position
-                """, (table_name,))
-                columns = local_cursor.fetchall()
-                
-                # 獲取主鍵
-                local_cursor.execute("""
-                    SELECT a.attname
-                    FROM pg_index i
-                    JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
-                    WHERE i.indrelid = %s::regclass AND i.indisprimary
-                """, (table_name,))
-                primary_keys = [row['attname'] for row in local_cursor.fetchall()]
-                
-                # 創建表格 SQL
-                column_defs = []
-                for col in columns:
-                    col_def = f'"{col["column_name"]}" {col["data_type"]}'
-                    if col['character_maximum_length']:
-                        col_def += f'({col["character_maximum_length"]})'
-                    if col['is_nullable'] == 'NO':
-                        col_def += ' NOT NULL'
-                    if col['column_default']:
-                        col_def += f' DEFAULT {col["column_default"]}'
-                    column_defs.append(col_def)
-                
-                create_table_sql = f'CREATE TABLE IF NOT EXISTS "{table_name}" ({", ".join(column_defs)}'
-                if primary_keys:
-                    pk_cols = ', '.join([f'"{pk}"' for pk in primary_keys])
-                    create_table_sql += f', PRIMARY KEY ({pk_cols})'
-                create_table_sql += ')'
-                
-                # 在 Neon 創建表格
-                neon_cursor.execute(create_table_sql)
-                neon_conn.commit()
-                
-                # 先檢查數據量
-                local_cursor.execute(f'SELECT COUNT(*) as count FROM "{table_name}"')
-                row_count = local_cursor.fetchone()['count']
-                logger.info(f"📊 {table_name} 有 {row_count} 行數據")
-                push_sse(
-                    'db_sync',
-                    'table_info',
-                    f'{table_name} 行數: {row_count}',
-                    direction='upload',
-                    table=table_name,
-                    row_count=row_count,
-                )
-                
-                col_names = [col['column_name'] for col in columns]
-                inserted_count = 0
-                
-                if row_count == 0:
-                    logger.info(f"⚠️ {table_name} 是空表格，跳過")
-                    push_sse('db_sync', 'table_skip', f'{table_name} 是空表格，跳過', direction='upload', table=table_name)
-                elif row_count > 10000:
-                    # 大表格：使用批次處理 + execute_values（更快）
-                    logger.info(f"🚀 使用批次處理上傳大表格 {table_name}...")
-                    
-                    batch_size = 5000  # 每批 5000 行
-                    offset = 0
-                    
-                    while offset < row_count:
-                        # 分批讀取
-                        local_cursor.execute(f'SELECT * FROM "{table_name}" LIMIT {batch_size} OFFSET {offset}')
-                        batch_rows = local_cursor.fetchall()
-                        
-                        if not batch_rows:
-                            break
-                        
-                        # 準備數據
-                        values_list = []
-                        for row in batch_rows:
-                            values = tuple(row[col] for col in col_names)
-                            values_list.append(values)
-                        
-                        # 使用 execute_values 批量插入（比逐行快很多）
-                        cols_str = ', '.join([f'"{col}"' for col in col_names])
-                        insert_sql = f'INSERT INTO "{table_name}" ({cols_str}) VALUES %s ON CONFLICT DO NOTHING'
-                        
-                        try:
-                            execute_values(neon_cursor, insert_sql, values_list, page_size=1000)
-                            neon_conn.commit()
-                            inserted_count += len(batch_rows)
-                            
-                            # 顯示進度
-                            progress = min(100, int((offset + len(batch_rows)) / row_count * 100))
-                            logger.info(f"  進度: {progress}% ({inserted_count}/{row_count})")
-                            push_sse(
-                                'db_sync',
-                                'batch_progress',
-                                f'{table_name} 進度 {progress}% ({inserted_count}/{row_count})',
-                                direction='upload',
-                                table=table_name,
-                                progress=progress,
-                                inserted=inserted_count,
-                                row_count=row_count,
-                            )
-                            
-                        except Exception as e:
-                            logger.error(f"Error batch inserting into {table_name}: {e}")
-                            neon_conn.rollback()
-                            push_sse('db_sync', 'error', f'{table_name} 批次寫入失敗: {e}', direction='upload', table=table_name)
-                        
-                        offset += batch_size
-                else:
-                    # 小表格：一次讀取全部
-                    local_cursor.execute(f'SELECT * FROM "{table_name}"')
-                    rows = local_cursor.fetchall()
-                    
-                    if rows:
-                        # 批次插入
-                        batch_size = 100
-                        for i in range(0, len(rows), batch_size):
-                            batch = rows[i:i + batch_size]
-                            
-                            for row in batch:
-                                values = [row[col] for col in col_names]
-                                placeholders = ', '.join(['%s'] * len(values))
-                                cols_str = ', '.join([f'"{col}"' for col in col_names])
-                                
-                                insert_sql = f'''
-                                    INSERT INTO "{table_name}" ({cols_str})
-                                    VALUES ({placeholders})
-                                    ON CONFLICT DO NOTHING
-                                '''
-                                
-                                try:
-                                    neon_cursor.execute(insert_sql, values)
-                                    inserted_count += 1
-                                except Exception as e:
-                                    logger.error(f"Error inserting row into {table_name}: {e}")
-                                    push_sse('db_sync', 'error', f'{table_name} 寫入失敗: {e}', direction='upload', table=table_name)
-                            
-                            neon_conn.commit()
-                
-                results['tables'].append({
-                    'name': table_name,
-                    'rowCount': row_count,
-                    'insertedCount': inserted_count,
-                    'success': True
-                })
-                
-                results['totalRows'] += inserted_count
-                logger.info(f"✓ {table_name}: {inserted_count}/{row_count} rows uploaded")
-                push_sse(
-                    'db_sync',
-                    'table_done',
-                    f'完成上傳表格: {table_name} ({inserted_count}/{row_count})',
-                    direction='upload',
-                    table=table_name,
-                    inserted=inserted_count,
-                    row_count=row_count,
-                )
-                
-            except Exception as e:
-                logger.error(f"Error processing table {table_name}: {e}")
-                push_sse('db_sync', 'error', f'表格 {table_name} 處理失敗: {e}', direction='upload', table=table_name)
-                results['errors'].append({
-                    'table': table_name,
-                    'error': str(e)
-                })
-                results['tables'].append({
-                    'name': table_name,
-                    'success': False,
-                    'error': str(e)
-                })
-                neon_conn.rollback()
-        
-        # 關閉連接
-        local_cursor.close()
-        neon_cursor.close()
-        local_conn.close()
-        neon_conn.close()
+        workers = int(data.get('workers') or os.environ.get('DB_SYNC_WORKERS', '3'))
+    except (TypeError, ValueError):
+        workers = 3
 
-        push_sse(
-            'db_sync',
-            'done',
-            f'同步完成（上傳：本機 → Neon），共 {results["totalTables"]} 表 / {results["totalRows"]} 行',
-            direction='upload',
-            total_tables=results['totalTables'],
-            total_rows=results['totalRows'],
-        )
-        
-        return jsonify(results)
-        
-    except Exception as e:
-        logger.error(f"Database sync error: {e}")
-        push_sse('db_sync', 'error', f'同步失敗（上傳）：{e}', direction='upload')
+    neon_url = _sync_neon_url()
+    if not neon_url:
         return jsonify({
             'success': False,
-            'error': str(e)
-        }), 500
+            'error': 'NEON_DATABASE_URL not configured'
+        }), 400
 
+    db_sync_lock = lock_manager.get('db_sync', 'neon')
+    if not db_sync_lock.acquire(blocking=False):
+        push_sse('db_sync', 'error', '已有同步作業正在進行中，請稍後再試', direction=direction)
+        return jsonify({
+            'success': False,
+            'error': '已有同步作業正在進行中，請稍後再試'
+        }), 409
 
-@app.route('/api/database-sync/download', methods=['POST'])
-def database_sync_download():
-    """將 Neon 資料庫下載回本地"""
-    local_conn = None
-    neon_conn = None
-    lock_acquired = False
     try:
-        data = request.get_json() or {}
-        selected_tables = data.get('tables', [])
-        truncate_local = bool(data.get('truncateLocal', False))
-
-        lock_acquired = db_sync_lock.acquire(blocking=False)
-        if not lock_acquired:
-            push_sse('db_sync', 'error', '已有同步作業正在進行中，請稍後再試', direction='download')
-            return jsonify({
-                'success': False,
-                'error': '已有同步作業正在進行中，請稍後再試'
-            }), 409
-
         push_sse(
             'db_sync',
             'start',
-            '開始同步：Neon → 本機',
-            direction='download',
+            f'開始同步：{label.split("：", 1)[1]}',
+            direction=direction,
             selected_tables=selected_tables,
             truncate_local=truncate_local,
+            full=full,
         )
-
         logger.info(
-            "⬇️ 開始從 Neon 同步回本地... 選擇的表格: %s | truncateLocal=%s",
+            "🚀 開始資料庫同步（%s）... 選擇的表格: %s | full=%s workers=%s",
+            label,
             selected_tables if selected_tables else '全部',
-            truncate_local,
+            full,
+            workers,
         )
 
-        neon_url = (
-            os.environ.get('DATABASE_URL')
-            or os.environ.get('NEON_DATABASE_URL')
-        )
-        if not neon_url:
-            return jsonify({
-                'success': False,
-                'error': 'NEON_DATABASE_URL not configured'
-            }), 400
-
-        local_config = {
-            'host': os.environ.get('DB_HOST', 'localhost'),
-            'port': os.environ.get('DB_PORT', '5432'),
-            'user': os.environ.get('DB_USER', 'postgres'),
-            'password': os.environ.get('DB_PASSWORD', ''),
-            'database': os.environ.get('DB_NAME', 'postgres')
-        }
-
-        logger.info("📡 連接 Neon 資料庫...")
-        neon_conn = psycopg2.connect(neon_url, cursor_factory=RealDictCursor)
-        neon_conn.autocommit = True
-        logger.info("✅ Neon 資料庫連接成功")
-        push_sse('db_sync', 'neon_connected', 'Neon 資料庫連接成功', direction='download')
-
-        logger.info("🗄️ 連接本地資料庫...")
-        local_conn = psycopg2.connect(**local_config, cursor_factory=RealDictCursor)
-        logger.info("✅ 本地資料庫連接成功")
-        push_sse('db_sync', 'local_connected', '本地資料庫連接成功', direction='download')
-
-        neon_cursor = neon_conn.cursor()
-        local_cursor = local_conn.cursor()
+        def neon_connect():
+            return psycopg2.connect(neon_url)
 
-        neon_cursor.execute("""
-            SELECT tablename
-            FROM pg_tables
-            WHERE schemaname = 'public'
-            ORDER BY tablename
-        """)
-        all_neon_tables = [row['tablename'] for row in neon_cursor.fetchall()]
+        src_name = 'local' if direction == 'upload' else 'neon'
+        all_tables = []
+        # 先各連一次確認連線，並從來源端取得表格清單
+        for key, event, name, connect in (
+            ('local', 'local_connected', '本地', _sync_local_connect),
+            ('neon', 'neon_connected', 'Neon', neon_connect),
+        ):
+            try:
+                conn = connect()
+            except Exception as e:
+                logger.error(f"❌ {name}資料庫連接失敗: {e}")
+                push_sse('db_sync', 'error', f'{name}資料庫連接失敗: {e}', direction=direction)
+                raise
+            try:
+                if key == src_name:
+                    all_tables = db_sync_engine.list_tables(conn.cursor())
+            finally:
+                conn.close()
+            push_sse('db_sync', event, f'{name}資料庫連接成功', direction=direction)
 
-        if selected_tables:
-            tables = [t for t in all_neon_tables if t in selected_tables]
-            logger.info(f"📋 將下載 {len(tables)} 個選中的表格（Neon 共 {len(all_neon_tables)} 個表格）")
-        else:
-            tables = all_neon_tables
-            logger.info(f"📋 將下載 Neon 所有 {len(tables)} 個表格")
+        tables = [t for t in all_tables if t in selected_tables] if selected_tables else all_tables
+        logger.info(f"📋 將同步 {len(tables)} 個表格（共 {len(all_tables)} 個表格）")
 
-        results = {
-            'success': True,
-            'direction': 'download',
-            'tables': [],
-            'totalTables': len(tables),
-            'totalRows': 0,
-            'errors': []
-        }
+        src_connect, dst_connect = (
+            (_sync_local_connect, neon_connect) if direction == 'upload' else (neon_connect, _sync_local_connect)
+        )
 
-        max_table_retries = 3
-        base_retry_delay = 0.5
+        def progress(event, message, **extra):
+            push_sse('db_sync', event, message, direction=direction, **extra)
+
+        report = db_sync_engine.sync_tables(
+            src_connect,
+            dst_connect,
+            tables,
+            direction=direction,
+            workers=workers,
+            full=full,
+            recreate=truncate_local,
+            progress=progress,
+        )
+        results = report.as_dict()
+        for item in results['tables']:
+            logger.info(
+                "✓ %s: %s/%s rows (%s, %.1fs)",
+                item['name'], item['insertedCount'], item['rowCount'], item['mode'], item['seconds'],
+            )
 
-        for table_name in tables:
-            attempt = 0
-            while True:
-                try:
-                    logger.info(f"Processing table (download): {table_name}")
-                    push_sse('db_sync', 'table_start', f'開始下載表格: {table_name}', direction='download', table=table_name)
+        push_sse(
+            'db_sync',
+            'done',
+            f'同步完成（{label}），共 {results["totalTables"]} 表 / {results["totalRows"]} 行',
+            direction=direction,
+            total_tables=results['totalTables'],
+            total_rows=results['totalRows'],
+        )
+        return jsonify(results)
 
-                    neon_cursor.execute("""
-                        SELECT
-                            column_name,
-                            data_type,
-                            character_maximum_length,
-                            is_nullable,
-                            column_default
-                        FROM information_schema.columns
-                        WHERE table_schema = 'public'
-                          AND table_name = %s
-                        ORDER BY ordinal_position
-                    """, (table_name,))
-                    columns = neon_cursor.fetchall()
-                    if not columns:
-                        logger.info(f"⚠️ Neon 表格 {table_name} 無欄位或不存在，跳過")
-                        results['tables'].append({
-                            'name': table_name,
-                            'rowCount': 0,
-                            'insertedCount': 0,
-                            'success': True
-                        })
-                        continue
+    except Exception as e:
+        logger.error(f"Database sync error ({direction}): {e}")
+        push_sse('db_sync', 'error', f'同步失敗（{label.split("：", 1)[0]}）：{e}', direction=direction)
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
 
-                    neon_cursor.execute("""
-                        SELECT kcu.column_name
-                        FROM information_schema.table_constraints tc
-                        JOIN information_schema.key_column_usage kcu
-                          ON tc.constraint_name = kcu.constraint_name
-                         AND tc.table_schema = kcu.table_schema
-                        WHERE tc.table_schema = 'public'
-                          AND tc.table_name = %s
-                          AND tc.constraint_type = 'PRIMARY KEY'
-                        ORDER BY kcu.ordinal_position
-                    """, (table_name,))
-                    primary_keys = [row['column_name'] for row in neon_cursor.fetchall()]
-
-                    if not primary_keys:
-                        try:
-                            neon_cursor.execute(
-                                """
-                                SELECT a.attname AS column_name
-                                FROM pg_index i
-                                JOIN pg_attribute a
-                                  ON a.attrelid = i.indrelid
-                                 AND a.attnum = ANY(i.indkey)
-                                WHERE i.indrelid = %s::regclass
-                                  AND i.indisprimary
-                                ORDER BY array_position(i.indkey, a.attnum)
-                                """,
-                                (table_name,),
-                            )
-                            primary_keys = [row['column_name'] for row in neon_cursor.fetchall()]
-                        except Exception:
-                            primary_keys = []
-
-                    column_defs = []
-                    seq_to_create: set[tuple[str | None, str]] = set()
-                    for col in columns:
-                        col_def = f'"{col["column_name"]}" {col["data_type"]}'
-                        if col.get('character_maximum_length'):
-                            col_def += f'({col["character_maximum_length"]})'
-                        if col.get('is_nullable') == 'NO':
-                            col_def += ' NOT NULL'
-                        if col.get('column_default'):
-                            default_expr = str(col['column_default'])
-                            m = re.search(r"nextval\('([^']+)'", default_expr)
-                            if m:
-                                seq_full = m.group(1)
-                                if '.' in seq_full:
-                                    seq_schema, seq_name = seq_full.split('.', 1)
-                                    seq_to_create.add((seq_schema, seq_name))
-                                else:
-                                    seq_to_create.add((None, seq_full))
-                            col_def += f' DEFAULT {col["column_default"]}'
-                        column_defs.append(col_def)
+    finally:
+        db_sync_lock.release()
 
-                    local_cursor.execute(
-                        """
-                        SELECT c.relkind
-                        FROM pg_class c
-                        JOIN pg_namespace n ON n.oid = c.relnamespace
-                        WHERE n.nspname = 'public'
-                          AND c.relname = %s
-                        """,
-                        (table_name,),
-                    )
-                    existing_rel = local_cursor.fetchone()
-                    if existing_rel:
-                        relkind = existing_rel.get('relkind')
-                        if relkind not in ('r', 'p'):
-                            drop_stmt = None
-                            if relkind == 'v':
-                                drop_stmt = f'DROP VIEW IF EXISTS "{table_name}" CASCADE'
-                            elif relkind == 'm':
-                                drop_stmt = f'DROP MATERIALIZED VIEW IF EXISTS "{table_name}" CASCADE'
-                            elif relkind == 'f':
-                                drop_stmt = f'DROP FOREIGN TABLE IF EXISTS "{table_name}" CASCADE'
-                            else:
-                                drop_stmt = f'DROP TABLE IF EXISTS "{table_name}" CASCADE'
-                            local_cursor.execute(drop_stmt)
-                            local_conn.commit()
-
-                    # 若使用 truncateLocal，代表希望本機 schema 完全跟 Neon 對齊：直接 drop/recreate
-                    if truncate_local:
-                        local_cursor.execute(f'DROP TABLE IF EXISTS "{table_name}" CASCADE')
-                        local_conn.commit()
-                        push_sse('db_sync', 'table_truncate', f'已清空本機表格: {table_name}', direction='download', table=table_name)
-
-                    # 先建立 CREATE TABLE 會用到的 sequences（避免 nextval(...) 指到不存在的 *_id_seq）
-                    for seq_schema, seq_name in sorted(seq_to_create):
-                        if seq_schema:
-                            local_cursor.execute(
-                                sql.SQL('CREATE SEQUENCE IF NOT EXISTS {}.{}').format(
-                                    sql.Identifier(seq_schema),
-                                    sql.Identifier(seq_name),
-                                )
-                            )
-                        else:
-                            local_cursor.execute(
-                                sql.SQL('CREATE SEQUENCE IF NOT EXISTS {}').format(
-                                    sql.Identifier(seq_name),
-                                )
-                            )
-                    if seq_to_create:
-                        local_conn.commit()
-
-                    create_table_sql = f'CREATE TABLE IF NOT EXISTS "{table_name}" ({", ".join(column_defs)}'
-                    if primary_keys:
-                        pk_cols = ', '.join([f'"{pk}"' for pk in primary_keys])
-                        create_table_sql += f', PRIMARY KEY ({pk_cols})'
-                    create_table_sql += ')'
-
-                    local_cursor.execute(create_table_sql)
-                    local_conn.commit()
-
-                    if truncate_local:
-                        # drop/recreate 後保險再做一次 truncate + reset identity
-                        local_cursor.execute(f'TRUNCATE TABLE "{table_name}" RESTART IDENTITY CASCADE')
-                        local_conn.commit()
-
-                    neon_cursor.execute(f'SELECT COUNT(*) as count FROM "{table_name}"')
-                    row_count = neon_cursor.fetchone()['count']
-                    logger.info(f"📊 Neon {table_name} 有 {row_count} 行數據")
-                    push_sse(
-                        'db_sync',
-                        'table_info',
-                        f'{table_name} 行數: {row_count}',
-                        direction='download',
-                        table=table_name,
-                        row_count=row_count,
-                    )
 
-                    col_names = [col['column_name'] for col in columns]
-                    col_types = {col['column_name']: (col.get('data_type') or '').lower() for col in columns}
-                    inserted_count = 0
+@sync_bp.route('/api/database-sync/upload', methods=['POST'])
+def database_sync_upload():
+    """將本地資料庫上傳到 Neon"""
+    return _run_database_sync('upload')
 
-                    if row_count == 0:
-                        logger.info(f"⚠️ {table_name} 是空表格，跳過")
-                    else:
-                        batch_size = 5000 if row_count > 10000 else 1000
-                        offset = 0
-
-                        cols_str = ', '.join([f'"{col}"' for col in col_names])
-                        placeholders_sql = f'INSERT INTO "{table_name}" ({cols_str}) VALUES %s'
-                        if primary_keys:
-                            pk_cols = ', '.join([f'"{pk}"' for pk in primary_keys])
-                            placeholders_sql += f' ON CONFLICT ({pk_cols}) DO NOTHING'
-
-                        while offset < row_count:
-                            neon_cursor.execute(
-                                f'SELECT * FROM "{table_name}" LIMIT {batch_size} OFFSET {offset}'
-                            )
-                            batch_rows = neon_cursor.fetchall()
-                            if not batch_rows:
-                                break
 
-                            values_list = []
-                            for r in batch_rows:
-                                row_vals = []
-                                for col in col_names:
-                                    v = r.get(col)
-                                    t = col_types.get(col, '')
-                                    if t in ('json', 'jsonb') and v is not None:
-                                        row_vals.append(Json(v))
-                                    else:
-                                        row_vals.append(v)
-                                values_list.append(tuple(row_vals))
-                            try:
-                                execute_values(local_cursor, placeholders_sql, values_list, page_size=1000)
-                                local_conn.commit()
-                                inserted_count += len(batch_rows)
-
-                                if row_count > 0:
-                                    progress = min(100, int((offset + len(batch_rows)) / row_count * 100))
-                                    logger.info(f"  進度: {progress}% ({inserted_count}/{row_count})")
-                                    push_sse(
-                                        'db_sync',
-                                        'batch_progress',
-                                        f'{table_name} 進度 {progress}% ({inserted_count}/{row_count})',
-                                        direction='download',
-                                        table=table_name,
-                                        progress=progress,
-                                        inserted=inserted_count,
-                                        row_count=row_count,
-                                    )
-                            except Exception as e:
-                                logger.error(f"Error batch inserting into local {table_name}: {e}")
-                                try:
-                                    local_conn.rollback()
-                                except Exception:
-                                    pass
-                                push_sse('db_sync', 'error', f'{table_name} 批次寫入失敗: {e}', direction='download', table=table_name)
-                                raise
+@sync_bp.route('/api/database-sync/download', methods=['POST'])
+def database_sync_download():
+    """將 Neon 資料庫下載回本地"""
+    return _run_database_sync('download')
 
-                            offset += batch_size
 
-                    results['tables'].append({
-                        'name': table_name,
-                        'rowCount': row_count,
-                        'insertedCount': inserted_count,
-                        'success': True
-                    })
-                    results['totalRows'] += inserted_count
-                    logger.info(f"✓ {table_name}: {inserted_count}/{row_count} rows downloaded")
-                    push_sse(
-                        'db_sync',
-                        'table_done',
-                        f'完成下載表格: {table_name} ({inserted_count}/{row_count})',
-                        direction='download',
-                        table=table_name,
-                        inserted=inserted_count,
-                        row_count=row_count,
-                    )
-                    break
 
-                except Exception as e:
-                    logger.error(f"Error processing table {table_name} (download): {e}")
-                    try:
-                        if local_conn:
-                            local_conn.rollback()
-                    except Exception:
-                        pass
-                    try:
-                        if neon_conn and not getattr(neon_conn, 'autocommit', False):
-                            neon_conn.rollback()
-                    except Exception:
-                        pass
+def _neon_replication_connect():
+    return psycopg2.connect(_sync_neon_url())
 
-                    msg = str(e)
-                    pgcode = getattr(e, 'pgcode', None)
-                    is_deadlock = (pgcode == '40P01') or ('deadlock detected' in msg.lower())
-                    if is_deadlock and attempt < (max_table_retries - 1):
-                        delay = base_retry_delay * (2 ** attempt)
-                        attempt += 1
-                        push_sse(
-                            'db_sync',
-                            'warning',
-                            f'表格 {table_name} 發生死鎖，{delay:.1f}s 後重試（第 {attempt + 1}/{max_table_retries} 次）',
-                            direction='download',
-                            table=table_name,
-                        )
-                        time.sleep(delay)
-                        continue
 
-                    push_sse('db_sync', 'error', f'表格 {table_name} 處理失敗: {e}', direction='download', table=table_name)
-                    results['errors'].append({
-                        'table': table_name,
-                        'error': str(e)
-                    })
-                    results['tables'].append({
-                        'name': table_name,
-                        'success': False,
-                        'error': str(e)
-                    })
-                    break
+try:
+    _replication_interval = float(os.getenv('NEON_REPLICATION_INTERVAL_SECONDS', '30'))
+except ValueError:
+    _replication_interval = 30.0
+
+neon_replicator = replication_log.Replicator(
+    _sync_local_connect,
+    _neon_replication_connect,
+    interval=_replication_interval,
+)
+if NEON_REPLICATION_ENABLED and _sync_neon_url():
+    neon_replicator.start()
+    logger.info("☁️ Neon 變更複寫已啟動（每 %.0f 秒）", _replication_interval)
 
-        try:
-            local_cursor.close()
-            neon_cursor.close()
-        except Exception:
-            pass
-        try:
-            local_conn.close()
-        except Exception:
-            pass
-        try:
-            neon_conn.close()
-        except Exception:
-            pass
 
-        push_sse(
-            'db_sync',
-            'done',
-            f'同步完成（下載：Neon → 本機），共 {results["totalTables"]} 表 / {results["totalRows"]} 行',
-            direction='download',
-            total_tables=results['totalTables'],
-            total_rows=results['totalRows'],
-        )
+@sync_bp.route('/api/replication/status', methods=['GET'])
+def replication_status():
+    """本機 replication_log 待送筆數與延遲秒數。"""
+    payload = {'success': True, 'enabled': NEON_REPLICATION_ENABLED, 'replicator': neon_replicator.status}
+    conn = None
+    try:
+        conn = _sync_local_connect()
+        payload['lag'] = replication_log.lag(conn.cursor())
+        conn.commit()
+    except Exception as e:
+        payload.update({'success': False, 'error': str(e)})
+        return jsonify(payload), 500
+    finally:
+        if conn is not None:
+            conn.close()
+    return jsonify(payload)
 
-        return jsonify(results)
 
+@sync_bp.route('/api/replication/run', methods=['POST'])
+def replication_run():
+    """立即把 replication_log 送到 Neon（管理員）。"""
+    denied = _require_quantgems_admin()
+    if denied:
+        return denied
+    if not _sync_neon_url():
+        return jsonify({'success': False, 'error': 'NEON_DATABASE_URL not configured'}), 400
+    try:
+        result = neon_replicator.run_once()
     except Exception as e:
-        logger.error(f"Database download sync error: {e}")
-        push_sse('db_sync', 'error', f'同步失敗（下載）：{e}', direction='download')
-        try:
-            if local_conn:
-                local_conn.close()
-        except Exception:
-            pass
-        try:
-            if neon_conn:
-                neon_conn.close()
-        except Exception:
-            pass
-        return jsonify({
-            'success': False,
-            'error': str(e)
-        }), 500
+        return jsonify({'success': False, 'error': str(e)}), 500
+    return jsonify({'success': True, **result, 'replicator': neon_replicator.status})
 
-    finally:
-        if lock_acquired:
-            try:
-                db_sync_lock.release()
-            except Exception:
-                pass
 
 def run_t86_job(start_date=None, end_date=None, market='both', sleep_seconds=0.6, persist=True, use_local=False):
     today = datetime.now().date().isoformat()
@@ -15216,6 +15425,56 @@ def parse_cli_args(argv=None):
     parser.add_argument('--use-local-db', action='store_true', help='Use local database settings instead of Neon/DATABASE_URL')
     return parser.parse_args(argv)
 
+SHARED_JOB_STATUSES = (
+    'anomaly_repair_status',
+    'financial_ratios_status',
+    'income_fetch_status',
+    'balance_fetch_status',
+    'cash_flow_fetch_status',
+    'warrants_import_status',
+    'twse_warrant_master_import_status',
+    'tpex_warrant_master_import_status',
+    'tpex_warrant_daily_import_status',
+    'tpex_warrant_daily_backfill_status',
+    'twse_warrant_ohlc_enrich_status',
+    'warrant_partition_status',
+)
+# getter 以名稱查 globals，工作函式重新指派整個 dict 時也能追到最新物件
+for _status_name in SHARED_JOB_STATUSES:
+    job_state_store.register(_status_name, lambda _n=_status_name: globals().get(_n))
+
+
+def create_app():
+    """WSGI app factory：CORS、請求量測、各領域 blueprint 與跨 worker 的工作狀態發佈。
+
+    gunicorn 可用 ``server:app`` 或 ``'server:create_app()'``；多個 worker 的工作進度
+    經由 job_state（tw_job_state）共享，狀態端點不論打到哪個 worker 都一致；
+    SSE 事件經 NOTIFY 轉送，/api/stream/logs 連到任一 worker 都能收到。
+    """
+    flask_app = Flask(__name__, static_folder=frontend_dir, static_url_path='')
+    CORS(flask_app, resources={r"/api/*": {"origins": allowed_origins}})
+    if REQUEST_METRICS_ENABLED:
+        request_metrics.install(flask_app)
+    flask_app.register_blueprint(cloud_jobs_blueprint)
+    for blueprint in DOMAIN_BLUEPRINTS:
+        flask_app.register_blueprint(blueprint)
+    # BWIBBU Blueprint（統一於本服務下提供 /api/bwibbu/*）
+    try:
+        from bwibbu_blueprint import create_bwibbu_blueprint
+        flask_app.register_blueprint(create_bwibbu_blueprint(DatabaseManager, stock_api))
+        logger.info("BWIBBU Blueprint 已註冊於 /api/bwibbu")
+    except Exception as e:
+        logger.warning(f"BWIBBU Blueprint 註冊失敗: {e}")
+    if JOB_STATE_SHARED:
+        job_state_store.start()
+    if SSE_SHARED:
+        sse_relay.start()
+    return flask_app
+
+
+app = create_app()
+
+
 if __name__ == '__main__':
     args = parse_cli_args()
 
@@ -0,0 +1,294 @@
+"""Persistent stock symbol master backed by ``tw_stock_symbols``.
+
+The table is the source of truth; this module keeps an in-process snapshot with
+dict indexes by code and by market so that market resolution is O(1).  Exchange
+listings are only fetched by a background refresher that writes the diff back
+to the table, so API requests never wait on ISIN pages.
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from typing import Any, Callable, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+MARKET_TWSE = "上市"
+MARKET_OTC = "上櫃"
+OTC_MARKET_ALIASES = {MARKET_OTC, "otc", "tpex", "OTC", "TPEX"}
+TWSE_MARKET_ALIASES = {MARKET_TWSE, "twse", "TWSE", "tse", "TSE"}
+DERIVATIVE_NAME_KEYWORDS = ("購", "牛熊證", "權證")
+DEFAULT_REFRESH_INTERVAL = 6 * 3600
+
+
+def split_symbol(symbol: str | None) -> tuple[str, str | None]:
+    """Return ``(code, suffix)`` for ``2330.TW`` style symbols."""
+    text = str(symbol or "").strip().upper()
+    if "." in text:
+        code, suffix = text.split(".", 1)
+        return code, suffix or None
+    return text, None
+
+
+def normalize_market(symbol: str, market: str | None) -> str | None:
+    """Resolve the market label, preferring the symbol suffix over the stored column."""
+    _, suffix = split_symbol(symbol)
+    if suffix == "TWO":
+        return MARKET_OTC
+    if suffix == "TW":
+        return MARKET_TWSE
+    value = str(market or "").strip()
+    if value in OTC_MARKET_ALIASES:
+        return MARKET_OTC
+    if value in TWSE_MARKET_ALIASES:
+        return MARKET_TWSE
+    return value or None
+
+
+def diff_listing(
+    current: dict[str, dict[str, Any]],
+    listing: Iterable[dict[str, Any]],
+) -> tuple[list[dict[str, Any]], list[dict[str, Any]], list[str]]:
+    """Compare a fresh exchange listing against the indexed master.
+
+    Returns ``(added, changed, removed_symbols)``; ``current`` is keyed by symbol.
+    """
+    seen: set[str] = set()
+    added: list[dict[str, Any]] = []
+    changed: list[dict[str, Any]] = []
+    for item in listing:
+        symbol = str(item.get("symbol") or "").strip().upper()
+        name = str(item.get("name") or "").strip()
+        if not symbol or not name or symbol in seen:
+            continue
+        seen.add(symbol)
+        entry = {
+            "symbol": symbol,
+            "name": name,
+            "market": normalize_market(symbol, item.get("market")),
+        }
+        existing = current.get(symbol)
+        if existing is None:
+            added.append(entry)
+        elif existing.get("name") != entry["name"] or existing.get("market") != entry["market"]:
+            changed.append(entry)
+    removed = sorted(symbol for symbol in current if symbol not in seen)
+    return added, changed, removed
+
+
+class SymbolMaster:
+    """In-process index over ``tw_stock_symbols`` with a background diff refresher."""
+
+    def __init__(
+        self,
+        connect: Callable[[], Any],
+        *,
+        listing_fetcher: Optional[Callable[[], list[dict[str, Any]]]] = None,
+        table: str = "tw_stock_symbols",
+        refresh_interval: float = DEFAULT_REFRESH_INTERVAL,
+    ):
+        self._connect = connect
+        self._listing_fetcher = listing_fetcher
+        self.table = table
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._refresh_thread: threading.Thread | None = None
+        self._symbols: list[dict[str, Any]] = []
+        self._by_symbol: dict[str, dict[str, Any]] = {}
+        self._by_code: dict[str, dict[str, Any]] = {}
+        self._by_market: dict[str, list[dict[str, Any]]] = {}
+        self.loaded_at: float | None = None
+        self._retry_load_at = 0.0
+        self.refreshed_at: float | None = None
+        self.last_refresh_stats: dict[str, Any] | None = None
+
+    # ------------------------------------------------------------------
+    # Index maintenance
+    # ------------------------------------------------------------------
+    def _build_indexes(self, rows: Iterable[dict[str, Any]]) -> None:
+        symbols: list[dict[str, Any]] = []
+        by_symbol: dict[str, dict[str, Any]] = {}
+        by_code: dict[str, dict[str, Any]] = {}
+        by_market: dict[str, list[dict[str, Any]]] = {}
+        for row in sorted(rows, key=lambda item: str(item.get("symbol") or "").upper()):
+            symbol = str(row.get("symbol") or "").strip().upper()
+            if not symbol or symbol in by_symbol:
+                continue
+            entry = {
+                "symbol": symbol,
+                "name": str(row.get("name") or "").strip(),
+                "market": normalize_market(symbol, row.get("market")),
+            }
+            code, _ = split_symbol(symbol)
+            symbols.append(entry)
+            by_symbol[symbol] = entry
+            # 同代號同時存在 .TW/.TWO 時以先出現者（排序後為 .TW）為準
+            by_code.setdefault(code, entry)
+            by_market.setdefault(entry["market"] or "", []).append(entry)
+        with self._lock:
+            self._symbols = symbols
+            self._by_symbol = by_symbol
+            self._by_code = by_code
+            self._by_market = by_market
+
+    def load(self) -> int:
+        """Load the full master from the database and rebuild the indexes."""
+        conn = self._connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT symbol, name, market FROM {self.table} ORDER BY symbol")
+            rows = [dict(row) for row in cursor.fetchall() or []]
+            cursor.close()
+        finally:
+            conn.close()
+        self._build_indexes(rows)
+        self.loaded_at = time.time()
+        logger.info("symbol master loaded %d symbols from %s", len(rows), self.table)
+        return len(rows)
+
+    def ensure_loaded(self) -> bool:
+        """Load once per process and schedule a refresh when the snapshot is stale."""
+        if self.loaded_at is None and time.time() >= self._retry_load_at:
+            try:
+                self.load()
+            except Exception as exc:
+                logger.warning("symbol master load failed: %s", exc)
+                self._retry_load_at = time.time() + 60
+        if self.refreshed_at is None or time.time() - self.refreshed_at >= self.refresh_interval:
+            self.refresh_async()
+        return bool(self._symbols)
+
+    # ------------------------------------------------------------------
+    # Lookups
+    # ------------------------------------------------------------------
+    def symbols(self) -> list[dict[str, Any]]:
+        with self._lock:
+            return [dict(item) for item in self._symbols]
+
+    def get(self, code_or_symbol: str | None) -> dict[str, Any] | None:
+        text = str(code_or_symbol or "").strip().upper()
+        if not text:
+            return None
+        entry = self._by_symbol.get(text)
+        if entry is None:
+            entry = self._by_code.get(split_symbol(text)[0])
+        return dict(entry) if entry else None
+
+    def market_of(self, code_or_symbol: str | None) -> str | None:
+        entry = self.get(code_or_symbol)
+        return entry.get("market") if entry else None
+
+    def is_otc(self, code_or_symbol: str | None) -> bool | None:
+        """True/False when the code is known, ``None`` when it is not in the master."""
+        market = self.market_of(code_or_symbol)
+        if market is None:
+            return None
+        return market == MARKET_OTC
+
+    def by_market(self, market: str) -> list[dict[str, Any]]:
+        key = normalize_market("", market) or ""
+        with self._lock:
+            return [dict(item) for item in self._by_market.get(key, [])]
+
+    def __len__(self) -> int:
+        return len(self._symbols)
+
+    # ------------------------------------------------------------------
+    # Refresh from exchanges
+    # ------------------------------------------------------------------
+    def apply_listing(self, listing: list[dict[str, Any]]) -> dict[str, Any]:
+        """Upsert the added/changed rows of ``listing`` and swap the indexes.
+
+        Delisted symbols are reported but kept, since price history still
+        references them.
+        """
+        with self._lock:
+            current = dict(self._by_symbol)
+        added, changed, removed = diff_listing(current, listing)
+        upserts = added + changed
+        if upserts:
+            conn = self._connect()
+            try:
+                cursor = conn.cursor()
+                for entry in upserts:
+                    cursor.execute(
+                        f"""
+                        INSERT INTO {self.table} (symbol, name, market, updated_at)
+                        VALUES (%s, %s, %s, CURRENT_TIMESTAMP)
+                        ON CONFLICT (symbol) DO UPDATE SET
+                            name = EXCLUDED.name,
+                            market = EXCLUDED.market,
+                            updated_at = CURRENT_TIMESTAMP
+                        """,
+                        (entry["symbol"], entry["name"], entry["market"]),
+                    )
+                conn.commit()
+                cursor.close()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                conn.close()
+            merged = dict(current)
+            for entry in upserts:
+                merged[entry["symbol"]] = entry
+            self._build_indexes(merged.values())
+        stats = {
+            "added": len(added),
+            "changed": len(changed),
+            "removed": len(removed),
+            "total": len(self._symbols),
+        }
+        logger.info(
+            "symbol master refresh: +%d ~%d -%d (total %d)",
+            stats["added"], stats["changed"], stats["removed"], stats["total"],
+        )
+        return stats
+
+    def refresh(self) -> dict[str, Any] | None:
+        if self._listing_fetcher is None:
+            return None
+        try:
+            listing = self._listing_fetcher()
+        except Exception as exc:
+            logger.warning("symbol master listing fetch failed: %s", exc)
+            return None
+        finally:
+            self.refreshed_at = time.time()
+        if not listing:
+            return None
+        stats = self.apply_listing(listing)
+        self.last_refresh_stats = stats
+        return stats
+
+    def refresh_async(self) -> bool:
+        """Start a background refresh unless one is already running."""
+        if self._listing_fetcher is None:
+            return False
+        with self._lock:
+            if self._refresh_thread is not None and self._refresh_thread.is_alive():
+                return False
+            self.refreshed_at = time.time()
+            thread = threading.Thread(target=self._refresh_safely, name="symbol-master-refresh", daemon=True)
+            self._refresh_thread = thread
+        thread.start()
+        return True
+
+    def _refresh_safely(self) -> None:
+        try:
+            self.refresh()
+        except Exception:
+            logger.exception("symbol master refresh failed")
+
+    def status(self) -> dict[str, Any]:
+        return {
+            "table": self.table,
+            "count": len(self._symbols),
+            "markets": {market or "unknown": len(items) for market, items in self._by_market.items()},
+            "loaded_at": self.loaded_at,
+            "refreshed_at": self.refreshed_at,
+            "refreshing": bool(self._refresh_thread and self._refresh_thread.is_alive()),
+            "last_refresh": self.last_refresh_stats,
+        }
@@ -0,0 +1,112 @@
+import advisory_locks
+from advisory_locks import DistributedLock, lock_key
+
+
+class FakeServer:
+    """Advisory lock table shared by every fake connection (one per 'backend')."""
+
+    def __init__(self):
+        self.held = {}
+        self.holders = {}
+        self.expired = set()
+        self.next_pid = 100
+
+    def connect(self):
+        self.next_pid += 1
+        return FakeConnection(self, self.next_pid)
+
+
+class FakeConnection:
+    def __init__(self, server, pid):
+        self.server = server
+        self.pid = pid
+        self.autocommit = False
+        self.closed = False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def close(self):
+        self.closed = True
+        # 連線關閉時 PostgreSQL 釋放 session advisory lock
+        for key, pid in list(self.server.held.items()):
+            if pid == self.pid:
+                del self.server.held[key]
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self._row = None
+
+    def execute(self, sql, params=None):
+        server = self.conn.server
+        text = " ".join(sql.split())
+        self._row = None
+        if text.startswith("SELECT pg_try_advisory_lock"):
+            key = params[0]
+            ok = server.held.get(key, self.conn.pid) == self.conn.pid
+            if ok:
+                server.held[key] = self.conn.pid
+            self._row = (ok,)
+        elif text.startswith("SELECT pg_advisory_unlock"):
+            server.held.pop(params[0], None)
+            self._row = (True,)
+        elif text.startswith("INSERT INTO tw_lock_holders"):
+            server.holders[params[0]] = {"owner": params[3], "pid": self.conn.pid}
+        elif text.startswith("SELECT backend_pid FROM tw_lock_holders"):
+            holder = server.holders.get(params[0])
+            if holder and params[0] in server.expired:
+                self._row = (holder["pid"],)
+        elif text.startswith("SELECT pg_terminate_backend"):
+            for key, pid in list(server.held.items()):
+                if pid == params[0]:
+                    del server.held[key]
+            self._row = (True,)
+        elif text.startswith("DELETE FROM tw_lock_holders"):
+            server.holders.pop(params[0], None)
+            server.expired.discard(params[0])
+
+    def fetchone(self):
+        return self._row
+
+    def close(self):
+        pass
+
+
+def test_lock_excludes_other_processes_until_released(monkeypatch):
+    monkeypatch.setattr(advisory_locks, "POLL_SECONDS", 0.0)
+    server = FakeServer()
+    worker_a = DistributedLock("update", "neon", server.connect, lease=60)
+    worker_b = DistributedLock("update", "neon", server.connect, lease=60)
+
+    assert worker_a.acquire(blocking=False) and worker_a.mode == "advisory"
+    assert worker_b.acquire(blocking=False) is False
+    assert not worker_b.locked()
+    worker_a.release()
+    assert worker_b.acquire(blocking=False)
+    worker_b.release()
+    assert server.held == {}
+
+
+def test_expired_lease_is_broken_by_contender(monkeypatch):
+    monkeypatch.setattr(advisory_locks, "POLL_SECONDS", 0.0)
+    server = FakeServer()
+    hung = DistributedLock("update", "neon", server.connect, lease=60)
+    assert hung.acquire(blocking=False)
+    server.expired.add(lock_key("update", "neon"))
+
+    contender = DistributedLock("update", "neon", server.connect, lease=60)
+    assert contender.acquire(blocking=False)
+    assert server.holders[lock_key("update", "neon")]["pid"] != hung._conn.pid
+
+
+def test_unreachable_database_degrades_to_process_lock():
+    def boom():
+        raise RuntimeError("db down")
+
+    lock = DistributedLock("db_sync", "neon", boom)
+    assert lock.acquire(blocking=False) and lock.mode == "local"
+    assert lock.acquire(blocking=False) is False
+    lock.release()
+    assert not lock.locked()
@@ -0,0 +1,33 @@
+from datetime import date
+
+from anomaly_repair import filter_by_previous_close, plan_repair, snapshot_records
+
+
+def test_plan_unions_padded_windows_into_weekdays_per_market():
+    plan = plan_repair(
+        [
+            {"symbol": "2330.TW", "date": "2024-05-08"},
+            {"symbol": "2317.TW", "date": "2024-05-09"},
+            {"symbol": "6488.TWO", "date": "2024-05-08"},
+            {"symbol": "^TWII", "date": "2024-05-08"},
+        ],
+        pad_days=1,
+        today=date(2024, 5, 31),
+    )
+    assert [d.day.isoformat() for d in plan.days] == ["2024-05-07", "2024-05-08", "2024-05-09", "2024-05-10"]
+    assert plan.days[1].twse == ["2317.TW", "2330.TW"]
+    assert plan.days[1].tpex == ["6488.TWO"]
+    assert plan.days[3].symbols == ["2317.TW"]
+    assert plan.skipped_symbols == ["^TWII"]
+    assert plan.summary()["fetches"] == 7
+
+
+def test_snapshot_rows_are_validated_against_previous_close():
+    snapshot = {
+        "2330": {"Open": 800, "High": 810, "Low": 790, "Close": 805, "Volume": 10},
+        "2317": {"Open": 1, "High": 1, "Low": 1, "Close": 1000, "Volume": 10},
+    }
+    rows = snapshot_records(snapshot, ["2330.TW", "2317.TW", "1101.TW"], date(2024, 5, 8))
+    accepted, rejected = filter_by_previous_close(rows, {"2330.TW": 790.0, "2317.TW": 150.0}, 0.5)
+    assert [r[0] for r in accepted] == ["2330.TW"]
+    assert [(r[0], reason) for r, reason in rejected] == [("2317.TW", "pct_change_gt_0.5")]
@@ -0,0 +1,122 @@
+import os
+import threading
+import time
+from types import SimpleNamespace
+
+import cloud_jobs
+from cloud_jobs import QUEUE_CHANNEL, JobListener
+
+
+class FakeListenConnection:
+    """Readable through a pipe, like the libpq socket when a NOTIFY arrives."""
+
+    def __init__(self):
+        self.autocommit = False
+        self.closed = 0
+        self.executed = []
+        self.notifies = []
+        self._pending = []
+        self._r, self._w = os.pipe()
+
+    def fileno(self):
+        return self._r
+
+    def cursor(self):
+        conn = self
+
+        class _Cursor:
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                return False
+
+            def execute(self, sql, params=None):
+                conn.executed.append(sql)
+
+        return _Cursor()
+
+    def notify(self, payload):
+        self._pending.append(SimpleNamespace(channel=QUEUE_CHANNEL, payload=payload))
+        os.write(self._w, b"n")
+
+    def poll(self):
+        os.read(self._r, 1024)
+        self.notifies.extend(self._pending)
+        self._pending.clear()
+
+    def close(self):
+        self.closed = 1
+
+
+def test_listener_returns_notifications_and_wakes_without_waiting():
+    conn = FakeListenConnection()
+    listener = JobListener(connect_fn=lambda: conn)
+    assert listener.wait(0) == []
+    assert conn.autocommit is True and conn.executed == [f'LISTEN "{QUEUE_CHANNEL}"']
+
+    conn.notify("t86")
+    assert listener.wait(5) == ["t86"]
+
+    listener.wake()
+    started = time.monotonic()
+    assert listener.wait(5) == []
+    assert time.monotonic() - started < 1
+    listener.close()
+
+
+def test_listener_degrades_to_sleep_when_database_is_down():
+    def boom():
+        raise RuntimeError("db down")
+
+    listener = JobListener(connect_fn=boom)
+    started = time.monotonic()
+    assert listener.wait(0.05) == []
+    assert time.monotonic() - started >= 0.04
+    listener.close()
+
+
+class FakePool:
+    """Raises like ThreadedConnectionPool once ``maxconn`` connections are out."""
+
+    closed = False
+
+    def __init__(self, maxconn):
+        self.maxconn = maxconn
+        self.out = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    def getconn(self):
+        with self.lock:
+            if self.out >= self.maxconn:
+                raise RuntimeError("connection pool exhausted")
+            self.out += 1
+            self.peak = max(self.peak, self.out)
+        return SimpleNamespace(commit=lambda: time.sleep(0.02), rollback=lambda: None, closed=0)
+
+    def putconn(self, conn, close=False):
+        with self.lock:
+            self.out -= 1
+
+
+def test_pooled_connection_waits_instead_of_exhausting_the_pool(monkeypatch):
+    pool = FakePool(cloud_jobs.POOL_MAX_CONNECTIONS)
+    monkeypatch.setattr(cloud_jobs, "_get_pool", lambda: pool)
+    monkeypatch.setattr(cloud_jobs, "_table_ready", True)
+    errors = []
+
+    def borrow():
+        try:
+            with cloud_jobs.pooled_connection():
+                pass
+        except Exception as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=borrow) for _ in range(cloud_jobs.POOL_MAX_CONNECTIONS * 3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert errors == []
+    assert pool.peak == cloud_jobs.POOL_MAX_CONNECTIONS and pool.out == 0
@@ -0,0 +1,85 @@
+import threading
+
+import cloud_worker
+from cloud_worker import JobProgress, SlotPool, fill_slots, parse_job_limits
+
+
+def test_job_limits_override_defaults():
+    limits = parse_job_limits("t86=4, stock_prices=0,bogus")
+    assert limits["t86"] == 4
+    assert limits["stock_prices"] == 0
+    assert limits["margin"] == cloud_worker.DEFAULT_JOB_LIMITS["margin"]
+
+
+def test_slots_run_network_jobs_in_parallel_and_serialize_price_backfills():
+    queue = [
+        {"id": i, "job_type": job_type}
+        for i, job_type in enumerate(["stock_prices", "stock_prices", "t86", "t86", "t86"])
+    ]
+    claimed_with = []
+
+    def claim(worker_id, job_types):
+        claimed_with.append(list(job_types))
+        for job in queue:
+            if job["job_type"] in job_types:
+                queue.remove(job)
+                return job
+        return None
+
+    release = threading.Event()
+    pool = SlotPool(3, {"stock_prices": 1, "t86": 2}, runner=lambda job: release.wait(5))
+
+    assert fill_slots(pool, claim) == 3
+    assert pool.running == {"stock_prices": 1, "t86": 2}
+    assert [job["job_type"] for job in queue] == ["stock_prices", "t86"]
+    assert pool.claimable_types() == []
+
+    release.set()
+    pool.join(5)
+    assert fill_slots(pool, claim) == 2
+    pool.join(5)
+    assert queue == []
+
+
+def test_progress_spans_map_phases_and_throttle():
+    calls = []
+    progress = JobProgress("job-1", interval=60, update=lambda job_id, **kw: calls.append(kw))
+    prices = progress.span(5, 80, "prices")
+    prices(1, 4, "2330.TW")
+    prices(2, 4, "2317.TW")  # throttled
+    prices(4, 4, "1101.TW")  # phase end is always written
+    assert [c["progress"] for c in calls] == [23, 80]
+    assert calls[-1]["current_item"] == "1101.TW"
+    assert calls[-1]["message"] == "prices 4/4"
+
+
+def test_sweeper_swallows_errors_and_freed_slot_wakes_dispatcher():
+    sweeper = cloud_worker.Sweeper(recover=lambda: {"requeued": 2, "failed": 0})
+    assert sweeper.sweep() == {"requeued": 2, "failed": 0}
+
+    def broken():
+        raise RuntimeError("db down")
+
+    assert cloud_worker.Sweeper(recover=broken).sweep() == {}
+
+    woken = threading.Event()
+    pool = SlotPool(1, {"t86": 1}, runner=lambda job: None, on_free=woken.set)
+    pool.submit({"id": 1, "job_type": "t86"})
+    assert woken.wait(5)
+
+
+def test_run_once_recovers_stale_jobs_before_claiming():
+    order = []
+    stale = {"id": "j1", "job_type": "t86", "attempts": 2}
+
+    def recover():
+        order.append("recover")
+        return {"requeued": 1, "failed": 0}
+
+    def claim(worker_id):
+        order.append("claim")
+        return stale if order.count("recover") else None
+
+    ran = []
+    assert cloud_worker.run_once(recover=recover, claim=claim, runner=ran.append) is True
+    assert order == ["recover", "claim"] and ran == [stale]
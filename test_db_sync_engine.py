@@ -0,0 +1,165 @@
+from db_sync_engine import TableShape, ensure_change_marker, list_tables, sync_table
+
+
+def _shape(columns, pk, unique_keys=()):
+    return TableShape("t", [{"name": c, "data_type": dt} for c, dt in columns], pk, [list(k) for k in unique_keys])
+
+
+def test_watermark_prefers_updated_at_then_key_range():
+    assert _shape([("id", "integer"), ("updated_at", "timestamp without time zone")], ["id"]).watermark_column() == "updated_at"
+    assert _shape([("symbol", "character varying"), ("date", "date")], ["symbol", "date"]).watermark_column() == "date"
+    assert _shape([("code", "text"), ("name", "text")], ["code"]).watermark_column() is None
+    # 無主鍵時 updated_at 也無法增量合併
+    assert _shape([("updated_at", "timestamp with time zone")], []).watermark_column() is None
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.rowcount = 0
+        self._rows = []
+
+    def execute(self, sql, params=None):
+        text = " ".join(sql.split())
+        self.conn.log.append((text, params))
+        self._rows = []
+        for needle, rows in self.conn.answers:
+            if needle in text:
+                self._rows = rows
+                break
+        if text.startswith(("INSERT INTO \"prices\"", "INSERT INTO \"tw_stock_prices\"")):
+            self.rowcount = 2
+
+    def fetchall(self):
+        return list(self._rows)
+
+    def mogrify(self, sql, params):
+        return ("'%s'" % params[0]).encode()
+
+    def copy_expert(self, sql, file):
+        self.conn.log.append((sql, None))
+        if "TO STDOUT" in sql:
+            file.write(b"2330.TW\t2024-05-08\t805\n2330.TW\t2024-05-09\t810\n")
+        else:
+            self.conn.copied = file.read()
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, answers):
+        self.answers = answers
+        self.log = []
+        self.copied = None
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.log.append(("COMMIT", None))
+
+    def rollback(self):
+        pass
+
+
+def test_sync_table_streams_incremental_copy_and_merges_with_watermark():
+    src = FakeConnection([
+        ("information_schema.columns", [
+            ("symbol", "character varying", 20, "NO", None),
+            ("date", "date", None, "NO", None),
+            ("close_price", "numeric", None, "YES", None),
+        ]),
+        ("AND i.indisprimary", [("symbol",), ("date",)]),
+    ])
+    dst = FakeConnection([
+        ("FROM sync_watermarks", [("date", "2024-05-08")]),
+        ("COUNT(*) FROM _sync_stage", [(2,)]),
+        ("MAX(\"date\")", [("2024-05-09",)]),
+    ])
+    result = sync_table(src, dst, "prices", direction="upload")
+
+    assert result.success and result.mode == "incremental"
+    assert (result.row_count, result.merged, result.watermark) == (2, 2, "2024-05-09")
+    copy_out = [sql for sql, _ in src.log if "TO STDOUT" in sql][0]
+    assert "WHERE \"date\" >= '2024-05-08'" in copy_out
+    assert dst.copied.count(b"\n") == 2
+    merge = [sql for sql, _ in dst.log if sql.startswith("INSERT INTO \"prices\"")][0]
+    assert "ON CONFLICT (\"symbol\", \"date\") DO UPDATE SET \"close_price\" = EXCLUDED.\"close_price\"" in merge
+    saved = [params for sql, params in dst.log if sql.startswith("INSERT INTO sync_watermarks")][0]
+    assert saved == ("upload", "prices", "date", "2024-05-09", 2)
+
+
+PRICE_COLUMNS = [
+    ("id", "integer", None, "NO", "nextval('tw_stock_prices_id_seq'::regclass)"),
+    ("symbol", "character varying", 20, "NO", None),
+    ("date", "date", None, "NO", None),
+    ("close_price", "numeric", None, "YES", None),
+]
+
+
+def test_serial_surrogate_key_gives_way_to_the_business_key():
+    shape = TableShape(
+        "tw_stock_prices",
+        [{"name": c[0], "data_type": c[1], "default": c[4]} for c in PRICE_COLUMNS],
+        ["id"],
+        [["symbol", "date"]],
+    )
+    assert shape.surrogate_key == "id"
+    assert shape.merge_key() == ["symbol", "date"]
+    assert shape.copy_columns == ["symbol", "date", "close_price"]
+    # 序號 id 不能當水位：改寫的列保留原 id
+    assert shape.watermark_column() == "date"
+    # 非序號的單欄主鍵維持原樣
+    assert _shape([("code", "text"), ("name", "text")], ["code"], [["name"]]).merge_key() == ["code"]
+
+
+def test_prices_table_merges_on_symbol_date_without_copying_ids():
+    src = FakeConnection([
+        ("information_schema.columns", PRICE_COLUMNS + [
+            ("updated_at", "timestamp without time zone", None, "YES", "CURRENT_TIMESTAMP"),
+        ]),
+        ("AND i.indisprimary", [("id",)]),
+        ("NOT i.indisprimary", [(["symbol", "date"],), (["symbol", "date"],)]),
+    ])
+    dst = FakeConnection([
+        ("FROM sync_watermarks", [("updated_at", "2024-05-08 18:00:00")]),
+        ("COUNT(*) FROM _sync_stage", [(2,)]),
+        ("MAX(\"updated_at\")", [("2024-05-09 18:00:00",)]),
+    ])
+    result = sync_table(src, dst, "tw_stock_prices", direction="upload")
+
+    assert result.success and result.watermark_column == "updated_at"
+    copy_out = [sql for sql, _ in src.log if "TO STDOUT" in sql][0]
+    assert copy_out.startswith('COPY (SELECT "symbol", "date", "close_price", "updated_at" FROM')
+    # updated_at 是交易開始時間，往回重讀一段重疊區間，晚提交的舊時間戳才不會漏掉
+    assert (
+        "WHERE \"updated_at\" >= CAST('2024-05-08 18:00:00' AS timestamp without time zone) - INTERVAL '600 seconds'"
+        in copy_out
+    )
+    uniques = [sql for sql, _ in dst.log if sql.startswith("CREATE UNIQUE INDEX")]
+    assert uniques == [
+        'CREATE UNIQUE INDEX IF NOT EXISTS "tw_stock_prices_symbol_date_key" ON "tw_stock_prices" ("symbol", "date")'
+    ]
+    merge = [sql for sql, _ in dst.log if sql.startswith("INSERT INTO \"tw_stock_prices\"")][0]
+    assert merge.startswith('INSERT INTO "tw_stock_prices" ("symbol", "date", "close_price", "updated_at")')
+    assert "ON CONFLICT (\"symbol\", \"date\") DO UPDATE SET \"close_price\"" in merge
+    assert "\"id\" = EXCLUDED" not in merge
+
+
+def test_change_marker_is_installed_once():
+    conn = FakeConnection([("pg_trigger", [(False, False)])])
+    assert ensure_change_marker(conn.cursor(), "tw_stock_prices") is True
+    ddl = [sql for sql, _ in conn.log if not sql.startswith("SELECT")]
+    assert ddl[0].startswith('ALTER TABLE "tw_stock_prices" ADD COLUMN IF NOT EXISTS updated_at')
+    assert ddl[-1].startswith('CREATE TRIGGER "tw_stock_prices_touch_updated_at" BEFORE UPDATE')
+
+    done = FakeConnection([("pg_trigger", [(True, True)])])
+    assert ensure_change_marker(done.cursor(), "tw_stock_prices") is False
+    assert len(done.log) == 1
+
+
+def test_partitions_are_synced_through_their_parent():
+    conn = FakeConnection([("NOT c.relispartition", [("sync_watermarks",), ("tw_stock_prices",), ("tw_warrant_trade",)])])
+    assert list_tables(conn.cursor()) == ["tw_stock_prices", "tw_warrant_trade"]
+    assert "c.relkind IN ('r', 'p')" in conn.log[0][0]
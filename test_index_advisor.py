@@ -0,0 +1,28 @@
+from index_advisor import MIGRATIONS, summarize_plan
+
+
+def test_summarize_plan_collects_seq_scans_and_indexes():
+    plan = [{
+        "Plan": {
+            "Node Type": "Nested Loop",
+            "Total Cost": 42.5,
+            "Plan Rows": 3,
+            "Plans": [
+                {"Node Type": "Seq Scan", "Relation Name": "stock_symbols"},
+                {"Node Type": "Index Scan", "Relation Name": "tw_warrant_master",
+                 "Index Name": "tw_warrant_master_underlying_norm_idx"},
+            ],
+        },
+        "Execution Time": 1.25,
+    }]
+    summary = summarize_plan(plan)
+    assert summary["total_cost"] == 42.5
+    assert summary["seq_scans"] == ["stock_symbols"]
+    assert summary["indexes"] == ["tw_warrant_master_underlying_norm_idx"]
+    assert summary["execution_ms"] == 1.25
+
+
+def test_migration_ids_are_unique_and_ordered():
+    ids = [migration[0] for migration in MIGRATIONS]
+    assert ids == sorted(ids)
+    assert len(ids) == len(set(ids))
@@ -0,0 +1,96 @@
+import json
+
+from job_state import MAX_EVENT_BYTES, EventRelay, JobStateStore
+
+
+class FakeCursor:
+    def __init__(self, db):
+        self.db = db
+        self._row = None
+
+    def execute(self, sql, params=None):
+        text = " ".join(sql.split())
+        if text.startswith("INSERT INTO tw_job_state"):
+            name, payload, owner = params
+            self.db.rows[name] = (payload, owner, self.db.age)
+            self.db.writes += 1
+        elif text.startswith("SELECT pg_notify"):
+            self.db.notifies.append(params)
+        elif text.startswith("SELECT payload"):
+            row = self.db.rows.get(params[0])
+            self._row = (json.loads(row[0]), row[1], row[2]) if row else None
+
+    def fetchone(self):
+        return self._row
+
+    def close(self):
+        pass
+
+
+class FakeDB:
+    def __init__(self):
+        self.rows = {}
+        self.notifies = []
+        self.writes = 0
+        self.age = 0.0
+        self.autocommit = False
+        self.closed = 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+
+def test_idle_defaults_are_not_published_and_progress_is_shared():
+    db = FakeDB()
+    worker_a = {"status": {"running": False, "processed": 0}}
+    worker_b = {"status": {"running": False, "processed": 0}}
+    store_a = JobStateStore(lambda: db)
+    store_b = JobStateStore(lambda: db)
+    store_a.register("import_status", lambda: worker_a["status"])
+    store_b.register("import_status", lambda: worker_b["status"])
+
+    store_b.flush_all()
+    assert db.writes == 0
+
+    # 工作函式整個重新指派 dict，getter 仍能追到
+    worker_a["status"] = {"running": True, "processed": 3}
+    store_a.flush_all()
+    seen_by_b = store_b.view("import_status")
+    assert seen_by_b["running"] is True and seen_by_b["processed"] == 3
+    assert seen_by_b["owner"] == store_a.owner
+    # 閒置的 worker B 不會蓋掉 A 的進度
+    assert db.writes == 1
+
+
+def test_running_status_without_heartbeat_is_reported_stale():
+    db = FakeDB()
+    status = {"running": True}
+    store = JobStateStore(lambda: db, stale_after=60)
+    store.register("job", lambda: {})
+    db.rows["job"] = (json.dumps(status), "gone:1", 600.0)
+    view = store.view("job")
+    assert view["running"] is False and view["stale"] is True
+
+
+def test_sse_events_reach_other_processes_only():
+    db = FakeDB()
+    seen_a, seen_b = [], []
+    relay_a = EventRelay(lambda: db, seen_a.append)
+    relay_b = EventRelay(lambda: db, seen_b.append)
+    relay_b.owner = "other-host:2"
+
+    event = {"channel": "anomaly_repair", "event": "progress", "message": "2330.TW", "done": 3}
+    assert relay_a.send(event)
+    assert db.notifies == [("tw_sse_events", relay_a.encode(event))]
+    for relay in (relay_a, relay_b):
+        relay.receive(db.notifies[0][1])
+    # 發送端自己的事件已在本機佇列，不重複
+    assert seen_a == [] and seen_b == [event]
+
+
+def test_oversized_sse_event_keeps_only_the_headline():
+    relay = EventRelay(lambda: None, lambda _: None)
+    event = {"channel": "db_sync", "event": "summary", "message": "done", "tables": ["x" * 50] * 500}
+    text = relay.encode(event)
+    assert len(text.encode("utf-8")) <= MAX_EVENT_BYTES
+    assert json.loads(text)["event"] == {"channel": "db_sync", "event": "summary", "message": "done"}
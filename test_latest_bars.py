@@ -0,0 +1,48 @@
+import latest_bars
+
+
+class FakeCursor:
+    """Bootstrap markers live in ``markers``; full rebuilds are recorded per source table."""
+
+    rowcount = 3
+
+    def __init__(self, markers=(), dsn="latest-bars"):
+        self.markers = set(markers)
+        self.rebuilds = []
+        self.connection = type("Conn", (), {"dsn": dsn})()
+        self._rows = []
+
+    def execute(self, sql, params=None):
+        text = " ".join(sql.split())
+        self._rows = []
+        if text.startswith("SELECT part FROM latest_bars_bootstrap"):
+            self._rows = [(p,) for p in params[0] if p in self.markers]
+        elif text.startswith("INSERT INTO latest_bars_bootstrap"):
+            self.markers.add(params[0])
+        elif "ROW_NUMBER() OVER w" in text:
+            self.rebuilds.append(text.split(" FROM ")[-1].split()[0])
+
+    def fetchall(self):
+        return self._rows
+
+
+def test_bootstrap_runs_once_per_part_even_when_ingest_filled_the_snapshot_first():
+    # 快照表已有匯入寫入的列，但從未完成首次建置：仍要整表重建
+    cur = FakeCursor(dsn="bootstrap-a")
+    filled = latest_bars.bootstrap(cur, prices_table="tw_stock_prices")
+    assert filled == {"stock": 3, "TWSE": 3, "TPEX": 3}
+    assert cur.rebuilds == ["tw_stock_prices", "tw_warrant_trade", "tpex_warrant_daily_quotes"]
+    assert cur.markers == {"stock", "TWSE", "TPEX"}
+
+    # 下一次讀到標記列：不再重建，之後整個行程都略過
+    assert latest_bars.bootstrap(cur) == {}
+    assert latest_bars.bootstrap(cur) == {}
+    assert len(cur.rebuilds) == 3
+
+
+def test_warrant_endpoints_bootstrap_only_warrant_markets():
+    cur = FakeCursor(markers={"TWSE"}, dsn="bootstrap-b")
+    filled = latest_bars.bootstrap(cur, parts=["TWSE", "TPEX"])
+    assert filled == {"TPEX": 3}
+    assert cur.rebuilds == ["tpex_warrant_daily_quotes"]
+    assert "stock" not in cur.markers
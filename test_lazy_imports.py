@@ -0,0 +1,36 @@
+import json
+import os
+import subprocess
+import sys
+
+from lazy_imports import lazy_module
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def test_lazy_module_imports_on_first_attribute_access():
+    mod = lazy_module("colorsys")
+    assert "not loaded" in repr(mod)
+    assert mod.rgb_to_hsv(1.0, 0.0, 0.0)[0] == 0.0
+    assert "(loaded)" in repr(mod)
+
+
+def test_server_import_is_offline_and_skips_heavy_modules():
+    probe = (
+        "import json, socket, sys\n"
+        "def _offline(*a, **k):\n"
+        "    raise OSError('offline')\n"
+        "socket.socket.connect = _offline\n"
+        "import server\n"
+        "print(json.dumps([m for m in ('pandas', 'yfinance', 'bs4', 'lxml', 'selenium') if m in sys.modules]))\n"
+    )
+    proc = subprocess.run(
+        [sys.executable, "-c", probe],
+        cwd=ROOT,
+        env=dict(os.environ, PYTHONPATH=ROOT, SYMBOL_MASTER_PRELOAD="0"),
+        capture_output=True,
+        text=True,
+        timeout=120,
+    )
+    assert proc.returncode == 0, proc.stderr[-2000:]
+    assert json.loads(proc.stdout.strip().splitlines()[-1]) == []
@@ -0,0 +1,77 @@
+import threading
+from datetime import date
+
+import mi_index
+from mi_index import SnapshotCache, parse_payload
+
+FIELDS = [
+    "證券代號", "證券名稱", "成交股數", "成交筆數", "成交金額",
+    "開盤價", "最高價", "最低價", "收盤價", "漲跌(+/-)", "漲跌價差",
+]
+DAY = date(2026, 7, 1)
+
+
+def _payload():
+    return {
+        "stat": "OK",
+        "tables": [
+            {"title": "價格指數", "fields": ["指數", "收盤指數"], "data": [["發行量加權股價指數", "23,000.12"]]},
+            {
+                "title": "每日收盤行情(全部)",
+                "fields": FIELDS,
+                "data": [
+                    ["2330", "台積電", "30,000,000", "50,000", "30,000,000,000",
+                     "1,000.00", "1,010.00", "995.00", "1,005.00", "<p style= color:red>+</p>", "5.00"],
+                    ["0050", "元大台灣50", "5,000,000", "3,000", "1,000,000,000",
+                     "200.00", "201.00", "199.00", "200.50", "+", "0.50"],
+                    ["030001", "台積電元大58購01", "120,000", "30", "150,000",
+                     "1.20", "1.30", "1.10", "1.25", "+", "0.05"],
+                    ["9999", "暫停交易", "0", "0", "0", "--", "--", "--", "--", " ", "0.00"],
+                ],
+            },
+        ],
+    }
+
+
+def test_one_payload_parses_into_stock_and_warrant_rows():
+    snapshot = parse_payload(_payload(), DAY)
+    stocks = {rec["ticker"]: rec for rec in snapshot.stock_records()}
+    assert set(stocks) == {"2330.TW", "0050.TW", "9999.TW"}
+    assert stocks["2330.TW"]["Close"] == 1005.0 and stocks["2330.TW"]["Volume"] == 30_000_000
+    assert stocks["9999.TW"]["Close"] is None
+
+    quotes = snapshot.trade_quotes()
+    assert quotes["030001"]["volume"] == 120  # 張
+    assert quotes["030001"]["turnover"] == 150000.0
+    assert snapshot.quotes["030001"].is_warrant and not snapshot.quotes["0050"].is_warrant
+
+
+def test_legacy_data9_layout_is_supported():
+    legacy = {"stat": "OK", "data9": [row for row in _payload()["tables"][1]["data"]]}
+    snapshot = parse_payload(legacy, DAY)
+    assert snapshot.quotes["2330"].close == 1005.0
+
+
+def test_cache_downloads_each_date_once_under_concurrency():
+    cache = SnapshotCache(ttl=60)
+    started = threading.Event()
+    calls = []
+
+    def fetch(day):
+        calls.append(day)
+        started.wait(1)
+        return _payload()
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get(DAY, fetch))) for _ in range(4)]
+    for t in threads:
+        t.start()
+    started.set()
+    for t in threads:
+        t.join(5)
+    assert len(calls) == 1 and cache.fetches == 1
+    assert all(r is results[0] for r in results)
+
+    # 非交易日不快取，之後仍可重抓
+    assert mi_index.fetch_snapshot(date(2026, 7, 4), fetch=lambda d: None, cache=cache) is None
+    assert cache.fetches == 2
@@ -0,0 +1,113 @@
+import price_anomalies
+from price_anomalies import query_price_anomalies, rule_version, update_price_anomalies
+
+
+class _Cursor:
+    def __init__(self):
+        self.connection = object()
+        self.statements = []
+        self.rowcount = 0
+
+    def execute(self, sql, params=None):
+        self.statements.append((" ".join(sql.split()), params))
+
+    def fetchall(self):
+        return []
+
+
+def test_incremental_update_is_anchored_on_previous_close():
+    cur = _Cursor()
+    price_anomalies._ready_dsns.add(price_anomalies._dsn_key(cur))
+    update_price_anomalies(cur, ["2330.TW", "2330.TW", ""], "2024-05-02", floor=0.1)
+    (delete_sql, delete_params), (insert_sql, insert_params) = cur.statements
+    assert delete_sql.startswith("DELETE FROM price_anomalies")
+    assert delete_params == (["2330.TW"], "2024-05-02")
+    assert "q.date < %s" in insert_sql and "px.date >= %s" in insert_sql
+    assert insert_params == [rule_version(0.1), ["2330.TW"], "2024-05-02", 0.1, "2024-05-02"]
+
+
+def test_query_filters_on_current_rule_version():
+    cur = _Cursor()
+    query_price_anomalies(cur, "2330.TW", "2024-01-01", None, 0.2, floor=0.1)
+    sql, params = cur.statements[0]
+    assert "rule_version = %s AND pct_change > %s AND symbol = %s AND date >= %s" in sql
+    assert params == [rule_version(0.1), 0.2, "2330.TW", "2024-01-01"]
+
+
+class _PricesDB:
+    """In-memory prices / scan state / anomaly index answering the module's statements."""
+
+    def __init__(self, prices):
+        self.prices = prices  # symbol -> [(date, close)]
+        self.scan_state = {}
+        self.anomalies = {}
+        self.commits = 0
+        self.connection = self
+        self.rowcount = 0
+        self._rows = []
+
+    def cursor(self):
+        return self
+
+    def commit(self):
+        self.commits += 1
+
+    def execute(self, sql, params=None):
+        text = " ".join(sql.split())
+        self._rows = []
+        if text.startswith("WITH RECURSIVE u(symbol)"):
+            version, *limit = params
+            stale = [s for s in sorted(self.prices) if self.scan_state.get(s) != version]
+            self._rows = [(s,) for s in stale[: limit[0] if limit else None]]
+        elif text.startswith("SELECT s.symbol FROM unnest"):
+            candidates, version, *limit = params
+            stale = sorted(s for s in candidates if self.scan_state.get(s) != version)
+            self._rows = [(s,) for s in stale[: limit[0] if limit else None]]
+        elif text.startswith("DELETE FROM price_anomalies WHERE symbol = ANY(%s)"):
+            for key in [k for k in self.anomalies if k[0] in params[0]]:
+                del self.anomalies[key]
+        elif text.startswith("INSERT INTO price_anomalies"):
+            version, symbols, floor = params[0], params[1], params[2]
+            for sym in symbols:
+                bars = sorted(self.prices.get(sym, []))
+                for (_, prev), (day, close) in zip(bars, bars[1:]):
+                    pct = abs(close - prev) / abs(prev)
+                    if pct > floor:
+                        self.anomalies[(sym, day)] = (pct, version)
+        elif text.startswith("INSERT INTO price_anomaly_scan_state"):
+            symbols, version = params
+            self.scan_state.update({s: version for s in symbols})
+        elif text.startswith("SELECT symbol, date, close_price, prev_close, pct_change FROM price_anomalies"):
+            version, threshold = params[0], params[1]
+            self._rows = [
+                {"symbol": s, "date": d, "pct_change": pct}
+                for (s, d), (pct, v) in sorted(self.anomalies.items())
+                if v == version and pct > threshold
+            ]
+
+    def fetchall(self):
+        return self._rows
+
+
+def test_symbols_missing_from_the_snapshot_are_still_scanned(monkeypatch):
+    monkeypatch.setattr(price_anomalies, "RESCAN_CHUNK", 2)
+    db = _PricesDB({
+        "1101.TW": [(1, 10.0), (2, 10.5)],
+        "2330.TW": [(1, 100.0), (2, 130.0), (3, 131.0)],
+        "9999.TW": [(1, 20.0), (2, 10.0)],  # 只在歷史表，不在 latest_stock_bars
+    })
+    price_anomalies._ready_dsns.add(price_anomalies._dsn_key(db))
+
+    assert not price_anomalies.index_covers(db)
+    assert price_anomalies.index_covers(db, "2330.TW") is False
+
+    rescanned = price_anomalies.rescan_stale_symbols(db, commit=db.commit)
+    assert rescanned == 3
+    assert db.commits == 2  # 每批各自 commit
+    assert price_anomalies.index_covers(db) and price_anomalies.index_covers(db, "9999.TW")
+    found = query_price_anomalies(db, threshold=0.2)
+    assert [(r["symbol"], r["date"]) for r in found] == [("2330.TW", 2), ("9999.TW", 2)]
+
+    # 已掃描過的股票不再重掃；降低下限（新規則版本）則全部重新變為待掃
+    assert price_anomalies.rescan_stale_symbols(db) == 0
+    assert price_anomalies.stale_symbols(db, floor=0.05) == ["1101.TW", "2330.TW", "9999.TW"]
@@ -0,0 +1,49 @@
+import numpy as np
+
+from price_validation import (
+    HISTORY_RULES,
+    SNAPSHOT_RULES,
+    refetch_rules,
+    sequential_prev_close,
+    split_records,
+    validate_records,
+)
+
+
+def test_snapshot_rules_reject_bad_rows_and_flag_warnings():
+    rows = [
+        {"Open": 100, "High": 105, "Low": 99, "Close": 104, "Volume": 1000},
+        {"Open": 100, "High": 105, "Low": 99, "Close": 0, "Volume": 1000},
+        {"Open": 100, "High": 105, "Low": 99, "Close": 104, "Volume": 0},
+        {"Open": 31000, "High": 31000, "Low": 31000, "Close": 31000, "Volume": 5},
+        {"Open": 100, "High": 98, "Low": 99, "Close": 104, "Volume": 1000},
+    ]
+    result = validate_records(rows, SNAPSHOT_RULES, prev_closes=[90, None, None, None, 100])
+    assert result.accept.tolist() == [True, False, False, False, True]
+    assert result.reason_codes(0) == ["limit_breach"]
+    assert result.reason_codes(1) == ["close_le_zero_or_null"]
+    assert result.reason_codes(2) == ["zero_volume"]
+    assert result.reason_codes(3) == ["price_ge_ceiling"]
+    assert result.reason_codes(4) == ["ohlc_order"]
+
+
+def test_history_rules_keep_zero_volume_days():
+    result = validate_records([{"Close": 50, "Volume": 0}], HISTORY_RULES)
+    assert result.accept.tolist() == [True]
+
+
+def test_sequential_prev_close_skips_invalid_closes():
+    prev = sequential_prev_close(np.array([10.0, np.nan, 0.0, 12.0]), 9.0)
+    assert prev.tolist() == [9.0, 10.0, 10.0, 10.0]
+
+
+def test_refetch_rules_compare_each_row_with_previous_close():
+    rows = [
+        {"date": "2024-05-06", "close_price": 100},
+        {"date": "2024-05-07", "close_price": 300},
+        {"date": "2024-05-08", "close_price": 310},
+    ]
+    result = validate_records(rows, refetch_rules(0.5), prev_close=98, sequential=True)
+    accepted, rejected = split_records(rows, result)
+    assert [r["date"] for r in accepted] == ["2024-05-06", "2024-05-08"]
+    assert rejected == [(rows[1], "pct_change_gt_threshold")]
@@ -0,0 +1,169 @@
+import json
+
+from replication_log import drop_triggers, install_triggers, replicate_once
+
+# tw_stock_prices 的實際結構：id SERIAL 主鍵 + UNIQUE(symbol, date)
+PRICE_SCHEMA = [
+    ("information_schema.columns", [
+        ("id", "integer", None, "NO", "nextval('tw_stock_prices_id_seq'::regclass)"),
+        ("symbol", "character varying", 20, "NO", None),
+        ("date", "date", None, "NO", None),
+        ("close_price", "numeric", None, "YES", None),
+    ]),
+    ("AND i.indisprimary", [("id",)]),
+    ("NOT i.indisprimary", [(["symbol", "date"],)]),
+]
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.rowcount = 0
+        self._rows = []
+
+    def execute(self, sql, params=None):
+        text = " ".join(sql.split())
+        self.conn.log.append((text, params))
+        self._rows = []
+        for needle, rows in self.conn.answers:
+            if needle in text:
+                self._rows = rows
+                break
+        self.rowcount = len(self._rows) if text.startswith("SELECT") else 1
+
+    def fetchall(self):
+        return list(self._rows)
+
+    def mogrify(self, sql, params):
+        return (sql % tuple("'%s'" % p for p in params)).encode()
+
+    def copy_expert(self, sql, file):
+        self.conn.log.append((" ".join(sql.split()), None))
+        if "TO STDOUT" in sql:
+            file.write(b"2330.TW\t2024-05-08\t805\n")
+        else:
+            self.conn.copied = file.read()
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, answers):
+        self.answers = answers
+        self.log = []
+        self.copied = None
+        self.commits = 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+
+def test_replicate_once_dedupes_keys_ships_rows_and_trims_log():
+    src = FakeConnection([
+        ("FROM replication_log ORDER BY id", [
+            (1, "tw_stock_prices", {"symbol": "2330.TW", "date": "2024-05-08"}, "I"),
+            (2, "tw_stock_prices", {"symbol": "2330.TW", "date": "2024-05-08"}, "U"),
+            (3, "tw_stock_prices", {"symbol": "2317.TW", "date": "2024-05-08"}, "D"),
+        ]),
+        *PRICE_SCHEMA,
+        ("WHERE NOT EXISTS", [("2317.TW", "2024-05-08")]),
+    ])
+    dst = FakeConnection([("COUNT(*) FROM _sync_stage", [(1,)])])
+
+    result = replicate_once(src, dst, table_map={"tw_stock_prices": "neon_prices"})
+
+    assert result["entries"] == 3
+    assert result["tables"]["tw_stock_prices"] == {"staged": 1, "merged": 1, "deleted": 1}
+    copy_out = [sql for sql, _ in src.log if "TO STDOUT" in sql][0]
+    shipped_keys = json.loads(copy_out.split("jsonb_to_recordset('", 1)[1].split("'::jsonb", 1)[0])
+    assert len(shipped_keys) == 2
+    assert copy_out.startswith('COPY (SELECT t."symbol", t."date", t."close_price" FROM')
+    assert dst.copied == b"2330.TW\t2024-05-08\t805\n"
+    dst_sql = [sql for sql, _ in dst.log]
+    # Neon 端 id 另行編號：以 (symbol, date) 合併，不帶 id
+    merge = [sql for sql in dst_sql if sql.startswith('INSERT INTO "neon_prices"')][0]
+    assert merge.startswith('INSERT INTO "neon_prices" ("symbol", "date", "close_price")')
+    assert 'ON CONFLICT ("symbol", "date") DO UPDATE SET "close_price" = EXCLUDED."close_price"' in merge
+    assert any(sql.startswith('DELETE FROM "neon_prices"') for sql in dst_sql)
+    # log 只在 Neon 提交後才刪除
+    assert dst.commits == 1
+    assert ("DELETE FROM replication_log WHERE id = ANY(%s)", ([1, 2, 3],)) in src.log
+
+
+class LogConnection(FakeConnection):
+    """``entries`` is the visible replication_log; the trim really deletes from it."""
+
+    def __init__(self, entries):
+        self.entries = list(entries)
+        super().__init__([*PRICE_SCHEMA])
+        self.answers.insert(0, ("FROM replication_log ORDER BY id", self.entries))
+
+    def cursor(self):
+        cur = FakeCursor(self)
+        execute = cur.execute
+
+        def _execute(sql, params=None):
+            execute(sql, params)
+            if sql.startswith("DELETE FROM replication_log"):
+                self.entries[:] = [e for e in self.entries if e[0] not in params[0]]
+
+        cur.execute = _execute
+        return cur
+
+
+def test_entry_committed_during_shipping_survives_the_trim():
+    src = LogConnection([(5, "tw_stock_prices", {"symbol": "2330.TW", "date": "2024-05-08"}, "U")])
+    dst = FakeConnection([("COUNT(*) FROM _sync_stage", [(1,)])])
+    late = (4, "tw_stock_prices", {"symbol": "2317.TW", "date": "2024-05-08"}, "I")
+    commit = dst.commit
+
+    def commit_while_late_writer_finishes():
+        # id 4 在讀取 log 時尚未提交，於送往 Neon 期間才提交
+        src.entries.insert(0, late)
+        commit()
+
+    dst.commit = commit_while_late_writer_finishes
+    assert replicate_once(src, dst)["entries"] == 1
+    assert src.entries == [late]
+
+
+def test_triggers_log_the_business_key_not_the_serial_id():
+    conn = FakeConnection(PRICE_SCHEMA)
+    assert install_triggers(conn.cursor(), ["tw_stock_prices"]) == ["tw_stock_prices"]
+    create = [sql for sql, _ in conn.log if sql.startswith("CREATE TRIGGER")][0]
+    assert create.endswith("EXECUTE FUNCTION replication_log_capture('symbol', 'date')")
+
+
+def test_drop_triggers_detaches_every_capture_trigger():
+    conn = FakeConnection([("FROM pg_trigger", [("tw_stock_prices", "tw_stock_prices_replication_log")])])
+    assert drop_triggers(conn.cursor()) == ["tw_stock_prices"]
+    assert conn.log[-1] == ('DROP TRIGGER IF EXISTS "tw_stock_prices_replication_log" ON "tw_stock_prices"', None)
+
+
+def test_entries_logged_by_id_are_mapped_to_business_keys():
+    src = FakeConnection([
+        ("FROM replication_log ORDER BY id", [
+            (7, "tw_stock_prices", {"id": 41}, "U"),
+            (8, "tw_stock_prices", {"id": 42}, "D"),
+        ]),
+        *PRICE_SCHEMA,
+        ('WHERE "id" = ANY(%s)', [("2330.TW", "2024-05-08")]),
+    ])
+    dst = FakeConnection([("COUNT(*) FROM _sync_stage", [(1,)])])
+
+    result = replicate_once(src, dst, table_map={"tw_stock_prices": "neon_prices"})
+
+    assert result["tables"]["tw_stock_prices"]["deleted"] == 0
+    lookup = [params for sql, params in src.log if 'WHERE "id" = ANY(%s)' in sql]
+    assert lookup == [([41, 42],)]
+    copy_out = [sql for sql, _ in src.log if "TO STDOUT" in sql][0]
+    shipped_keys = json.loads(copy_out.split("jsonb_to_recordset('", 1)[1].split("'::jsonb", 1)[0])
+    assert shipped_keys == [{"symbol": "2330.TW", "date": "2024-05-08"}]
+    assert not any(sql.startswith('DELETE FROM "neon_prices"') for sql, _ in dst.log)
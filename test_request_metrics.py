@@ -0,0 +1,18 @@
+from request_metrics import MetricsRegistry
+
+
+def test_queries_are_attributed_to_the_current_request():
+    registry = MetricsRegistry()
+    registry.begin_request()
+    registry.set_route("/api/stocks/<symbol>")
+    registry.record_query(0.01, 5)
+    registry.record_query(0.02, -1)
+    stats = registry.end_request("GET", "/api/stocks/<symbol>", 200)
+    registry.record_query(0.5, 1)
+
+    assert (stats.queries, stats.rows) == (2, 5)
+    text = registry.render_prometheus()
+    assert 'http_request_db_queries_count{method="GET",route="/api/stocks/<symbol>"} 1' in text
+    assert 'db_queries_total{route="/api/stocks/<symbol>"} 2' in text
+    assert 'db_queries_total{route="<background>"} 1' in text
+    assert 'http_request_duration_seconds_bucket{method="GET",route="/api/stocks/<symbol>",status="200",le="+Inf"} 1' in text
@@ -0,0 +1,83 @@
+from symbol_master import MARKET_OTC, MARKET_TWSE, SymbolMaster, diff_listing
+
+
+class _Cursor:
+    def __init__(self, db):
+        self.db = db
+
+    def execute(self, sql, params=None):
+        self.db.statements.append((" ".join(sql.split()), params))
+
+    def fetchall(self):
+        return self.db.rows
+
+    def close(self):
+        pass
+
+
+class _Connection:
+    def __init__(self, rows):
+        self.rows = rows
+        self.statements = []
+        self.commits = 0
+
+    def cursor(self):
+        return _Cursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def _master(rows):
+    db = _Connection(rows)
+    return SymbolMaster(lambda: db), db
+
+
+def test_load_indexes_by_code_and_market():
+    master, _ = _master([
+        {"symbol": "2330.TW", "name": "台積電", "market": "上市"},
+        {"symbol": "6488.TWO", "name": "環球晶", "market": None},
+        {"symbol": "0050.TW", "name": "元大台灣50", "market": "ETF"},
+    ])
+    assert master.load() == 3
+    assert master.market_of("2330") == MARKET_TWSE
+    assert master.is_otc("6488") is True
+    assert master.is_otc("2330.TW") is False
+    assert master.is_otc("9999") is None
+    assert [item["symbol"] for item in master.by_market("tpex")] == ["6488.TWO"]
+
+
+def test_diff_listing_reports_added_changed_and_removed():
+    current = {
+        "2330.TW": {"symbol": "2330.TW", "name": "台積電", "market": MARKET_TWSE},
+        "1101.TW": {"symbol": "1101.TW", "name": "台泥", "market": MARKET_TWSE},
+    }
+    added, changed, removed = diff_listing(current, [
+        {"symbol": "2330.TW", "name": "台積電", "market": "上市"},
+        {"symbol": "1101.TW", "name": "台泥公司", "market": "上市"},
+        {"symbol": "6488.TWO", "name": "環球晶", "market": "上櫃"},
+    ])
+    assert [item["symbol"] for item in added] == ["6488.TWO"]
+    assert added[0]["market"] == MARKET_OTC
+    assert [item["symbol"] for item in changed] == ["1101.TW"]
+    assert removed == []
+
+
+def test_apply_listing_only_upserts_the_diff():
+    master, db = _master([{"symbol": "2330.TW", "name": "台積電", "market": "上市"}])
+    master.load()
+    db.statements.clear()
+    stats = master.apply_listing([
+        {"symbol": "2330.TW", "name": "台積電", "market": "上市"},
+        {"symbol": "6488.TWO", "name": "環球晶", "market": "上櫃"},
+    ])
+    assert stats == {"added": 1, "changed": 0, "removed": 0, "total": 2}
+    assert [params[0] for _, params in db.statements] == ["6488.TWO"]
+    assert db.commits == 1
+    assert master.is_otc("6488") is True
@@ -0,0 +1,40 @@
+import os
+
+os.environ.setdefault("SYMBOL_MASTER_PRELOAD", "0")
+
+from server import _rewrite_table_names, _rewrite_table_names_cached  # noqa: E402
+
+LOCAL = (("tw_stock_prices", "tw_stock_prices_local"), ("tw_stock_returns", "tw_stock_returns_local"))
+STAGING = (("tw_stock_prices", "stg_prices"),)
+
+
+def test_only_whole_identifiers_are_rewritten():
+    sql = (
+        "INSERT INTO tw_stock_prices_archive SELECT p.* FROM tw_stock_prices p "
+        "JOIN tw_stock_returns r USING (symbol) WHERE p.symbol NOT IN (SELECT symbol FROM my_tw_stock_prices)"
+    )
+    assert _rewrite_table_names(sql, LOCAL) == (
+        "INSERT INTO tw_stock_prices_archive SELECT p.* FROM tw_stock_prices_local p "
+        "JOIN tw_stock_returns_local r USING (symbol) WHERE p.symbol NOT IN (SELECT symbol FROM my_tw_stock_prices)"
+    )
+    # 未出現在對應表中的邏輯表名保持原樣
+    assert _rewrite_table_names("SELECT * FROM tw_institutional_trades", LOCAL) == "SELECT * FROM tw_institutional_trades"
+
+
+def test_quoted_and_schema_qualified_names():
+    sql = 'SELECT "tw_stock_prices".close_price FROM public."tw_stock_prices", public.tw_stock_returns'
+    assert _rewrite_table_names(sql, LOCAL) == (
+        'SELECT "tw_stock_prices_local".close_price FROM public."tw_stock_prices_local", public.tw_stock_returns_local'
+    )
+    # 較長名稱中的片段不是獨立識別字（字串常值內亦同）
+    assert _rewrite_table_names("SELECT 'tw_stock_prices_v2' AS src", LOCAL) == "SELECT 'tw_stock_prices_v2' AS src"
+
+
+def test_cache_is_keyed_by_table_map():
+    _rewrite_table_names_cached.cache_clear()
+    sql = "SELECT MAX(date) FROM tw_stock_prices WHERE symbol = %s"
+    assert _rewrite_table_names_cached(sql, LOCAL) == "SELECT MAX(date) FROM tw_stock_prices_local WHERE symbol = %s"
+    assert _rewrite_table_names_cached(sql, STAGING) == "SELECT MAX(date) FROM stg_prices WHERE symbol = %s"
+    assert _rewrite_table_names_cached(sql, LOCAL) == "SELECT MAX(date) FROM tw_stock_prices_local WHERE symbol = %s"
+    info = _rewrite_table_names_cached.cache_info()
+    assert (info.hits, info.misses) == (1, 2)
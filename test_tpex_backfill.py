@@ -0,0 +1,206 @@
+import threading
+from datetime import date, timedelta
+
+import tpex_backfill
+from tpex_backfill import HostRateLimiter, holiday_weekdays, plan_days, run_backfill
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+
+
+def test_rate_limiter_spaces_request_starts():
+    clock = FakeClock()
+    limiter = HostRateLimiter(0.5, clock=clock, sleep=clock.sleep)
+    for _ in range(3):
+        limiter.wait()
+    assert clock.sleeps == [0.5, 1.0]
+    clock.now = 10.0
+    limiter.wait()
+    assert clock.sleeps == [0.5, 1.0]
+
+
+def test_holidays_need_priced_days_on_both_sides():
+    # 2026-02-16..20 休市（前後皆有交易日）；2026-03 下旬起價格表尚未回補
+    priced = {date(2026, 2, 13), date(2026, 2, 23), date(2026, 3, 20)}
+    candidates = [date(2026, 2, 17), date(2026, 2, 23), date(2026, 3, 25)]
+    assert holiday_weekdays(candidates, priced, timedelta(days=10)) == {date(2026, 2, 17)}
+
+
+class PlanCursor:
+    def __init__(self, priced, progress):
+        self.priced = priced
+        self.progress = progress
+        self._rows = []
+
+    def execute(self, sql, params=None):
+        if "DISTINCT date" in sql:
+            lo, hi = params
+            self._rows = [(d,) for d in self.priced if lo <= d <= hi]
+        elif "FROM tpex_warrant_backfill_days" in sql:
+            lo, hi = params
+            self._rows = [(d, st) for d, st in self.progress.items() if lo <= d <= hi]
+        elif "INSERT INTO tpex_warrant_backfill_days" in sql and "'holiday'" in sql:
+            self.progress.setdefault(params[0], "holiday")
+            self._rows = []
+        else:
+            self._rows = []
+
+    def fetchall(self):
+        return self._rows
+
+
+def test_plan_skips_weekends_holidays_and_completed_days():
+    start, end = date(2026, 4, 1), date(2026, 4, 10)  # Wed .. next Fri
+    priced = {date(2026, 3, 31), date(2026, 4, 1), date(2026, 4, 2), date(2026, 4, 7), date(2026, 4, 8)}
+    progress = {date(2026, 4, 1): "done", date(2026, 4, 2): "failed", date(2026, 4, 7): "empty"}
+    cur = PlanCursor(priced, progress)
+
+    plan = plan_days(cur, start, end, today=date(2026, 4, 20))
+    assert plan["holidays"] == [date(2026, 4, 3), date(2026, 4, 6)]
+    assert plan["days"] == [date(2026, 4, 2), date(2026, 4, 8), date(2026, 4, 9), date(2026, 4, 10)]
+
+    no_retry = plan_days(cur, start, end, retry_failed=False, today=date(2026, 4, 20))
+    assert date(2026, 4, 2) not in no_retry["days"]
+    forced = plan_days(cur, start, end, force=True)
+    assert date(2026, 4, 1) in forced["days"] and date(2026, 4, 3) in forced["days"]
+
+
+def test_inferred_holidays_are_recorded_and_a_fetched_result_overrides_them():
+    start, end = date(2026, 4, 1), date(2026, 4, 7)
+    priced = {date(2026, 3, 31), date(2026, 4, 1), date(2026, 4, 2), date(2026, 4, 7)}
+    progress = {date(2026, 4, 6): "done"}
+    cur = PlanCursor(priced, progress)
+
+    plan = plan_days(cur, start, end, today=date(2026, 4, 20))
+    # 4/6 已實際抓到資料，不再當成休市；4/3 記為 holiday，進度表上看得到
+    assert plan["holidays"] == [date(2026, 4, 3)]
+    assert progress == {date(2026, 4, 3): "holiday", date(2026, 4, 6): "done"}
+    assert date(2026, 4, 3) not in plan["days"] and date(2026, 4, 6) not in plan["days"]
+
+    # 價格表補上該日後推測不成立，記錄中的 holiday 不會讓它被永久略過
+    cur.priced.add(date(2026, 4, 3))
+    assert date(2026, 4, 3) in plan_days(cur, start, end, today=date(2026, 4, 20))["days"]
+
+
+def test_recent_empty_days_are_fetched_again():
+    # 當天收盤前抓到空結果：之後的執行仍要重抓，過了幾天才視為確定無資料
+    progress = {date(2026, 4, 9): "empty", date(2026, 4, 10): "empty"}
+    cur = PlanCursor(set(), progress)
+    plan = plan_days(cur, date(2026, 4, 9), date(2026, 4, 10), today=date(2026, 4, 10))
+    assert plan["days"] == [date(2026, 4, 9), date(2026, 4, 10)]
+    later = plan_days(cur, date(2026, 4, 9), date(2026, 4, 10), today=date(2026, 4, 13))
+    assert later["days"] == [date(2026, 4, 10)] and later["completed"] == [date(2026, 4, 9)]
+
+
+class FakeConnection:
+    def __init__(self):
+        self.committed = []
+        self.pending = []
+        self.rollbacks = 0
+
+    def cursor(self):
+        conn = self
+
+        class Cur:
+            def execute(self, sql, params=None):
+                if "tpex_warrant_backfill_days" in sql:
+                    conn.pending.append((params[0], params[1]))
+
+            def close(self):
+                pass
+
+        return Cur()
+
+    def commit(self):
+        self.committed.extend(self.pending)
+        self.pending = []
+
+    def rollback(self):
+        self.pending = []
+        self.rollbacks += 1
+
+
+def test_failed_days_are_recorded_and_the_range_continues():
+    days = [date(2026, 5, d) for d in (4, 5, 6, 7, 8)]
+    active, peak = [0], [0]
+    lock = threading.Lock()
+    barrier = threading.Barrier(3, timeout=5)
+
+    def fetch(day):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        try:
+            if day.day <= 6:
+                barrier.wait()  # 前三日同時在抓
+            if day.day == 6:
+                raise RuntimeError("HTTP 503")
+            return [] if day.day == 8 else [{"Code": f"7{day.day:05d}"}]
+        finally:
+            with lock:
+                active[0] -= 1
+
+    def write(cursor, rows):
+        if rows[0]["Code"] == "700007":
+            raise ValueError("bad row")
+        return len(rows)
+
+    conn = FakeConnection()
+    seen = []
+    result = run_backfill(
+        conn, days, fetch=fetch, write=write, workers=3,
+        on_day=lambda day, status, res: seen.append((day, status)),
+    )
+
+    assert peak[0] >= 3
+    assert result.imported_days == 2 and result.empty_days == 1 and result.imported_count == 2
+    assert [f["date"] for f in result.failures] == ["2026-05-06", "2026-05-07"]
+    assert dict(conn.committed) == {
+        date(2026, 5, 4): "done",
+        date(2026, 5, 5): "done",
+        date(2026, 5, 6): "failed",
+        date(2026, 5, 7): "failed",
+        date(2026, 5, 8): "empty",
+    }
+    assert result.touched_codes == {"700004", "700005"} and result.earliest == date(2026, 5, 4)
+    assert sorted(result.done_days) == [date(2026, 5, 4), date(2026, 5, 5)]
+    assert len(seen) == 5
+
+
+def test_finish_range_refreshes_derived_tables_once(monkeypatch):
+    calls = []
+    monkeypatch.setattr(tpex_backfill, "refresh_latest_warrant_bars", lambda cur, m, codes: calls.append(("latest", m, sorted(codes))))
+    monkeypatch.setattr(tpex_backfill.warrant_ta_state, "update_states", lambda cur, m, codes, since: calls.append(("ta", m, since)))
+    monkeypatch.setattr(tpex_backfill.warrant_rankings, "invalidate", lambda cur, m, days: calls.append(("rank", m, sorted(days))))
+    monkeypatch.setattr(tpex_backfill.warrant_portal_stats, "refresh", lambda cur: calls.append(("stats",)))
+
+    conn = FakeConnection()
+    assert tpex_backfill.finish_range(conn, tpex_backfill.BackfillResult()) is False
+    assert calls == []
+
+    result = tpex_backfill.BackfillResult(
+        touched_codes={"700005", "700004"},
+        done_days=[date(2026, 5, 5), date(2026, 5, 4)],
+        earliest=date(2026, 5, 4),
+    )
+    assert tpex_backfill.finish_range(conn, result) is True
+    assert calls == [
+        ("latest", "TPEX", ["700004", "700005"]),
+        ("ta", "TPEX", date(2026, 5, 4)),
+        ("rank", "TPEX", [date(2026, 5, 4), date(2026, 5, 5)]),
+        ("stats",),
+    ]
+
+
+def test_empty_plan_does_nothing():
+    assert run_backfill(FakeConnection(), [], fetch=None, write=None).summary()["importedDays"] == 0
+    assert tpex_backfill.weekdays(date(2026, 5, 9), date(2026, 5, 10)) == []
@@ -0,0 +1,161 @@
+from datetime import date, timedelta
+
+import numpy as np
+
+from warrant_bar_cache import WarrantBarCache, pack_recent
+from warrant_ta_screen import evaluate_packed_signals, evaluate_ta_signals
+
+D0 = date(2026, 3, 2)
+
+
+def _bar(i, close, **extra):
+    row = {
+        "trade_date": D0 + timedelta(days=i),
+        "warrant_name": "台積電元大58購01",
+        "open_price": close - 0.01,
+        "high_price": close + 0.02,
+        "low_price": close - 0.02,
+        "close_price": close,
+        "volume": 100 + i,
+        "turnover": 1000.0 + i,
+    }
+    row.update(extra)
+    return row
+
+
+class FakeCursor:
+    """History per (market, code); latest_warrant_bars derived from it."""
+
+    def __init__(self, history, expiry=None):
+        self.history = history
+        self.expiry = expiry or {}
+        self.queries = []
+        self._rows = []
+
+    def snapshot_row(self, market, code):
+        bars = self.history[(market, code)]
+        cur, prev = bars[-1], (bars[-2] if len(bars) > 1 else None)
+        return dict(
+            cur, market=market, warrant_code=code,
+            prev_trade_date=prev["trade_date"] if prev else None,
+            prev_close=prev["close_price"] if prev else None,
+        )
+
+    def execute(self, sql, params=None):
+        self.queries.append(sql)
+        if "latest_warrant_bars" in sql:
+            codes = params[0]
+            self._rows = [self.snapshot_row(m, c) for (m, c) in self.history if c in codes]
+        elif "ROW_NUMBER" in sql:
+            market = "TWSE" if "tw_warrant_trade" in sql else "TPEX"
+            codes, limit = params
+            self._rows = [
+                dict(bar, warrant_code=c)
+                for (m, c), bars in sorted(self.history.items())
+                if m == market and c in codes
+                for bar in bars[-limit:]
+            ]
+        elif "warrant_master" in sql:
+            self._rows = [
+                {"warrant_code": c, "expiry_date": d} for c, d in self.expiry.items() if c in params[0]
+            ]
+        else:
+            self._rows = []
+
+    def fetchall(self):
+        return self._rows
+
+
+def _history(n, start=1.0):
+    return [_bar(i, round(start + 0.01 * ((i * 7) % 11), 2)) for i in range(n)]
+
+
+def test_loads_last_bars_and_serves_timeseries_rows():
+    cur = FakeCursor({("TWSE", "030001"): _history(300), ("TPEX", "700001"): _history(5)})
+    cache = WarrantBarCache(max_bars=250, check_seconds=60, clock=lambda: 0.0)
+
+    got = cache.get_many(cur, ["030001", "700001", "missing"])
+    assert set(got) == {"030001", "700001"}
+    assert len(got["030001"]) == 250 and got["700001"].market == "TPEX"
+    rows = got["030001"].rows(3)
+    assert [r["trade_date"] for r in rows] == [str(D0 + timedelta(days=i)) for i in (297, 298, 299)]
+    assert rows[-1]["close_price"] == cur.history[("TWSE", "030001")][-1]["close_price"]
+
+    n = len(cur.queries)
+    cache.get(cur, "030001")
+    assert len(cur.queries) == n  # fresh entry: no database round-trip
+    assert cache.memory()["bytes"] == sum(s.nbytes for s in got.values())
+
+
+def test_new_day_in_snapshot_is_appended_without_reload():
+    now = [0.0]
+    cur = FakeCursor({("TWSE", "030001"): _history(20)})
+    cache = WarrantBarCache(max_bars=20, check_seconds=30, clock=lambda: now[0])
+    cache.get(cur, "030001")
+
+    cur.history[("TWSE", "030001")].append(_bar(20, 1.5))
+    now[0] = 31.0
+    series = cache.get(cur, "030001")
+    assert cache.stats["appends"] == 1 and cache.stats["reloads"] == 0
+    assert len(series) == 20 and series.rows(1)[0]["close_price"] == 1.5
+    assert series.dates[-1] == np.datetime64(D0 + timedelta(days=20))
+
+
+def test_append_publishes_a_new_series_and_leaves_readers_snapshot_intact():
+    now = [0.0]
+    cur = FakeCursor({("TWSE", "030001"): _history(20)})
+    cache = WarrantBarCache(max_bars=20, check_seconds=30, clock=lambda: now[0])
+    before = cache.get(cur, "030001")
+    dates, closes = before.dates.copy(), before.cols["close"].copy()
+
+    cur.history[("TWSE", "030001")].append(_bar(20, 1.5))
+    now[0] = 31.0
+    after = cache.get(cur, "030001")
+    assert after is not before and after.dates[-1] == np.datetime64(D0 + timedelta(days=20))
+    # 請求進行中拿到的舊序列：日期與各欄位仍是同一批，不會被移位一半
+    assert np.array_equal(before.dates, dates) and np.array_equal(before.cols["close"], closes)
+    assert cache.get(cur, "030001") is after
+    assert cache.memory()["bytes"] == after.nbytes
+
+
+def test_rewritten_history_triggers_reload():
+    now = [0.0]
+    cur = FakeCursor({("TWSE", "030001"): _history(10)})
+    cache = WarrantBarCache(check_seconds=30, clock=lambda: now[0])
+    cache.get(cur, "030001")
+
+    cur.history[("TWSE", "030001")][-1] = _bar(9, 9.99)
+    now[0] = 31.0
+    series = cache.get(cur, "030001")
+    assert cache.stats["reloads"] == 1
+    assert series.rows(1)[0]["close_price"] == 9.99
+
+
+def test_budget_evicts_expired_warrants_before_lru():
+    history = {("TWSE", c): _history(50) for c in ("A", "B", "C")}
+    cur = FakeCursor(history, expiry={"A": date(2030, 1, 1), "B": date(2020, 1, 1), "C": date(2030, 1, 1)})
+    one = WarrantBarCache().get(cur, "A").nbytes
+    cache = WarrantBarCache(max_bytes=2 * one, today=lambda: date(2026, 6, 1))
+
+    cache.get(cur, "A")
+    cache.get(cur, "B")
+    got = cache.get_many(cur, ["C"])
+    assert "C" in got
+    mem = cache.memory()
+    assert mem["entries"] == 2 and mem["evictions"] == 1 and mem["bytes"] <= 2 * one
+    assert set(cache._entries) == {"A", "C"}  # expired B went first although A is older
+
+
+def test_pack_recent_matches_the_ta_screen_signals():
+    bars = _history(120)
+    bars[50]["close_price"] = None
+    bars[60]["open_price"] = None
+    cur = FakeCursor({("TWSE", "030001"): bars})
+    series = WarrantBarCache().get_many(cur, ["030001"])
+
+    signals = evaluate_packed_signals(*pack_recent(series, 80))
+    screen_bars = [
+        {"open": b["open_price"], "high": b["high_price"], "low": b["low_price"], "close": b["close_price"]}
+        for b in bars if b["close_price"] is not None
+    ][-80:]
+    assert signals["030001"] == evaluate_ta_signals(screen_bars)
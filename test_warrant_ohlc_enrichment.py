@@ -0,0 +1,177 @@
+import threading
+from datetime import date
+
+import warrant_ohlc_enrichment
+from tpex_backfill import HostRateLimiter
+from warrant_ohlc_enrichment import missing_bars, run_enrichment, stock_day_tasks
+
+
+class FakeConnection:
+    """``bars`` maps (date, code) -> close (None = priceless); writes land on commit."""
+
+    def __init__(self, bars):
+        self.bars = dict(bars)
+        self.pending = {}
+        self.written = set()
+        self.commits = 0
+
+    def cursor(self):
+        conn = self
+
+        class Cur:
+            def execute(self, sql, params=None):
+                if sql.startswith("SELECT NOW()"):
+                    self._rows = [{"started_at": "t0"}]
+                    return
+                if "ARRAY_AGG(DISTINCT warrant_code)" in sql:
+                    self._rows = [{
+                        "codes": sorted({c for _, c in conn.written}) or None,
+                        "days": sorted({d for d, _ in conn.written}) or None,
+                    }]
+                    return
+                assert "close_price IS NULL" in sql
+                lo, hi = params[0], params[1]
+                codes = set(params[2]) if len(params) > 2 else None
+                self._rows = [
+                    {"trade_date": d, "warrant_code": c}
+                    for (d, c), close in conn.bars.items()
+                    if close is None and lo <= d <= hi and (codes is None or c in codes)
+                ]
+
+            def fetchall(self):
+                return self._rows
+
+            def fetchone(self):
+                return self._rows[0]
+
+            def close(self):
+                pass
+
+        return Cur()
+
+    def commit(self):
+        self.bars.update(self.pending)
+        self.written.update(self.pending)
+        self.pending = {}
+        self.commits += 1
+
+    def rollback(self):
+        self.pending = {}
+
+
+D1, D2, D3 = date(2026, 9, 29), date(2026, 9, 30), date(2026, 10, 1)
+
+
+def test_stock_day_tasks_are_deduplicated_per_code_and_month():
+    missing = {D1: {"030001", "030002"}, D2: {"030001"}, D3: {"030001"}}
+    assert stock_day_tasks(missing) == [
+        ("030001", 2026, 9), ("030001", 2026, 10), ("030002", 2026, 9),
+    ]
+
+
+def _record_refreshes(monkeypatch):
+    calls = []
+    monkeypatch.setattr(warrant_ohlc_enrichment, "refresh_latest_warrant_bars", lambda cur, m, codes: calls.append(("latest", list(codes))))
+    monkeypatch.setattr(warrant_ohlc_enrichment.warrant_ta_state, "update_states", lambda cur, m, codes, since: calls.append(("ta", since)))
+    monkeypatch.setattr(warrant_ohlc_enrichment.warrant_rankings, "invalidate", lambda cur, m, days: calls.append(("rank", list(days))))
+    return calls
+
+
+def test_snapshot_per_date_then_stock_day_for_codes_still_missing(monkeypatch):
+    refreshes = _record_refreshes(monkeypatch)
+    conn = FakeConnection({
+        (D1, "030001"): None, (D1, "030002"): None,
+        (D2, "030001"): None, (D2, "030002"): 1.0,
+        (D3, "030003"): None,
+    })
+    snapshot_calls, stock_day_calls = [], []
+    lock = threading.Lock()
+
+    def fetch_snapshot(day):
+        with lock:
+            snapshot_calls.append(day)
+        if day == D2:
+            raise RuntimeError("MI_INDEX HTTP 503")
+        # D3 的快照沒有 030003（例如當日未列入）
+        return {"day": day, "codes": ["030001", "030002"] if day == D1 else []}
+
+    def write_snapshot(cursor, snap, codes):
+        assert codes is None
+        for code in snap["codes"]:
+            conn.pending[(snap["day"], code)] = 1.1
+        return len(snap["codes"])
+
+    def fetch_stock_day(code, year, month):
+        with lock:
+            stock_day_calls.append((code, year, month))
+        days = [d for d in (D1, D2, D3) if (d.year, d.month) == (year, month)]
+        return [{"trade_date": d, "warrant_code": code} for d in days]
+
+    def write_stock_day(cursor, rows):
+        for r in rows:
+            if (r["trade_date"], r["warrant_code"]) in conn.bars:
+                conn.pending[(r["trade_date"], r["warrant_code"])] = 2.0
+        return len(rows)
+
+    progress = []
+    result = run_enrichment(
+        conn, D3, D1,
+        fetch_snapshot=fetch_snapshot, write_snapshot=write_snapshot,
+        fetch_stock_day=fetch_stock_day, write_stock_day=write_stock_day,
+        workers=3, limiter=HostRateLimiter(0.0),
+        on_progress=lambda phase, item, status: progress.append((phase, status)),
+    )
+
+    assert sorted(snapshot_calls) == [D1, D2, D3]
+    assert sorted(stock_day_calls) == [("030001", 2026, 9), ("030003", 2026, 10)]
+    assert all(close is not None for close in conn.bars.values())
+    summary = result.summary()
+    assert summary["missingBefore"] == 4 and summary["missingAfter"] == 0 and summary["filledBars"] == 4
+    assert summary["snapshot"]["done"] == 1 and summary["snapshot"]["empty"] == 1
+    assert [f["item"] for f in summary["snapshot"]["failures"]] == ["2026-09-30"]
+    assert summary["stockDay"]["requests"] == 2 and summary["stockDay"]["failed"] == 0
+    assert len(progress) == 5
+    # 衍生表在整段補齊後只更新一次
+    assert refreshes == [
+        ("latest", ["030001", "030002", "030003"]),
+        ("ta", D1),
+        ("rank", [D1, D2, D3]),
+    ]
+
+
+def test_codes_filter_and_disabled_stock_day():
+    conn = FakeConnection({(D1, "030001"): None, (D1, "030002"): None})
+    result = run_enrichment(
+        conn, D1, D1,
+        fetch_snapshot=lambda day: None, write_snapshot=None,
+        fetch_stock_day=None, write_stock_day=None,
+        codes=["030002"], stock_day=False, limiter=HostRateLimiter(0.0),
+    )
+    assert result.missing_before == 1 and result.missing_after == 1
+    assert result.summary()["stockDay"]["requests"] == 0
+    assert missing_bars(conn.cursor(), D1, D1) == {D1: {"030001", "030002"}}
+
+
+def test_snapshot_phase_writes_only_the_requested_codes(monkeypatch):
+    refreshes = _record_refreshes(monkeypatch)
+    conn = FakeConnection({(D1, "030001"): None, (D1, "030002"): None})
+
+    def write_snapshot(cursor, snap, codes):
+        written = [c for c in ("030001", "030002") if codes is None or c in codes]
+        conn.pending.update({(D1, c): 1.0 for c in written})
+        return len(written)
+
+    result = run_enrichment(
+        conn, D1, D1,
+        fetch_snapshot=lambda day: {"day": day}, write_snapshot=write_snapshot,
+        fetch_stock_day=None, write_stock_day=None,
+        codes=["030002"], stock_day=False, limiter=HostRateLimiter(0.0),
+    )
+    assert conn.bars == {(D1, "030001"): None, (D1, "030002"): 1.0}
+    assert result.missing_before == 1 and result.missing_after == 0
+    assert refreshes[0] == ("latest", ["030002"])
+
+
+def test_roc_dates_parse_for_stock_day_rows():
+    assert warrant_ohlc_enrichment._parse_roc_date("115/07/01") == date(2026, 7, 1)
+    assert warrant_ohlc_enrichment._parse_roc_date("bad") is None
@@ -0,0 +1,149 @@
+from datetime import date
+
+import warrant_partitions
+from warrant_partitions import add_months, archive_expired, archived_bars, ensure_partitions, months_between
+
+COLUMNS = {
+    "tw_warrant_trade": ["trade_date", "warrant_code", "close_price"],
+    "tw_warrant_trade_archive": ["trade_date", "warrant_code", "close_price", "archived_at"],
+}
+
+
+class FakeCursor:
+    """Catalog lookups answer from ``tables`` / ``partitioned``; everything else is recorded."""
+
+    def __init__(self, tables=(), partitioned=(), hot_rows=None, expired=(), archive_rows=None):
+        self.tables = set(tables)
+        self.partitioned = set(partitioned)
+        self.hot_rows = dict(hot_rows or {})  # code -> number of hot rows
+        self.expired = list(expired)
+        self.archive_rows = dict(archive_rows or {})  # archive table -> rows
+        self.statements = []
+        self.rowcount = 0
+        self._rows = []
+
+    def execute(self, sql, params=None):
+        sql = " ".join(sql.split())
+        self.statements.append((sql, params))
+        self._rows = []
+        if "to_regclass(%s) IS NOT NULL" in sql:
+            self._rows = [(params[0] in self.tables,)]
+        elif "relkind" in sql:
+            self._rows = [("p",)] if params[0] in self.partitioned else []
+        elif "information_schema.columns" in sql:
+            self._rows = [(c,) for c in COLUMNS.get(params[0], [])]
+        elif sql.startswith("CREATE TABLE") and "IF NOT EXISTS" not in sql:
+            self.tables.add(sql.split()[2])
+        elif "MIN(trade_date) AS lo, MAX(trade_date) AS hi" in sql:
+            self._rows = [{"lo": date(2025, 11, 3), "hi": date(2026, 10, 16)}]
+        elif "FROM tw_warrant_master m" in sql:
+            self._rows = [(c,) for c in self.expired]
+        elif sql.startswith("WITH moved AS ( DELETE FROM tw_warrant_trade "):
+            self.rowcount = sum(self.hot_rows.pop(c, 0) for c in params[0])
+        elif "SELECT trade_date, warrant_code, warrant_name" in sql:
+            table = sql.split(" FROM ")[1].split()[0]
+            rows = self.archive_rows.get(table, [])
+            self._rows = sorted(rows, key=lambda r: r["trade_date"], reverse="DESC" in sql)
+            if "LIMIT" in sql:
+                self._rows = self._rows[: params[-1]]
+
+    def fetchone(self):
+        return self._rows[0] if self._rows else None
+
+    def fetchall(self):
+        return self._rows
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self.commits = 0
+        self.rollbacks = 0
+
+    def cursor(self):
+        return self._cursor
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+def _sql(cur, prefix):
+    return [(sql, params) for sql, params in cur.statements if sql.startswith(prefix)]
+
+
+def test_month_arithmetic():
+    assert add_months(date(2026, 11, 30), 2) == date(2027, 1, 1)
+    assert months_between(date(2026, 10, 19), date(2027, 1, 1)) == [
+        date(2026, 10, 1), date(2026, 11, 1), date(2026, 12, 1), date(2027, 1, 1),
+    ]
+    assert warrant_partitions.partition_name("tw_warrant_trade", date(2026, 10, 1)) == "tw_warrant_trade_p202610"
+
+
+def test_new_month_is_split_out_of_the_default_partition_then_attached():
+    cur = FakeCursor(
+        tables={"tw_warrant_trade", "tw_warrant_trade_default", "tw_warrant_trade_p202610"},
+        partitioned={"tw_warrant_trade"},
+    )
+    created = ensure_partitions(cur, "tw_warrant_trade", [date(2026, 10, 19), date(2026, 11, 5)])
+    assert created == ["tw_warrant_trade_p202611"]
+    moved = _sql(cur, "WITH moved AS ( DELETE FROM tw_warrant_trade_default")
+    assert moved[0][1] == (date(2026, 11, 1), date(2026, 12, 1))
+    assert "INSERT INTO tw_warrant_trade_p202611 (trade_date, warrant_code, close_price)" in moved[0][0]
+    attach = _sql(cur, "ALTER TABLE tw_warrant_trade ATTACH PARTITION tw_warrant_trade_p202611")
+    assert attach[0][1] == (date(2026, 11, 1), date(2026, 12, 1))
+
+
+def test_migration_is_a_noop_once_partitioned():
+    cur = FakeCursor(tables={"tw_warrant_trade"}, partitioned={"tw_warrant_trade"})
+    result = warrant_partitions.migrate_to_partitioned(cur, "twse", date(2026, 10, 19))
+    assert result["migrated"] is False
+    assert not _sql(cur, "ALTER TABLE") and not _sql(cur, "LOCK TABLE")
+
+
+def test_expired_history_moves_in_committed_batches():
+    cur = FakeCursor(
+        tables={"tw_warrant_trade", "tw_warrant_trade_archive"},
+        hot_rows={"030001": 120, "030002": 80, "030003": 5},
+        expired=["030001", "030002", "030003"],
+    )
+    conn = FakeConnection(cur)
+    progress = []
+    result = archive_expired(
+        conn, "TWSE", date(2026, 10, 19), grace_days=30, batch_size=2,
+        on_batch=lambda codes, rows: progress.append((codes, rows)),
+    )
+    assert result == {"market": "TWSE", "cutoff": "2026-09-19", "codes": 3, "rows": 205}
+    assert progress == [(2, 200), (3, 205)]
+    assert conn.commits == 3 and conn.rollbacks == 0
+
+    expired_query = [p for s, p in cur.statements if "FROM tw_warrant_master m" in s]
+    assert expired_query == [(date(2026, 9, 19),)]
+    move = _sql(cur, "WITH moved AS ( DELETE FROM tw_warrant_trade ")[0][0]
+    assert "INSERT INTO tw_warrant_trade_archive (trade_date, warrant_code, close_price, archived_at)" in move
+    assert "ON CONFLICT (warrant_code, trade_date) DO UPDATE SET close_price = EXCLUDED.close_price" in move
+    # 歸檔表依年份建冷分區，涵蓋熱表的日期範圍
+    years = [s.split()[5] for s, _ in _sql(cur, "ALTER TABLE tw_warrant_trade_archive ATTACH PARTITION")]
+    assert years == ["tw_warrant_trade_archive_y2025", "tw_warrant_trade_archive_y2026"]
+
+
+def test_archived_bars_fall_back_per_market_and_keep_the_tail():
+    rows = [
+        {"trade_date": date(2024, 3, d), "warrant_code": "700001", "close_price": d} for d in (1, 4, 5)
+    ]
+    cur = FakeCursor(
+        tables={"tw_warrant_trade_archive", "tpex_warrant_daily_quotes_archive"},
+        archive_rows={"tpex_warrant_daily_quotes_archive": rows},
+    )
+    market, bars = archived_bars(cur, "700001", limit=2)
+    assert market == "TPEX"
+    assert [b["trade_date"].day for b in bars] == [4, 5]
+
+    market, bars = archived_bars(cur, "700001", start="2024-03-01", end="2024-03-31")
+    assert [b["trade_date"].day for b in bars] == [1, 4, 5]
+    assert archived_bars(FakeCursor(), "700001") == (None, [])
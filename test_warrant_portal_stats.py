@@ -0,0 +1,68 @@
+from datetime import date, datetime, timedelta
+
+import warrant_portal_stats
+
+
+class FakeCursor:
+    rowcount = 2
+
+    def __init__(self, stored=None):
+        self.stored = stored or {}
+        self.queries = []
+        self.refreshes = 0
+        self._rows = []
+
+    def execute(self, sql, params=None):
+        self.queries.append(sql)
+        if "INSERT INTO warrant_portal_stats" in sql:
+            self.refreshes += 1
+            for market in ("TWSE", "TPEX"):
+                self.stored[market] = {
+                    "market": market, "master_total": 10, "call_count": 7, "put_count": 3,
+                    "latest_trade_date": date(2026, 10, 16), "traded_count": 4,
+                    "refreshed_at": datetime(2026, 10, 16, 15, 0),
+                }
+        elif sql.startswith("SELECT market, master_total"):
+            self._rows = list(self.stored.values())
+        else:
+            self._rows = []
+
+    def fetchall(self):
+        return self._rows
+
+
+def test_refresh_is_one_grouped_statement():
+    cur = FakeCursor()
+    warrant_portal_stats.refresh(cur)
+    inserts = [q for q in cur.queries if "INSERT INTO warrant_portal_stats" in q]
+    assert len(inserts) == 1
+    sql = inserts[0]
+    assert "UNION ALL" in sql and "COUNT(*) FILTER (WHERE warrant_type = '認購')" in sql
+    assert "ON CONFLICT (market)" in sql
+
+
+def test_read_uses_cache_rows_and_refreshes_only_when_missing_or_stale():
+    cur = FakeCursor()
+    rows = warrant_portal_stats.read(cur)
+    assert cur.refreshes == 1 and set(rows) == {"TWSE", "TPEX"}
+
+    now = lambda: datetime(2026, 10, 16, 15, 30)
+    warrant_portal_stats.read(cur, max_age=timedelta(hours=1), now=now)
+    assert cur.refreshes == 1
+
+    later = lambda: datetime(2026, 10, 16, 17, 0)
+    warrant_portal_stats.read(cur, max_age=timedelta(hours=1), now=later)
+    assert cur.refreshes == 2
+
+
+def test_payload_keeps_the_homepage_shape():
+    out = warrant_portal_stats.payload({
+        "TWSE": {"master_total": 12, "call_count": 8, "put_count": 4,
+                 "latest_trade_date": date(2026, 10, 16), "traded_count": 5},
+    })
+    assert out == {
+        "success": True,
+        "twse": {"master_total": 12, "call": 8, "put": 4, "latest_trade_date": "2026-10-16", "traded_count": 5},
+        "tpex": {"master_total": 0, "call": 0, "put": 0, "latest_trade_date": None, "traded_count": 0},
+        "total_master": 12,
+    }
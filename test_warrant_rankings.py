@@ -0,0 +1,80 @@
+from datetime import date
+
+import warrant_rankings
+
+DAY = date(2026, 10, 16)
+
+
+def _row(code, turnover, volume, wtype="認購"):
+    return {"warrant_code": code, "warrant_name": code, "warrant_type": wtype,
+            "turnover": turnover, "volume": volume, "close_price": 1.0}
+
+
+class FakeCursor:
+    """Stored lists keyed by (market, bucket, metric); builds fill from ``source``."""
+
+    rowcount = 6
+
+    def __init__(self, stored=None, source=None):
+        self.stored = stored or {}
+        self.source = source or {}
+        self.builds = []
+        self.deletes = []
+        self._rows = []
+
+    def execute(self, sql, params=None):
+        if "INSERT INTO warrant_rankings" in sql:
+            market = params[-1]
+            self.builds.append((market, params[0]))
+            for (m, bucket, metric), rows in self.source.items():
+                if m == market:
+                    self.stored[(m, bucket, metric)] = rows
+        elif sql.lstrip().startswith("SELECT market, warrant_type, rows"):
+            _, markets, metric, buckets = params
+            self._rows = [
+                {"market": m, "warrant_type": b, "rows": rows}
+                for (m, b, met), rows in self.stored.items()
+                if m in markets and b in buckets and met == metric
+            ]
+        elif sql.startswith("DELETE FROM warrant_rankings"):
+            self.deletes.append(params)
+        else:
+            self._rows = []
+
+    def fetchall(self):
+        return self._rows
+
+
+def test_all_types_and_both_markets_merge_the_stored_top_lists():
+    stored = {
+        ("TWSE", "認購", "turnover"): [_row("030001", 900, 10), _row("030002", 100, 5)],
+        ("TWSE", "認售", "turnover"): [_row("03001P", 500, 99, "認售")],
+        ("TWSE", "", "turnover"): [_row("03009X", None, 7, None)],
+        ("TPEX", "認購", "turnover"): [_row("700001", 500, 100)],
+    }
+    cur = FakeCursor(stored)
+    rows = warrant_rankings.read(cur, DAY, markets=["TWSE", "TPEX"], metric="turnover", limit=4)
+    assert [(r["market"], r["warrant_code"]) for r in rows] == [
+        ("TWSE", "030001"), ("TPEX", "700001"), ("TWSE", "03001P"), ("TWSE", "030002"),
+    ]
+    assert cur.builds == []
+
+    calls = warrant_rankings.read(cur, DAY, markets=["TWSE"], warrant_type="認購", limit=10)
+    assert [r["warrant_code"] for r in calls] == ["030001", "030002"]
+
+
+def test_missing_market_day_is_built_on_demand():
+    source = {("TPEX", "認售", "volume"): [_row("70001P", 1, 50, "認售")]}
+    cur = FakeCursor({("TWSE", "認售", "volume"): [_row("03001P", 2, 40, "認售")]}, source)
+    rows = warrant_rankings.read(cur, DAY, markets=["TWSE", "TPEX"], warrant_type="認售", metric="volume")
+    assert cur.builds == [("TPEX", DAY)]
+    assert [r["warrant_code"] for r in rows] == ["70001P", "03001P"]
+
+
+def test_invalidate_drops_only_the_given_days():
+    cur = FakeCursor()
+    warrant_rankings.invalidate(cur, "twse", [DAY, DAY, None])
+    assert cur.deletes == [("TWSE", [DAY])]
+    warrant_rankings.invalidate(cur, "TWSE", [])
+    assert len(cur.deletes) == 1
+    assert warrant_rankings.build_day(cur, "TWSE", None) == 0
@@ -0,0 +1,58 @@
+import warrant_search
+from warrant_search import base_query, search_clause
+
+
+class FakeCursor:
+    rowcount = 0
+
+    def __init__(self, fail_on=None):
+        self.fail_on = fail_on
+        self.queries = []
+
+    def execute(self, sql, params=None):
+        self.queries.append((" ".join(sql.split()), params))
+        if self.fail_on and self.fail_on in sql:
+            raise RuntimeError("permission denied to create extension")
+
+    def fetchall(self):
+        return []
+
+
+def test_code_query_is_exact_or_prefix_on_normalised_columns():
+    clause, params = search_clause("2330.tw")
+    assert "underlying_keys @> ARRAY[%s]::text[]" in clause
+    assert "stock_symbols" not in clause and "REPLACE" not in clause
+    assert params == ["2330", "2330%", "2330"]
+
+
+def test_name_query_stays_fuzzy_but_codes_exact():
+    clause, params = search_clause("台積電")
+    assert "warrant_name ILIKE %s" in clause and "underlying_norm = %s" in clause
+    assert params == ["%台積電%", "%台積電%", "台積電", "台積電"]
+    assert search_clause("  ") == ("", [])
+
+
+def test_base_query_filters_one_table_and_turns_days_into_expiry_ranges():
+    sql, params = base_query(market="tpex", q="5274", warrant_type="認購", days_min=30, days_max=None, expiry_to="")
+    assert "UNION" not in sql and "FROM warrant_search" in sql
+    assert "market = %s" in sql and "expiry_date >= CURRENT_DATE + %s::int" in sql
+    assert "(expiry_date - CURRENT_DATE) AS days_to_expiry" in sql
+    assert params == ["TPEX", "5274", "5274%", "5274", "認購", 30]
+    assert "market = %s" not in base_query(market="both")[0]
+
+
+def test_refresh_rebuilds_only_the_requested_market():
+    cur = FakeCursor()
+    warrant_search.refresh(cur, ["tpex"])
+    delete = [p for q, p in cur.queries if q.startswith("DELETE FROM warrant_search")]
+    assert delete == [(["TPEX"],)]
+    insert = next(q for q, _ in cur.queries if "INSERT INTO warrant_search" in q)
+    assert "FROM tpex_warrant_master" in insert and "tw_warrant_master" not in insert
+    assert warrant_search.refresh(cur, []) == 0
+
+
+def test_missing_pg_trgm_privilege_skips_only_the_trigram_index():
+    cur = FakeCursor(fail_on="CREATE EXTENSION")
+    assert warrant_search.ensure_search_table(cur) is False
+    assert cur.queries[-1][0] == "ROLLBACK TO SAVEPOINT warrant_search_trgm"
+    assert any("warrant_search_keys_idx" in q for q, _ in cur.queries)
@@ -0,0 +1,108 @@
+import random
+
+import numpy as np
+
+from warrant_ta_screen import (
+    DEFAULT_GOLDEN_WAVE_PARAMS,
+    WARRANT_GOLDEN_WAVE_PARAMS,
+    build_heikin_ashi,
+    calc_ema,
+    calc_golden_wave,
+    calc_sma,
+    ema_matrix,
+    evaluate_ta_signals,
+    evaluate_ta_signals_matrix,
+    filter_codes_by_ta,
+    golden_wave_matrix,
+    heikin_ashi_matrix,
+    pack_bars,
+    sma_matrix,
+)
+
+
+def _bars(n, seed):
+    rng = random.Random(seed)
+    price = 0.5 + rng.random() * 3
+    out = []
+    for _ in range(n):
+        price = max(0.01, price * (1 + rng.uniform(-0.1, 0.1)))
+        o = price * (1 + rng.uniform(-0.04, 0.04))
+        bar = {
+            'open': round(o, 2),
+            'high': round(max(o, price) * 1.02, 2),
+            'low': round(min(o, price) * 0.98, 2),
+            'close': round(price, 2),
+        }
+        r = rng.random()
+        if r < 0.08:
+            bar['open'] = None  # Heikin-Ashi 略過此根
+        elif r < 0.12:
+            bar['close'] = None  # 無收盤：整根略過
+        out.append(bar)
+    return out
+
+
+def _universe(seed=0):
+    rng = random.Random(seed)
+    lengths = [0, 1, 2, 3, 4, 9, 10, 11, 80, 159, 160, 200] + [rng.randint(1, 220) for _ in range(150)]
+    return {f'{i:06d}': _bars(n, seed * 1000 + i) for i, n in enumerate(lengths)}
+
+
+def _to_list(row):
+    return [None if np.isnan(v) else float(v) for v in row]
+
+
+def test_sma_and_ema_kernels_match_the_list_reference():
+    universe = _universe(1)
+    codes, closes, _ = pack_bars(universe)
+    for period in (5, 10, 12, 55):
+        sma, ema = sma_matrix(closes, period), ema_matrix(closes, period)
+        for i, code in enumerate(codes):
+            valid = [v for v in closes[i] if not np.isnan(v)]
+            pad = closes.shape[1] - len(valid)
+            assert _to_list(sma[i, pad:]) == calc_sma(valid, period)
+            assert _to_list(ema[i, pad:]) == calc_ema(valid, period)
+
+
+def test_golden_wave_and_heikin_ashi_kernels_match_the_list_reference():
+    universe = _universe(2)
+    codes, closes, ohlc = pack_bars(universe)
+    gw = golden_wave_matrix(closes, WARRANT_GOLDEN_WAVE_PARAMS)
+    ha = heikin_ashi_matrix(ohlc)
+    for i, code in enumerate(codes):
+        valid = [v for v in closes[i] if not np.isnan(v)]
+        ref = calc_golden_wave(valid, WARRANT_GOLDEN_WAVE_PARAMS)
+        pad = closes.shape[1] - len(valid)
+        assert _to_list(gw['dif'][i, pad:]) == ref['dif']
+        assert _to_list(gw['difSub'][i, pad:]) == ref['difSub']
+
+        ref_ha = build_heikin_ashi(universe[code])
+        pad = ohlc.shape[2] - len(ref_ha)
+        assert _to_list(ha['open'][i, pad:]) == [b['open'] for b in ref_ha]
+        assert _to_list(ha['close'][i, pad:]) == [b['close'] for b in ref_ha]
+
+
+def test_batch_signals_match_evaluate_ta_signals_per_code():
+    for seed in range(5):
+        universe = _universe(seed)
+        batch = evaluate_ta_signals_matrix(universe)
+        assert list(batch) == list(universe)
+        for code, bars in universe.items():
+            assert batch[code] == evaluate_ta_signals(bars), (seed, code, len(bars))
+
+
+def test_long_histories_switch_to_default_params():
+    bars = _bars(200, 42)
+    closes = [b['close'] for b in bars if b['close'] is not None]
+    assert len(closes) >= 160
+    _, m, _ = pack_bars({'x': bars})
+    gw = golden_wave_matrix(m, DEFAULT_GOLDEN_WAVE_PARAMS)
+    assert _to_list(gw['dif'][0]) == calc_golden_wave(closes, DEFAULT_GOLDEN_WAVE_PARAMS)['dif']
+    assert evaluate_ta_signals_matrix({'x': bars})['x'] == evaluate_ta_signals(bars)
+
+
+def test_filter_codes_by_ta_uses_batch_signals():
+    universe = _universe(3)
+    flags = {'ma5gtMa10': True, 'heikinFirstRed': False, 'reversalFirstRed': False}
+    expected = [c for c, b in universe.items() if b and evaluate_ta_signals(b)['ma5gtMa10']]
+    assert filter_codes_by_ta(universe, flags) == expected
@@ -0,0 +1,136 @@
+import json
+import random
+from datetime import date, timedelta
+
+import warrant_ta_state
+from warrant_ta_screen import evaluate_ta_signals
+from warrant_ta_state import TAState, replay, replay_keeping_prev
+
+START = date(2026, 1, 5)
+
+
+def _bars(n, seed, gaps=False):
+    rng = random.Random(seed)
+    price = 1.0 + rng.random()
+    out = []
+    for i in range(n):
+        price = max(0.01, price * (1 + rng.uniform(-0.12, 0.12)))
+        o = price * (1 + rng.uniform(-0.05, 0.05))
+        bar = {
+            "trade_date": START + timedelta(days=i),
+            "open": round(o, 2),
+            "high": round(max(o, price) * 1.03, 2),
+            "low": round(min(o, price) * 0.97, 2),
+            "close": round(price, 2),
+        }
+        if gaps and rng.random() < 0.15:
+            bar["open"] = None  # 只有收盤價：Heikin-Ashi 略過、均線照算
+        out.append(bar)
+    return out
+
+
+def test_replay_matches_batch_screen_on_the_screen_window():
+    for seed in range(60):
+        for n in (1, 2, 4, 9, 10, 11, 35, 80):
+            bars = _bars(n, seed, gaps=seed % 2 == 0)
+            assert replay(bars).signals() == evaluate_ta_signals(bars), (seed, n)
+
+
+def test_stepping_from_a_stored_state_equals_a_full_replay():
+    bars = _bars(120, 7, gaps=True)
+    state = replay(bars[:90])
+    stored = TAState.from_json(state.to_json(), state.last_trade_date)
+    for bar in bars[90:]:
+        stored.step(bar)
+    assert stored == replay(bars)
+    assert stored.last_trade_date == bars[-1]["trade_date"]
+
+
+def test_prev_state_allows_replaying_the_last_bar():
+    bars = _bars(30, 3)
+    state, prev = replay_keeping_prev(bars)
+    assert prev == replay(bars[:-1])
+    revised = dict(bars[-1], close=bars[-1]["close"] * 1.5)
+    assert replay([revised], prev) == replay(bars[:-1] + [revised])
+    assert state == replay(bars)
+
+
+def _row(state, prev):
+    return {
+        "warrant_code": "030001",
+        "last_trade_date": state.last_trade_date,
+        "state": json.loads(state.to_json()),
+        "prev_trade_date": prev.last_trade_date if prev else None,
+        "prev_state": json.loads(prev.to_json()) if prev else None,
+    }
+
+
+def test_base_state_resumes_rolls_back_or_reseeds():
+    bars = _bars(20, 5)
+    state, prev = replay_keeping_prev(bars)
+    row = _row(state, prev)
+    last = state.last_trade_date
+
+    assert warrant_ta_state._base_state(row, None) == state
+    assert warrant_ta_state._base_state(row, last + timedelta(days=1)) == state
+    assert warrant_ta_state._base_state(row, last) == prev
+    assert warrant_ta_state._base_state(row, prev.last_trade_date) is None
+
+
+class FakeCursor:
+    def __init__(self, states, bars):
+        self.connection = object()
+        self.states = states
+        self.bars = bars
+        self._rows = []
+
+    def execute(self, sql, params=None):
+        if "unnest" in sql:
+            codes, bases, floor = params
+            assert floor == min(bases)
+            self._rows = [
+                dict(bar, warrant_code=code)
+                for code, base in zip(codes, bases)
+                for bar in self.bars.get(code, [])
+                if bar["trade_date"] > base and bar["trade_date"] > floor
+            ]
+        elif "ROW_NUMBER" in sql:
+            codes, limit = params
+            self._rows = [
+                dict(bar, warrant_code=code)
+                for code in codes
+                for bar in self.bars.get(code, [])[-limit:]
+            ]
+        elif "FROM warrant_ta_state" in sql:
+            self._rows = [r for code, r in self.states.items() if code in params[1]]
+        else:
+            self._rows = []
+
+    def fetchall(self):
+        return self._rows
+
+
+def test_update_states_advances_existing_and_seeds_new_codes(monkeypatch):
+    monkeypatch.setattr(warrant_ta_state, "ensure_state_table", lambda cur: None)
+    saved = {}
+
+    def save(cur, market, states):
+        saved.update(states)
+
+    monkeypatch.setattr(warrant_ta_state, "_save_states", save)
+    old_bars, new_bars = _bars(100, 11), _bars(100, 12)
+    state, prev = replay_keeping_prev(old_bars[:-1])
+    cur = FakeCursor({"030001": _row(state, prev)}, {"030001": old_bars, "030002": new_bars})
+
+    written = warrant_ta_state.update_states(cur, "TWSE", ["030001", "030002", "030001"])
+
+    assert written == 2
+    assert saved["030001"][0] == replay(old_bars)
+    assert saved["030002"][0] == replay(new_bars[-warrant_ta_state.WARMUP_BARS:])
+    assert saved["030002"][1] == replay(new_bars[-warrant_ta_state.WARMUP_BARS:-1])
+
+
+def test_flag_clause_only_includes_requested_flags():
+    clause = warrant_ta_state.flag_clause({"ma5gtMa10": True, "heikinFirstRed": False})
+    assert clause == "ts.ma5_gt_ma10"
+    assert warrant_ta_state.flag_clause({}) == "TRUE"
@@ -0,0 +1,328 @@
+"""Parallel, resumable backfill of TPEX warrant daily quotes.
+
+The backfill used to walk calendar days one by one (weekends included), sleep
+between days and abort the whole range on the first failure.  Here:
+
+* ``plan_days`` keeps weekdays only, drops weekdays the price table shows were
+  market holidays, and drops days already recorded as done (or empty) in
+  ``tpex_warrant_backfill_days`` -- so a restarted backfill resumes.  Inferred
+  holidays are recorded there as ``holiday`` so they can be inspected; a
+  fetched result for the day, or ``force``, overrides the inference.  An
+  ``empty`` fetch only counts as final once the day is older than
+  ``EMPTY_FINAL_AFTER_DAYS``; TPEX publishes the day's quotes after the close,
+  so a recent empty day is fetched again.
+* ``run_backfill`` fetches up to ``workers`` days concurrently; every request
+  to the TPEX host goes through one ``HostRateLimiter``.
+* Each day is written in its own transaction together with its progress row;
+  a failing day is recorded as ``failed`` with its error and the run goes on.
+  Failed days are picked up again by the next run (``retry_failed``).
+* ``finish_range`` refreshes the derived warrant tables once for the whole
+  range; the API job and ``scripts/backfill_tpex_warrant_daily.py`` share it.
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Iterable, Optional
+
+import warrant_portal_stats
+import warrant_rankings
+import warrant_ta_state
+from latest_bars import refresh_latest_warrant_bars
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_TABLE = "tpex_warrant_backfill_days"
+# 價格表某個平日無資料、但前後 HOLIDAY_WINDOW_DAYS 天內都有 → 視為休市；更長的缺口當成資料未回補
+HOLIDAY_WINDOW_DAYS = 10
+# 近幾天的空結果可能只是 TPEX 尚未公布，之後的執行要再抓
+EMPTY_FINAL_AFTER_DAYS = 3
+DEFAULT_WORKERS = 4
+MAX_WORKERS = 8
+
+
+class HostRateLimiter:
+    """Spaces request starts to one per ``min_interval`` seconds across threads."""
+
+    def __init__(self, min_interval: float, clock=time.monotonic, sleep=time.sleep):
+        self.min_interval = max(0.0, float(min_interval))
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._next_at = 0.0
+
+    def wait(self) -> None:
+        with self._lock:
+            now = self._clock()
+            start = max(now, self._next_at)
+            self._next_at = start + self.min_interval
+        if start > now:
+            self._sleep(start - now)
+
+
+def ensure_progress_table(cursor) -> None:
+    cursor.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {PROGRESS_TABLE} (
+            trade_date DATE PRIMARY KEY,
+            status VARCHAR(10) NOT NULL,
+            row_count INTEGER NOT NULL DEFAULT 0,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+
+
+def record_day(cursor, day: date, status: str, rows: int = 0, error: Optional[str] = None) -> None:
+    cursor.execute(
+        f"""
+        INSERT INTO {PROGRESS_TABLE} (trade_date, status, row_count, attempts, error, updated_at)
+        VALUES (%s, %s, %s, 1, %s, CURRENT_TIMESTAMP)
+        ON CONFLICT (trade_date) DO UPDATE SET
+            status = EXCLUDED.status,
+            row_count = EXCLUDED.row_count,
+            attempts = {PROGRESS_TABLE}.attempts + 1,
+            error = EXCLUDED.error,
+            updated_at = CURRENT_TIMESTAMP
+        """,
+        (day, status, int(rows or 0), (error or None) and str(error)[:1000]),
+    )
+
+
+def record_holidays(cursor, days: Iterable[date]) -> None:
+    """Record inferred holidays; a day that already has a progress row keeps it."""
+    for day in days:
+        cursor.execute(
+            f"""
+            INSERT INTO {PROGRESS_TABLE} (trade_date, status, row_count, attempts, error, updated_at)
+            VALUES (%s, 'holiday', 0, 0, %s, CURRENT_TIMESTAMP)
+            ON CONFLICT (trade_date) DO NOTHING
+            """,
+            (day, f"推測休市：價格表無資料，前後 {HOLIDAY_WINDOW_DAYS} 天內皆有交易日"),
+        )
+
+
+def _first(row: Any) -> Any:
+    if isinstance(row, dict):
+        return next(iter(row.values()), None)
+    return row[0] if row else None
+
+
+def _dates(rows: Iterable[Any]) -> set[date]:
+    out = set()
+    for row in rows or []:
+        val = _first(row)
+        if isinstance(val, datetime):
+            val = val.date()
+        if isinstance(val, date):
+            out.add(val)
+    return out
+
+
+def weekdays(start: date, end: date) -> list[date]:
+    days, cur = [], start
+    while cur <= end:
+        if cur.weekday() < 5:
+            days.append(cur)
+        cur += timedelta(days=1)
+    return days
+
+
+def holiday_weekdays(candidates: list[date], priced: set[date], window: timedelta) -> set[date]:
+    ordered = sorted(priced)
+    out = set()
+    for d in candidates:
+        if d in priced:
+            continue
+        before = any(d - window <= p < d for p in ordered)
+        after = any(d < p <= d + window for p in ordered)
+        if before and after:
+            out.add(d)
+    return out
+
+
+def plan_days(
+    cursor,
+    start: date,
+    end: date,
+    *,
+    prices_table: str = "tw_stock_prices",
+    retry_failed: bool = True,
+    force: bool = False,
+    today: Optional[date] = None,
+) -> dict[str, Any]:
+    """Trading days of ``[start, end]`` that still need a fetch.
+
+    Returns ``{'days', 'holidays', 'completed'}``.  ``holidays`` are weekdays
+    without stored prices that have priced days on both sides within
+    ``HOLIDAY_WINDOW_DAYS`` (TWSE and TPEX share the calendar); they are
+    recorded as ``holiday`` in the progress table unless the day already has a
+    fetched result there, which wins over the inference.  ``completed`` are
+    the days a previous run finished (``empty`` days within
+    ``EMPTY_FINAL_AFTER_DAYS`` of ``today`` are not final yet).  ``force``
+    plans every weekday, inferred holidays included.
+    """
+    if end < start:
+        start, end = end, start
+    ensure_progress_table(cursor)
+    candidates = weekdays(start, end)
+    if force:
+        return {"days": candidates, "holidays": [], "completed": []}
+
+    cursor.execute(
+        f"SELECT trade_date, status FROM {PROGRESS_TABLE} WHERE trade_date BETWEEN %s AND %s",
+        (start, end),
+    )
+    recorded: dict[date, str] = {}
+    for row in cursor.fetchall() or []:
+        day, status = tuple(row.values()) if isinstance(row, dict) else tuple(row)
+        if isinstance(day, datetime):
+            day = day.date()
+        recorded[day] = status
+
+    window = timedelta(days=HOLIDAY_WINDOW_DAYS)
+    cursor.execute(
+        f"SELECT DISTINCT date FROM {prices_table} WHERE date BETWEEN %s AND %s",
+        (start - window, end + window),
+    )
+    holidays = {
+        d for d in holiday_weekdays(candidates, _dates(cursor.fetchall()), window)
+        if recorded.get(d, "holiday") == "holiday"
+    }
+    record_holidays(cursor, sorted(d for d in holidays if d not in recorded))
+
+    done_statuses = {"done"} if retry_failed else {"done", "failed"}
+    empty_cutoff = (today or date.today()) - timedelta(days=EMPTY_FINAL_AFTER_DAYS)
+    completed = {
+        d for d, status in recorded.items()
+        if status in done_statuses or (status == "empty" and d < empty_cutoff)
+    }
+
+    days = [d for d in candidates if d not in holidays and d not in completed]
+    return {"days": days, "holidays": sorted(holidays), "completed": sorted(completed)}
+
+
+@dataclass
+class BackfillResult:
+    imported_days: int = 0
+    empty_days: int = 0
+    imported_count: int = 0
+    failures: list[dict[str, str]] = field(default_factory=list)
+    touched_codes: set[str] = field(default_factory=set)
+    done_days: list[date] = field(default_factory=list)
+    earliest: Optional[date] = None
+
+    def summary(self) -> dict[str, Any]:
+        return {
+            "importedDays": self.imported_days,
+            "emptyDays": self.empty_days,
+            "failedDays": len(self.failures),
+            "importedCount": self.imported_count,
+            "failures": self.failures,
+        }
+
+
+def run_backfill(
+    connection,
+    days: list[date],
+    *,
+    fetch: Callable[[date], list[dict]],
+    write: Callable[[Any, list[dict]], int],
+    workers: int = DEFAULT_WORKERS,
+    limiter: Optional[HostRateLimiter] = None,
+    on_day: Optional[Callable[[date, str, BackfillResult], None]] = None,
+) -> BackfillResult:
+    """Fetch ``days`` concurrently and write each one in its own transaction.
+
+    ``fetch(day)`` runs in worker threads behind ``limiter``; ``write(cursor,
+    rows)`` runs on the calling thread (one connection) and returns the row
+    count.  ``on_day(day, status, result)`` reports progress.
+    """
+    result = BackfillResult()
+    if not days:
+        return result
+    limiter = limiter or HostRateLimiter(0.0)
+
+    def fetch_day(day: date) -> list[dict]:
+        limiter.wait()
+        return fetch(day)
+
+    cursor = connection.cursor()
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, min(MAX_WORKERS, int(workers)))) as pool:
+            futures = {pool.submit(fetch_day, day): day for day in days}
+            for future in as_completed(futures):
+                day = futures[future]
+                status = _write_day(connection, cursor, day, future, write, result)
+                if on_day is not None:
+                    on_day(day, status, result)
+    finally:
+        cursor.close()
+    result.failures.sort(key=lambda f: f["date"])
+    return result
+
+
+def _write_day(connection, cursor, day: date, future, write, result: BackfillResult) -> str:
+    try:
+        rows = future.result()
+        if not rows:
+            record_day(cursor, day, "empty")
+            connection.commit()
+            result.empty_days += 1
+            return "empty"
+        count = int(write(cursor, rows) or 0)
+        record_day(cursor, day, "done", count)
+        connection.commit()
+    except Exception as exc:
+        logger.warning("TPEX 權證日線回補失敗 %s: %s", day.isoformat(), exc)
+        try:
+            connection.rollback()
+            record_day(cursor, day, "failed", error=str(exc))
+            connection.commit()
+        except Exception:
+            logger.exception("記錄回補失敗日 %s 失敗", day.isoformat())
+            try:
+                connection.rollback()
+            except Exception:
+                pass
+        result.failures.append({"date": day.isoformat(), "error": str(exc)})
+        return "failed"
+
+    result.imported_days += 1
+    result.imported_count += count
+    result.touched_codes.update(str(r.get("Code") or "").strip() for r in rows if r.get("Code"))
+    result.done_days.append(day)
+    result.earliest = day if result.earliest is None else min(result.earliest, day)
+    return "done"
+
+
+def finish_range(connection, result: BackfillResult) -> bool:
+    """Refresh what the per-day writes skipped, once for the whole range.
+
+    The latest-bar snapshot and TA states of the touched warrants are rebuilt,
+    the cached rankings of the imported days dropped (rebuilt on read) and the
+    portal stats recomputed, in one transaction.  Returns whether it committed.
+    """
+    if not result.touched_codes:
+        return False
+    cursor = connection.cursor()
+    try:
+        refresh_latest_warrant_bars(cursor, "TPEX", result.touched_codes)
+        warrant_ta_state.update_states(cursor, "TPEX", result.touched_codes, since=result.earliest)
+        warrant_rankings.invalidate(cursor, "TPEX", result.done_days)
+        warrant_portal_stats.refresh(cursor)
+        connection.commit()
+        return True
+    except Exception:
+        connection.rollback()
+        logger.exception("TPEX 權證回補後更新最新 K 棒快照失敗")
+        return False
+    finally:
+        cursor.close()
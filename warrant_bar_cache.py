@@ -0,0 +1,385 @@
+"""Process-resident columnar cache of recent warrant bars.
+
+Each cached warrant keeps its last ``max_bars`` daily bars as NumPy columns
+(date, OHLC, volume, turnover) so the portal timeseries and TA screen can slice
+a code without a PostgreSQL round-trip.
+
+Coherence across gunicorn workers and the cloud worker comes from
+``latest_warrant_bars``: before serving, entries not checked for
+``check_seconds`` are compared against their snapshot row in one batched
+query.  A matching last bar means the entry is current; a snapshot whose
+``prev_trade_date``/``prev_close`` equal the cached last bar is appended (the
+daily import); anything else reloads the code.  Series are never modified
+once published: an append builds new arrays and swaps in a new ``BarSeries``,
+so a reader slicing a series outside the lock always sees matching columns.  Importers call
+``sync`` after committing so the writing process is current immediately.
+
+Memory is accounted from the array sizes.  When the budget is exceeded,
+expired warrants (``expiry_date < today``) are evicted first, least recently
+used first, then any least recently used entry.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field, replace
+from datetime import date
+from typing import Any, Iterable, Optional
+
+import numpy as np
+
+from latest_bars import LATEST_WARRANT_TABLE
+
+logger = logging.getLogger(__name__)
+
+MAX_BARS = int(os.getenv("WARRANT_BAR_CACHE_BARS", "250"))
+MAX_BYTES = int(float(os.getenv("WARRANT_BAR_CACHE_MB", "256")) * 1024 * 1024)
+CHECK_SECONDS = float(os.getenv("WARRANT_BAR_CACHE_CHECK_SECONDS", "30"))
+LOAD_BATCH = 2000
+
+COLUMNS = ("open", "high", "low", "close", "volume", "turnover")
+
+# market -> (history table, volume column, turnover column)
+_SOURCES = (
+    ("TWSE", "tw_warrant_trade", "volume", "turnover"),
+    ("TPEX", "tpex_warrant_daily_quotes", "trade_volume", "trade_value"),
+)
+
+
+def _num(val: Any) -> float:
+    if val is None:
+        return np.nan
+    try:
+        return float(val)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _day(val: Any) -> np.datetime64:
+    return np.datetime64(str(val)[:10], "D")
+
+
+def _same(a: float, b: float) -> bool:
+    return (np.isnan(a) and np.isnan(b)) or a == b
+
+
+@dataclass
+class BarSeries:
+    code: str
+    market: str
+    name: Optional[str]
+    expiry_date: Optional[date]
+    dates: np.ndarray
+    cols: dict[str, np.ndarray]
+    checked_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.dates.nbytes + sum(a.nbytes for a in self.cols.values()))
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+    def last_bar(self) -> Optional[tuple]:
+        if not len(self):
+            return None
+        return (self.dates[-1],) + tuple(float(self.cols[c][-1]) for c in COLUMNS)
+
+    def with_bar(self, day: np.datetime64, values: tuple[float, ...], max_bars: int) -> "BarSeries":
+        """Copy with the bar of ``day`` replaced if it is the last one, else appended."""
+        if len(self) and self.dates[-1] == day:
+            cols = {c: self.cols[c].copy() for c in COLUMNS}
+            for c, v in zip(COLUMNS, values):
+                cols[c][-1] = v
+            return replace(self, cols=cols)
+        dates = np.append(self.dates, day)[-max_bars:]
+        cols = {c: np.append(self.cols[c], v)[-max_bars:] for c, v in zip(COLUMNS, values)}
+        return replace(self, dates=dates, cols=cols)
+
+    def rows(self, limit: int) -> list[dict[str, Any]]:
+        """Last ``limit`` bars in ``/api/warrants/timeseries`` row shape (ascending)."""
+        start = max(0, len(self) - int(limit))
+        dates = self.dates[start:].astype(str).tolist()
+        cols = {
+            c: [None if v != v else v for v in self.cols[c][start:].tolist()]  # NaN -> None
+            for c in COLUMNS
+        }
+        return [
+            {
+                "trade_date": dates[i],
+                "warrant_code": self.code,
+                "warrant_name": self.name,
+                "open_price": cols["open"][i],
+                "high_price": cols["high"][i],
+                "low_price": cols["low"][i],
+                "close_price": cols["close"][i],
+                "volume": cols["volume"][i],
+                "turnover": cols["turnover"][i],
+            }
+            for i in range(len(dates))
+        ]
+
+    def recent_ohlc(self, limit: int) -> tuple[np.ndarray, np.ndarray]:
+        """``(closes, ohlc)`` of the last ``limit`` bars with a close, as the TA screen loads them."""
+        close = self.cols["close"]
+        idx = np.flatnonzero(~np.isnan(close))[-int(limit):]
+        o, h, low = self.cols["open"][idx], self.cols["high"][idx], self.cols["low"][idx]
+        full = ~(np.isnan(o) | np.isnan(h) | np.isnan(low))
+        return close[idx], np.stack([o[full], h[full], low[full], close[idx][full]])
+
+
+class WarrantBarCache:
+    def __init__(
+        self,
+        max_bars: int = MAX_BARS,
+        max_bytes: int = MAX_BYTES,
+        check_seconds: float = CHECK_SECONDS,
+        clock=time.monotonic,
+        today=date.today,
+    ):
+        self.max_bars = max(1, int(max_bars))
+        self.max_bytes = int(max_bytes)
+        self.check_seconds = float(check_seconds)
+        self._clock = clock
+        self._today = today
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, BarSeries]" = OrderedDict()
+        self._bytes = 0
+        self.stats = {"hits": 0, "loads": 0, "appends": 0, "reloads": 0, "evictions": 0}
+
+    # ---- lookup ----------------------------------------------------------------
+    def get_many(self, cursor, codes: Iterable[Any]) -> dict[str, BarSeries]:
+        """Series for ``codes`` (codes without bars are absent), loading or revalidating as needed."""
+        code_list = list(dict.fromkeys(str(c).strip() for c in codes if str(c or "").strip()))
+        now = self._clock()
+        with self._lock:
+            cached = {c: self._entries[c] for c in code_list if c in self._entries}
+            for c in cached:
+                self._entries.move_to_end(c)
+        due = [s for s in cached.values() if now - s.checked_at >= self.check_seconds]
+        stale, appended = self._revalidate(cursor, due) if due else ([], {})
+        cached.update(appended)
+        missing = [c for c in code_list if c not in cached] + stale
+        loaded = self._load(cursor, missing) if missing else {}
+        self.invalidate(c for c in stale if c not in loaded)
+        with self._lock:
+            self.stats["hits"] += len(cached) - len(stale)
+        # 本次載入者直接回傳：即使預算不足已被逐出，這次請求仍拿得到
+        merged = {**cached, **loaded}
+        return {c: merged[c] for c in code_list if c in merged and (c in loaded or c not in stale)}
+
+    def get(self, cursor, code: str) -> Optional[BarSeries]:
+        return self.get_many(cursor, [code]).get(str(code or "").strip())
+
+    def invalidate(self, codes: Iterable[Any]) -> None:
+        with self._lock:
+            for code in codes:
+                entry = self._entries.pop(str(code or "").strip(), None)
+                if entry is not None:
+                    self._bytes -= entry.nbytes
+
+    def sync(self, cursor) -> int:
+        """Revalidate every cached entry now (call after committing a warrant import)."""
+        with self._lock:
+            entries = list(self._entries.values())
+        stale, _ = self._revalidate(cursor, entries) if entries else ([], {})
+        if stale:
+            loaded = self._load(cursor, stale)
+            self.invalidate(c for c in stale if c not in loaded)
+        return len(entries)
+
+    def memory(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "maxBytes": self.max_bytes,
+                "maxBars": self.max_bars,
+                **self.stats,
+            }
+
+    # ---- coherence -------------------------------------------------------------
+    def _revalidate(self, cursor, entries: list[BarSeries]) -> tuple[list[str], dict[str, BarSeries]]:
+        """Apply snapshot rows to ``entries``.
+
+        Returns the codes that need a reload and the replacement series of the
+        codes that got a new bar.
+        """
+        cursor.execute(
+            f"""
+            SELECT market, warrant_code, trade_date, open_price, high_price, low_price,
+                   close_price, volume, turnover, prev_trade_date, prev_close
+            FROM {LATEST_WARRANT_TABLE}
+            WHERE warrant_code = ANY(%s)
+            """,
+            ([e.code for e in entries],),
+        )
+        names = ("market", "warrant_code", "trade_date", "open_price", "high_price", "low_price",
+                 "close_price", "volume", "turnover", "prev_trade_date", "prev_close")
+        snap = {}
+        for row in cursor.fetchall() or []:
+            row = row if isinstance(row, dict) else dict(zip(names, row))
+            snap[(row["market"], row["warrant_code"])] = row
+
+        now = self._clock()
+        stale: list[str] = []
+        appended: dict[str, BarSeries] = {}
+        with self._lock:
+            for entry in entries:
+                row = snap.get((entry.market, entry.code))
+                entry.checked_at = now
+                if row is None:
+                    continue
+                day = _day(row["trade_date"])
+                values = tuple(_num(row[c]) for c in (
+                    "open_price", "high_price", "low_price", "close_price", "volume", "turnover"))
+                last = entry.last_bar()
+                if last is not None and last[0] == day and all(map(_same, last[1:], values)):
+                    continue
+                prev_day = row["prev_trade_date"]
+                if (
+                    last is not None and prev_day is not None and last[0] == _day(prev_day)
+                    and _same(last[4], _num(row["prev_close"]))
+                ):
+                    fresh = entry.with_bar(day, values, self.max_bars)
+                    # 只替換仍在快取中的同一份；被逐出或已重載的不放回
+                    if self._entries.get(entry.code) is entry:
+                        self._entries[entry.code] = fresh
+                        self._bytes += fresh.nbytes - entry.nbytes
+                    appended[entry.code] = fresh
+                    self.stats["appends"] += 1
+                    continue
+                stale.append(entry.code)
+            self.stats["reloads"] += len(stale)
+        return stale, appended
+
+    # ---- loading ---------------------------------------------------------------
+    def _load(self, cursor, codes: list[str]) -> dict[str, BarSeries]:
+        loaded: dict[str, BarSeries] = {}
+        for i in range(0, len(codes), LOAD_BATCH):
+            batch = codes[i:i + LOAD_BATCH]
+            series: dict[str, BarSeries] = {}
+            for market, table, volume_col, turnover_col in _SOURCES:
+                todo = [c for c in batch if c not in series]
+                if not todo:
+                    break
+                cursor.execute(
+                    f"""
+                    SELECT warrant_code, trade_date, warrant_name, open_price, high_price,
+                           low_price, close_price, volume, turnover
+                    FROM (
+                        SELECT warrant_code, trade_date, warrant_name, open_price, high_price,
+                               low_price, close_price, {volume_col} AS volume, {turnover_col} AS turnover,
+                               ROW_NUMBER() OVER (PARTITION BY warrant_code ORDER BY trade_date DESC) AS rn
+                        FROM {table}
+                        WHERE warrant_code = ANY(%s)
+                    ) t
+                    WHERE rn <= %s
+                    ORDER BY warrant_code, trade_date
+                    """,
+                    (todo, self.max_bars),
+                )
+                series.update(self._build(market, cursor.fetchall() or []))
+            if not series:
+                continue
+            expiry = self._expiry_dates(cursor, list(series))
+            with self._lock:
+                for code, entry in series.items():
+                    entry.expiry_date = expiry.get(code)
+                    old = self._entries.pop(code, None)
+                    if old is not None:
+                        self._bytes -= old.nbytes
+                    self._entries[code] = entry
+                    self._bytes += entry.nbytes
+                self.stats["loads"] += len(series)
+                self._evict()
+            loaded.update(series)
+        return loaded
+
+    def _build(self, market: str, rows: list[Any]) -> dict[str, BarSeries]:
+        names = ("warrant_code", "trade_date", "warrant_name", "open_price", "high_price",
+                 "low_price", "close_price", "volume", "turnover")
+        grouped: dict[str, list[dict[str, Any]]] = {}
+        for row in rows:
+            row = row if isinstance(row, dict) else dict(zip(names, row))
+            grouped.setdefault(row["warrant_code"], []).append(row)
+        out = {}
+        for code, items in grouped.items():
+            name = next((r["warrant_name"] for r in reversed(items) if r.get("warrant_name")), None)
+            out[code] = BarSeries(
+                code=code,
+                market=market,
+                name=name,
+                expiry_date=None,
+                dates=np.array([_day(r["trade_date"]) for r in items], dtype="datetime64[D]"),
+                cols={
+                    c: np.array([_num(r[f"{c}_price" if c in ("open", "high", "low", "close") else c])
+                                 for r in items], dtype=float)
+                    for c in COLUMNS
+                },
+                checked_at=self._clock(),
+            )
+        return out
+
+    def _expiry_dates(self, cursor, codes: list[str]) -> dict[str, date]:
+        cursor.execute(
+            """
+            SELECT warrant_code, expiry_date FROM tw_warrant_master WHERE warrant_code = ANY(%s)
+            UNION ALL
+            SELECT warrant_code, expiry_date FROM tpex_warrant_master WHERE warrant_code = ANY(%s)
+            """,
+            (codes, codes),
+        )
+        out = {}
+        for row in cursor.fetchall() or []:
+            row = row if isinstance(row, dict) else dict(zip(("warrant_code", "expiry_date"), row))
+            if row["expiry_date"] is not None:
+                out.setdefault(row["warrant_code"], row["expiry_date"])
+        return out
+
+    def _evict(self) -> None:
+        """Caller holds the lock.  Expired warrants go first, then plain LRU."""
+        if self._bytes <= self.max_bytes:
+            return
+        today = self._today()
+        expired = [c for c, e in self._entries.items() if e.expiry_date is not None and e.expiry_date < today]
+        for code in expired + list(self._entries):
+            if self._bytes <= self.max_bytes or len(self._entries) <= 1:
+                break
+            entry = self._entries.pop(code, None)
+            if entry is None:
+                continue
+            self._bytes -= entry.nbytes
+            self.stats["evictions"] += 1
+
+
+def pack_recent(series: dict[str, BarSeries], limit: int) -> tuple[list[str], np.ndarray, np.ndarray]:
+    """``warrant_ta_screen.pack_bars`` layout built straight from cached columns."""
+    codes = list(series)
+    parts = [series[c].recent_ohlc(limit) for c in codes]
+    width = max((len(p[0]) for p in parts), default=0)
+    ha_width = max((p[1].shape[1] for p in parts), default=0)
+    closes = np.full((len(codes), width), np.nan)
+    ohlc = np.full((4, len(codes), ha_width), np.nan)
+    for i, (c, o) in enumerate(parts):
+        if len(c):
+            closes[i, width - len(c):] = c
+        if o.shape[1]:
+            ohlc[:, i, ha_width - o.shape[1]:] = o
+    return codes, closes, ohlc
+
+
+_caches: dict[Any, WarrantBarCache] = {}
+_caches_lock = threading.Lock()
+
+
+def cache_for(key: Any) -> WarrantBarCache:
+    """One cache per database (``DatabaseManager.is_neon``)."""
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = WarrantBarCache()
+        return _caches[key]
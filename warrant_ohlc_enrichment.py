@@ -0,0 +1,411 @@
+"""Queue-based OHLC enrichment of ``tw_warrant_trade``.
+
+TWSE's warrant trade file carries turnover/volume but no prices, so bars
+arrive with ``close_price IS NULL``.  Filling them one warrant × one month at
+a time through STOCK_DAY takes days for the whole market.  Here:
+
+1. **MI_INDEX per date** -- every date in the range that still has priceless
+   bars is fetched once; one snapshot covers every warrant traded that day.
+2. **STOCK_DAY fallback** -- bars still missing afterwards (MI_INDEX gaps,
+   codes absent from the snapshot) become ``(code, year, month)`` tasks,
+   deduplicated, so a code missing ten days in one month costs one request.
+
+Both phases run through ``_pump``: fetches go to a thread pool behind one
+``HostRateLimiter`` shared by every TWSE caller in the process
+(``TWSE_LIMITER``); writes run on the calling thread, one transaction per
+date / task, and a failing item is recorded without stopping the run.
+``EnrichmentResult.summary()`` reports per-phase counts and throughput.
+
+The writers skip the per-write refresh of the derived tables; once both
+phases are done ``refresh_written`` rebuilds the latest-bar snapshot and TA
+states of every warrant written during the run and drops the cached rankings
+of its dates, once for the whole range.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from typing import Any, Callable, Iterable, Optional
+
+import requests
+from psycopg2.extras import execute_values
+
+import warrant_rankings
+import warrant_ta_state
+from latest_bars import refresh_latest_warrant_bars
+from mi_index import parse_number
+from tpex_backfill import HostRateLimiter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 4
+MAX_WORKERS = 8
+# 所有對 www.twse.com.tw 的請求共用的最小間隔（秒）
+TWSE_MIN_INTERVAL = float(os.getenv("TWSE_MIN_INTERVAL", "1.5"))
+TWSE_LIMITER = HostRateLimiter(TWSE_MIN_INTERVAL)
+STOCK_DAY_URL = "https://www.twse.com.tw/exchangeReport/STOCK_DAY"
+
+
+def _as_date(val: Any) -> Optional[date]:
+    if isinstance(val, datetime):
+        return val.date()
+    if isinstance(val, date):
+        return val
+    return None
+
+
+def missing_bars(cursor, start: date, end: date, codes: Optional[Iterable[str]] = None) -> dict[date, set[str]]:
+    """``{trade_date: {codes}}`` of traded (or unknown-volume) bars without a close."""
+    sql = """
+        SELECT trade_date, warrant_code FROM tw_warrant_trade
+        WHERE trade_date BETWEEN %s AND %s
+          AND close_price IS NULL
+          AND (volume IS NULL OR volume > 0)
+    """
+    params: list[Any] = [start, end]
+    if codes is not None:
+        sql += " AND warrant_code = ANY(%s)"
+        params.append(sorted({str(c) for c in codes}))
+    cursor.execute(sql, params)
+    out: dict[date, set[str]] = {}
+    for row in cursor.fetchall() or []:
+        d, code = (row.get("trade_date"), row.get("warrant_code")) if isinstance(row, dict) else row[:2]
+        d = _as_date(d)
+        if d and code:
+            out.setdefault(d, set()).add(str(code))
+    return out
+
+
+def stock_day_tasks(missing: dict[date, set[str]]) -> list[tuple[str, int, int]]:
+    """Deduplicated ``(code, year, month)`` STOCK_DAY requests covering ``missing``."""
+    return sorted({(code, d.year, d.month) for d, codes in missing.items() for code in codes})
+
+
+def _parse_roc_date(text: Any) -> Optional[date]:
+    """115/07/01 -> date."""
+    parts = str(text or "").strip().replace("-", "/").split("/")
+    if len(parts) != 3:
+        return None
+    try:
+        y, m, d = (int(p) for p in parts)
+        return date(y + 1911 if y < 1911 else y, m, d)
+    except ValueError:
+        return None
+
+
+def fetch_stock_day(code: str, year: int, month: int, *, timeout: float = 30) -> list[dict]:
+    """One warrant × one month of daily OHLC from STOCK_DAY (``[]`` when unavailable)."""
+    resp = requests.get(
+        STOCK_DAY_URL,
+        params={"response": "json", "date": f"{year}{month:02d}01", "stockNo": code},
+        headers={"User-Agent": "Mozilla/5.0"},
+        timeout=timeout,
+    )
+    if resp.status_code != 200:
+        return []
+    try:
+        payload = resp.json()
+    except ValueError:
+        return []
+    if not isinstance(payload, dict) or payload.get("stat") != "OK":
+        return []
+    idx = {name: i for i, name in enumerate(payload.get("fields") or [])}
+
+    def num(row: list, name: str) -> Optional[float]:
+        return parse_number(row[idx[name]]) if name in idx else None
+
+    rows = []
+    for row in payload.get("data") or []:
+        if not isinstance(row, list):
+            continue
+        trade_date = _parse_roc_date(row[idx["日期"]]) if "日期" in idx else None
+        if not trade_date:
+            continue
+        shares = num(row, "成交股數")
+        rows.append({
+            "trade_date": trade_date,
+            "warrant_code": code,
+            "turnover": num(row, "成交金額"),
+            "volume": int(shares / 1000) if shares is not None else None,
+            "open_price": num(row, "開盤價"),
+            "high_price": num(row, "最高價"),
+            "low_price": num(row, "最低價"),
+            "close_price": num(row, "收盤價"),
+            "price_change": num(row, "漲跌價差"),
+        })
+    return rows
+
+
+def write_stock_day_rows(cursor, rows: list[dict], *, refresh_snapshots: bool = True) -> int:
+    """Fill ``tw_warrant_trade`` from STOCK_DAY rows without overwriting known values.
+
+    ``refresh_snapshots=False`` leaves the derived tables to ``refresh_written``.
+    """
+    if not rows:
+        return 0
+    values = [
+        (
+            r.get("trade_date"), r.get("warrant_code"), r.get("turnover"), r.get("volume"),
+            r.get("open_price"), r.get("high_price"), r.get("low_price"),
+            r.get("close_price"), r.get("price_change"),
+        )
+        for r in rows
+    ]
+    execute_values(
+        cursor,
+        """
+        INSERT INTO tw_warrant_trade (
+            trade_date, warrant_code, turnover, volume,
+            open_price, high_price, low_price, close_price, price_change, updated_at
+        ) VALUES %s
+        ON CONFLICT (warrant_code, trade_date) DO UPDATE SET
+            turnover = COALESCE(EXCLUDED.turnover, tw_warrant_trade.turnover),
+            volume = COALESCE(EXCLUDED.volume, tw_warrant_trade.volume),
+            open_price = COALESCE(EXCLUDED.open_price, tw_warrant_trade.open_price),
+            high_price = COALESCE(EXCLUDED.high_price, tw_warrant_trade.high_price),
+            low_price = COALESCE(EXCLUDED.low_price, tw_warrant_trade.low_price),
+            close_price = COALESCE(EXCLUDED.close_price, tw_warrant_trade.close_price),
+            price_change = COALESCE(EXCLUDED.price_change, tw_warrant_trade.price_change),
+            updated_at = NOW()
+        """,
+        values,
+        template="(%s,%s,%s,%s,%s,%s,%s,%s,%s,NOW())",
+        page_size=500,
+    )
+    if not refresh_snapshots:
+        return len(values)
+    codes = [v[1] for v in values]
+    refresh_latest_warrant_bars(cursor, "TWSE", codes)
+    warrant_ta_state.update_states(
+        cursor, "TWSE", codes, since=min((v[0] for v in values if v[0]), default=None),
+    )
+    warrant_rankings.invalidate(cursor, "TWSE", [v[0] for v in values])
+    return len(values)
+
+
+def refresh_written(cursor, start: date, end: date, since: Any) -> int:
+    """Refresh the derived tables for bars of ``[start, end]`` written at or after ``since``.
+
+    Both writers stamp ``updated_at = NOW()``, so the run's writes are found
+    without the callers tracking them.  Returns the number of warrants refreshed.
+    """
+    cursor.execute(
+        """
+        SELECT ARRAY_AGG(DISTINCT warrant_code) AS codes, ARRAY_AGG(DISTINCT trade_date) AS days
+        FROM tw_warrant_trade
+        WHERE trade_date BETWEEN %s AND %s AND updated_at >= %s
+        """,
+        (start, end, since),
+    )
+    row = cursor.fetchone()
+    codes, days = (row.get("codes"), row.get("days")) if isinstance(row, dict) else (row or (None, None))[:2]
+    codes = sorted({str(c) for c in codes or [] if c})
+    days = sorted({d for d in (_as_date(v) for v in days or []) if d})
+    if not codes:
+        return 0
+    refresh_latest_warrant_bars(cursor, "TWSE", codes)
+    warrant_ta_state.update_states(cursor, "TWSE", codes, since=days[0] if days else None)
+    warrant_rankings.invalidate(cursor, "TWSE", days)
+    return len(codes)
+
+
+@dataclass
+class PhaseStats:
+    items: int = 0
+    done: int = 0
+    empty: int = 0
+    rows: int = 0
+    seconds: float = 0.0
+    failures: list[dict[str, str]] = field(default_factory=list)
+
+    def summary(self) -> dict[str, Any]:
+        per_min = self.items / self.seconds * 60 if self.seconds > 0 else None
+        return {
+            "requests": self.items,
+            "done": self.done,
+            "empty": self.empty,
+            "failed": len(self.failures),
+            "rows": self.rows,
+            "seconds": round(self.seconds, 1),
+            "requestsPerMinute": round(per_min, 1) if per_min is not None else None,
+            "rowsPerSecond": round(self.rows / self.seconds, 1) if self.seconds > 0 else None,
+            "failures": self.failures[:50],
+        }
+
+
+@dataclass
+class EnrichmentResult:
+    missing_before: int = 0
+    missing_after: int = 0
+    snapshot: PhaseStats = field(default_factory=PhaseStats)
+    stock_day: PhaseStats = field(default_factory=PhaseStats)
+
+    def summary(self) -> dict[str, Any]:
+        seconds = self.snapshot.seconds + self.stock_day.seconds
+        filled = max(0, self.missing_before - self.missing_after)
+        return {
+            "missingBefore": self.missing_before,
+            "missingAfter": self.missing_after,
+            "filledBars": filled,
+            "seconds": round(seconds, 1),
+            "filledBarsPerMinute": round(filled / seconds * 60, 1) if seconds > 0 else None,
+            "snapshot": self.snapshot.summary(),
+            "stockDay": self.stock_day.summary(),
+        }
+
+
+def _pump(
+    connection,
+    items: list,
+    *,
+    fetch: Callable[[Any], Any],
+    write: Callable[[Any, Any, Any], int],
+    workers: int,
+    limiter: HostRateLimiter,
+    label: Callable[[Any], str],
+    on_item: Optional[Callable[[Any, str], None]] = None,
+    clock: Callable[[], float] = time.monotonic,
+) -> PhaseStats:
+    stats = PhaseStats(items=len(items))
+    if not items:
+        return stats
+    started = clock()
+
+    def fetch_item(item):
+        limiter.wait()
+        return fetch(item)
+
+    cursor = connection.cursor()
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, min(MAX_WORKERS, int(workers)))) as pool:
+            futures = {pool.submit(fetch_item, item): item for item in items}
+            for future in as_completed(futures):
+                item = futures[future]
+                try:
+                    payload = future.result()
+                    count = int(write(cursor, item, payload) or 0) if payload else 0
+                    connection.commit()
+                except Exception as exc:
+                    logger.warning("權證 OHLC 補齊失敗 %s: %s", label(item), exc)
+                    try:
+                        connection.rollback()
+                    except Exception:
+                        pass
+                    stats.failures.append({"item": label(item), "error": str(exc)})
+                    status = "failed"
+                else:
+                    if count:
+                        stats.done += 1
+                        stats.rows += count
+                        status = "done"
+                    else:
+                        stats.empty += 1
+                        status = "empty"
+                if on_item is not None:
+                    on_item(item, status)
+    finally:
+        cursor.close()
+    stats.seconds = clock() - started
+    stats.failures.sort(key=lambda f: f["item"])
+    return stats
+
+
+def run_enrichment(
+    connection,
+    start: date,
+    end: date,
+    *,
+    fetch_snapshot: Callable[[date], Any],
+    write_snapshot: Callable[[Any, Any], int],
+    fetch_stock_day: Callable[[str, int, int], list[dict]],
+    write_stock_day: Callable[[Any, list[dict]], int],
+    days: Optional[Iterable[date]] = None,
+    codes: Optional[Iterable[str]] = None,
+    workers: int = DEFAULT_WORKERS,
+    limiter: Optional[HostRateLimiter] = None,
+    stock_day: bool = True,
+    on_progress: Optional[Callable[[str, Any, str], None]] = None,
+) -> EnrichmentResult:
+    """Fill priceless bars of ``[start, end]``: MI_INDEX per date, then STOCK_DAY.
+
+    ``days`` adds dates to fetch from MI_INDEX regardless of missing bars (a
+    plain range backfill).  ``write_snapshot(cursor, snapshot, codes)`` writes
+    the snapshot's warrants (only ``codes`` when given) and
+    ``write_stock_day(cursor, rows)`` the STOCK_DAY rows; both return the
+    number of rows written and leave the derived tables alone, which are
+    refreshed once at the end (``refresh_written``).
+    ``on_progress(phase, item, status)`` is called after each item.
+    """
+    if end < start:
+        start, end = end, start
+    limiter = limiter or TWSE_LIMITER
+    codes = None if codes is None else sorted({str(c) for c in codes})
+    code_set = None if codes is None else set(codes)
+    result = EnrichmentResult()
+
+    cursor = connection.cursor()
+    try:
+        cursor.execute("SELECT NOW() AS started_at")
+        row = cursor.fetchone()
+        started_at = row.get("started_at") if isinstance(row, dict) else row[0]
+        missing = missing_bars(cursor, start, end, codes)
+        connection.commit()
+    finally:
+        cursor.close()
+    result.missing_before = sum(len(c) for c in missing.values())
+
+    snapshot_days = sorted(set(missing) | {d for d in (days or []) if start <= d <= end})
+    result.snapshot = _pump(
+        connection,
+        snapshot_days,
+        fetch=fetch_snapshot,
+        write=lambda cur, day, snap: write_snapshot(cur, snap, code_set),
+        workers=workers,
+        limiter=limiter,
+        label=lambda day: day.isoformat(),
+        on_item=(lambda day, status: on_progress("snapshot", day, status)) if on_progress else None,
+    )
+
+    cursor = connection.cursor()
+    try:
+        missing = missing_bars(cursor, start, end, codes)
+        connection.commit()
+    finally:
+        cursor.close()
+
+    if stock_day and missing:
+        result.stock_day = _pump(
+            connection,
+            stock_day_tasks(missing),
+            fetch=lambda task: fetch_stock_day(*task),
+            write=lambda cur, task, rows: write_stock_day(cur, rows),
+            workers=workers,
+            limiter=limiter,
+            label=lambda task: f"{task[0]}@{task[1]}-{task[2]:02d}",
+            on_item=(lambda task, status: on_progress("stockDay", task, status)) if on_progress else None,
+        )
+        cursor = connection.cursor()
+        try:
+            missing = missing_bars(cursor, start, end, codes)
+            connection.commit()
+        finally:
+            cursor.close()
+
+    result.missing_after = sum(len(c) for c in missing.values())
+
+    if result.snapshot.rows or result.stock_day.rows:
+        cursor = connection.cursor()
+        try:
+            refresh_written(cursor, start, end, started_at)
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            logger.exception("權證 OHLC 補齊後更新最新 K 棒快照失敗")
+        finally:
+            cursor.close()
+    return result
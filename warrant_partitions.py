@@ -0,0 +1,409 @@
+"""Monthly partitioning of the warrant trade tables and expired-warrant archival.
+
+``tw_warrant_trade`` and ``tpex_warrant_daily_quotes`` only ever grow, and most
+of their rows belong to warrants that expired long ago.  This module
+
+* converts each table (once, ``migrate_to_partitioned``) into a table
+  ``PARTITION BY RANGE (trade_date)`` with one ``{table}_pYYYYMM`` partition per
+  month plus ``{table}_default``, so date-bounded reads prune to the months
+  they touch;
+* keeps monthly partitions created ahead of time (``ensure_upcoming`` /
+  ``maintain``); rows that land in the default partition (backfills older than
+  the first month) are split out into their own month on the next run;
+* moves the whole history of warrants expired for more than ``grace_days`` into
+  ``{table}_archive`` (``archive_expired``), itself partitioned by year, so the
+  hot partitions only hold live warrants.
+
+Archived history stays queryable: ``archived_bars`` serves single-warrant
+series and ``warrant_rankings`` reads the archive for historical days.  A later
+backfill that re-inserts archived rows into the hot table is harmless; the next
+archive run moves them again, the newer values winning.
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+from datetime import date, timedelta
+from typing import Any, Callable, Iterable, Optional
+
+from latest_bars import WARRANT_SOURCES, _dsn_key
+
+logger = logging.getLogger(__name__)
+
+MASTER_TABLES = {
+    "TWSE": "tw_warrant_master",
+    "TPEX": "tpex_warrant_master",
+}
+
+# hot table -> (primary key, secondary indexes), mirroring DatabaseManager.create_tables
+_LAYOUT = {
+    "tw_warrant_trade": (
+        "(warrant_code, trade_date)",
+        {"tw_warrant_trade_trade_date_idx": "(trade_date DESC)"},
+    ),
+    "tpex_warrant_daily_quotes": (
+        "(trade_date, warrant_code)",
+        {
+            "tpex_warrant_daily_quotes_code_idx": "(warrant_code, trade_date DESC)",
+            "tpex_warrant_daily_quotes_trade_date_idx": "(trade_date DESC)",
+        },
+    ),
+}
+
+AHEAD_MONTHS = 2
+DEFAULT_GRACE_DAYS = 30
+ARCHIVE_BATCH = 200  # warrant codes moved per statement / commit
+
+_ready_lock = threading.Lock()
+_ready: set[tuple[str, date]] = set()
+_archive_ready: set[str] = set()
+
+
+def hot_table(market: str) -> str:
+    return WARRANT_SOURCES[str(market).upper()][0]
+
+
+def archive_table(table: str) -> str:
+    return f"{table}_archive"
+
+
+def month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def add_months(day: date, months: int) -> date:
+    index = day.year * 12 + day.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def months_between(start: date, end: date) -> list[date]:
+    """First days of every month from ``start`` through ``end`` (inclusive)."""
+    out, cur = [], month_start(start)
+    while cur <= end:
+        out.append(cur)
+        cur = add_months(cur, 1)
+    return out
+
+
+def _scalar(cursor):
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    return next(iter(row.values())) if isinstance(row, dict) else row[0]
+
+
+def _as_date(value) -> Optional[date]:
+    if value is None:
+        return None
+    return value.date() if hasattr(value, "date") and callable(value.date) else value
+
+
+def is_partitioned(cursor, table: str) -> bool:
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (table,))
+    return _scalar(cursor) == "p"
+
+
+def table_exists(cursor, table: str) -> bool:
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (table,))
+    return bool(_scalar(cursor))
+
+
+def _columns(cursor, table: str) -> list[str]:
+    cursor.execute(
+        """
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = %s
+        ORDER BY ordinal_position
+        """,
+        (table,),
+    )
+    return [r["column_name"] if isinstance(r, dict) else r[0] for r in cursor.fetchall() or []]
+
+
+# ---- partitions ------------------------------------------------------------
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_p{month:%Y%m}"
+
+
+def _add_partition(cursor, table: str, name: str, lo: date, hi: date) -> bool:
+    """Create ``name`` for [lo, hi), moving matching rows out of the default partition first.
+
+    Attaching a range that the default partition already holds rows for would
+    fail, so the partition is built as a plain table, filled from the default
+    and then attached.
+    """
+    if table_exists(cursor, name):
+        return False
+    default = f"{table}_default"
+    cols = ", ".join(_columns(cursor, table))
+    cursor.execute(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS)")
+    if table_exists(cursor, default):
+        cursor.execute(
+            f"""
+            WITH moved AS (
+                DELETE FROM {default} WHERE trade_date >= %s AND trade_date < %s
+                RETURNING {cols}
+            )
+            INSERT INTO {name} ({cols}) SELECT {cols} FROM moved
+            """,
+            (lo, hi),
+        )
+    cursor.execute(f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)", (lo, hi))
+    return True
+
+
+def ensure_partitions(cursor, table: str, months: Iterable[date]) -> list[str]:
+    """Make sure ``table`` has a partition for each month; returns the ones created."""
+    created = []
+    for month in sorted({month_start(m) for m in months}):
+        name = partition_name(table, month)
+        if _add_partition(cursor, table, name, month, add_months(month, 1)):
+            created.append(name)
+    return created
+
+
+def default_months(cursor, table: str) -> list[date]:
+    """Months that currently have rows parked in ``{table}_default``."""
+    default = f"{table}_default"
+    if not table_exists(cursor, default):
+        return []
+    cursor.execute(f"SELECT DISTINCT date_trunc('month', trade_date)::date AS m FROM {default}")
+    return [_as_date(r["m"] if isinstance(r, dict) else r[0]) for r in cursor.fetchall() or []]
+
+
+def maintain(cursor, today: date, *, ahead: int = AHEAD_MONTHS) -> dict[str, list[str]]:
+    """Create upcoming months and split the default partition, for every partitioned hot table."""
+    created: dict[str, list[str]] = {}
+    upcoming = months_between(today, add_months(today, ahead))
+    for market in WARRANT_SOURCES:
+        table = hot_table(market)
+        if not is_partitioned(cursor, table):
+            continue
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT")
+        created[table] = ensure_partitions(cursor, table, upcoming + default_months(cursor, table))
+    return created
+
+
+def ensure_upcoming(cursor, today: date) -> None:
+    """Cheap per-process guard for ``create_tables``: upcoming months once per target and month.
+
+    Runs under a savepoint so a failure never aborts the caller's transaction.
+    """
+    key = (_dsn_key(cursor), month_start(today))
+    if key in _ready:
+        return
+    with _ready_lock:
+        if key in _ready:
+            return
+        cursor.execute("SAVEPOINT warrant_partitions")
+        try:
+            for market in WARRANT_SOURCES:
+                table = hot_table(market)
+                if is_partitioned(cursor, table):
+                    ensure_partitions(cursor, table, months_between(today, add_months(today, AHEAD_MONTHS)))
+            cursor.execute("RELEASE SAVEPOINT warrant_partitions")
+        except Exception as exc:
+            cursor.execute("ROLLBACK TO SAVEPOINT warrant_partitions")
+            logger.warning("warrant partition pre-creation skipped: %s", exc)
+            return
+        _ready.add(key)
+
+
+def migrate_to_partitioned(cursor, market: str, today: date) -> dict[str, Any]:
+    """Rebuild one hot table as a monthly range-partitioned table (single transaction).
+
+    The old table is renamed, a partitioned table takes its name, every month
+    from the first trade date through ``today + AHEAD_MONTHS`` gets a
+    partition, the rows are copied, the old table is dropped and the primary
+    key / indexes are built on the loaded partitions.  No-op when the table is
+    already partitioned.
+    """
+    table = hot_table(market)
+    if is_partitioned(cursor, table):
+        return {"table": table, "migrated": False, "partitions": 0, "rows": 0}
+    pk, indexes = _LAYOUT[table]
+    old = f"{table}_unpartitioned"
+    cols = ", ".join(_columns(cursor, table))
+
+    cursor.execute(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE")
+    cursor.execute(f"SELECT MIN(trade_date) AS lo FROM {table}")
+    first = _as_date(_scalar(cursor)) or today
+    cursor.execute(f"ALTER TABLE {table} RENAME TO {old}")
+    cursor.execute(f"CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS) PARTITION BY RANGE (trade_date)")
+    months = months_between(first, add_months(today, AHEAD_MONTHS))
+    for month in months:
+        cursor.execute(
+            f"CREATE TABLE {partition_name(table, month)} PARTITION OF {table} FOR VALUES FROM (%s) TO (%s)",
+            (month, add_months(month, 1)),
+        )
+    cursor.execute(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT")
+    cursor.execute(f"INSERT INTO {table} ({cols}) SELECT {cols} FROM {old}")
+    rows = cursor.rowcount or 0
+    cursor.execute(f"DROP TABLE {old}")
+    cursor.execute(f"ALTER TABLE {table} ADD PRIMARY KEY {pk}")
+    for name, spec in indexes.items():
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} {spec}")
+    return {"table": table, "migrated": True, "partitions": len(months), "rows": rows}
+
+
+# ---- archive ---------------------------------------------------------------
+
+def ensure_archive_tables(cursor) -> None:
+    """``{table}_archive`` per market, partitioned by year, keyed by (warrant_code, trade_date).
+
+    Created once per connection target; the columns follow the hot table at creation time.
+    """
+    key = _dsn_key(cursor)
+    if key in _archive_ready:
+        return
+    for market in WARRANT_SOURCES:
+        table = hot_table(market)
+        archive = archive_table(table)
+        cursor.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {archive} (
+                LIKE {table} INCLUDING DEFAULTS,
+                archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (warrant_code, trade_date)
+            ) PARTITION BY RANGE (trade_date)
+            """
+        )
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {archive}_default PARTITION OF {archive} DEFAULT")
+    _archive_ready.add(key)
+
+
+def archive_partition_name(archive: str, year: int) -> str:
+    return f"{archive}_y{year}"
+
+
+def _ensure_archive_years(cursor, table: str) -> None:
+    archive = archive_table(table)
+    cursor.execute(f"SELECT MIN(trade_date) AS lo, MAX(trade_date) AS hi FROM {table}")
+    row = cursor.fetchone() or {}
+    lo, hi = (row.get("lo"), row.get("hi")) if isinstance(row, dict) else tuple(row)
+    if lo is None:
+        return
+    for year in range(_as_date(lo).year, _as_date(hi).year + 1):
+        _add_partition(cursor, archive, archive_partition_name(archive, year), date(year, 1, 1), date(year + 1, 1, 1))
+
+
+def expired_codes(cursor, market: str, cutoff: date) -> list[str]:
+    """Warrants whose master expiry is before ``cutoff`` and that still have hot rows."""
+    market = str(market).upper()
+    table, master = hot_table(market), MASTER_TABLES[market]
+    cursor.execute(
+        f"""
+        SELECT m.warrant_code
+        FROM {master} m
+        WHERE m.expiry_date < %s
+          AND EXISTS (SELECT 1 FROM {table} t WHERE t.warrant_code = m.warrant_code)
+        ORDER BY m.warrant_code
+        """,
+        (cutoff,),
+    )
+    return [r["warrant_code"] if isinstance(r, dict) else r[0] for r in cursor.fetchall() or []]
+
+
+def archive_expired(
+    connection,
+    market: str,
+    today: date,
+    *,
+    grace_days: int = DEFAULT_GRACE_DAYS,
+    batch_size: int = ARCHIVE_BATCH,
+    on_batch: Optional[Callable[[int, int], None]] = None,
+) -> dict[str, Any]:
+    """Move the history of warrants expired before ``today - grace_days`` into the archive.
+
+    Each batch of codes is one ``DELETE ... RETURNING`` feeding an upsert into
+    the archive and is committed on its own, so an interrupted run resumes
+    where it stopped.  ``on_batch(codes_done, rows_moved)`` reports progress.
+    """
+    market = str(market).upper()
+    table = hot_table(market)
+    archive = archive_table(table)
+    cutoff = today - timedelta(days=max(0, int(grace_days)))
+
+    cur = connection.cursor()
+    try:
+        ensure_archive_tables(cur)
+        _ensure_archive_years(cur, table)
+        hot_cols = _columns(cur, table)
+        archive_cols = set(_columns(cur, archive))
+        cols = [c for c in hot_cols if c in archive_cols]
+        codes = expired_codes(cur, market, cutoff)
+        connection.commit()
+
+        col_sql = ", ".join(cols)
+        updates = ", ".join(
+            f"{c} = EXCLUDED.{c}" for c in cols + ["archived_at"] if c not in ("warrant_code", "trade_date")
+        )
+        moved = done = 0
+        for i in range(0, len(codes), max(1, int(batch_size))):
+            batch = codes[i:i + batch_size]
+            cur.execute(
+                f"""
+                WITH moved AS (
+                    DELETE FROM {table} WHERE warrant_code = ANY(%s)
+                    RETURNING {col_sql}
+                )
+                INSERT INTO {archive} ({col_sql}, archived_at)
+                SELECT {col_sql}, CURRENT_TIMESTAMP FROM moved
+                ON CONFLICT (warrant_code, trade_date) DO UPDATE SET {updates}
+                """,
+                (batch,),
+            )
+            moved += cur.rowcount or 0
+            connection.commit()
+            done += len(batch)
+            if on_batch is not None:
+                on_batch(done, moved)
+        return {"market": market, "cutoff": cutoff.isoformat(), "codes": len(codes), "rows": moved}
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def archived_bars(
+    cursor,
+    code: str,
+    *,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    limit: Optional[int] = None,
+) -> tuple[Optional[str], list[dict[str, Any]]]:
+    """(market, bars oldest first) of an archived warrant, in the timeseries column shape.
+
+    Without ``start`` / ``end`` the last ``limit`` bars are returned.
+    """
+    for market, (table, volume_col, turnover_col) in WARRANT_SOURCES.items():
+        archive = archive_table(table)
+        if not table_exists(cursor, archive):
+            continue
+        where, params = ["warrant_code = %s"], [code]
+        if start:
+            where.append("trade_date >= %s::date")
+            params.append(start)
+        if end:
+            where.append("trade_date <= %s::date")
+            params.append(end)
+        tail = not (start or end) and limit
+        cursor.execute(
+            f"""
+            SELECT trade_date, warrant_code, warrant_name,
+                   {turnover_col} AS turnover, {volume_col} AS volume,
+                   close_price, open_price, high_price, low_price
+            FROM {archive}
+            WHERE {' AND '.join(where)}
+            ORDER BY trade_date {'DESC LIMIT %s' if tail else 'ASC'}
+            """,
+            params + ([int(limit)] if tail else []),
+        )
+        rows = list(cursor.fetchall() or [])
+        if rows:
+            return market, (rows[::-1] if tail else rows)
+    return None, []
@@ -0,0 +1,148 @@
+"""Cached aggregates behind the warrant portal homepage stats.
+
+``warrant_portal_stats`` holds one row per market (master totals split by
+call/put, latest trade date and how many warrants traded on it).  ``refresh``
+recomputes both rows with a single grouped statement -- ``COUNT(*) FILTER``
+over a ``UNION ALL`` of the two master tables, plus ``latest_warrant_bars``
+for the trade side -- and is called after warrant master or daily imports
+commit.  ``read`` is the homepage lookup; it refreshes inline only when the
+table is empty or older than ``max_age`` (writers outside the server, such as
+the backfill scripts, do not call ``refresh``).
+"""
+
+from __future__ import annotations
+
+from datetime import datetime, timedelta
+from typing import Any, Optional
+
+from latest_bars import LATEST_WARRANT_TABLE, ensure_latest_tables
+
+STATS_TABLE = "warrant_portal_stats"
+MARKETS = ("TWSE", "TPEX")
+
+_AGGREGATE_SQL = f"""
+    SELECT mk.market,
+           COALESCE(ms.master_total, 0) AS master_total,
+           COALESCE(ms.call_count, 0) AS call_count,
+           COALESCE(ms.put_count, 0) AS put_count,
+           lb.latest_trade_date,
+           COALESCE(lb.traded_count, 0) AS traded_count
+    FROM (VALUES ('TWSE'), ('TPEX')) AS mk(market)
+    LEFT JOIN (
+        SELECT market,
+               COUNT(*) AS master_total,
+               COUNT(*) FILTER (WHERE warrant_type = '認購') AS call_count,
+               COUNT(*) FILTER (WHERE warrant_type = '認售') AS put_count
+        FROM (
+            SELECT 'TWSE'::text AS market, warrant_type FROM tw_warrant_master
+            UNION ALL
+            SELECT 'TPEX'::text AS market, warrant_type FROM tpex_warrant_master
+        ) m
+        GROUP BY market
+    ) ms ON ms.market = mk.market
+    LEFT JOIN (
+        SELECT market,
+               latest_trade_date,
+               COUNT(*) FILTER (
+                   WHERE trade_date = latest_trade_date AND COALESCE(turnover, 0) > 0
+               ) AS traded_count
+        FROM (
+            SELECT market, trade_date, turnover,
+                   MAX(trade_date) OVER (PARTITION BY market) AS latest_trade_date
+            FROM {LATEST_WARRANT_TABLE}
+        ) b
+        GROUP BY market, latest_trade_date
+    ) lb ON lb.market = mk.market
+"""
+
+
+def ensure_stats_table(cursor) -> None:
+    cursor.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {STATS_TABLE} (
+            market VARCHAR(10) PRIMARY KEY,
+            master_total INTEGER NOT NULL DEFAULT 0,
+            call_count INTEGER NOT NULL DEFAULT 0,
+            put_count INTEGER NOT NULL DEFAULT 0,
+            latest_trade_date DATE,
+            traded_count INTEGER NOT NULL DEFAULT 0,
+            refreshed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+
+
+def refresh(cursor) -> int:
+    """Recompute both market rows in one statement."""
+    ensure_latest_tables(cursor)
+    ensure_stats_table(cursor)
+    cursor.execute(
+        f"""
+        INSERT INTO {STATS_TABLE} (
+            market, master_total, call_count, put_count,
+            latest_trade_date, traded_count, refreshed_at
+        )
+        SELECT market, master_total, call_count, put_count,
+               latest_trade_date, traded_count, CURRENT_TIMESTAMP
+        FROM ({_AGGREGATE_SQL}) agg
+        ON CONFLICT (market) DO UPDATE SET
+            master_total = EXCLUDED.master_total,
+            call_count = EXCLUDED.call_count,
+            put_count = EXCLUDED.put_count,
+            latest_trade_date = EXCLUDED.latest_trade_date,
+            traded_count = EXCLUDED.traded_count,
+            refreshed_at = CURRENT_TIMESTAMP
+        """
+    )
+    return cursor.rowcount or 0
+
+
+_NAMES = ("market", "master_total", "call_count", "put_count", "latest_trade_date", "traded_count", "refreshed_at")
+
+
+def _load(cursor) -> dict[str, dict[str, Any]]:
+    cursor.execute(f"SELECT {', '.join(_NAMES)} FROM {STATS_TABLE}")
+    out = {}
+    for row in cursor.fetchall() or []:
+        row = row if isinstance(row, dict) else dict(zip(_NAMES, row))
+        out[row["market"]] = row
+    return out
+
+
+def read(cursor, *, max_age: Optional[timedelta] = None, now=datetime.now) -> dict[str, dict[str, Any]]:
+    """Rows keyed by market; refreshes first when missing or older than ``max_age``.
+
+    Returns ``{}`` only when the table does not exist yet and cannot be built.
+    """
+    ensure_stats_table(cursor)
+    rows = _load(cursor)
+    stale = len(rows) < len(MARKETS)
+    if not stale and max_age is not None:
+        oldest = min(r["refreshed_at"] for r in rows.values())
+        stale = oldest is None or now() - oldest > max_age
+    if stale:
+        refresh(cursor)
+        rows = _load(cursor)
+    return rows
+
+
+def payload(rows: dict[str, dict[str, Any]]) -> dict[str, Any]:
+    """Homepage JSON shape of ``/api/warrants/portal/stats``."""
+    def market(key: str) -> dict[str, Any]:
+        row = rows.get(key) or {}
+        latest = row.get("latest_trade_date")
+        return {
+            "master_total": int(row.get("master_total") or 0),
+            "call": int(row.get("call_count") or 0),
+            "put": int(row.get("put_count") or 0),
+            "latest_trade_date": latest.strftime("%Y-%m-%d") if hasattr(latest, "strftime") else latest,
+            "traded_count": int(row.get("traded_count") or 0),
+        }
+
+    twse, tpex = market("TWSE"), market("TPEX")
+    return {
+        "success": True,
+        "twse": twse,
+        "tpex": tpex,
+        "total_master": twse["master_total"] + tpex["master_total"],
+    }
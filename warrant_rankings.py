@@ -0,0 +1,237 @@
+"""Per-day warrant turnover / volume rankings, materialised at ingest time.
+
+``/api/warrants/rankings`` used to sort a whole day of ``tw_warrant_trade``
+and/or ``tpex_warrant_daily_quotes`` joined with the masters on every call.
+``warrant_rankings`` stores, for each (trade_date, market, type bucket,
+metric), the top ``TOP_K`` rows as one JSONB array.  Type buckets are
+認購 / 認售 / '' (type unknown or missing from the master), so
+
+* a call/put ranking is one bucket;
+* the all-types ranking is the merge of the three buckets;
+* the both-markets ranking is the merge of the two markets;
+
+and each merge of top-``TOP_K`` lists is exact for any ``limit <= TOP_K``.
+
+Days are built from the hot table plus the expired-warrant archive (see
+``warrant_partitions``), so archiving never changes a ranking.
+``build_day`` runs inside the import transaction for the day just ingested;
+``invalidate`` drops days rewritten by multi-day jobs.  ``read`` builds a
+missing (market, day) on demand, so historical dates materialise on first use.
+"""
+
+from __future__ import annotations
+
+import json
+from datetime import date
+from typing import Any, Iterable, Optional
+
+import warrant_partitions
+
+RANKINGS_TABLE = "warrant_rankings"
+TOP_K = 200
+MARKETS = ("TWSE", "TPEX")
+METRICS = ("turnover", "volume")
+TYPE_BUCKETS = ("認購", "認售", "")
+
+# market -> (hot table, one day of rows from ``{table}`` aliased ``t``)
+_SOURCES = {
+    "TWSE": ("tw_warrant_trade", """
+        SELECT t.warrant_code, t.warrant_name, t.turnover, t.volume, t.close_price,
+               m.underlying_code, m.underlying_name, m.warrant_type
+        FROM {table} t
+        LEFT JOIN tw_warrant_master m ON m.warrant_code = t.warrant_code
+        WHERE t.trade_date = %s::date
+    """),
+    "TPEX": ("tpex_warrant_daily_quotes", """
+        SELECT t.warrant_code, t.warrant_name,
+               t.trade_value AS turnover, t.trade_volume AS volume, t.close_price,
+               COALESCE(t.underlying_code, m.underlying_code) AS underlying_code,
+               COALESCE(t.underlying_name, m.underlying_name) AS underlying_name,
+               m.warrant_type
+        FROM {table} t
+        LEFT JOIN tpex_warrant_master m ON m.warrant_code = t.warrant_code
+        WHERE t.trade_date = %s::date
+    """),
+}
+
+
+def _source_sql(market: str) -> str:
+    """Hot rows of the day plus archived (expired) warrants not also present in the hot table."""
+    table, select = _SOURCES[market]
+    archive = warrant_partitions.archive_table(table)
+    return f"""
+        {select.format(table=table)}
+        UNION ALL
+        {select.format(table=archive)}
+          AND NOT EXISTS (
+              SELECT 1 FROM {table} h WHERE h.warrant_code = t.warrant_code AND h.trade_date = t.trade_date
+          )
+    """
+
+
+_ROW_JSON = """jsonb_build_object(
+    'warrant_code', warrant_code, 'warrant_name', warrant_name, 'warrant_type', warrant_type,
+    'turnover', turnover, 'volume', volume, 'close_price', close_price,
+    'underlying_code', underlying_code, 'underlying_name', underlying_name
+)"""
+
+
+def ensure_rankings_table(cursor) -> None:
+    cursor.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {RANKINGS_TABLE} (
+            trade_date DATE NOT NULL,
+            market VARCHAR(10) NOT NULL,
+            warrant_type VARCHAR(10) NOT NULL,
+            metric VARCHAR(10) NOT NULL,
+            rows JSONB NOT NULL,
+            built_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (trade_date, market, warrant_type, metric)
+        )
+        """
+    )
+
+
+def build_day(cursor, market: str, trade_date: Optional[date]) -> int:
+    """(Re)build every bucket × metric of one market-day in one statement.
+
+    Days without any rows in the source table are not materialised.
+    """
+    market = str(market or "").upper()
+    if market not in _SOURCES or trade_date is None:
+        return 0
+    ensure_rankings_table(cursor)
+    warrant_partitions.ensure_archive_tables(cursor)
+    buckets = ", ".join(f"('{b}', '{m}')" for b in TYPE_BUCKETS for m in METRICS)
+    cursor.execute(
+        f"""
+        WITH src AS (
+            SELECT s.*,
+                   CASE WHEN s.warrant_type IN ('認購', '認售') THEN s.warrant_type ELSE '' END AS bucket
+            FROM ({_source_sql(market)}) s
+        ),
+        ranked AS (
+            SELECT src.*,
+                   ROW_NUMBER() OVER (
+                       PARTITION BY bucket
+                       ORDER BY turnover DESC NULLS LAST, volume DESC NULLS LAST, warrant_code ASC
+                   ) AS rn_turnover,
+                   ROW_NUMBER() OVER (
+                       PARTITION BY bucket
+                       ORDER BY volume DESC NULLS LAST, turnover DESC NULLS LAST, warrant_code ASC
+                   ) AS rn_volume
+            FROM src
+        ),
+        agg AS (
+            SELECT bucket, 'turnover' AS metric, jsonb_agg({_ROW_JSON} ORDER BY rn_turnover) AS rows
+            FROM ranked WHERE rn_turnover <= %s GROUP BY bucket
+            UNION ALL
+            SELECT bucket, 'volume' AS metric, jsonb_agg({_ROW_JSON} ORDER BY rn_volume) AS rows
+            FROM ranked WHERE rn_volume <= %s GROUP BY bucket
+        )
+        INSERT INTO {RANKINGS_TABLE} (trade_date, market, warrant_type, metric, rows, built_at)
+        SELECT %s::date, %s, k.bucket, k.metric, COALESCE(agg.rows, '[]'::jsonb), CURRENT_TIMESTAMP
+        FROM (VALUES {buckets}) AS k(bucket, metric)
+        LEFT JOIN agg ON agg.bucket = k.bucket AND agg.metric = k.metric
+        WHERE EXISTS (SELECT 1 FROM src)
+        ON CONFLICT (trade_date, market, warrant_type, metric) DO UPDATE SET
+            rows = EXCLUDED.rows,
+            built_at = CURRENT_TIMESTAMP
+        """,
+        (trade_date, trade_date, TOP_K, TOP_K, trade_date, market),
+    )
+    return cursor.rowcount or 0
+
+
+def invalidate(cursor, market: str, dates: Iterable[Any]) -> None:
+    """Drop materialised days of ``market`` so the next read rebuilds them."""
+    dates = sorted({d for d in dates if d})
+    if not dates:
+        return
+    ensure_rankings_table(cursor)
+    cursor.execute(
+        f"DELETE FROM {RANKINGS_TABLE} WHERE market = %s AND trade_date = ANY(%s)",
+        (str(market).upper(), dates),
+    )
+
+
+def _sort_key(metric: str):
+    other = "volume" if metric == "turnover" else "turnover"
+
+    def key(row: dict) -> tuple:
+        primary, secondary = row.get(metric), row.get(other)
+        return (
+            primary is None, -(float(primary) if primary is not None else 0.0),
+            secondary is None, -(float(secondary) if secondary is not None else 0.0),
+            str(row.get("warrant_code") or ""),
+        )
+
+    return key
+
+
+def _fetch(cursor, trade_date, markets, buckets, metric) -> dict[str, list[tuple[str, list]]]:
+    cursor.execute(
+        f"""
+        SELECT market, warrant_type, rows FROM {RANKINGS_TABLE}
+        WHERE trade_date = %s::date AND market = ANY(%s) AND metric = %s AND warrant_type = ANY(%s)
+        """,
+        (trade_date, list(markets), metric, list(buckets)),
+    )
+    out: dict[str, list[tuple[str, list]]] = {}
+    for row in cursor.fetchall() or []:
+        if not isinstance(row, dict):
+            row = dict(zip(("market", "warrant_type", "rows"), row))
+        rows = row["rows"]
+        if isinstance(rows, str):
+            rows = json.loads(rows)
+        out.setdefault(row["market"], []).append((row["warrant_type"], rows or []))
+    return out
+
+
+def read(
+    cursor,
+    trade_date,
+    *,
+    markets: Iterable[str] = MARKETS,
+    warrant_type: str = "",
+    metric: str = "turnover",
+    limit: int = 50,
+) -> list[dict[str, Any]]:
+    """Top ``limit`` rows of one day, building missing market-days first.
+
+    Rows carry ``market`` in addition to the stored fields.
+    """
+    markets = [m for m in MARKETS if m in {str(x).upper() for x in markets}]
+    metric = metric if metric in METRICS else "turnover"
+    buckets = [warrant_type] if warrant_type in ("認購", "認售") else list(TYPE_BUCKETS)
+    ensure_rankings_table(cursor)
+    found = _fetch(cursor, trade_date, markets, buckets, metric)
+    missing = [m for m in markets if m not in found]
+    if missing:
+        for market in missing:
+            build_day(cursor, market, trade_date)
+        found.update(_fetch(cursor, trade_date, missing, buckets, metric))
+
+    merged = [
+        dict(row, market=market)
+        for market, lists in found.items()
+        for _, rows in lists
+        for row in rows
+    ]
+    merged.sort(key=_sort_key(metric))
+    return merged[: max(0, min(int(limit), TOP_K))]
+
+
+def latest_trade_date(cursor, markets: Iterable[str] = MARKETS):
+    """Latest day in ``latest_warrant_bars`` for ``markets`` (index probe per market)."""
+    markets = [m for m in MARKETS if m in {str(x).upper() for x in markets}]
+    if not markets:
+        return None
+    probes = ", ".join(
+        "(SELECT MAX(trade_date) FROM latest_warrant_bars WHERE market = %s)" for _ in markets
+    )
+    cursor.execute(f"SELECT GREATEST({probes}) AS d", markets)
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    return row.get("d") if isinstance(row, dict) else row[0]
@@ -0,0 +1,255 @@
+"""Unified, pre-normalised warrant master for the portal search box.
+
+The portal search used to run against ``tw_warrant_master UNION ALL
+tpex_warrant_master`` with the underlying code normalised per row
+(``UPPER(REPLACE(REPLACE(REPLACE(...))))``) and two correlated
+``stock_symbols`` subqueries per keystroke.  ``warrant_search`` holds both
+masters in one table with those values computed at refresh time:
+
+* ``code_upper`` -- ``UPPER(warrant_code)``, btree ``text_pattern_ops`` for
+  exact and prefix matches;
+* ``underlying_norm`` -- underlying code without ``.TW``/``.TWO``/``.TAI``;
+* ``underlying_keys`` -- ``underlying_norm`` plus every stock code whose
+  ``stock_symbols`` display name equals ``underlying_name`` (GIN), replacing
+  the ``stock_symbols`` subqueries;
+* trigram GIN on ``warrant_name``/``underlying_name`` for ``ILIKE '%q%'``.
+
+``refresh`` rebuilds one or both markets in the caller's transaction and is
+run after master imports.  Days-to-expiry filters are turned into
+``expiry_date`` ranges so they use the btree on ``expiry_date``; a stored
+day count would go stale at midnight.
+"""
+
+from __future__ import annotations
+
+import logging
+from typing import Any, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+SEARCH_TABLE = "warrant_search"
+MARKETS = ("TWSE", "TPEX")
+
+_SUFFIX_RE = r"'\.(TWO|TW|TAI)$'"
+
+
+def _norm_sql(expr: str) -> str:
+    return f"REGEXP_REPLACE(UPPER(TRIM({expr})), {_SUFFIX_RE}, '')"
+
+
+_MASTER_SELECT = {
+    "TWSE": """
+        SELECT 'TWSE'::text AS market, warrant_code, warrant_name, warrant_type,
+               warrant_category, underlying_code, underlying_name, expiry_date,
+               last_trade_date, latest_exercise_price, latest_exercise_ratio,
+               issuance_units_thousand AS issuance, exercise_start_date, report_date
+        FROM tw_warrant_master
+    """,
+    "TPEX": """
+        SELECT 'TPEX'::text AS market, warrant_code, warrant_name, warrant_type,
+               NULL::varchar AS warrant_category, underlying_code, underlying_name, expiry_date,
+               NULL::date AS last_trade_date, latest_exercise_price, latest_exercise_ratio,
+               accumulated_issuance AS issuance, listed_date AS exercise_start_date, report_date
+        FROM tpex_warrant_master
+    """,
+}
+
+COLUMNS = (
+    "market", "warrant_code", "warrant_name", "warrant_type", "warrant_category",
+    "underlying_code", "underlying_name", "expiry_date", "last_trade_date",
+    "latest_exercise_price", "latest_exercise_ratio", "issuance",
+    "exercise_start_date", "report_date",
+)
+
+
+def ensure_search_table(cursor) -> bool:
+    """Create the table and indexes; returns whether trigram search is indexed."""
+    cursor.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} (
+            market VARCHAR(10) NOT NULL,
+            warrant_code VARCHAR(20) NOT NULL,
+            code_upper VARCHAR(20) NOT NULL,
+            warrant_name VARCHAR(100),
+            warrant_type VARCHAR(20),
+            warrant_category VARCHAR(80),
+            underlying_code VARCHAR(20),
+            underlying_norm VARCHAR(20) NOT NULL DEFAULT '',
+            underlying_name VARCHAR(100),
+            underlying_keys TEXT[] NOT NULL DEFAULT '{{}}',
+            expiry_date DATE,
+            last_trade_date DATE,
+            latest_exercise_price NUMERIC(20,6),
+            latest_exercise_ratio NUMERIC(20,10),
+            issuance BIGINT,
+            exercise_start_date DATE,
+            report_date DATE,
+            refreshed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (market, warrant_code)
+        )
+        """
+    )
+    cursor.execute(
+        f"CREATE INDEX IF NOT EXISTS {SEARCH_TABLE}_code_idx "
+        f"ON {SEARCH_TABLE} (code_upper text_pattern_ops)"
+    )
+    cursor.execute(
+        f"CREATE INDEX IF NOT EXISTS {SEARCH_TABLE}_underlying_idx ON {SEARCH_TABLE} (underlying_norm)"
+    )
+    cursor.execute(
+        f"CREATE INDEX IF NOT EXISTS {SEARCH_TABLE}_keys_idx ON {SEARCH_TABLE} USING gin (underlying_keys)"
+    )
+    cursor.execute(
+        f"CREATE INDEX IF NOT EXISTS {SEARCH_TABLE}_expiry_idx ON {SEARCH_TABLE} (expiry_date)"
+    )
+    # pg_trgm 需要建立 extension 的權限；失敗時退回無索引的 ILIKE
+    cursor.execute("SAVEPOINT warrant_search_trgm")
+    try:
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        cursor.execute(
+            f"CREATE INDEX IF NOT EXISTS {SEARCH_TABLE}_name_trgm_idx ON {SEARCH_TABLE} "
+            "USING gin (warrant_name gin_trgm_ops, underlying_name gin_trgm_ops)"
+        )
+        cursor.execute("RELEASE SAVEPOINT warrant_search_trgm")
+        return True
+    except Exception as exc:
+        logger.warning("warrant_search 無法建立 pg_trgm 索引: %s", exc)
+        cursor.execute("ROLLBACK TO SAVEPOINT warrant_search_trgm")
+        return False
+
+
+def refresh(cursor, markets: Iterable[str] = MARKETS) -> int:
+    """Rebuild the rows of ``markets`` from the master tables (caller commits)."""
+    markets = [m for m in MARKETS if m in {str(x).upper() for x in markets}]
+    if not markets:
+        return 0
+    ensure_search_table(cursor)
+    source = " UNION ALL ".join(_MASTER_SELECT[m] for m in markets)
+    cols = ", ".join(COLUMNS)
+    cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE market = ANY(%s)", (markets,))
+    cursor.execute(
+        f"""
+        WITH sym AS (
+            SELECT COALESCE(NULLIF(TRIM(short_name), ''), name) AS display_name,
+                   ARRAY_AGG(DISTINCT {_norm_sql('symbol')}) AS keys
+            FROM stock_symbols
+            GROUP BY 1
+        ),
+        m AS (
+            SELECT src.*, {_norm_sql("COALESCE(src.underlying_code, '')")} AS underlying_norm
+            FROM ({source}) src
+            WHERE src.warrant_code IS NOT NULL
+        )
+        INSERT INTO {SEARCH_TABLE} ({cols}, code_upper, underlying_norm, underlying_keys, refreshed_at)
+        SELECT {", ".join(f"m.{c}" for c in COLUMNS)},
+               UPPER(m.warrant_code),
+               m.underlying_norm,
+               ARRAY(
+                   SELECT DISTINCT k
+                   FROM UNNEST(ARRAY_APPEND(COALESCE(sym.keys, ARRAY[]::text[]), m.underlying_norm::text)) AS k
+                   WHERE k <> ''
+               ),
+               CURRENT_TIMESTAMP
+        FROM m
+        LEFT JOIN sym ON sym.display_name = m.underlying_name
+        ON CONFLICT (market, warrant_code) DO NOTHING
+        """
+    )
+    return cursor.rowcount or 0
+
+
+def is_empty(cursor) -> bool:
+    cursor.execute(f"SELECT 1 FROM {SEARCH_TABLE} LIMIT 1")
+    return not cursor.fetchall()
+
+
+def _normalize_code(q: str) -> str:
+    s = (q or "").strip().upper()
+    for suffix in (".TW", ".TWO", ".TAI"):
+        if s.endswith(suffix):
+            s = s[: -len(suffix)]
+            break
+    return s.strip()
+
+
+def search_clause(q: str) -> tuple[str, list]:
+    """主檔關鍵字：權證代號／名稱、標的名稱、股票代號（含 2330.TW）。
+
+    代號類查詢（如 5274、2330.TW）採精確／前綴比對，避免「5274」誤中「052745」；
+    標的代號同時比對 stock_symbols 以名稱對應到的代號（``underlying_keys``）。
+    名稱類查詢仍用模糊比對（trigram 索引）。
+    """
+    q = (q or "").strip()
+    if not q:
+        return "", []
+    q_norm = _normalize_code(q)
+    has_cjk = any("\u4e00" <= ch <= "\u9fff" for ch in q)
+    code_body = q_norm.replace(".", "")
+    is_code_query = (
+        bool(code_body)
+        and code_body.isalnum()
+        and any(ch.isdigit() for ch in code_body)
+        and not has_cjk
+    )
+    if is_code_query:
+        clause = "(code_upper = %s OR code_upper LIKE %s OR underlying_keys @> ARRAY[%s]::text[])"
+        return clause, [q_norm, f"{q_norm}%", q_norm]
+
+    name_pat = f"%{q}%"
+    code_key = q_norm or q.upper()
+    clause = (
+        "(warrant_name ILIKE %s OR underlying_name ILIKE %s"
+        " OR code_upper = %s OR underlying_norm = %s)"
+    )
+    return clause, [name_pat, name_pat, code_key, code_key]
+
+
+def base_query(
+    *,
+    market: str = "both",
+    q: str = "",
+    warrant_type: str = "",
+    expiry_from: Optional[str] = None,
+    expiry_to: Optional[str] = None,
+    exercise_min: Optional[float] = None,
+    exercise_max: Optional[float] = None,
+    ratio_min: Optional[float] = None,
+    ratio_max: Optional[float] = None,
+    days_min: Optional[int] = None,
+    days_max: Optional[int] = None,
+) -> tuple[str, list[Any]]:
+    """Unexpired warrants matching the portal filters, as ``(sql, params)``.
+
+    Rows carry the master columns plus ``days_to_expiry``.
+    """
+    where = ["expiry_date >= CURRENT_DATE"]
+    params: list[Any] = []
+    m = (market or "").strip().upper()
+    if m in MARKETS:
+        where.append("market = %s")
+        params.append(m)
+    if q:
+        clause, q_params = search_clause(q)
+        where.append(clause)
+        params.extend(q_params)
+    if warrant_type in ("認購", "認售"):
+        where.append("warrant_type = %s")
+        params.append(warrant_type)
+    for cond, val in (
+        ("expiry_date >= %s::date", expiry_from),
+        ("expiry_date <= %s::date", expiry_to),
+        ("latest_exercise_price >= %s", exercise_min),
+        ("latest_exercise_price <= %s", exercise_max),
+        ("latest_exercise_ratio >= %s", ratio_min),
+        ("latest_exercise_ratio <= %s", ratio_max),
+        ("expiry_date >= CURRENT_DATE + %s::int", days_min),
+        ("expiry_date <= CURRENT_DATE + %s::int", days_max),
+    ):
+        if val is not None and val != "":
+            where.append(cond)
+            params.append(val)
+    sql = (
+        f"SELECT {', '.join(COLUMNS)}, (expiry_date - CURRENT_DATE) AS days_to_expiry "
+        f"FROM {SEARCH_TABLE} WHERE {' AND '.join(where)}"
+    )
+    return sql, params
@@ -9,6 +9,8 @@ from __future__ import annotations
 from collections import defaultdict
 from typing import Any, Iterable
 
+import numpy as np
+
 
 DEFAULT_GOLDEN_WAVE_PARAMS = {
     'fastMa': 30,
@@ -193,6 +195,149 @@ def evaluate_ta_signals(bars_asc: list[dict[str, Any]]) -> dict[str, bool]:
     }
 
 
+# ---- array kernels (codes × bars, NaN = missing / left padding) ----------------
+#
+# Rows are right-aligned so column -1 is every code's latest bar.  Each kernel
+# performs the same floating-point operations, in the same order, as its
+# list-based counterpart above, which stays the reference implementation.
+
+def _right_align(values: np.ndarray, row_idx: np.ndarray, n_rows: int) -> np.ndarray:
+    """Scatter row-grouped ``values`` (k × m, in bar order) into n_rows × width × m, right-aligned."""
+    counts = np.bincount(row_idx, minlength=n_rows)
+    width = int(counts.max()) if n_rows else 0
+    out = np.full((n_rows, width, values.shape[1]), np.nan)
+    if len(row_idx):
+        starts = np.cumsum(counts) - counts
+        rank = np.arange(len(row_idx)) - starts[row_idx]
+        out[row_idx, width - counts[row_idx] + rank] = values
+    return out
+
+
+def pack_bars(bars_by_code: dict[str, list[dict[str, Any]]]) -> tuple[list[str], np.ndarray, np.ndarray]:
+    """Return ``(codes, closes, ohlc)``.
+
+    ``closes`` holds every bar with a close; ``ohlc`` (shape 4 × codes × bars)
+    only the bars with full OHLC, like ``build_heikin_ashi``.  Prices must be
+    numeric or ``None``.
+    """
+    codes = list(bars_by_code)
+    lengths = [len(bars_by_code[c] or []) for c in codes]
+    flat = np.array(
+        [
+            (b.get('open'), b.get('high'), b.get('low'), b.get('close'))
+            for c in codes for b in bars_by_code[c] or []
+        ],
+        dtype=float,
+    ).reshape(-1, 4)
+    row_idx = np.repeat(np.arange(len(codes)), lengths)
+    has_close = ~np.isnan(flat[:, 3])
+    closes = _right_align(flat[has_close, 3:], row_idx[has_close], len(codes))[:, :, 0]
+    full = ~np.isnan(flat).any(axis=1)
+    ohlc = _right_align(flat[full], row_idx[full], len(codes)).transpose(2, 0, 1)
+    return codes, closes, ohlc
+
+
+def sma_matrix(values: np.ndarray, period: int) -> np.ndarray:
+    """Row-wise SMA; NaN where the window is short or holds a gap (as ``calc_sma``)."""
+    n, t = values.shape
+    p = max(1, int(period))
+    out = np.full((n, t), np.nan)
+    if t < p:
+        return out
+    # p shifted adds instead of a cumsum difference: same summation order as
+    # sum(chunk), so round(..., 4) agrees with the reference bit for bit
+    acc = np.zeros((n, t - p + 1))
+    for k in range(p):
+        acc = acc + values[:, k:t - p + 1 + k]
+    out[:, p - 1:] = np.round(acc / p, 4)
+    return out
+
+
+def ema_matrix(values: np.ndarray, period: int) -> np.ndarray:
+    """Row-wise EMA seeded by each row's first value; recurrence over time only."""
+    k = 2 / (period + 1)
+    out = np.full(values.shape, np.nan)
+    ema = np.full(values.shape[0], np.nan)
+    for t in range(values.shape[1]):
+        x = values[:, t]
+        valid = ~np.isnan(x)
+        ema = np.where(valid, np.where(np.isnan(ema), x, x * k + ema * (1 - k)), ema)
+        out[:, t] = np.where(valid, ema, np.nan)
+    return out
+
+
+def golden_wave_matrix(closes: np.ndarray, params: dict[str, int]) -> dict[str, np.ndarray]:
+    dif = ema_matrix(closes, params['fastMa']) - ema_matrix(closes, params['slowMa'])
+    dif_slow = ema_matrix(closes, params['fastMa2']) - ema_matrix(closes, params['slowMa2'])
+    return {'dif': dif, 'difSub': np.abs(dif - dif_slow)}
+
+
+def heikin_ashi_matrix(ohlc: np.ndarray) -> dict[str, np.ndarray]:
+    """HA open/close per column for right-aligned OHLC rows (``build_heikin_ashi``)."""
+    o, h, low, c = ohlc
+    ha_close = (o + h + low + c) / 4
+    ha_open = np.full(o.shape, np.nan)
+    prev_open = np.full(o.shape[0], np.nan)
+    prev_close = np.full(o.shape[0], np.nan)
+    for t in range(o.shape[1]):
+        first = np.isnan(prev_open)
+        ha_open[:, t] = np.where(first, (o[:, t] + c[:, t]) / 2, (prev_open + prev_close) / 2)
+        prev_open, prev_close = ha_open[:, t], ha_close[:, t]
+    return {'open': ha_open, 'close': ha_close}
+
+
+def _golden_wave_red_at(gw: dict[str, np.ndarray], t: int) -> np.ndarray:
+    dif, sub = gw['dif'][:, t], gw['difSub'][:, t]
+    prev3 = gw['difSub'][:, t - 3] if t >= 3 else np.full(dif.shape, np.nan)
+    return (dif >= 0) & ~np.isnan(sub) & (np.isnan(prev3) | (sub > prev3))
+
+
+def evaluate_ta_signals_matrix(bars_by_code: dict[str, list[dict[str, Any]]]) -> dict[str, dict[str, bool]]:
+    """``evaluate_ta_signals`` for many codes at once."""
+    return evaluate_packed_signals(*pack_bars(bars_by_code))
+
+
+def evaluate_packed_signals(
+    codes: list[str], closes: np.ndarray, ohlc: np.ndarray,
+) -> dict[str, dict[str, bool]]:
+    n, width = closes.shape
+    counts = (~np.isnan(closes)).sum(axis=1)
+
+    reversal = np.zeros(n, dtype=bool)
+    if width:
+        last = width - 1
+        for params in (WARRANT_GOLDEN_WAVE_PARAMS, DEFAULT_GOLDEN_WAVE_PARAMS):
+            rows = np.array([resolve_golden_wave_params(c) is params for c in counts], dtype=bool)
+            if not rows.any():
+                continue
+            gw = golden_wave_matrix(closes[rows], params)
+            red_now = _golden_wave_red_at(gw, last)
+            if last >= 1:
+                single = np.isnan(closes[rows, last - 1])
+                red_now &= single | ~_golden_wave_red_at(gw, last - 1)
+            reversal[rows] = red_now
+
+    heikin = np.zeros(n, dtype=bool)
+    if ohlc.shape[2] >= 2:
+        ha = heikin_ashi_matrix(ohlc)
+        red = ha['close'] >= ha['open']
+        heikin = red[:, -1] & ~np.isnan(ha['open'][:, -2]) & ~red[:, -2]
+
+    ma = np.zeros(n, dtype=bool)
+    if width:
+        ma5, ma10 = sma_matrix(closes, 5)[:, -1], sma_matrix(closes, 10)[:, -1]
+        ma = ~np.isnan(ma5) & ~np.isnan(ma10) & (ma5 > ma10)
+
+    return {
+        code: {
+            'reversalFirstRed': bool(reversal[i]),
+            'heikinFirstRed': bool(heikin[i]),
+            'ma5gtMa10': bool(ma[i]),
+        }
+        for i, code in enumerate(codes)
+    }
+
+
 def passes_ta_filters(signals: dict[str, bool], flags: dict[str, bool]) -> bool:
     if flags.get('reversalFirstRed') and not signals.get('reversalFirstRed'):
         return False
@@ -303,14 +448,8 @@ def filter_codes_by_ta(
     bars_by_code: dict[str, list[dict[str, Any]]],
     flags: dict[str, bool],
 ) -> list[str]:
-    matched: list[str] = []
-    for code, bars in bars_by_code.items():
-        if not bars:
-            continue
-        signals = evaluate_ta_signals(bars)
-        if passes_ta_filters(signals, flags):
-            matched.append(code)
-    return matched
+    signals_by_code = evaluate_ta_signals_matrix({c: b for c, b in bars_by_code.items() if b})
+    return [code for code, signals in signals_by_code.items() if passes_ta_filters(signals, flags)]
 
 
 def chunked(items: list[str], size: int) -> Iterable[list[str]]:
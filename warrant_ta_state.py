@@ -0,0 +1,402 @@
+"""Incrementally maintained technical-indicator state per warrant.
+
+``warrant_ta_state`` keeps, per ``(market, warrant_code)``, everything needed
+to advance the screener signals of ``warrant_ta_screen`` by one bar:
+
+* the four golden-wave EMA states and the last three ``difSub`` values,
+* the last Heikin-Ashi open/close and whether that candle was red,
+* the last ten closes (MA5 / MA10 windows),
+
+plus the resulting flags (``reversal_first_red``, ``heikin_first_red``,
+``ma5_gt_ma10``).  The warrant writers call ``update_states`` inside their
+transaction, next to ``refresh_latest_warrant_bars``, so the portal TA screen
+becomes an indexed ``WHERE`` over the flags instead of recomputing 80 bars per
+code on every request.
+
+Codes without state are seeded from their last ``WARMUP_BARS`` bars (the
+window the screen used to load), and the screen always used the warrant
+golden-wave parameters for that window, so the state does too.  A write to a
+date at or before a code's ``last_trade_date`` rolls back to the state kept
+from before its last bar (the common same-day re-import) and replays from
+there; older corrections re-seed the code.  ``catch_up`` compares against
+``latest_warrant_bars`` and advances anything a writer missed.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import threading
+from dataclasses import asdict, dataclass, field, replace
+from datetime import date
+from typing import Any, Iterable, Optional
+
+from psycopg2.extras import execute_values
+
+from latest_bars import LATEST_WARRANT_TABLE, WARRANT_SOURCES, _dsn_key
+from warrant_ta_screen import WARRANT_GOLDEN_WAVE_PARAMS, is_golden_wave_bar_red
+
+logger = logging.getLogger(__name__)
+
+STATE_TABLE = "warrant_ta_state"
+WARMUP_BARS = 80
+BATCH_CODES = 2000
+
+FLAG_COLUMNS = {
+    "reversalFirstRed": "reversal_first_red",
+    "heikinFirstRed": "heikin_first_red",
+    "ma5gtMa10": "ma5_gt_ma10",
+}
+
+_EMA_K = tuple(
+    2 / (WARRANT_GOLDEN_WAVE_PARAMS[key] + 1)
+    for key in ("fastMa", "slowMa", "fastMa2", "slowMa2")
+)
+
+_ready_lock = threading.Lock()
+_ready_dsns: set[str] = set()
+
+
+def _float(val: Any) -> Optional[float]:
+    try:
+        return float(val)
+    except (TypeError, ValueError):
+        return None
+
+
+@dataclass
+class TAState:
+    last_trade_date: Optional[date] = None
+    bar_count: int = 0
+    emas: list[Optional[float]] = field(default_factory=lambda: [None, None, None, None])
+    dif_sub_hist: list[float] = field(default_factory=list)
+    gw_red: bool = False
+    recent_closes: list[float] = field(default_factory=list)
+    ha_open: Optional[float] = None
+    ha_close: Optional[float] = None
+    ha_count: int = 0
+    ha_red: bool = False
+    reversal_first_red: bool = False
+    heikin_first_red: bool = False
+    ma5_gt_ma10: bool = False
+
+    def step(self, bar: dict[str, Any]) -> None:
+        """Advance by one chronological bar (``open/high/low/close``, optional ``trade_date``)."""
+        c = _float(bar.get("close"))
+        if c is None:
+            return
+        if bar.get("trade_date") is not None:
+            self.last_trade_date = bar["trade_date"]
+
+        # golden wave (EMA 差離) — same recurrences as warrant_ta_screen.calc_golden_wave
+        self.emas = [
+            c if prev is None else c * k + prev * (1 - k)
+            for prev, k in zip(self.emas, _EMA_K)
+        ]
+        fast, slow, fast2, slow2 = self.emas
+        dif = fast - slow
+        dif_sub = abs(dif - (fast2 - slow2))
+        prev3 = self.dif_sub_hist[-3] if len(self.dif_sub_hist) >= 3 else None
+        red = is_golden_wave_bar_red(dif, dif_sub, prev3)
+        self.reversal_first_red = red and (self.bar_count == 0 or not self.gw_red)
+        self.gw_red = red
+        self.dif_sub_hist = (self.dif_sub_hist + [dif_sub])[-3:]
+
+        # MA5 / MA10 — calc_sma rounds to 4 decimals before comparing
+        self.recent_closes = (self.recent_closes + [c])[-10:]
+        if len(self.recent_closes) >= 10:
+            ma5 = round(sum(self.recent_closes[-5:]) / 5, 4)
+            ma10 = round(sum(self.recent_closes) / 10, 4)
+            self.ma5_gt_ma10 = ma5 > ma10
+        else:
+            self.ma5_gt_ma10 = False
+        self.bar_count += 1
+
+        # Heikin-Ashi — bars without full OHLC are skipped, as in build_heikin_ashi
+        o, h, low = _float(bar.get("open")), _float(bar.get("high")), _float(bar.get("low"))
+        if o is None or h is None or low is None:
+            return
+        ha_close = (o + h + low + c) / 4
+        if self.ha_count == 0:
+            ha_open = (o + c) / 2
+        else:
+            ha_open = (self.ha_open + self.ha_close) / 2  # type: ignore[operator]
+        red = ha_close >= ha_open
+        self.heikin_first_red = self.ha_count >= 1 and red and not self.ha_red
+        self.ha_open, self.ha_close, self.ha_red = ha_open, ha_close, red
+        self.ha_count += 1
+
+    def to_json(self) -> str:
+        data = asdict(self)
+        data.pop("last_trade_date")
+        return json.dumps(data)
+
+    @classmethod
+    def from_json(cls, raw: Any, last_trade_date: Optional[date]) -> "TAState":
+        data = json.loads(raw) if isinstance(raw, str) else dict(raw)
+        return cls(last_trade_date=last_trade_date, **data)
+
+    def signals(self) -> dict[str, bool]:
+        return {
+            "reversalFirstRed": self.reversal_first_red,
+            "heikinFirstRed": self.heikin_first_red,
+            "ma5gtMa10": self.ma5_gt_ma10,
+        }
+
+
+def replay(bars_asc: Iterable[dict[str, Any]], state: Optional[TAState] = None) -> TAState:
+    state = state or TAState()
+    for bar in bars_asc:
+        state.step(bar)
+    return state
+
+
+def replay_keeping_prev(
+    bars_asc: list[dict[str, Any]], state: Optional[TAState] = None,
+) -> tuple[TAState, Optional[TAState]]:
+    """Replay ``bars_asc``; also return the state as it was before the last bar."""
+    state = replay(bars_asc[:-1], state)
+    prev = replace(state) if state.bar_count else None
+    state.step(bars_asc[-1])
+    return state, prev
+
+
+# ---- persistence -------------------------------------------------------------
+def ensure_state_table(cursor) -> None:
+    key = _dsn_key(cursor)
+    if key in _ready_dsns:
+        return
+    with _ready_lock:
+        if key in _ready_dsns:
+            return
+        cursor.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {STATE_TABLE} (
+                market VARCHAR(10) NOT NULL,
+                warrant_code VARCHAR(20) NOT NULL,
+                last_trade_date DATE NOT NULL,
+                state JSONB NOT NULL,
+                prev_trade_date DATE,
+                prev_state JSONB,
+                reversal_first_red BOOLEAN NOT NULL DEFAULT FALSE,
+                heikin_first_red BOOLEAN NOT NULL DEFAULT FALSE,
+                ma5_gt_ma10 BOOLEAN NOT NULL DEFAULT FALSE,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (market, warrant_code)
+            )
+            """
+        )
+        # 每個訊號一個 partial index：篩選只掃描旗標為真的少數列
+        for column in FLAG_COLUMNS.values():
+            cursor.execute(
+                f"""
+                CREATE INDEX IF NOT EXISTS {STATE_TABLE}_{column}_idx
+                ON {STATE_TABLE}(warrant_code) WHERE {column}
+                """
+            )
+        _ready_dsns.add(key)
+
+
+def _row_dict(row: Any, names: tuple[str, ...]) -> dict[str, Any]:
+    if isinstance(row, dict):
+        return row
+    return dict(zip(names, row))
+
+
+def _as_date(val: Any) -> Optional[date]:
+    if val is None or isinstance(val, date):
+        return val
+    return date.fromisoformat(str(val)[:10])
+
+
+_STATE_NAMES = ("warrant_code", "last_trade_date", "state", "prev_trade_date", "prev_state")
+
+
+def _load_states(cursor, market: str, codes: list[str]) -> dict[str, dict[str, Any]]:
+    cursor.execute(
+        f"""
+        SELECT {', '.join(_STATE_NAMES)}
+        FROM {STATE_TABLE}
+        WHERE market = %s AND warrant_code = ANY(%s)
+        """,
+        (market, codes),
+    )
+    return {
+        row["warrant_code"]: row
+        for row in (_row_dict(r, _STATE_NAMES) for r in cursor.fetchall() or [])
+    }
+
+
+def _base_state(row: dict[str, Any], since: Optional[date]) -> Optional[TAState]:
+    """State to resume from, or ``None`` when the code must be re-seeded."""
+    last = _as_date(row["last_trade_date"])
+    if since is None or last < since:
+        return TAState.from_json(row["state"], last)
+    prev = _as_date(row["prev_trade_date"])
+    if row["prev_state"] is not None and prev is not None and prev < since:
+        return TAState.from_json(row["prev_state"], prev)
+    return None
+
+
+_BAR_NAMES = ("warrant_code", "trade_date", "open", "high", "low", "close")
+
+
+def _load_bars(cursor, market: str, resume_from: dict[str, date], new_codes: list[str], warmup: int):
+    source = WARRANT_SOURCES[market][0]
+    bars: dict[str, list[dict[str, Any]]] = {}
+
+    def collect(rows):
+        for row in rows or []:
+            row = _row_dict(row, _BAR_NAMES)
+            bars.setdefault(row["warrant_code"], []).append(row)
+
+    if resume_from:
+        cursor.execute(
+            f"""
+            SELECT t.warrant_code, t.trade_date, t.open_price AS open, t.high_price AS high,
+                   t.low_price AS low, t.close_price AS close
+            FROM {source} t
+            JOIN unnest(%s::text[], %s::date[]) AS b(code, base_date)
+                ON b.code = t.warrant_code
+            WHERE t.trade_date > b.base_date
+              AND t.trade_date > %s::date
+              AND t.close_price IS NOT NULL
+            ORDER BY t.warrant_code, t.trade_date
+            """,
+            # 常數下界讓按月分區的來源表只掃描近期分區（見 warrant_partitions）
+            (list(resume_from), list(resume_from.values()), min(resume_from.values())),
+        )
+        collect(cursor.fetchall())
+    if new_codes:
+        cursor.execute(
+            f"""
+            SELECT warrant_code, trade_date, open, high, low, close
+            FROM (
+                SELECT warrant_code, trade_date, open_price AS open, high_price AS high,
+                       low_price AS low, close_price AS close,
+                       ROW_NUMBER() OVER (PARTITION BY warrant_code ORDER BY trade_date DESC) AS rn
+                FROM {source}
+                WHERE warrant_code = ANY(%s) AND close_price IS NOT NULL
+            ) t
+            WHERE rn <= %s
+            ORDER BY warrant_code, trade_date
+            """,
+            (new_codes, int(warmup)),
+        )
+        collect(cursor.fetchall())
+    return bars
+
+
+def _save_states(cursor, market: str, states: dict[str, tuple[TAState, Optional[TAState]]]) -> None:
+    if not states:
+        return
+    values = []
+    for code, (state, prev) in states.items():
+        values.append((
+            market, code, state.last_trade_date, state.to_json(),
+            prev.last_trade_date if prev else None, prev.to_json() if prev else None,
+            state.reversal_first_red, state.heikin_first_red, state.ma5_gt_ma10,
+        ))
+    execute_values(
+        cursor,
+        f"""
+        INSERT INTO {STATE_TABLE} (
+            market, warrant_code, last_trade_date, state, prev_trade_date, prev_state,
+            reversal_first_red, heikin_first_red, ma5_gt_ma10, updated_at
+        ) VALUES %s
+        ON CONFLICT (market, warrant_code) DO UPDATE SET
+            last_trade_date = EXCLUDED.last_trade_date,
+            state = EXCLUDED.state,
+            prev_trade_date = EXCLUDED.prev_trade_date,
+            prev_state = EXCLUDED.prev_state,
+            reversal_first_red = EXCLUDED.reversal_first_red,
+            heikin_first_red = EXCLUDED.heikin_first_red,
+            ma5_gt_ma10 = EXCLUDED.ma5_gt_ma10,
+            updated_at = CURRENT_TIMESTAMP
+        """,
+        values,
+        template="(%s,%s,%s,%s::jsonb,%s,%s::jsonb,%s,%s,%s,CURRENT_TIMESTAMP)",
+        page_size=1000,
+    )
+
+
+def _unique_codes(codes: Iterable[Any]) -> list[str]:
+    return list(dict.fromkeys(str(c).strip() for c in codes if str(c or "").strip()))
+
+
+def update_states(
+    cursor,
+    market: str,
+    codes: Iterable[Any],
+    *,
+    since: Any = None,
+    warmup: int = WARMUP_BARS,
+) -> int:
+    """Advance the state of ``codes`` through every stored bar newer than their state.
+
+    ``since``: earliest trade date just written.  States that already consumed
+    that date resume from before it (or are re-seeded) so rewritten bars count.
+    Returns the number of states written.
+    """
+    market = str(market or "").strip().upper()
+    if market not in WARRANT_SOURCES:
+        raise ValueError(f"Unsupported warrant market: {market}")
+    code_list = _unique_codes(codes)
+    if not code_list:
+        return 0
+    since = _as_date(since)
+    ensure_state_table(cursor)
+    written = 0
+    for i in range(0, len(code_list), BATCH_CODES):
+        batch = code_list[i:i + BATCH_CODES]
+        bases: dict[str, TAState] = {}
+        for code, row in _load_states(cursor, market, batch).items():
+            base = _base_state(row, since)
+            if base is not None:
+                bases[code] = base
+        new_codes = [c for c in batch if c not in bases]
+        resume_from = {code: base.last_trade_date for code, base in bases.items()}
+        bars = _load_bars(cursor, market, resume_from, new_codes, warmup)
+        changed = {}
+        for code, code_bars in bars.items():
+            state, prev = replay_keeping_prev(code_bars, bases.get(code))
+            if state.last_trade_date is not None:
+                changed[code] = (state, prev)
+        _save_states(cursor, market, changed)
+        written += len(changed)
+    return written
+
+
+def stale_codes(cursor, market: str) -> list[str]:
+    """Codes whose latest bar is newer than their indicator state (or that have none)."""
+    ensure_state_table(cursor)
+    cursor.execute(
+        f"""
+        SELECT b.warrant_code
+        FROM {LATEST_WARRANT_TABLE} b
+        LEFT JOIN {STATE_TABLE} s
+            ON s.market = b.market AND s.warrant_code = b.warrant_code
+        WHERE b.market = %s
+          AND (s.last_trade_date IS NULL OR s.last_trade_date < b.trade_date)
+        """,
+        (market,),
+    )
+    return [_row_dict(r, ("warrant_code",))["warrant_code"] for r in cursor.fetchall() or []]
+
+
+def catch_up(cursor) -> dict[str, int]:
+    """Advance every market's stale states (first use seeds the whole table)."""
+    done = {}
+    for market in WARRANT_SOURCES:
+        codes = stale_codes(cursor, market)
+        if codes:
+            done[market.lower()] = update_states(cursor, market, codes)
+    if done:
+        logger.info("warrant TA state catch-up: %s", done)
+    return done
+
+
+def flag_clause(flags: dict[str, bool], alias: str = "ts") -> str:
+    """SQL predicate over the precomputed flags requested by the screen."""
+    parts = [f"{alias}.{column}" for key, column in FLAG_COLUMNS.items() if flags.get(key)]
+    return " AND ".join(parts) or "TRUE"